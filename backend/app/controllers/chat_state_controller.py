@@ -1,7 +1,17 @@
+from sqlalchemy import and_, distinct, func, select
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Dict, Iterable, Optional
+import os
 
 from ..db import models
+from ..db.models import chat_users_table
+
+
+def unread_mode() -> str:
+    # "seq": chats.last_seq - read_seq per chat (integer arithmetic, one join);
+    # "query": count the seqs after each read position from messages instead
+    mode = (os.environ.get("UNREAD_COUNTS", "seq") or "").strip().lower()
+    return mode if mode in ("seq", "query") else "seq"
 
 
 def get_user_chat_state(db: Session, user_id: int, chat_id: int):
@@ -12,6 +22,20 @@ def get_user_chat_state(db: Session, user_id: int, chat_id: int):
     )
 
 
+def _read_seq_for(db: Session, chat_id: int, last_read_message_id: Optional[int]) -> int:
+    # seq is assigned in id order, so the newest row at or below the id carries it
+    if last_read_message_id is None:
+        return 0
+    m = models.Message
+    row = (
+        db.query(m.seq)
+        .filter(m.chat_id == chat_id, m.id <= last_read_message_id)
+        .order_by(m.id.desc())
+        .first()
+    )
+    return int(row[0] or 0) if row is not None else 0
+
+
 def upsert_user_chat_state(db: Session, user_id: int, chat_id: int, last_read_message_id: Optional[int]):
     state = get_user_chat_state(db, user_id, chat_id)
     if not state:
@@ -19,8 +43,71 @@ def upsert_user_chat_state(db: Session, user_id: int, chat_id: int, last_read_me
         db.add(state)
     else:
         state.last_read_message_id = last_read_message_id
+    state.read_seq = _read_seq_for(db, chat_id, last_read_message_id)
     db.commit()
     db.refresh(state)
     return state
 
 
+def advance_read_seq(db: Session, user_id: int, chat_id: int, seq: int):
+    """A send marks the chat read for its sender up to that send (caller's transaction)."""
+    s = models.UserChatState
+    # A state row added earlier in this transaction (e.g. a group-commit batch) must be visible
+    db.flush()
+    updated = db.query(s).filter(s.user_id == user_id, s.chat_id == chat_id).update(
+        {s.read_seq: seq}, synchronize_session=False
+    )
+    if not updated:
+        db.add(s(user_id=user_id, chat_id=chat_id, read_seq=seq))
+
+
+def unread_increments(member_ids: Iterable[int], sender_id: int) -> Dict[int, int]:
+    """Unread deltas for one send: +1 for every member but the sender."""
+    return {uid: 1 for uid in member_ids if uid != sender_id}
+
+
+def get_unread_count(db: Session, user_id: int, chat_id: int) -> int:
+    c, st = models.Chat, models.UserChatState
+    row = (
+        db.query(c.last_seq, st.read_seq)
+        .outerjoin(st, and_(st.chat_id == c.id, st.user_id == user_id))
+        .filter(c.id == chat_id)
+        .first()
+    )
+    if row is None:
+        return 0
+    return max(int(row[0] or 0) - int(row[1] or 0), 0)
+
+
+def get_unread_counts(db: Session, user_id: int) -> Dict[int, int]:
+    """chat_id -> unread count for every chat the user is in."""
+    if unread_mode() == "query":
+        return get_unread_counts_query(db, user_id)
+    cu, c, s = chat_users_table, models.Chat.__table__, models.UserChatState.__table__
+    rows = db.execute(
+        select(cu.c.chat_id, c.c.last_seq, func.coalesce(s.c.read_seq, 0))
+        .select_from(
+            cu.join(c, c.c.id == cu.c.chat_id)
+            .outerjoin(s, and_(s.c.chat_id == cu.c.chat_id, s.c.user_id == cu.c.user_id))
+        )
+        .where(cu.c.user_id == user_id)
+    )
+    return {chat_id: max(int(last or 0) - int(read), 0) for chat_id, last, read in rows}
+
+
+def get_unread_counts_query(db: Session, user_id: int) -> Dict[int, int]:
+    """Same result counted from messages in one grouped query (doesn't trust chats.last_seq)."""
+    cu, s, m = chat_users_table, models.UserChatState.__table__, models.Message.__table__
+    rows = db.execute(
+        select(cu.c.chat_id, func.count(distinct(m.c.seq)))
+        .select_from(
+            cu.outerjoin(s, and_(s.c.chat_id == cu.c.chat_id, s.c.user_id == cu.c.user_id))
+            .outerjoin(m, and_(
+                m.c.chat_id == cu.c.chat_id,
+                m.c.seq > func.coalesce(s.c.read_seq, 0),
+            ))
+        )
+        .where(cu.c.user_id == user_id)
+        .group_by(cu.c.chat_id)
+    )
+    return {chat_id: int(n) for chat_id, n in rows}
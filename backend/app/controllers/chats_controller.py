@@ -1,9 +1,24 @@
+from sqlalchemy import and_, case, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import os
 
 from ..db import models, schemas
+from ..db.models import chat_users_table
+from ..core.membership import membership
 from .users_controller import get_user
 
 
+def member_preview_size() -> int:
+    # Members embedded in each ChatOut; the rest come from GET /chats/{id}/members.
+    # At least 2 so private chats always carry both sides.
+    try:
+        return max(2, int(os.environ.get("CHAT_MEMBER_PREVIEW", "3")))
+    except Exception:
+        return 3
+
+
 def get_chat(db: Session, chat_id: int):
     return db.query(models.Chat).filter(models.Chat.id == chat_id).first()
 
@@ -13,7 +28,365 @@ def get_chats_for_user(db: Session, user_id: int):
     return user.chats if user else []
 
 
+def list_user_chats(db: Session, user_id: int, chat_ids: Optional[Iterable[int]] = None):
+    """One row per chat of the user, in sidebar order, without loading ORM objects.
+
+    Pinned chats come first (in the order they were pinned), then the rest
+    by latest message, chats without messages last (newest chat first).
+    Rows carry the chat columns, the chat_summaries columns and pinned_at.
+    """
+    cu, c, s, p = chat_users_table, models.Chat, models.ChatSummary, models.PinnedChat
+    q = (
+        select(
+            c.id, c.chat_type, c.name, c.admin_user_id,
+            s.last_message_id, s.last_message_at, s.last_sender_id, s.message_count,
+            p.pinned_at,
+        )
+        .select_from(cu)
+        .join(c, c.id == cu.c.chat_id)
+        .outerjoin(s, s.chat_id == c.id)
+        .outerjoin(p, and_(p.chat_id == c.id, p.user_id == user_id))
+        .where(cu.c.user_id == user_id)
+        .order_by(
+            p.pinned_at.is_(None),
+            p.pinned_at.asc(),
+            func.coalesce(s.last_message_id, 0).desc(),
+            c.id.desc(),
+        )
+    )
+    if chat_ids is not None:
+        q = q.where(c.id.in_(list(chat_ids)))
+    return db.execute(q).all()
+
+
+def chat_member_previews(
+    db: Session, user_id: int, chat_ids: Optional[Iterable[int]] = None
+) -> Dict[int, Tuple[int, List[schemas.UserBasic]]]:
+    """chat_id -> (member count, first members by id) for every chat of the user, from one query.
+
+    Only the preview rows are joined to users, so a large group costs a
+    few rows here however many members it has.
+    """
+    mine, other, u = chat_users_table.alias("mine"), chat_users_table.alias("other"), models.User
+    ranked = (
+        select(
+            other.c.chat_id,
+            other.c.user_id,
+            func.row_number().over(partition_by=other.c.chat_id, order_by=other.c.user_id).label("rn"),
+            func.count().over(partition_by=other.c.chat_id).label("n"),
+        )
+        .select_from(mine)
+        .join(other, other.c.chat_id == mine.c.chat_id)
+        .where(mine.c.user_id == user_id)
+    )
+    if chat_ids is not None:
+        ranked = ranked.where(mine.c.chat_id.in_(list(chat_ids)))
+    ranked = ranked.subquery()
+    rows = db.execute(
+        select(ranked.c.chat_id, ranked.c.n, u.id, u.username, u.first_name, u.last_name)
+        .join(u, u.id == ranked.c.user_id)
+        .where(ranked.c.rn <= member_preview_size())
+        .order_by(ranked.c.chat_id, u.id)
+    )
+    out: Dict[int, Tuple[int, List[schemas.UserBasic]]] = {}
+    for chat_id, n, uid, username, first_name, last_name in rows:
+        out.setdefault(chat_id, (int(n), []))[1].append(
+            schemas.UserBasic(id=uid, username=username, first_name=first_name, last_name=last_name)
+        )
+    return out
+
+
+def get_chat_members_page(
+    db: Session, chat_id: int, limit: int, after_id: Optional[int] = None
+) -> Tuple[List[schemas.UserBasic], Optional[int]]:
+    """One page of a chat's members by user id; next_cursor is the after_id of the next page."""
+    u, cu = models.User, chat_users_table
+    q = (
+        select(u.id, u.username, u.first_name, u.last_name)
+        .join(cu, cu.c.user_id == u.id)
+        .where(cu.c.chat_id == chat_id)
+        .order_by(u.id)
+        .limit(limit + 1)
+    )
+    if after_id is not None:
+        q = q.where(u.id > after_id)
+    rows = db.execute(q).all()
+    members = [
+        schemas.UserBasic(id=uid, username=username, first_name=first_name, last_name=last_name)
+        for uid, username, first_name, last_name in rows[:limit]
+    ]
+    return members, (members[-1].id if len(rows) > limit else None)
+
+
+def chat_title(
+    chat_type: str, name: Optional[str], participants: List[Any], me_id: int, member_count: Optional[int] = None
+) -> Optional[str]:
+    """Sidebar title as seen by me_id; participants need .id and .username.
+
+    participants may be a preview; pass member_count when it is.
+    """
+    if chat_type == "group":
+        return name or f"צ'אט עם {member_count if member_count is not None else len(participants)} משתתפים"
+    if len(participants) == 1 and participants[0].id == me_id:
+        return "צ'אט עם עצמי"
+    other = next((p for p in participants if p.id != me_id), None)
+    return f"צ'אט עם {other.username}" if other else None
+
+
+def private_pair(a: int, b: int) -> Tuple[int, int]:
+    return (a, b) if a <= b else (b, a)
+
+
+def find_private_chat(db: Session, a: int, b: int) -> Optional[int]:
+    """The DM between a and b (the self chat when a == b): one unique-index lookup."""
+    low, high = private_pair(a, b)
+    return db.execute(
+        select(models.Chat.id).where(models.Chat.pair_low == low, models.Chat.pair_high == high)
+    ).scalar()
+
+
+def get_or_create_private_chat(db: Session, a: int, b: int) -> Tuple[int, Dict[int, Tuple[int, str]]]:
+    """The DM between a and b, created (and committed) if missing.
+
+    Returns the chat id and record_chat_change's changes, empty when the
+    chat already existed. Concurrent creators race on the unique pair
+    index; the loser rolls back and returns the winner's chat.
+    """
+    existing = find_private_chat(db, a, b)
+    if existing is not None:
+        return existing, {}
+    low, high = private_pair(a, b)
+    try:
+        chat = models.Chat(chat_type="private", pair_low=low, pair_high=high)
+        db.add(chat)
+        db.flush()
+        db.execute(insert(chat_users_table), [{"chat_id": chat.id, "user_id": uid} for uid in sorted({low, high})])
+        changes = record_chat_change(db, chat.id, {low, high}, "upsert")
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return find_private_chat(db, a, b), {}
+    membership.invalidate_chat(chat.id, {low, high})
+    return chat.id, changes
+
+
+def list_peers(db: Session, user_id: int):
+    """Every user with the id of their DM with user_id (None if there is none), in one query.
+
+    The DM is matched on its pair key, so each user costs one unique-index probe.
+    """
+    u, c = models.User, models.Chat
+    me = literal(user_id)
+    return db.execute(
+        select(u.id, u.username, c.id.label("chat_id"))
+        .outerjoin(c, and_(
+            c.pair_low == case((u.id < me, u.id), else_=me),
+            c.pair_high == case((u.id < me, me), else_=u.id),
+        ))
+        .order_by(u.id)
+    ).all()
+
+
+def create_self_chat(db: Session, user_id: int) -> int:
+    return get_or_create_private_chat(db, user_id, user_id)[0]
+
+
+def _chat_out(r, member_count: int, participants: List[schemas.UserBasic], user_id: int) -> schemas.ChatOut:
+    # r: a list_user_chats row; participants: the member preview
+    return schemas.ChatOut(
+        id=r.id,
+        chat_type=r.chat_type,
+        name=r.name,
+        admin_user_id=r.admin_user_id,
+        member_count=member_count,
+        participants=participants,
+        title=chat_title(r.chat_type, r.name, participants, user_id, member_count),
+        is_pinned=r.pinned_at is not None,
+        last_message_id=r.last_message_id,
+        last_message_at=r.last_message_at,
+        last_sender_id=r.last_sender_id,
+        message_count=r.message_count or 0,
+    )
+
+
+def _chat_outs(db: Session, user_id: int, chat_ids: Optional[Iterable[int]] = None) -> List[schemas.ChatOut]:
+    if chat_ids is not None:
+        chat_ids = list(chat_ids)
+        if not chat_ids:
+            return []
+    rows = list_user_chats(db, user_id, chat_ids)
+    previews = chat_member_previews(db, user_id, chat_ids)
+    return [_chat_out(r, *previews.get(r.id, (0, [])), user_id) for r in rows]
+
+
+def get_chat_list(db: Session, user_id: int) -> List[schemas.ChatOut]:
+    """The user's sidebar: two set-based queries, whatever the number of chats.
+
+    Every user has a private chat with themselves; it's created here the
+    first time it's found missing and slotted in without re-reading the list.
+    """
+    result = _chat_outs(db, user_id)
+    has_self = any(
+        c.chat_type == "private" and c.member_count == 1 and c.participants[0].id == user_id for c in result
+    )
+    if not has_self:
+        me = db.execute(
+            select(models.User.id, models.User.username, models.User.first_name, models.User.last_name)
+            .where(models.User.id == user_id)
+        ).first()
+        if me is not None:
+            chat_id = create_self_chat(db, user_id)
+            me_basic = schemas.UserBasic(id=me.id, username=me.username, first_name=me.first_name, last_name=me.last_name)
+            out = schemas.ChatOut(
+                id=chat_id,
+                chat_type="private",
+                member_count=1,
+                participants=[me_basic],
+                title=chat_title("private", None, [me_basic], user_id),
+            )
+            # Newest of the chats without messages: ahead of the first of them
+            at = next((i for i, c in enumerate(result) if not c.is_pinned and c.last_message_id is None), len(result))
+            result.insert(at, out)
+    return result
+
+
+# ---- chat list change log ----
+# Each user has a chat_list_version; every change to their list (a chat
+# added, removed, renamed, its members or their pin changed) bumps it under
+# the user row's lock and logs (version, chat_id, op). Clients holding
+# version N ask for the changes after N instead of the whole list.
+
+def get_chat_list_version(db: Session, user_id: int) -> int:
+    v = db.execute(select(models.User.chat_list_version).where(models.User.id == user_id)).scalar()
+    return int(v or 0)
+
+
+def record_chat_change(db: Session, chat_id: int, user_ids: Iterable[int], op: str) -> Dict[int, Tuple[int, str]]:
+    """Log a change of one chat for these users (caller's transaction); user id -> (new version, op)."""
+    ids = sorted(set(user_ids))
+    if not ids:
+        return {}
+    u = models.User
+    # Sorted ids: concurrent changes lock user rows in the same order
+    rows = db.execute(
+        update(u).where(u.id.in_(ids)).values(chat_list_version=u.chat_list_version + 1)
+        .returning(u.id, u.chat_list_version),
+        execution_options={"synchronize_session": False},
+    ).all()
+    if rows:
+        db.execute(insert(models.ChatListChange), [
+            {"user_id": uid, "version": v, "chat_id": chat_id, "op": op} for uid, v in rows
+        ])
+    return {uid: (int(v), op) for uid, v in rows}
+
+
+def get_chat_list_delta(db: Session, user_id: int, since_version: int) -> schemas.ChatListDelta:
+    """What changed in the user's chat list after since_version.
+
+    A since_version this server never issued (ahead of the current one)
+    gets the full list with full=True.
+    """
+    version = get_chat_list_version(db, user_id)
+    if since_version > version:
+        return schemas.ChatListDelta(version=version, full=True, upserts=get_chat_list(db, user_id))
+    ch = models.ChatListChange
+    last_op: Dict[int, str] = {}
+    for chat_id, op in db.execute(
+        select(ch.chat_id, ch.op)
+        .where(ch.user_id == user_id, ch.version > since_version, ch.version <= version)
+        .order_by(ch.version)
+    ):
+        last_op[chat_id] = op
+    upserts = _chat_outs(db, user_id, [cid for cid, op in last_op.items() if op == "upsert"])
+    # An upsert for a chat the user has since left shows up as neither
+    present = {c.id for c in upserts}
+    removed = [cid for cid, op in last_op.items() if op == "remove" and cid not in present]
+    return schemas.ChatListDelta(version=version, upserts=upserts, removed=removed)
+
+
+def chat_outs_for_members(db: Session, chat_id: int, user_ids: Iterable[int]) -> Dict[int, schemas.ChatOut]:
+    """One chat as each of these members sees it (title and pin differ), in three queries.
+
+    Non-members among user_ids are left out.
+    """
+    ids = list(user_ids)
+    c, s, p = models.Chat, models.ChatSummary, models.PinnedChat
+    row = db.execute(
+        select(c.id, c.chat_type, c.name, c.admin_user_id,
+               s.last_message_id, s.last_message_at, s.last_sender_id, s.message_count)
+        .select_from(c)
+        .outerjoin(s, s.chat_id == c.id)
+        .where(c.id == chat_id)
+    ).first()
+    if row is None or not ids:
+        return {}
+    u, cu = models.User, chat_users_table
+    # The member count comes along with the preview (counted before the limit)
+    preview = db.execute(
+        select(u.id, u.username, u.first_name, u.last_name, func.count().over().label("n"))
+        .join(cu, cu.c.user_id == u.id)
+        .where(cu.c.chat_id == chat_id)
+        .order_by(u.id)
+        .limit(member_preview_size())
+    ).all()
+    member_count = int(preview[0].n) if preview else 0
+    participants = [
+        schemas.UserBasic(id=r.id, username=r.username, first_name=r.first_name, last_name=r.last_name)
+        for r in preview
+    ]
+    # Which of user_ids are members, and their pins
+    pinned = {uid: at for uid, at in db.execute(
+        select(cu.c.user_id, p.pinned_at)
+        .outerjoin(p, and_(p.chat_id == cu.c.chat_id, p.user_id == cu.c.user_id))
+        .where(cu.c.chat_id == chat_id, cu.c.user_id.in_(ids))
+    )}
+    return {
+        uid: _chat_out(_ChatRow(row, pinned[uid]), member_count, participants, uid)
+        for uid in ids if uid in pinned
+    }
+
+
+def changed_chat_outs(db: Session, chat_id: int, changes: Dict[int, Tuple[int, str]]) -> Dict[int, dict]:
+    """JSON ChatOut per user whose change (from record_chat_change) is an upsert."""
+    upserted = [uid for uid, (_, op) in changes.items() if op == "upsert"]
+    return {uid: out.model_dump(mode="json") for uid, out in chat_outs_for_members(db, chat_id, upserted).items()}
+
+
+class _ChatRow:
+    # A chat_outs_for_members row with the member's own pinned_at, shaped like a list_user_chats row
+    def __init__(self, row, pinned_at):
+        self._row = row
+        self.pinned_at = pinned_at
+
+    def __getattr__(self, name):
+        return getattr(self._row, name)
+
+
+def record_message(db: Session, chat_id: int, last: models.Message):
+    """Move the chat's summary to a just-flushed send (caller's transaction).
+
+    Runs under the chat row lock taken for the send's seq, so creating the
+    row on a chat's first message can't race another sender.
+    """
+    s = models.ChatSummary
+    values = {
+        s.last_message_id: last.id,
+        s.last_message_at: last.timestamp,
+        s.last_sender_id: last.sender_id,
+        s.message_count: s.message_count + 1,
+    }
+    if not db.query(s).filter(s.chat_id == chat_id).update(values, synchronize_session=False):
+        db.add(s(chat_id=chat_id, last_message_id=last.id, last_message_at=last.timestamp,
+                 last_sender_id=last.sender_id, message_count=1))
+
+
 def create_chat(db: Session, chat: schemas.ChatCreate, creator_id: int):
+    if chat.chat_type == "private":
+        # A DM is keyed by its pair: the same chat POST /chats/private finds
+        # (at most one other participant; none means the self chat)
+        other = next((uid for uid in chat.participant_ids if uid != creator_id), creator_id)
+        chat_id, changes = get_or_create_private_chat(db, creator_id, other)
+        return get_chat(db, chat_id), changes
     db_chat = models.Chat(chat_type=chat.chat_type, name=chat.name, admin_user_id=creator_id if chat.chat_type == 'group' else None)
     db.add(db_chat)
     db.commit()
@@ -24,32 +397,44 @@ def create_chat(db: Session, chat: schemas.ChatCreate, creator_id: int):
         user = get_user(db, user_id)
         if user:
             db_chat.participants.append(user)
+    db.flush()
+    changes = record_chat_change(db, db_chat.id, [u.id for u in db_chat.participants], "upsert")
     db.commit()
     db.refresh(db_chat)
-    return db_chat
+    membership.invalidate_chat(db_chat.id, all_participant_ids)
+    return db_chat, changes
 
 
 def add_members(db: Session, chat_id: int, member_ids: list[int]):
     chat = get_chat(db, chat_id)
     if not chat:
-        return None
+        return None, {}
     for uid in member_ids:
         user = get_user(db, uid)
         if user and user not in chat.participants:
             chat.participants.append(user)
+    db.flush()
+    # Existing members see the new participants too
+    changes = record_chat_change(db, chat_id, [u.id for u in chat.participants], "upsert")
     db.commit()
     db.refresh(chat)
-    return chat
+    membership.invalidate_chat(chat_id, member_ids)
+    return chat, changes
 
 
 def remove_members(db: Session, chat_id: int, member_ids: list[int]):
     chat = get_chat(db, chat_id)
     if not chat:
-        return None
-    chat.participants = [u for u in chat.participants if u.id not in set(member_ids)]
+        return None, {}
+    removed = {u.id for u in chat.participants if u.id in set(member_ids)}
+    chat.participants = [u for u in chat.participants if u.id not in removed]
+    db.flush()
+    changes = record_chat_change(db, chat_id, removed, "remove")
+    changes.update(record_chat_change(db, chat_id, [u.id for u in chat.participants], "upsert"))
     db.commit()
     db.refresh(chat)
-    return chat
+    membership.invalidate_chat(chat_id, member_ids)
+    return chat, changes
 
 
 def get_or_create_chat(db: Session, chat_id: int, chat_type: str = "group"):
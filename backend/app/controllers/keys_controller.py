@@ -20,7 +20,7 @@ def get_user_public_key(db: Session, user_id: int):
     return db.query(models.UserPublicKey).filter(models.UserPublicKey.user_id == user_id).first()
 
 
-def upsert_group_key_share(db: Session, chat_id: int, provider_user_id: int, recipient_user_id: int, wrapped_key_ciphertext: str, wrapped_key_nonce: str, algorithm: str):
+def upsert_group_key_share(db: Session, chat_id: int, provider_user_id: int, recipient_user_id: int, wrapped_key_ciphertext: bytes, wrapped_key_nonce: bytes, algorithm: str):
     rec = (
         db.query(models.GroupKeyShare)
         .filter(models.GroupKeyShare.chat_id == chat_id, models.GroupKeyShare.recipient_user_id == recipient_user_id)
@@ -29,6 +29,7 @@ def upsert_group_key_share(db: Session, chat_id: int, provider_user_id: int, rec
     if rec:
         rec.wrapped_key_ciphertext = wrapped_key_ciphertext
         rec.wrapped_key_nonce = wrapped_key_nonce
+        rec.wrapped_key_ciphertext_b64 = rec.wrapped_key_nonce_b64 = None
         rec.algo = algorithm
     else:
         rec = models.GroupKeyShare(
@@ -1,55 +1,197 @@
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import and_, exists, insert, or_, update
+from sqlalchemy.orm import Session, selectinload
+from typing import List, Optional, Tuple
+import datetime
 
 from ..db import models, schemas
+from .chat_state_controller import advance_read_seq
+from .chats_controller import record_message
 
 
-def create_chat_message(db: Session, message: schemas.MessageCreate, chat_id: int, sender_id: int) -> List[models.Message]:
-    created_messages: list[models.Message] = []
+def next_seq(db: Session, chat_id: int) -> int:
+    """Claim the chat's next seq; the row lock holds later senders until commit."""
+    c = models.Chat
+    return db.execute(
+        update(c).where(c.id == chat_id).values(last_seq=c.last_seq + 1).returning(c.last_seq)
+    ).scalar_one()
+
+
+def build_chat_messages(db: Session, message: schemas.MessageCreate, chat_id: int, sender_id: int) -> List[models.Message]:
+    """Add the rows for one send to the session without committing.
+
+    All rows of the send share one seq, and the sender's read position moves
+    up to it, so their own messages never count as unread. The chat's
+    summary row follows in the same transaction.
+    """
+    seq = next_seq(db, chat_id)
+    created = _build_rows(db, message, chat_id, sender_id)
+    for m in created:
+        m.seq = seq
+    advance_read_seq(db, sender_id, chat_id, seq)
+    db.flush()
+    record_message(db, chat_id, created[-1])
+    return created
+
+
+def _build_rows(db: Session, message: schemas.MessageCreate, chat_id: int, sender_id: int) -> List[models.Message]:
     if message.items:
-        for it in message.items:
-            rec = models.Message(
-                chat_id=chat_id,
-                sender_id=sender_id,
-                recipient_id=it.recipient_id,
-                content=None,
-                content_type=message.content_type,
-                ciphertext=it.ciphertext,
-                nonce=it.nonce,
-                algo=it.algo,
-            )
-            db.add(rec)
-            db.flush()
-            created_messages.append(rec)
-        db.commit()
-        for m in created_messages:
-            db.refresh(m)
-        return created_messages
-    else:
-        derived_type = message.content_type
-        attachment_id = getattr(message, 'attachment_id', None)
-        if attachment_id:
-            att = db.query(models.Attachment).get(attachment_id)
-            if att:
-                if att.mime_type.startswith('image/'):
-                    derived_type = 'image'
-                elif att.mime_type.startswith('video/'):
-                    derived_type = 'video'
-                else:
-                    derived_type = 'file'
-        db_message = models.Message(
+        # One logical row for the send; the per-recipient ciphertexts go into
+        # message_recipients in a single executemany once its id is known
+        rec = models.Message(
             chat_id=chat_id,
             sender_id=sender_id,
-            content=message.content,
-            content_type=derived_type,
-            ciphertext=message.ciphertext,
-            nonce=message.nonce,
-            algo=message.algo,
-            attachment_id=attachment_id,
+            content=None,
+            content_type=message.content_type,
+            fanout=True,
         )
-        db.add(db_message)
-        db.commit()
-        db.refresh(db_message)
-        return [db_message]
+        db.add(rec)
+        db.flush()
+        db.execute(insert(models.MessageRecipient), [
+            {"message_id": rec.id, "recipient_id": it.recipient_id, "ciphertext": it.ciphertext, "nonce": it.nonce, "algo": it.algo}
+            for it in message.items
+        ])
+        return [rec]
+    derived_type = message.content_type
+    attachment_id = getattr(message, 'attachment_id', None)
+    if attachment_id:
+        att = db.query(models.Attachment).get(attachment_id)
+        if att:
+            if att.mime_type.startswith('image/'):
+                derived_type = 'image'
+            elif att.mime_type.startswith('video/'):
+                derived_type = 'video'
+            else:
+                derived_type = 'file'
+    db_message = models.Message(
+        chat_id=chat_id,
+        sender_id=sender_id,
+        content=message.content,
+        content_type=derived_type,
+        ciphertext=message.ciphertext,
+        nonce=message.nonce,
+        algo=message.algo,
+        attachment_id=attachment_id,
+    )
+    db.add(db_message)
+    return [db_message]
+
+
+def create_chat_message(db: Session, message: schemas.MessageCreate, chat_id: int, sender_id: int) -> List[models.Message]:
+    created_messages = build_chat_messages(db, message, chat_id, sender_id)
+    db.commit()
+    for m in created_messages:
+        db.refresh(m)
+    return created_messages
+
+
+def _with_relations(q, viewer_id: Optional[int] = None):
+    # Sender, attachment and the viewer's fan-out copy for a whole page in
+    # one IN query each, not per row
+    q = q.options(selectinload(models.Message.sender), selectinload(models.Message.attachment))
+    if viewer_id is not None:
+        q = q.options(selectinload(models.Message.copies.and_(models.MessageRecipient.recipient_id == viewer_id)))
+    return q
+
+
+def _chat_rows(db: Session, chat_id: int, viewer_id: Optional[int], *entities):
+    """A chat's messages as viewer_id sees them: shared rows plus the fan-out sends they got a copy of.
+
+    Group E2EE sends are one messages row (fanout) with the per-recipient
+    ciphertexts in message_recipients; rows from before that layout carry
+    recipient_id themselves. Sends without a copy for the viewer are
+    filtered here instead of being shipped and discarded. viewer_id None
+    reads every row.
+    """
+    q = db.query(*entities) if entities else db.query(models.Message)
+    q = q.filter(models.Message.chat_id == chat_id)
+    if viewer_id is not None:
+        r = models.MessageRecipient
+        has_copy = exists().where(r.message_id == models.Message.id, r.recipient_id == viewer_id)
+        q = q.filter(or_(
+            and_(models.Message.recipient_id.is_(None), or_(models.Message.fanout.is_(False), has_copy)),
+            models.Message.recipient_id == viewer_id,
+        ))
+    return q
+
+
+def get_chat_messages_page(
+    db: Session,
+    chat_id: int,
+    limit: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    viewer_id: Optional[int] = None,
+) -> Tuple[List[models.Message], Optional[int]]:
+    """One page of a chat's history in id order, plus the cursor for the next page.
+
+    Without after_id this pages backwards from the newest message (or from
+    before_id) and next_cursor is the before_id for older messages; with
+    after_id it pages forwards and next_cursor is the next after_id. Either
+    way it's a range scan on (chat_id, id), so page cost doesn't grow with
+    how deep into the chat the page is.
+    """
+    q = _with_relations(_chat_rows(db, chat_id, viewer_id), viewer_id)
+    if after_id is not None:
+        rows = q.filter(models.Message.id > after_id).order_by(models.Message.id.asc()).limit(limit + 1).all()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return rows, (rows[-1].id if more else None)
+    if before_id is not None:
+        q = q.filter(models.Message.id < before_id)
+    rows = q.order_by(models.Message.id.desc()).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    return rows, (rows[0].id if more else None)
+
+
+def find_anchor_at(db: Session, chat_id: int, at: datetime.datetime, viewer_id: Optional[int] = None) -> Optional[int]:
+    """Id of the first message at or after `at`, else the last one before it."""
+    if at.tzinfo is not None:
+        at = at.astimezone(datetime.timezone.utc)
+    else:
+        at = at.replace(tzinfo=datetime.timezone.utc)
+    base = _chat_rows(db, chat_id, viewer_id, models.Message.id)
+    # Both seeks walk (chat_id, timestamp) from one end
+    row = (
+        base.filter(models.Message.timestamp >= at)
+        .order_by(models.Message.timestamp.asc(), models.Message.id.asc())
+        .first()
+    )
+    if row is None:
+        row = (
+            base.filter(models.Message.timestamp < at)
+            .order_by(models.Message.timestamp.desc(), models.Message.id.desc())
+            .first()
+        )
+    return row[0] if row is not None else None
+
 
+def get_chat_messages_around(
+    db: Session, chat_id: int, anchor_id: int, limit: int, viewer_id: Optional[int] = None
+) -> Tuple[List[models.Message], Optional[int], Optional[int]]:
+    """Up to `limit` messages around anchor_id (included if it exists), split
+    evenly unless one side runs out, in which case the other fills the rest.
 
+    Returns (messages in id order, before_cursor, after_cursor); the cursors
+    continue paging through GET /chats/{id}/messages as before_id / after_id
+    and are None when that end of the chat is reached.
+    """
+    q = _chat_rows(db, chat_id, viewer_id)
+    # Ids only, so a short side can lend its slots to the other
+    older = [r[0] for r in q.with_entities(models.Message.id).filter(models.Message.id < anchor_id).order_by(models.Message.id.desc()).limit(limit + 1)]
+    newer = [r[0] for r in q.with_entities(models.Message.id).filter(models.Message.id >= anchor_id).order_by(models.Message.id.asc()).limit(limit + 1)]
+    take_newer = min(len(newer), max(limit - limit // 2, limit - len(older)))
+    take_older = min(len(older), limit - take_newer)
+    more_older, more_newer = len(older) > take_older, len(newer) > take_newer
+    lo = older[take_older - 1] if take_older else anchor_id
+    hi = newer[take_newer - 1] if take_newer else anchor_id - 1
+    rows = (
+        _with_relations(q, viewer_id)
+        .filter(models.Message.id >= lo, models.Message.id <= hi)
+        .order_by(models.Message.id.asc())
+        .all()
+    )
+    before_cursor = rows[0].id if rows and more_older else None
+    after_cursor = rows[-1].id if rows and more_newer else None
+    return rows, before_cursor, after_cursor
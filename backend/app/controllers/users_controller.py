@@ -3,6 +3,8 @@ from typing import Optional
 
 from ..db import models, schemas
 from ..core.security import get_password_hash
+from ..core.membership import membership
+from ..ws.envelopes import envelope_cache
 
 
 def get_user(db: Session, user_id: int):
@@ -29,13 +31,14 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.refresh(db_user)
     # Auto-create self-chat (private with only this user)
     try:
-        self_chat = models.Chat(chat_type="private")
+        self_chat = models.Chat(chat_type="private", pair_low=db_user.id, pair_high=db_user.id)
         db.add(self_chat)
         db.commit()
         db.refresh(self_chat)
         self_chat.participants.append(db_user)
         db.commit()
         db.refresh(self_chat)
+        membership.invalidate_chat(self_chat.id, [db_user.id])
     except Exception:
         db.rollback()
     return db_user
@@ -68,6 +71,9 @@ def delete_user(db: Session, user_id: int):
         return False
     db.delete(u)
     db.commit()
+    # Their messages lose the sender; other nodes drop theirs on the membership event
+    envelope_cache.invalidate_sender(user_id)
+    membership.invalidate_user(user_id)
     return True
 
 
@@ -0,0 +1,173 @@
+from typing import Any, Deque, Dict, List, NamedTuple, Optional
+from collections import deque
+import asyncio
+import logging
+import os
+
+from sqlalchemy.orm import Session
+
+from ..db import database, models, schemas
+from ..controllers import messages_controller
+from ..ws import envelopes
+
+logger = logging.getLogger(__name__)
+
+
+def group_commit_enabled() -> bool:
+    return os.environ.get("MESSAGE_GROUP_COMMIT", "0").strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except Exception:
+        return default
+
+
+class SavedMessage(NamedTuple):
+    id: int
+    recipient_id: Optional[int]
+    body: bytes
+
+
+def _saved(rows: List[models.Message], message: schemas.MessageCreate, sender: Any) -> List[SavedMessage]:
+    # A fan-out send is one row but one envelope per recipient; the items
+    # are exactly what went into message_recipients
+    saved = []
+    for m in rows:
+        if m.fanout:
+            saved.extend(
+                SavedMessage(m.id, it.recipient_id, envelopes.encode_message(m, sender=sender, copy=it))
+                for it in message.items
+            )
+        else:
+            saved.append(SavedMessage(m.id, m.recipient_id, envelopes.encode_message(m, sender=sender)))
+    return saved
+
+
+class _PendingSend:
+    __slots__ = ("message", "chat_id", "sender", "future")
+
+    def __init__(self, message: schemas.MessageCreate, chat_id: int, sender: Any, future: asyncio.Future):
+        self.message = message
+        self.chat_id = chat_id
+        self.sender = sender
+        self.future = future
+
+
+class MessageWriter:
+    """Write path for chat messages with optional group commit.
+
+    With MESSAGE_GROUP_COMMIT on, concurrent sends on this worker are queued
+    and written by one task: every GROUP_COMMIT_WINDOW_MS, or as soon as
+    GROUP_COMMIT_MAX sends are waiting, the queue is flushed as a single
+    transaction. Rows are added in arrival order, so ids (and therefore
+    order within a chat) follow the order the sends came in. Each caller
+    gets its own rows back as SavedMessage(id, recipient_id, envelope).
+    """
+
+    def __init__(self, enabled: Optional[bool] = None, window_ms: Optional[float] = None, max_batch: Optional[int] = None):
+        self.enabled = group_commit_enabled() if enabled is None else enabled
+        self.window = (window_ms if window_ms is not None else _env_number("GROUP_COMMIT_WINDOW_MS", 5)) / 1000.0
+        self.max_batch = max(1, int(max_batch if max_batch is not None else _env_number("GROUP_COMMIT_MAX", 200)))
+        self._pending: Deque[_PendingSend] = deque()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.messages = 0
+        self.fallbacks = 0
+
+    async def submit(self, message: schemas.MessageCreate, chat_id: int, sender: Any) -> List[SavedMessage]:
+        """Persist one send and return its saved rows with their encoded envelopes."""
+        if not self.enabled:
+            async with database.AsyncSessionLocal() as db:
+                return await db.run_sync(self._write_one, message, chat_id, sender)
+        self._ensure_task()
+        assert self._wakeup is not None and self._full is not None
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_PendingSend(message, chat_id, sender, future))
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        self._wakeup.set()
+        return await future
+
+    def _ensure_task(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._full = asyncio.Event()
+            self._pending.clear()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        assert self._wakeup is not None and self._full is not None
+        while True:
+            await self._wakeup.wait()
+            if len(self._pending) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            self._full.clear()
+            batch = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+            if self._pending:
+                self._wakeup.set()
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch: List[_PendingSend]):
+        try:
+            async with database.AsyncSessionLocal() as db:
+                results = await db.run_sync(self._write_batch, batch)
+        except Exception:
+            # One bad send must not fail its neighbours: retry them one by one
+            self.fallbacks += 1
+            logger.exception(f"Group commit of {len(batch)} sends failed; retrying individually")
+            for item in batch:
+                if item.future.done():
+                    continue
+                try:
+                    async with database.AsyncSessionLocal() as db:
+                        saved = await db.run_sync(self._write_one, item.message, item.chat_id, item.sender)
+                    item.future.set_result(saved)
+                except Exception as e:
+                    item.future.set_exception(e)
+            return
+        self.batches += 1
+        self.messages += len(batch)
+        for item, saved in zip(batch, results):
+            if not item.future.done():
+                item.future.set_result(saved)
+
+    def _write_one(self, s: Session, message: schemas.MessageCreate, chat_id: int, sender: Any) -> List[SavedMessage]:
+        rows = messages_controller.create_chat_message(db=s, message=message, chat_id=chat_id, sender_id=sender.id)
+        return _saved(rows, message, sender)
+
+    def _write_batch(self, s: Session, batch: List[_PendingSend]) -> List[List[SavedMessage]]:
+        rows = [
+            messages_controller.build_chat_messages(s, item.message, item.chat_id, item.sender.id)
+            for item in batch
+        ]
+        s.commit()
+        # One query instead of a refresh per row, so column values read back
+        # exactly as create_chat_message's refresh would see them
+        ids = [m.id for group in rows for m in group]
+        s.query(models.Message).filter(models.Message.id.in_(ids)).populate_existing().all()
+        return [_saved(group, item.message, item.sender) for item, group in zip(batch, rows)]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "enabled": self.enabled,
+            "batches": self.batches,
+            "messages": self.messages,
+            "avg_batch": (self.messages / self.batches) if self.batches else 0.0,
+            "fallbacks": self.fallbacks,
+            "queued": len(self._pending),
+        }
+
+
+message_writer = MessageWriter()
@@ -0,0 +1,179 @@
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+import os
+import threading
+
+from sqlalchemy.orm import Session
+
+from ..db import database
+from ..db.models import chat_users_table
+
+
+def cache_enabled() -> bool:
+    return os.environ.get("MEMBERSHIP_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+class MembershipIndex:
+    """Process-local chat membership index.
+
+    chat_id -> member ids and user_id -> chat ids, both filled lazily from
+    chat_users and dropped by the chats/users controllers whenever
+    membership changes.
+    """
+
+    def __init__(self, enabled: Optional[bool] = None):
+        self.enabled = cache_enabled() if enabled is None else enabled
+        self._chat_members: Dict[int, FrozenSet[int]] = {}
+        self._user_chats: Dict[int, FrozenSet[int]] = {}
+        # Bumped by invalidations; a load only stores its result if the
+        # generation it started under is still current
+        self._generation = 0
+        self._chat_gens: Dict[int, int] = {}
+        self._user_gens: Dict[int, int] = {}
+        # Sync routes touch this from the threadpool, WS handlers from the loop
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Called with a change dict on local invalidations (e.g. to tell other workers)
+        self._listeners: List[Callable[[dict], None]] = []
+
+    def add_listener(self, fn: Callable[[dict], None]):
+        if fn not in self._listeners:
+            self._listeners.append(fn)
+
+    def remove_listener(self, fn: Callable[[dict], None]):
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    def _notify(self, change: dict):
+        for fn in list(self._listeners):
+            try:
+                fn(change)
+            except Exception:
+                pass
+
+    def _query(self, db: Optional[Session], column, value) -> FrozenSet[int]:
+        other = chat_users_table.c.user_id if column is chat_users_table.c.chat_id else chat_users_table.c.chat_id
+        own = db is None
+        if own:
+            db = database.SessionLocal()
+        try:
+            rows = db.query(other).filter(column == value).all()
+            return frozenset(r[0] for r in rows)
+        finally:
+            if own:
+                db.close()
+
+    def _chat_token(self, chat_id: int) -> Tuple[int, int]:
+        return self._generation, self._chat_gens.get(chat_id, 0)
+
+    def _user_token(self, user_id: int) -> Tuple[int, int]:
+        return self._generation, self._user_gens.get(user_id, 0)
+
+    def _store_members(self, chat_id: int, ids: FrozenSet[int], token: Tuple[int, int]):
+        with self._lock:
+            # Invalidated while the query was in flight: the result may be stale
+            if self._chat_token(chat_id) == token:
+                self._chat_members[chat_id] = ids
+
+    def members(self, chat_id: int, db: Optional[Session] = None) -> FrozenSet[int]:
+        """Member ids of a chat (empty if the chat does not exist)."""
+        if self.enabled:
+            cached = self._chat_members.get(chat_id)
+            if cached is not None:
+                self.hits += 1
+                return cached
+        self.misses += 1
+        token = self._chat_token(chat_id)
+        ids = self._query(db, chat_users_table.c.chat_id, chat_id)
+        if self.enabled:
+            self._store_members(chat_id, ids, token)
+        return ids
+
+    def chats_for_user(self, user_id: int, db: Optional[Session] = None) -> FrozenSet[int]:
+        if self.enabled:
+            cached = self._user_chats.get(user_id)
+            if cached is not None:
+                self.hits += 1
+                return cached
+        self.misses += 1
+        token = self._user_token(user_id)
+        ids = self._query(db, chat_users_table.c.user_id, user_id)
+        if self.enabled:
+            with self._lock:
+                if self._user_token(user_id) == token:
+                    self._user_chats[user_id] = ids
+        return ids
+
+    def is_member(self, chat_id: int, user_id: int, db: Optional[Session] = None) -> bool:
+        return user_id in self.members(chat_id, db)
+
+    async def amembers(self, chat_id: int) -> FrozenSet[int]:
+        """members() for the event loop: a cold chat is loaded via the async engine."""
+        if self.enabled:
+            cached = self._chat_members.get(chat_id)
+            if cached is not None:
+                self.hits += 1
+                return cached
+        self.misses += 1
+        token = self._chat_token(chat_id)
+        async with database.AsyncSessionLocal() as db:
+            ids = await db.run_sync(lambda s: self._query(s, chat_users_table.c.chat_id, chat_id))
+        if self.enabled:
+            self._store_members(chat_id, ids, token)
+        return ids
+
+    async def ais_member(self, chat_id: int, user_id: int) -> bool:
+        return user_id in await self.amembers(chat_id)
+
+    def invalidate_chat(self, chat_id: int, user_ids: Iterable[int] = (), propagate: bool = True):
+        """Forget a chat's members and the chat lists of everyone involved.
+
+        Pass the ids of users who joined or left; previous members are
+        taken from the cached entry.
+        """
+        user_ids = [int(u) for u in user_ids]
+        with self._lock:
+            affected: Set[int] = set(user_ids)
+            affected.update(self._chat_members.pop(chat_id, ()))
+            self._chat_gens[chat_id] = self._chat_gens.get(chat_id, 0) + 1
+            for uid in affected:
+                self._user_chats.pop(uid, None)
+                self._user_gens[uid] = self._user_gens.get(uid, 0) + 1
+        if propagate:
+            self._notify({"chat_id": chat_id, "user_ids": user_ids})
+
+    def invalidate_user(self, user_id: int, propagate: bool = True):
+        with self._lock:
+            chats = self._user_chats.pop(user_id, frozenset())
+            for chat_id in chats:
+                self._chat_members.pop(chat_id, None)
+            for chat_id, members in list(self._chat_members.items()):
+                if user_id in members:
+                    del self._chat_members[chat_id]
+            # Any chat load in flight may include this user
+            self._generation += 1
+        if propagate:
+            self._notify({"user_id": user_id})
+
+    def clear(self):
+        with self._lock:
+            self._chat_members.clear()
+            self._user_chats.clear()
+            self._chat_gens.clear()
+            self._user_gens.clear()
+            self._generation += 1
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "chats": len(self._chat_members),
+            "users": len(self._user_chats),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+
+membership = MembershipIndex()
@@ -0,0 +1,30 @@
+"""Ciphertexts, nonces and wrapped keys are stored as raw bytes.
+
+Clients send and receive them as standard base64 text; the conversion
+happens here, at the API edge, and nowhere else. Rows written before the
+binary columns keep their base64 text in the legacy column until
+app.db.convert_binary has moved them over, so readers take whichever of
+the two is set.
+"""
+from typing import Any, Optional
+import base64
+import binascii
+
+
+def decode(value: Any) -> Any:
+    """Base64 text from a client as bytes; bytes and None pass through."""
+    if value is None or isinstance(value, (bytes, bytearray)):
+        return value
+    if not isinstance(value, str):
+        raise ValueError("expected base64 text")
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("invalid base64")
+
+
+def encode(raw: Optional[bytes], legacy: Optional[str] = None) -> Optional[str]:
+    """The base64 text a client sees for a binary column (or its legacy text)."""
+    if raw is None:
+        return legacy
+    return base64.b64encode(raw).decode("ascii")
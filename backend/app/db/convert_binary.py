@@ -0,0 +1,99 @@
+"""Move base64 text from the legacy columns into the binary ones, in batches.
+
+Online: every batch is its own short transaction over the next range of
+primary keys, and readers take whichever column is set (db/binary.py), so
+the app keeps serving while this runs. A row is only rewritten if its text
+is still what was read, so a concurrent update wins. Re-running is safe
+and picks up only what is left; values that aren't valid base64 stay in
+the text column and are reported as skipped.
+
+    python -m app.db.convert_binary [--batch 1000] [--pause-ms 0] [--table messages ...]
+"""
+from typing import Dict, Optional, Sequence, Tuple
+import argparse
+import logging
+import time
+
+from sqlalchemy import and_, bindparam, column, or_, select, table, tuple_, update
+from sqlalchemy.engine import Engine
+
+from . import binary
+from .migrations import BINARY_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_KEYS: Dict[str, Tuple[str, ...]] = {
+    "messages": ("id",),
+    "message_recipients": ("message_id", "recipient_id"),
+    "attachments": ("id",),
+    "group_key_shares": ("id",),
+}
+
+
+def convert_table(engine: Engine, name: str, batch: int = 1000, pause: float = 0.0) -> Dict[str, int]:
+    """Convert one table; returns counts of converted and skipped values and batches run."""
+    keys = PRIMARY_KEYS[name]
+    texts = [c for t, c in BINARY_COLUMNS if t == name]
+    t = table(name, *(column(c) for c in keys), *(column(c) for c in texts), *(column(f"{c}_bin") for c in texts))
+    pk = [t.c[k] for k in keys]
+    stats = {"converted": 0, "skipped": 0, "batches": 0}
+    last: Optional[Sequence] = None
+    while True:
+        with engine.begin() as conn:
+            q = select(*pk, *(t.c[c] for c in texts)).where(or_(*(t.c[c].isnot(None) for c in texts)))
+            if last is not None:
+                q = q.where(tuple_(*pk) > tuple_(*last))
+            rows = conn.execute(q.order_by(*pk).limit(batch)).all()
+            if not rows:
+                return stats
+            last = tuple(rows[-1][: len(keys)])
+            for i, c in enumerate(texts):
+                params = []
+                for row in rows:
+                    value = row[len(keys) + i]
+                    if value is None:
+                        continue
+                    try:
+                        raw = binary.decode(value)
+                    except ValueError:
+                        stats["skipped"] += 1
+                        continue
+                    params.append({**{f"k_{k}": row[j] for j, k in enumerate(keys)}, "old": value, "raw": raw})
+                if params:
+                    conn.execute(
+                        update(t)
+                        .where(and_(*(t.c[k] == bindparam(f"k_{k}") for k in keys), t.c[c] == bindparam("old")))
+                        .values({f"{c}_bin": bindparam("raw"), c: None}),
+                        params,
+                    )
+                    stats["converted"] += len(params)
+            stats["batches"] += 1
+        if pause:
+            time.sleep(pause)
+
+
+def convert_all(engine: Engine, tables: Optional[Sequence[str]] = None, batch: int = 1000, pause: float = 0.0) -> Dict[str, Dict[str, int]]:
+    results = {}
+    for name in tables or PRIMARY_KEYS:
+        results[name] = convert_table(engine, name, batch=batch, pause=pause)
+        try:
+            logger.info(f"convert_binary {name}: {results[name]}")
+        except Exception:
+            pass
+    return results
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch", type=int, default=1000, help="rows per transaction")
+    parser.add_argument("--pause-ms", type=float, default=0.0, help="sleep between batches to go easy on a busy database")
+    parser.add_argument("--table", action="append", choices=sorted(PRIMARY_KEYS), help="only these tables (repeatable)")
+    args = parser.parse_args(argv)
+    from .database import engine
+
+    for name, stats in convert_all(engine, args.table, batch=args.batch, pause=args.pause_ms / 1000.0).items():
+        print(f"{name}: {stats['converted']} converted, {stats['skipped']} skipped (not base64), {stats['batches']} batches")
+
+
+if __name__ == "__main__":
+    main()
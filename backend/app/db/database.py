@@ -1,7 +1,9 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from ..core.config import get_settings
 
 settings = get_settings()
@@ -11,6 +13,29 @@ engine = create_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
 
+def async_database_url(url: str) -> str:
+    # Same database through an asyncio driver: asyncpg for Postgres, aiosqlite for sqlite
+    scheme, sep, rest = url.partition("://")
+    dialect = scheme.split("+", 1)[0]
+    if dialect in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    if dialect == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    return url
+
+
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
 
+# sqlite connections are cheap and must not outlive the event loop that opened
+# them (the test client runs a loop per request), so don't pool them
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    **({"poolclass": NullPool} if ASYNC_DATABASE_URL.startswith("sqlite") else {}),
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
+Base = declarative_base()
@@ -0,0 +1,282 @@
+import datetime
+import logging
+import re
+from typing import Callable, Dict, List, Set, Tuple
+
+from sqlalchemy import DateTime, inspect, select, text
+from sqlalchemy import column as sa_column, table as sa_table
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+# create_all only creates missing tables; anything added to an existing table
+# (indexes, columns) is brought in here. Every step checks before it acts, so
+# running them on each startup is a no-op once a database is up to date.
+
+
+def _has_table(conn: Connection, table: str) -> bool:
+    return inspect(conn).has_table(table)
+
+
+def _has_index(conn: Connection, table: str, name: str) -> bool:
+    return any(ix.get("name") == name for ix in inspect(conn).get_indexes(table))
+
+
+def _add_index(conn: Connection, table: str, name: str, columns: List[str], unique: bool = False):
+    if not _has_table(conn, table) or _has_index(conn, table, name):
+        return False
+    conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({', '.join(columns)})"))
+    return True
+
+
+def _has_column(conn: Connection, table: str, name: str) -> bool:
+    return any(col["name"] == name for col in inspect(conn).get_columns(table))
+
+
+def _add_column(conn: Connection, table: str, name: str, ddl: str) -> bool:
+    if not _has_table(conn, table) or _has_column(conn, table, name):
+        return False
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+    return True
+
+
+# Per-recipient copies of one legacy send were inserted back to back, each
+# stamped by its own Python default, so they differ by a little
+LEGACY_SEND_WINDOW = datetime.timedelta(seconds=2)
+
+
+def _legacy_send_ids(conn: Connection, batch: int = 10000) -> None:
+    """Fill _legacy_send_ids with (copy id, id of its send's first copy).
+
+    A run of recipient rows in one chat, from one sender, each recipient
+    once and within LEGACY_SEND_WINDOW of the first, is one send. Only
+    the later copies get a row; everything else is its own send.
+    """
+    conn.execute(text("CREATE TABLE _legacy_send_ids (id INTEGER PRIMARY KEY, send_id INTEGER NOT NULL)"))
+    m = sa_table(
+        "messages", sa_column("id"), sa_column("chat_id"), sa_column("sender_id"), sa_column("recipient_id"),
+        sa_column("timestamp", DateTime(timezone=True)),
+    )
+    # chat_id -> (send id, sender, start, recipients) of the run still open there
+    runs: Dict[int, Tuple[int, int, datetime.datetime, Set[int]]] = {}
+    last = 0
+    while True:
+        rows = conn.execute(
+            select(m.c.id, m.c.chat_id, m.c.sender_id, m.c.recipient_id, m.c.timestamp)
+            .where(m.c.id > last).order_by(m.c.id).limit(batch)
+        ).all()
+        if not rows:
+            return
+        last = rows[-1].id
+        later = []
+        for r in rows:
+            run = runs.pop(r.chat_id, None)
+            if r.recipient_id is None or r.timestamp is None:
+                continue
+            ts = r.timestamp.replace(tzinfo=None)
+            if (
+                run is not None and run[1] == r.sender_id and r.recipient_id not in run[3]
+                and abs(ts - run[2]) <= LEGACY_SEND_WINDOW
+            ):
+                run[3].add(r.recipient_id)
+                later.append({"id": r.id, "send_id": run[0]})
+            else:
+                run = (r.id, r.sender_id, ts, {r.recipient_id})
+            runs[r.chat_id] = run
+        if later:
+            conn.execute(text("INSERT INTO _legacy_send_ids (id, send_id) VALUES (:id, :send_id)"), later)
+
+
+def _message_seqs(conn: Connection) -> bool:
+    if not _add_column(conn, "messages", "seq", "INTEGER"):
+        return False
+    _add_column(conn, "chats", "last_seq", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(conn, "user_chat_states", "read_seq", "INTEGER NOT NULL DEFAULT 0")
+    # One seq per send: the per-recipient copies of a group send share theirs,
+    # or unread (last_seq - read_seq) would count each send once per copy
+    _legacy_send_ids(conn)
+    conn.execute(text(
+        "UPDATE messages SET seq = r.seq FROM ("
+        "SELECT m.id, DENSE_RANK() OVER (PARTITION BY m.chat_id ORDER BY COALESCE(l.send_id, m.id)) AS seq "
+        "FROM messages m LEFT JOIN _legacy_send_ids l ON l.id = m.id"
+        ") AS r WHERE messages.id = r.id"
+    ))
+    conn.execute(text("DROP TABLE _legacy_send_ids"))
+    if _has_table(conn, "chats"):
+        conn.execute(text(
+            "UPDATE chats SET last_seq = COALESCE("
+            "(SELECT m.seq FROM messages m WHERE m.chat_id = chats.id ORDER BY m.id DESC LIMIT 1), 0)"
+        ))
+    if not _has_table(conn, "user_chat_states"):
+        return True
+    # A state row per membership, read up to the last read message or the
+    # user's own last send, whichever is newer
+    conn.execute(text(
+        "INSERT INTO user_chat_states (user_id, chat_id, read_seq) "
+        "SELECT cu.user_id, cu.chat_id, 0 FROM chat_users cu "
+        "LEFT JOIN user_chat_states s ON s.user_id = cu.user_id AND s.chat_id = cu.chat_id "
+        "WHERE s.id IS NULL"
+    ))
+    conn.execute(text(
+        "UPDATE user_chat_states SET read_seq = COALESCE(("
+        "SELECT MAX(m.seq) FROM messages m WHERE m.chat_id = user_chat_states.chat_id "
+        "AND (m.id <= COALESCE(user_chat_states.last_read_message_id, 0) "
+        "OR m.sender_id = user_chat_states.user_id)), 0)"
+    ))
+    return True
+
+
+def _chat_summaries(conn: Connection) -> bool:
+    # create_all makes the table empty; fill it once for chats that already have messages
+    if not _has_table(conn, "chat_summaries") or not _has_table(conn, "messages"):
+        return False
+    if conn.execute(text("SELECT 1 FROM chat_summaries LIMIT 1")).first() is not None:
+        return False
+    if conn.execute(text("SELECT 1 FROM messages LIMIT 1")).first() is None:
+        return False
+    conn.execute(text(
+        "INSERT INTO chat_summaries (chat_id, last_message_id, message_count) "
+        "SELECT chat_id, MAX(id), COUNT(DISTINCT seq) FROM messages WHERE chat_id IS NOT NULL GROUP BY chat_id"
+    ))
+    conn.execute(text(
+        "UPDATE chat_summaries SET "
+        "last_message_at = (SELECT m.timestamp FROM messages m WHERE m.id = chat_summaries.last_message_id), "
+        "last_sender_id = (SELECT m.sender_id FROM messages m WHERE m.id = chat_summaries.last_message_id)"
+    ))
+    return True
+
+
+def _private_pairs(conn: Connection) -> bool:
+    if not _add_column(conn, "chats", "pair_low", "INTEGER"):
+        return False
+    _add_column(conn, "chats", "pair_high", "INTEGER")
+    # Key every private chat of one or two members by its sorted pair
+    conn.execute(text(
+        "UPDATE chats SET "
+        "pair_low = (SELECT MIN(cu.user_id) FROM chat_users cu WHERE cu.chat_id = chats.id), "
+        "pair_high = (SELECT MAX(cu.user_id) FROM chat_users cu WHERE cu.chat_id = chats.id) "
+        "WHERE chat_type = 'private' "
+        "AND (SELECT COUNT(*) FROM chat_users cu WHERE cu.chat_id = chats.id) BETWEEN 1 AND 2"
+    ))
+    # Duplicate DMs from earlier races: the oldest one keeps the key, the
+    # others stay reachable from the chat list but are no longer looked up
+    conn.execute(text(
+        "UPDATE chats SET pair_low = NULL, pair_high = NULL "
+        "WHERE pair_low IS NOT NULL AND EXISTS ("
+        "SELECT 1 FROM chats c2 WHERE c2.pair_low = chats.pair_low "
+        "AND c2.pair_high = chats.pair_high AND c2.id < chats.id)"
+    ))
+    _add_index(conn, "chats", "ux_chats_private_pair", ["pair_low", "pair_high"], unique=True)
+    return True
+
+
+def _message_recipients(conn: Connection) -> bool:
+    # create_all makes message_recipients; the column marks the step as done
+    if not _has_table(conn, "message_recipients") or not _has_column(conn, "messages", "seq"):
+        return False
+    if not _add_column(conn, "messages", "fanout", "BOOLEAN NOT NULL DEFAULT false"):
+        return False
+    # A send's per-recipient rows share (chat_id, seq); the oldest one becomes
+    # the logical row. Rows numbered one per row by the seq step just become
+    # single-copy sends.
+    keep = (
+        "SELECT chat_id, seq, MIN(id) AS id FROM messages "
+        "WHERE recipient_id IS NOT NULL AND seq IS NOT NULL GROUP BY chat_id, seq"
+    )
+    # References to the copies about to go move to the logical row first
+    for table, column in (("chat_summaries", "last_message_id"), ("user_chat_states", "last_read_message_id")):
+        if not _has_table(conn, table):
+            continue
+        conn.execute(text(
+            f"UPDATE {table} SET {column} = (SELECT k.id FROM messages m JOIN ({keep}) k "
+            f"ON k.chat_id = m.chat_id AND k.seq = m.seq WHERE m.id = {table}.{column}) "
+            f"WHERE {column} IN (SELECT id FROM messages WHERE recipient_id IS NOT NULL AND seq IS NOT NULL)"
+        ))
+    # One copy per recipient (the oldest, should a send have listed someone twice)
+    conn.execute(text(
+        "INSERT INTO message_recipients (message_id, recipient_id, ciphertext, nonce, algo) "
+        f"SELECT k.id, m.recipient_id, COALESCE(m.ciphertext, ''), m.nonce, m.algo FROM messages m "
+        f"JOIN ({keep}) k ON k.chat_id = m.chat_id AND k.seq = m.seq "
+        "WHERE m.id IN (SELECT MIN(id) FROM messages WHERE recipient_id IS NOT NULL AND seq IS NOT NULL "
+        "GROUP BY chat_id, seq, recipient_id)"
+    ))
+    conn.execute(text(
+        "UPDATE messages SET fanout = true, recipient_id = NULL, ciphertext = NULL, nonce = NULL, algo = NULL "
+        f"WHERE id IN (SELECT id FROM ({keep}) k)"
+    ))
+    conn.execute(text("DELETE FROM messages WHERE recipient_id IS NOT NULL AND seq IS NOT NULL"))
+    return True
+
+
+# Base64 text columns that now have a raw-bytes twin named <column>_bin
+# (see db/binary.py); app.db.convert_binary moves the rows over
+BINARY_COLUMNS: List[Tuple[str, str]] = [
+    ("messages", "ciphertext"),
+    ("messages", "nonce"),
+    ("message_recipients", "ciphertext"),
+    ("message_recipients", "nonce"),
+    ("attachments", "nonce"),
+    ("group_key_shares", "wrapped_key_ciphertext"),
+    ("group_key_shares", "wrapped_key_nonce"),
+]
+
+
+def _drop_not_null(conn: Connection, table: str, column: str) -> bool:
+    cols = {c["name"]: c for c in inspect(conn).get_columns(table)}
+    if column not in cols or cols[column]["nullable"]:
+        return False
+    if conn.dialect.name != "sqlite":
+        conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} DROP NOT NULL"))
+        return True
+    # SQLite can't change a column's constraints: rebuild the table from its
+    # own DDL without the NOT NULL, then put its indexes back
+    ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :t"), {"t": table}).scalar_one()
+    ddl = re.sub(rf"(\b{column}\b\s+\w+(?:\(\d+\))?)\s+NOT NULL", r"\1", ddl, count=1)
+    ddl = re.sub(rf'^CREATE TABLE\s+"?{table}"?', f"CREATE TABLE {table}__rebuild", ddl, count=1)
+    indexes = [r[0] for r in conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = :t AND sql IS NOT NULL"), {"t": table}
+    )]
+    conn.execute(text(ddl))
+    conn.execute(text(f"INSERT INTO {table}__rebuild SELECT * FROM {table}"))
+    conn.execute(text(f"DROP TABLE {table}"))
+    conn.execute(text(f"ALTER TABLE {table}__rebuild RENAME TO {table}"))
+    for sql in indexes:
+        conn.execute(text(sql))
+    return True
+
+
+def _binary_columns(conn: Connection) -> bool:
+    # Expand only: adding the columns is cheap, and new rows no longer fill
+    # the text ones, so those can't stay NOT NULL. Existing rows are
+    # converted online by app.db.convert_binary.
+    kind = "BYTEA" if conn.dialect.name == "postgresql" else "BLOB"
+    changed = False
+    for table, column in BINARY_COLUMNS:
+        if not _has_table(conn, table):
+            continue
+        changed = _add_column(conn, table, f"{column}_bin", kind) or changed
+        changed = _drop_not_null(conn, table, column) or changed
+    return changed
+
+
+MIGRATIONS: List[Tuple[str, Callable[[Connection], bool]]] = [
+    ("ix_messages_chat_id_id", lambda c: _add_index(c, "messages", "ix_messages_chat_id_id", ["chat_id", "id"])),
+    ("ix_messages_chat_id_timestamp", lambda c: _add_index(c, "messages", "ix_messages_chat_id_timestamp", ["chat_id", "timestamp"])),
+    ("messages.seq", _message_seqs),
+    ("chat_summaries", _chat_summaries),
+    ("users.chat_list_version", lambda c: _add_column(c, "users", "chat_list_version", "INTEGER NOT NULL DEFAULT 0")),
+    ("chats.pair_low", _private_pairs),
+    ("ix_messages_chat_recipient_id", lambda c: _add_index(c, "messages", "ix_messages_chat_recipient_id", ["chat_id", "recipient_id", "id"])),
+    ("messages.fanout", _message_recipients),
+    ("binary columns", _binary_columns),
+]
+
+
+def run_migrations(engine: Engine):
+    for name, step in MIGRATIONS:
+        with engine.begin() as conn:
+            if step(conn):
+                try:
+                    logger.info(f"Migration applied: {name}")
+                except Exception:
+                    pass
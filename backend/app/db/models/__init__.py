@@ -2,11 +2,16 @@ from ..database import Base
 from .association import chat_users_table
 from .user import User
 from .chat import Chat
+from .chat_summary import ChatSummary
+from .chat_list_change import ChatListChange
 from .message import Message
+from .message_recipient import MessageRecipient
 from .user_chat_state import UserChatState
 from .user_public_key import UserPublicKey
 from .group_key_share import GroupKeyShare
 from .attachment import Attachment
+from .upload_session import UploadSession
+from .upload_chunk import UploadChunk
 from .user_settings import UserSettings
 from .pinned_chat import PinnedChat
 
@@ -15,11 +20,16 @@ __all__ = [
     "chat_users_table",
     "User",
     "Chat",
+    "ChatSummary",
+    "ChatListChange",
     "Message",
+    "MessageRecipient",
     "UserChatState",
     "UserPublicKey",
     "GroupKeyShare",
     "Attachment",
+    "UploadSession",
+    "UploadChunk",
     "UserSettings",
     "PinnedChat",
 ]
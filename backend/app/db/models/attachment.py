@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, LargeBinary
 from ..database import Base
 
 
@@ -12,7 +12,9 @@ class Attachment(Base):
     mime_type = Column(String, nullable=False)
     size_bytes = Column(Integer, nullable=False)
     uploaded_by = Column(Integer, ForeignKey("users.id"), nullable=False)
-    nonce = Column(String, nullable=False)
+    nonce = Column("nonce_bin", LargeBinary, nullable=True)
+    # Base64 text from before the binary column, until convert_binary moves it
+    nonce_b64 = Column("nonce", String, nullable=True)
     algo = Column(String, default="AES-GCM", nullable=False)
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.datetime.now(datetime.timezone.utc))
 
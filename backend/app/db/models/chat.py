@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Enum, ForeignKey
+from sqlalchemy import Column, Integer, String, Enum, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from ..database import Base
 from .association import chat_users_table
@@ -11,9 +11,19 @@ class Chat(Base):
     chat_type = Column(Enum("group", "private", name="chat_type_enum"), nullable=False)
     name = Column(String, nullable=True)
     admin_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    # seq of the newest message; bumped in the inserting transaction
+    last_seq = Column(Integer, nullable=False, default=0, server_default="0")
+    # Private chats only: the two members as (min id, max id), a self chat as
+    # (u, u). Unique, so there is one DM per pair even under concurrent creates.
+    pair_low = Column(Integer, nullable=True)
+    pair_high = Column(Integer, nullable=True)
 
     messages = relationship("Message", back_populates="chat")
     participants = relationship("User", secondary=chat_users_table, back_populates="chats")
     pinned_by_users = relationship("PinnedChat", back_populates="chat")
 
+    __table_args__ = (
+        Index("ux_chats_private_pair", "pair_low", "pair_high", unique=True),
+    )
+
 
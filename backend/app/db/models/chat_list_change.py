@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
+from ..database import Base
+
+
+class ChatListChange(Base):
+    """One entry in a user's chat-list change log (see users.chat_list_version)."""
+
+    __tablename__ = "chat_list_changes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    version = Column(Integer, nullable=False)
+    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    # "upsert" (added, renamed, members or pin changed) or "remove"
+    op = Column(String, nullable=False)
+
+    __table_args__ = (
+        Index("ix_chat_list_changes_user_version", "user_id", "version"),
+    )
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, DateTime, ForeignKey
+from ..database import Base
+
+
+class ChatSummary(Base):
+    """Denormalized last-activity row per chat, written with each send."""
+
+    __tablename__ = "chat_summaries"
+
+    chat_id = Column(Integer, ForeignKey("chats.id"), primary_key=True)
+    last_message_id = Column(Integer, ForeignKey("messages.id"), nullable=True)
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
+    # Sends, not rows: the per-recipient copies of a group send count once
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_sender_id = Column(Integer, ForeignKey("users.id"), nullable=True)
@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, LargeBinary, Text, UniqueConstraint
 from ..database import Base
 
 
@@ -10,8 +10,11 @@ class GroupKeyShare(Base):
     chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
     provider_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     recipient_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    wrapped_key_ciphertext = Column(Text, nullable=False)
-    wrapped_key_nonce = Column(String, nullable=False)
+    wrapped_key_ciphertext = Column("wrapped_key_ciphertext_bin", LargeBinary, nullable=True)
+    wrapped_key_nonce = Column("wrapped_key_nonce_bin", LargeBinary, nullable=True)
+    # Base64 text from before the binary columns, until convert_binary moves it
+    wrapped_key_ciphertext_b64 = Column("wrapped_key_ciphertext", Text, nullable=True)
+    wrapped_key_nonce_b64 = Column("wrapped_key_nonce", String, nullable=True)
     algo = Column(String, default="AES-GCM", nullable=False)
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.datetime.now(datetime.timezone.utc))
     __table_args__ = (
@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Text
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, ForeignKey, Enum, Text, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from ..database import Base
 
@@ -9,6 +9,8 @@ class Message(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     chat_id = Column(Integer, ForeignKey("chats.id"))
+    # Per-chat, gap-free; one per send
+    seq = Column(Integer, nullable=True)
     sender_id = Column(Integer, ForeignKey("users.id"))
     recipient_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     content = Column(String, nullable=True)
@@ -18,14 +20,32 @@ class Message(Base):
         nullable=False,
     )
     timestamp = Column(DateTime(timezone=True), default=lambda: datetime.datetime.now(datetime.timezone.utc))
-    ciphertext = Column(Text, nullable=True)
-    nonce = Column(String, nullable=True)
+    ciphertext = Column("ciphertext_bin", LargeBinary, nullable=True)
+    nonce = Column("nonce_bin", LargeBinary, nullable=True)
+    # Base64 text from before the binary columns, until convert_binary moves it
+    ciphertext_b64 = Column("ciphertext", Text, nullable=True)
+    nonce_b64 = Column("nonce", String, nullable=True)
     algo = Column(String, nullable=True)
     attachment_id = Column(Integer, ForeignKey("attachments.id"), nullable=True)
+    # Group E2EE send: no ciphertext here, one message_recipients row per recipient
+    fanout = Column(Boolean, nullable=False, default=False)
 
     chat = relationship("Chat", back_populates="messages")
     sender = relationship("User", foreign_keys=[sender_id], back_populates="sent_messages")
     recipient = relationship("User", foreign_keys=[recipient_id], back_populates="received_messages")
     attachment = relationship("Attachment", foreign_keys=[attachment_id])
+    # Never loaded wholesale: history reads load only the viewer's copy
+    # (messages_controller._with_relations)
+    copies = relationship("MessageRecipient", lazy="raise")
+
+    __table_args__ = (
+        # Range reads within a chat (history, resume-from-cursor replay)
+        Index('ix_messages_chat_id_id', 'chat_id', 'id'),
+        # Seeking to a date within a chat
+        Index('ix_messages_chat_id_timestamp', 'chat_id', 'timestamp'),
+        # History as one member sees it: shared rows (NULL) and their own
+        # per-recipient rows from before message_recipients
+        Index('ix_messages_chat_recipient_id', 'chat_id', 'recipient_id', 'id'),
+    )
 
 
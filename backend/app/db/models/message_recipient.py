@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, LargeBinary, Text
+from ..database import Base
+
+
+class MessageRecipient(Base):
+    """One recipient's ciphertext of a group E2EE send (messages.fanout).
+
+    The shared columns (sender, time, type, seq) live once on the message
+    row; each recipient only adds their own ciphertext here.
+    """
+
+    __tablename__ = "message_recipients"
+
+    # Primary key doubles as the lookup for "this viewer's copies of these messages"
+    message_id = Column(Integer, ForeignKey("messages.id"), primary_key=True)
+    recipient_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    ciphertext = Column("ciphertext_bin", LargeBinary, nullable=True)
+    nonce = Column("nonce_bin", LargeBinary, nullable=True)
+    # Base64 text from before the binary columns, until convert_binary moves it
+    ciphertext_b64 = Column("ciphertext", Text, nullable=True)
+    nonce_b64 = Column("nonce", String, nullable=True)
+    algo = Column(String, nullable=True)
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String, ForeignKey
+from ..database import Base
+
+
+class UploadChunk(Base):
+    """One chunk of an upload session that has been written to disk.
+
+    A row per chunk rather than a counter on the session, so chunks sent in
+    parallel each record themselves with a plain insert and never race.
+    """
+
+    __tablename__ = "upload_chunks"
+
+    session_id = Column(String, ForeignKey("upload_sessions.id"), primary_key=True)
+    # Chunk number; its bytes start at index * session.chunk_size
+    index = Column(Integer, primary_key=True)
@@ -0,0 +1,23 @@
+import datetime
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, LargeBinary
+from ..database import Base
+
+
+class UploadSession(Base):
+    """A resumable attachment upload in progress (routes/files.py).
+
+    The ciphertext collects in `.{id}.upload` under FILES_DIR; finishing
+    the session renames it to `id` and turns this row into an Attachment.
+    """
+
+    __tablename__ = "upload_sessions"
+
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    mime_type = Column(String, nullable=False)
+    size_bytes = Column(Integer, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    nonce = Column(LargeBinary, nullable=False)
+    algo = Column(String, default="AES-GCM", nullable=False)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.datetime.now(datetime.timezone.utc), index=True)
@@ -16,6 +16,8 @@ class User(Base):
     last_name = Column(String, nullable=True)
     signup_ip = Column(String, nullable=True)
     signup_at = Column(DateTime, nullable=True)
+    # Bumped (under this row's lock) for every chat_list_changes entry of the user
+    chat_list_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     sent_messages = relationship(
         "Message",
@@ -9,6 +9,8 @@ class UserChatState(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
     last_read_message_id = Column(Integer, ForeignKey("messages.id"), nullable=True)
+    # Chat seq read up to (a send also advances the sender's); unread is chats.last_seq - read_seq
+    read_seq = Column(Integer, nullable=False, default=0, server_default="0")
 
     __table_args__ = (
         UniqueConstraint("user_id", "chat_id", name="uq_user_chat_state"),
@@ -1,6 +1,11 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, BeforeValidator
 import datetime
-from typing import List, Optional
+from typing import Annotated, List, Optional
+
+from . import binary
+
+# Base64 text on the wire, raw bytes from validation on (see db/binary.py)
+Base64Bytes = Annotated[bytes, BeforeValidator(binary.decode)]
 
 
 # Base user fields that are common across all user schemas
@@ -43,14 +48,14 @@ class MessageBase(BaseModel):
 
 class MessageCreate(MessageBase):
     # For E2EE, when sending encrypted payloads
-    ciphertext: Optional[str] = None
-    nonce: Optional[str] = None
+    ciphertext: Optional[Base64Bytes] = None
+    nonce: Optional[Base64Bytes] = None
     algo: Optional[str] = None
     # For group E2EE fan-out
     class EncryptedItem(BaseModel):
         recipient_id: int
-        ciphertext: str
-        nonce: str
+        ciphertext: Base64Bytes
+        nonce: Base64Bytes
         algo: Optional[str] = None
     items: Optional[List[EncryptedItem]] = None
     # Optional attachment id (from prior upload)
@@ -104,14 +109,30 @@ class ChatOut(BaseModel):
     chat_type: str
     name: Optional[str] = None
     admin_user_id: Optional[int] = None
+    member_count: int = 0
+    # The first members by id (CHAT_MEMBER_PREVIEW); all of them via GET /chats/{id}/members
     participants: List[UserBasic] = []
     title: Optional[str] = None
     is_pinned: bool = False
+    # From chat_summaries; None until the chat's first message
+    last_message_id: Optional[int] = None
+    last_message_at: Optional[datetime.datetime] = None
+    last_sender_id: Optional[int] = None
+    message_count: int = 0
 
     class Config:
         from_attributes = True
 
 
+class ChatListDelta(BaseModel):
+    # Changes after since_version, up to version; full=True means upserts is
+    # the whole list (since_version unknown here) and local state should be replaced
+    version: int
+    full: bool = False
+    upserts: List[ChatOut] = []
+    removed: List[int] = []
+
+
 # Update forward reference
 User.update_forward_refs()
 
@@ -172,6 +193,7 @@ class RenameChatRequest(BaseModel):
 
 class MessageOut(BaseModel):
     id: int
+    seq: Optional[int] = None
     content: Optional[str] = None
     content_type: str
     timestamp: datetime.datetime
@@ -200,6 +222,26 @@ class MessageOut(BaseModel):
         from_attributes = True
 
 
+class MemberPage(BaseModel):
+    members: List[UserBasic]
+    # Pass back as after_id; None after the last member
+    next_cursor: Optional[int] = None
+
+
+class MessagePage(BaseModel):
+    messages: List[MessageOut]
+    # Pass back as before_id (or after_id, when paging forwards); None at the end
+    next_cursor: Optional[int] = None
+
+
+class MessageWindow(BaseModel):
+    messages: List[MessageOut]
+    anchor_id: Optional[int] = None
+    # before_id / after_id for GET /chats/{id}/messages; None at either end
+    before_cursor: Optional[int] = None
+    after_cursor: Optional[int] = None
+
+
 class PeerOut(BaseModel):
     user_id: int
     username: str
@@ -213,6 +255,7 @@ class PeerOut(BaseModel):
 class UserChatStateOut(BaseModel):
     chat_id: int
     last_read_message_id: Optional[int] = None
+    read_seq: int = 0
 
     class Config:
         from_attributes = True
@@ -244,8 +287,8 @@ class RegisterIn(BaseModel):
 class GroupKeyWrapIn(BaseModel):
     chat_id: int
     recipient_user_id: int
-    wrapped_key_ciphertext: str
-    wrapped_key_nonce: str
+    wrapped_key_ciphertext: Base64Bytes
+    wrapped_key_nonce: Base64Bytes
     algo: str = "AES-GCM"
 
 
@@ -263,6 +306,27 @@ class LoginWithKeyIn(BaseModel):
     password: str
 
 
+# Resumable Upload Schemas
+class UploadSessionCreate(BaseModel):
+    filename: str
+    mime_type: str
+    size_bytes: int
+    nonce: Base64Bytes
+    algo: str = "AES-GCM"
+
+
+class UploadSessionOut(BaseModel):
+    id: str
+    filename: str
+    mime_type: str
+    size_bytes: int
+    chunk_size: int
+    # Bytes stored from the start of the file with no gaps; resume from here
+    received_bytes: int
+    # Start offsets of the chunks still to send (parallel senders may leave holes)
+    missing_offsets: List[int]
+
+
 # Pinned Chat Schemas
 class PinnedChatBase(BaseModel):
     chat_id: int
@@ -1,18 +1,18 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
 
 from ..core import security as auth
 from ..controllers import users_controller
-from .db import get_db
+from .db import get_async_db
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
 async def get_current_user(
-    db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)
+    db: AsyncSession = Depends(get_async_db), token: str = Depends(oauth2_scheme)
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -28,9 +28,8 @@ async def get_current_user(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = users_controller.get_user_by_username(db, username=username)
+    # Returned detached: callers use its columns (id, username, role) only
+    user = await db.run_sync(lambda s: users_controller.get_user_by_username(s, username=username))
     if user is None:
         raise credentials_exception
     return user
-
-
@@ -1,11 +1,16 @@
-from ..db.database import SessionLocal
+from ..db import database
 
 
 def get_db():
-    db = SessionLocal()
+    db = database.SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
 
+async def get_async_db():
+    # For async def routes: queries go through the asyncio driver instead of
+    # blocking the event loop. Sync controller code runs via db.run_sync(...)
+    async with database.AsyncSessionLocal() as db:
+        yield db
@@ -6,7 +6,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from .db.database import SessionLocal, engine
 from .db import models
-from .routes.files import router as files_router
+from .db.migrations import run_migrations
+from .routes.files import router as files_router, start_upload_sweeper, stop_upload_sweeper
 from .routes.auth_routes import router as auth_router
 from .routes.chats import router as chats_router
 from .routes.admin import router as admin_router
@@ -14,8 +15,11 @@ from .routes.users import router as users_router
 from .routes.crypto import router as crypto_router
 from .routes.user_settings import router as user_settings_router
 from .ws.sockets import ws_router
+from .ws.ws_manager import manager
+from .ws.backplane import create_backplane
 
 models.Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 
 app = FastAPI(title="Secure LAN Live Chat")
@@ -29,6 +33,8 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Read by the client to ask for chat list deltas
+    expose_headers=["X-Chat-List-Version"],
 )
 
 # Mount routers
@@ -42,6 +48,27 @@ app.include_router(ws_router)
 app.include_router(crypto_router)
 
 
+@app.on_event("startup")
+async def start_ws_backplane():
+    await manager.start_backplane(create_backplane())
+
+
+@app.on_event("startup")
+async def start_upload_sweep():
+    # Abandoned resumable uploads are reaped even if nobody starts a new one
+    start_upload_sweeper()
+
+
+@app.on_event("shutdown")
+async def stop_ws_backplane():
+    await manager.stop_backplane()
+
+
+@app.on_event("shutdown")
+async def stop_upload_sweep():
+    await stop_upload_sweeper()
+
+
 @app.get("/")
 async def read_root():
     return {"message": "Welcome to the Secure LAN Chat Server"}
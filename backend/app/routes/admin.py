@@ -1,11 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
 
 from ..db import schemas
 from ..controllers import users_controller
-from ..deps.db import get_db
+from ..deps.db import get_db, get_async_db
 from ..deps.auth import get_current_user
+from ..ws.ws_manager import manager
+from ..ws.envelopes import envelope_cache
+from ..core.membership import membership
+from ..core.group_commit import message_writer
 
 router = APIRouter()
 
@@ -18,13 +23,16 @@ def admin_list_users(db: Session = Depends(get_db), current_user: schemas.User =
 
 
 @router.post("/admin/users", response_model=schemas.UserOut)
-async def admin_create_user(body: schemas.UserCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+async def admin_create_user(body: schemas.UserCreate, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not admin")
-    if users_controller.get_user_by_username(db, body.username):
-        raise HTTPException(status_code=400, detail="Username exists")
-    u = users_controller.create_user(db, body)
-    return u
+
+    def _create(s: Session):
+        if users_controller.get_user_by_username(s, body.username):
+            raise HTTPException(status_code=400, detail="Username exists")
+        return schemas.UserOut.model_validate(users_controller.create_user(s, body))
+
+    return await db.run_sync(_create)
 
 
 @router.put("/admin/users/{user_id}", response_model=schemas.UserOut)
@@ -45,3 +53,17 @@ def admin_delete_user(user_id: int, db: Session = Depends(get_db), current_user:
     if not ok:
         raise HTTPException(status_code=404, detail="User not found")
     return {"ok": True}
+
+
+@router.get("/admin/metrics")
+def admin_metrics(current_user: schemas.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not admin")
+    return {
+        "envelope_cache": envelope_cache.stats(),
+        "ws_fanout": manager.fanout_stats(),
+        "ws_replay": manager.replay.stats(),
+        "ws_unread": manager.unread.stats(),
+        "membership": membership.stats(),
+        "message_writer": message_writer.stats(),
+    }
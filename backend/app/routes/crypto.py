@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 
-from ..db import schemas, models
+from ..db import binary, schemas, models
 from ..deps.db import get_db
 from ..deps.auth import get_current_user
 from ..controllers import keys_controller
@@ -43,8 +43,8 @@ def publish_group_key_wrap(body: schemas.GroupKeyWrapIn, db: Session = Depends(g
         chat_id=rec.chat_id,
         provider_user_id=rec.provider_user_id,
         recipient_user_id=rec.recipient_user_id,
-        wrapped_key_ciphertext=rec.wrapped_key_ciphertext,
-        wrapped_key_nonce=rec.wrapped_key_nonce,
+        wrapped_key_ciphertext=binary.encode(rec.wrapped_key_ciphertext, rec.wrapped_key_ciphertext_b64),
+        wrapped_key_nonce=binary.encode(rec.wrapped_key_nonce, rec.wrapped_key_nonce_b64),
         algo=rec.algo,
     )
 
@@ -63,8 +63,8 @@ def get_group_key_wrap(chat_id: int, db: Session = Depends(get_db), current_user
         chat_id=rec.chat_id,
         provider_user_id=rec.provider_user_id,
         recipient_user_id=rec.recipient_user_id,
-        wrapped_key_ciphertext=rec.wrapped_key_ciphertext,
-        wrapped_key_nonce=rec.wrapped_key_nonce,
+        wrapped_key_ciphertext=binary.encode(rec.wrapped_key_ciphertext, rec.wrapped_key_ciphertext_b64),
+        wrapped_key_nonce=binary.encode(rec.wrapped_key_nonce, rec.wrapped_key_nonce_b64),
         algo=rec.algo,
     )
 
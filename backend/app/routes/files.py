@@ -1,16 +1,30 @@
+import asyncio
+import datetime
+import logging
 import os
 import uuid
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request
+from typing import Dict, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from urllib.parse import quote
 
-from ..db import models
+try:
+    from python_multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+
+from ..db import binary, database, models
 from ..db import schemas
-from ..deps.db import get_db
+from ..deps.db import get_db, get_async_db
 from ..deps.auth import get_current_user
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 
 def files_dir() -> str:
@@ -19,7 +33,30 @@ def files_dir() -> str:
     return base
 
 
+def max_upload_bytes() -> int:
+    # Configurable max size (MB) via env var; default 200MB for enterprise use
+    try:
+        max_mb = int(os.environ.get("FILES_MAX_MB", "200"))
+    except Exception:
+        max_mb = 200
+    return max_mb * 1024 * 1024
+
+
+def upload_chunk_bytes() -> int:
+    # How much of an upload is buffered before each (off-loop) disk write
+    try:
+        return max(64, int(os.environ.get("FILES_CHUNK_KB", "1024"))) * 1024
+    except Exception:
+        return 1024 * 1024
+
+
 def _validate_mime(filename: str, mime_type: str, size_bytes: int) -> None:
+    if size_bytes <= 0 or size_bytes > max_upload_bytes():
+        raise HTTPException(status_code=400, detail="File too large or empty")
+    _check_type(mime_type)
+
+
+def _check_type(mime_type: str) -> None:
     allowed_prefixes = ["image/", "video/"]
     allowed_specific = {
         "application/pdf",
@@ -46,62 +83,486 @@ def _validate_mime(filename: str, mime_type: str, size_bytes: int) -> None:
         "application/x-xz",  # .xz
         "text/plain",  # .txt
     }
-    # Configurable max size (MB) via env var; default 200MB for enterprise use
-    try:
-        max_mb = int(os.environ.get("FILES_MAX_MB", "200"))
-    except Exception:
-        max_mb = 200
-    max_bytes = max_mb * 1024 * 1024
-    if size_bytes <= 0 or size_bytes > max_bytes:
-        raise HTTPException(status_code=400, detail="File too large or empty")
     ok = any(mime_type.startswith(p) for p in allowed_prefixes) or mime_type in allowed_specific
     if not ok:
         raise HTTPException(status_code=400, detail="Unsupported file type")
 
 
+class _FilePart:
+    """Callbacks for MultipartParser that pick out the `file` field.
+
+    Its bytes pile up in `pending` until the route takes them for the next
+    disk write, so memory holds at most about one chunk per upload.
+    """
+
+    def __init__(self):
+        self.found = False
+        self.filename: Optional[str] = None
+        self.mime_type = "application/octet-stream"
+        self.headers: Dict[str, str] = {}
+        self.size = 0
+        self.pending: List[bytes] = []
+        self.pending_size = 0
+        self._reading = False
+        self._field = b""
+        self._value = b""
+        self._part_headers: Dict[str, str] = {}
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field,
+            "on_header_value": self._header_value,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        }
+
+    def take(self) -> bytes:
+        data = b"".join(self.pending)
+        self.pending, self.pending_size = [], 0
+        return data
+
+    def _part_begin(self):
+        self._part_headers = {}
+
+    def _header_field(self, data: bytes, start: int, end: int):
+        self._field += data[start:end]
+
+    def _header_value(self, data: bytes, start: int, end: int):
+        self._value += data[start:end]
+
+    def _header_end(self):
+        self._part_headers[self._field.decode("latin-1").lower()] = self._value.decode("latin-1")
+        self._field = self._value = b""
+
+    def _headers_finished(self):
+        _, options = parse_options_header(self._part_headers.get("content-disposition", ""))
+        if self.found or options.get(b"name") != b"file":
+            return
+        self.found = self._reading = True
+        self.headers = self._part_headers
+        if options.get(b"filename"):
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+        self.mime_type = self._part_headers.get("content-type") or self.mime_type
+
+    def _part_data(self, data: bytes, start: int, end: int):
+        if self._reading:
+            self.pending.append(data[start:end])
+            self.pending_size += end - start
+            self.size += end - start
+
+    def _part_end(self):
+        self._reading = False
+
+
 @router.post("/files/upload")
-async def upload_file(request: Request, file: UploadFile = File(...), db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    data = await file.read()
-    mime_type = file.content_type or "application/octet-stream"
-    _validate_mime(file.filename or "file", mime_type, len(data))
-    # Accept nonce from request headers (browser-friendly) or file part headers if provided
-    nonce = (
-        request.headers.get('x-nonce')
-        or (getattr(file, 'headers', {}) or {}).get('x-nonce')
-        or (file.headers.get('x-nonce') if hasattr(file, 'headers') else None)
-    )
-    if not nonce:
-        raise HTTPException(status_code=400, detail="Missing nonce header")
-    name = file.filename or f"file-{uuid.uuid4().hex}"
+async def upload_file(request: Request, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)):
+    """Store one encrypted attachment from a multipart `file` field.
+
+    The body is parsed as it arrives and written to a temp file next to
+    the final one, a chunk at a time off the event loop, so memory stays
+    flat whatever the file size and an oversized upload is cut off as soon
+    as it crosses FILES_MAX_MB. The blob appears under its final name by
+    an atomic rename only once it is complete and valid.
+    """
+    ctype, options = parse_options_header(request.headers.get("content-type", ""))
+    if ctype != b"multipart/form-data" or not options.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="Expected multipart/form-data")
+    limit = max_upload_bytes()
+    try:
+        # Whole-body bound (the file plus some room for the multipart framing)
+        too_big = int(request.headers.get("content-length", "0")) > limit + 64 * 1024
+    except ValueError:
+        too_big = False
+    if too_big:
+        raise HTTPException(status_code=400, detail="File too large or empty")
+
+    part = _FilePart()
+    parser = MultipartParser(options[b"boundary"], part.callbacks())
+    chunk = upload_chunk_bytes()
     uid = uuid.uuid4().hex
     path = os.path.join(files_dir(), uid)
+    tmp_path = os.path.join(files_dir(), f".{uid}.part")
+    stored = False
     try:
-        with open(path, 'wb') as f:
-            f.write(data)
+        f = await run_in_threadpool(open, tmp_path, "wb")
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to store file")
-    rec = models.Attachment(
-        filename=name,
-        stored_path=uid,
-        mime_type=mime_type,
-        size_bytes=len(data),
-        uploaded_by=current_user.id,
-        nonce=nonce,
-        algo="AES-GCM",
-    )
-    db.add(rec)
-    db.commit()
-    db.refresh(rec)
+    try:
+        checked = False
+        try:
+            async for data in request.stream():
+                parser.write(data)
+                if part.found and not checked:
+                    _check_type(part.mime_type)
+                    checked = True
+                if part.size > limit:
+                    raise HTTPException(status_code=400, detail="File too large or empty")
+                if part.pending_size >= chunk:
+                    await run_in_threadpool(f.write, part.take())
+            parser.finalize()
+            if part.pending_size:
+                await run_in_threadpool(f.write, part.take())
+            await run_in_threadpool(f.close)
+        except MultipartParseError:
+            raise HTTPException(status_code=400, detail="Malformed multipart body")
+        except OSError:
+            raise HTTPException(status_code=500, detail="Failed to store file")
+        if not part.found:
+            raise HTTPException(status_code=400, detail="Missing file")
+        _validate_mime(part.filename or "file", part.mime_type, part.size)
+        # Accept nonce from request headers (browser-friendly) or file part headers if provided
+        nonce = request.headers.get('x-nonce') or part.headers.get('x-nonce')
+        if not nonce:
+            raise HTTPException(status_code=400, detail="Missing nonce header")
+        try:
+            nonce_raw = binary.decode(nonce)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Nonce must be base64")
+        try:
+            await run_in_threadpool(os.replace, tmp_path, path)
+        except OSError:
+            raise HTTPException(status_code=500, detail="Failed to store file")
+        rec = models.Attachment(
+            filename=part.filename or f"file-{uid}",
+            stored_path=uid,
+            mime_type=part.mime_type,
+            size_bytes=part.size,
+            uploaded_by=current_user.id,
+            nonce=nonce_raw,
+            algo="AES-GCM",
+        )
+        db.add(rec)
+        await db.commit()
+        stored = True
+    finally:
+        if not f.closed:
+            await run_in_threadpool(f.close)
+        if not stored:
+            await run_in_threadpool(_discard, tmp_path, path)
+    return _attachment_out(rec)
+
+
+def _attachment_out(rec: models.Attachment) -> dict:
     return {
         "id": rec.id,
         "filename": rec.filename,
         "mime_type": rec.mime_type,
         "size_bytes": rec.size_bytes,
-        "nonce": rec.nonce,
+        "nonce": binary.encode(rec.nonce),
         "algo": rec.algo,
     }
 
 
+def _discard(*paths: str) -> None:
+    for p in paths:
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+
+# Resumable uploads: POST a session, PUT its chunks (in any order, several at
+# once if the client likes), GET it to see what is still missing after a
+# dropped connection, then POST .../complete to turn it into an attachment.
+
+def resumable_chunk_bytes() -> int:
+    # Chunk size handed to clients; what a retry resends after a failure
+    try:
+        return max(64, int(os.environ.get("FILES_UPLOAD_CHUNK_KB", "8192"))) * 1024
+    except Exception:
+        return 8 * 1024 * 1024
+
+
+def upload_session_ttl() -> datetime.timedelta:
+    # Unfinished sessions older than this are dropped with their temp files
+    try:
+        hours = float(os.environ.get("FILES_UPLOAD_TTL_HOURS", "24"))
+    except Exception:
+        hours = 24.0
+    return datetime.timedelta(hours=hours)
+
+
+def max_open_uploads() -> int:
+    # Unfinished sessions one user may hold at a time
+    try:
+        return max(1, int(os.environ.get("FILES_UPLOAD_MAX_OPEN", "4")))
+    except Exception:
+        return 4
+
+
+def upload_quota_bytes() -> int:
+    # Bytes one user's unfinished sessions may reserve; never less than one
+    # largest allowed file (default room for two)
+    try:
+        quota = int(os.environ.get("FILES_UPLOAD_QUOTA_MB", "0")) * 1024 * 1024
+    except Exception:
+        quota = 0
+    return max(quota, max_upload_bytes()) if quota else 2 * max_upload_bytes()
+
+
+def upload_sweep_seconds() -> float:
+    # How often expired sessions are swept, whether or not anyone uploads
+    try:
+        return max(1.0, float(os.environ.get("FILES_UPLOAD_SWEEP_MINUTES", "10")) * 60.0)
+    except Exception:
+        return 600.0
+
+
+def _upload_path(upload_id: str) -> str:
+    return os.path.join(files_dir(), f".{upload_id}.upload")
+
+
+def _touch(path: str) -> None:
+    # Starts empty and grows only as chunks land (writes past the end leave a
+    # hole), so the disk holds what was actually sent, not what was announced
+    with open(path, "wb"):
+        pass
+
+
+def _chunk_count(sess: models.UploadSession) -> int:
+    return -(-sess.size_bytes // sess.chunk_size)
+
+
+async def _own_session(db: AsyncSession, upload_id: str, user_id: int) -> models.UploadSession:
+    sess = await db.get(models.UploadSession, upload_id)
+    if not sess or sess.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return sess
+
+
+async def _session_out(db: AsyncSession, sess: models.UploadSession) -> dict:
+    done = set(
+        (await db.execute(select(models.UploadChunk.index).where(models.UploadChunk.session_id == sess.id))).scalars()
+    )
+    missing = [i for i in range(_chunk_count(sess)) if i not in done]
+    return schemas.UploadSessionOut(
+        id=sess.id,
+        filename=sess.filename,
+        mime_type=sess.mime_type,
+        size_bytes=sess.size_bytes,
+        chunk_size=sess.chunk_size,
+        received_bytes=min(missing[0] * sess.chunk_size, sess.size_bytes) if missing else sess.size_bytes,
+        missing_offsets=[i * sess.chunk_size for i in missing],
+    ).model_dump()
+
+
+async def _drop_sessions(db: AsyncSession, ids: List[str]) -> None:
+    if not ids:
+        return
+    await db.execute(delete(models.UploadChunk).where(models.UploadChunk.session_id.in_(ids)))
+    await db.execute(delete(models.UploadSession).where(models.UploadSession.id.in_(ids)))
+
+
+async def _purge_expired_uploads(db: AsyncSession) -> int:
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - upload_session_ttl()
+    ids = list(
+        (await db.execute(select(models.UploadSession.id).where(models.UploadSession.created_at < cutoff))).scalars()
+    )
+    if not ids:
+        return 0
+    await _drop_sessions(db, ids)
+    await db.commit()
+    await run_in_threadpool(_discard, *(_upload_path(i) for i in ids))
+    return len(ids)
+
+
+async def sweep_expired_uploads() -> int:
+    async with database.AsyncSessionLocal() as db:
+        return await _purge_expired_uploads(db)
+
+
+async def _sweep_loop():
+    while True:
+        try:
+            swept = await sweep_expired_uploads()
+            if swept:
+                try:
+                    logger.info(f"Expired upload sessions swept: {swept}")
+                except Exception:
+                    pass
+        except Exception:
+            logger.exception("Upload session sweep failed")
+        await asyncio.sleep(upload_sweep_seconds())
+
+
+_sweeper: Optional[asyncio.Task] = None
+
+
+def start_upload_sweeper():
+    global _sweeper
+    if _sweeper is None or _sweeper.done():
+        _sweeper = asyncio.get_running_loop().create_task(_sweep_loop())
+
+
+async def stop_upload_sweeper():
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.cancel()
+        try:
+            await _sweeper
+        except asyncio.CancelledError:
+            pass
+        _sweeper = None
+
+
+@router.post("/files/uploads")
+async def create_upload(body: schemas.UploadSessionCreate, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)):
+    """Start a resumable upload of `size_bytes` of ciphertext.
+
+    Type and size are checked here, before any data is sent, and so are
+    the user's unfinished sessions: at most FILES_UPLOAD_MAX_OPEN (429)
+    reserving at most FILES_UPLOAD_QUOTA_MB between them (413). The
+    response carries the session id and the chunk size every PUT must use.
+    """
+    _validate_mime(body.filename, body.mime_type, body.size_bytes)
+    try:
+        await _purge_expired_uploads(db)
+    except Exception:
+        await db.rollback()
+    open_count, reserved = (await db.execute(
+        select(func.count(), func.coalesce(func.sum(models.UploadSession.size_bytes), 0))
+        .where(models.UploadSession.user_id == current_user.id)
+    )).one()
+    if open_count >= max_open_uploads():
+        raise HTTPException(status_code=429, detail="Too many unfinished uploads")
+    if reserved + body.size_bytes > upload_quota_bytes():
+        raise HTTPException(status_code=413, detail="Unfinished uploads exceed the upload quota")
+    sess = models.UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=current_user.id,
+        filename=body.filename,
+        mime_type=body.mime_type,
+        size_bytes=body.size_bytes,
+        chunk_size=resumable_chunk_bytes(),
+        nonce=body.nonce,
+        algo=body.algo,
+    )
+    try:
+        await run_in_threadpool(_touch, _upload_path(sess.id))
+    except OSError:
+        raise HTTPException(status_code=500, detail="Failed to store file")
+    db.add(sess)
+    await db.commit()
+    return await _session_out(db, sess)
+
+
+@router.get("/files/uploads/{upload_id}")
+async def get_upload(upload_id: str, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)):
+    return await _session_out(db, await _own_session(db, upload_id, current_user.id))
+
+
+@router.put("/files/uploads/{upload_id}")
+async def put_upload_chunk(upload_id: str, offset: int, request: Request, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)):
+    """Write one chunk, the raw request body, at `offset`.
+
+    Offsets are multiples of the session's chunk_size and each chunk is
+    exactly chunk_size bytes (the last one whatever is left). Chunks go
+    straight to their place in the temp file, so they may arrive in any
+    order and in parallel; resending one that is already stored is harmless.
+    """
+    sess = await _own_session(db, upload_id, current_user.id)
+    if offset < 0 or offset >= sess.size_bytes or offset % sess.chunk_size:
+        raise HTTPException(status_code=400, detail="Offset must be a chunk boundary within the file")
+    expected = min(sess.chunk_size, sess.size_bytes - offset)
+    try:
+        wrong_length = int(request.headers.get("content-length", str(expected))) != expected
+    except ValueError:
+        wrong_length = False
+    if wrong_length:
+        raise HTTPException(status_code=400, detail=f"Chunk at {offset} must be {expected} bytes")
+    # Don't sit in a transaction while the body trickles in (detached first,
+    # so the rollback doesn't expire what was loaded)
+    db.expunge(sess)
+    await db.rollback()
+
+    try:
+        f = await run_in_threadpool(open, _upload_path(sess.id), "r+b")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except OSError:
+        raise HTTPException(status_code=500, detail="Failed to store file")
+    try:
+        await run_in_threadpool(f.seek, offset)
+        chunk = upload_chunk_bytes()
+        pending: List[bytes] = []
+        pending_size = received = 0
+        async for data in request.stream():
+            received += len(data)
+            if received > expected:
+                raise HTTPException(status_code=400, detail=f"Chunk at {offset} must be {expected} bytes")
+            pending.append(data)
+            pending_size += len(data)
+            if pending_size >= chunk:
+                await run_in_threadpool(f.write, b"".join(pending))
+                pending, pending_size = [], 0
+        if received != expected:
+            raise HTTPException(status_code=400, detail=f"Chunk at {offset} must be {expected} bytes")
+        if pending:
+            await run_in_threadpool(f.write, b"".join(pending))
+        await run_in_threadpool(f.close)
+    except OSError:
+        raise HTTPException(status_code=500, detail="Failed to store file")
+    finally:
+        if not f.closed:
+            await run_in_threadpool(f.close)
+
+    db.add(models.UploadChunk(session_id=sess.id, index=offset // sess.chunk_size))
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Sent twice (a retry racing the original); the bytes are the same
+        await db.rollback()
+    return await _session_out(db, sess)
+
+
+@router.post("/files/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)):
+    """Turn a fully received session into an attachment, same reply as /files/upload."""
+    sess = await _own_session(db, upload_id, current_user.id)
+    status = await _session_out(db, sess)
+    if status["missing_offsets"]:
+        raise HTTPException(status_code=409, detail="Upload incomplete")
+    _validate_mime(sess.filename, sess.mime_type, sess.size_bytes)
+    tmp_path, path = _upload_path(sess.id), os.path.join(files_dir(), sess.id)
+    try:
+        await run_in_threadpool(os.replace, tmp_path, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except OSError:
+        raise HTTPException(status_code=500, detail="Failed to store file")
+    rec = models.Attachment(
+        filename=sess.filename,
+        stored_path=sess.id,
+        mime_type=sess.mime_type,
+        size_bytes=sess.size_bytes,
+        uploaded_by=current_user.id,
+        nonce=sess.nonce,
+        algo=sess.algo,
+    )
+    db.add(rec)
+    await _drop_sessions(db, [sess.id])
+    try:
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        # Put the data back so the client can simply retry
+        await run_in_threadpool(os.replace, path, tmp_path)
+        raise
+    return _attachment_out(rec)
+
+
+@router.delete("/files/uploads/{upload_id}")
+async def cancel_upload(upload_id: str, db: AsyncSession = Depends(get_async_db), current_user: schemas.User = Depends(get_current_user)):
+    sess = await _own_session(db, upload_id, current_user.id)
+    await _drop_sessions(db, [sess.id])
+    await db.commit()
+    await run_in_threadpool(_discard, _upload_path(sess.id))
+    return {"ok": True}
+
+
 @router.get("/files/{file_id}")
 def serve_file(file_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
     att = db.query(models.Attachment).get(file_id)
@@ -124,7 +585,7 @@ def serve_file(file_id: int, db: Session = Depends(get_db), current_user: schema
                     break
                 yield chunk
     resp = StreamingResponse(iterator(), media_type=att.mime_type)
-    resp.headers['x-nonce'] = att.nonce
+    resp.headers['x-nonce'] = binary.encode(att.nonce, att.nonce_b64) or ''
     resp.headers['x-algo'] = att.algo
     # Ensure ASCII-safe header value with RFC 5987 filename* (UTF-8 percent-encoded)
     safe_ascii = (att.filename or 'file').encode('ascii', 'ignore').decode('ascii') or 'file'
@@ -1,9 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from ..deps.db import get_db
+from ..deps.db import get_async_db
 from ..db.schemas import UserSettings, UserSettingsUpdate
 from ..deps.auth import get_current_user
 from ..db.models import User, UserSettings as UserSettingsModel
+from ..controllers import chats_controller
+from ..ws.ws_manager import manager
+from ..ws import envelopes
 
 router = APIRouter(prefix="/user-settings", tags=["user-settings"])
 
@@ -11,173 +15,207 @@ router = APIRouter(prefix="/user-settings", tags=["user-settings"])
 @router.get("/", response_model=UserSettings)
 async def get_user_settings(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get current user settings"""
-    user_settings = db.query(UserSettingsModel).filter(
-        UserSettingsModel.user_id == current_user.id
-    ).first()
-    
-    if not user_settings:
-        # Create default settings
-        user_settings = UserSettingsModel(
-            user_id=current_user.id,
-            pinned_chats_limit=3
-        )
-        db.add(user_settings)
-        db.commit()
-        db.refresh(user_settings)
+    def _get(s: Session):
+        user_settings = s.query(UserSettingsModel).filter(
+            UserSettingsModel.user_id == current_user.id
+        ).first()
+    
+        if not user_settings:
+            # Create default settings
+            user_settings = UserSettingsModel(
+                user_id=current_user.id,
+                pinned_chats_limit=3
+            )
+            s.add(user_settings)
+            s.commit()
+            s.refresh(user_settings)
     
-    return user_settings
+        return UserSettings.model_validate(user_settings)
+
+    return await db.run_sync(_get)
 
 
 @router.put("/", response_model=UserSettings)
 async def update_user_settings(
     settings_update: UserSettingsUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update current user settings"""
-    user_settings = db.query(UserSettingsModel).filter(
-        UserSettingsModel.user_id == current_user.id
-    ).first()
-    
-    if not user_settings:
-        # Create default settings
-        user_settings = UserSettingsModel(
-            user_id=current_user.id,
-            pinned_chats_limit=3
-        )
-        db.add(user_settings)
-        db.commit()
-        db.refresh(user_settings)
-    
-    # Validate pinned_chats_limit
-    if settings_update.pinned_chats_limit is not None:
-        if settings_update.pinned_chats_limit < 1:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Pinned chats limit must be at least 1"
+    def _update(s: Session):
+        user_settings = s.query(UserSettingsModel).filter(
+            UserSettingsModel.user_id == current_user.id
+        ).first()
+    
+        if not user_settings:
+            # Create default settings
+            user_settings = UserSettingsModel(
+                user_id=current_user.id,
+                pinned_chats_limit=3
             )
+            s.add(user_settings)
+            s.commit()
+            s.refresh(user_settings)
+    
+        # Validate pinned_chats_limit
+        if settings_update.pinned_chats_limit is not None:
+            if settings_update.pinned_chats_limit < 1:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Pinned chats limit must be at least 1"
+                )
         
-        if settings_update.pinned_chats_limit > 5:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Pinned chats limit cannot exceed 5"
-            )
+            if settings_update.pinned_chats_limit > 5:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Pinned chats limit cannot exceed 5"
+                )
         
-        # Check if current pinned chats exceed new limit
-        from ..db.models import PinnedChat as PinnedChatModel
-        current_pinned_count = db.query(PinnedChatModel).filter(
-            PinnedChatModel.user_id == current_user.id
-        ).count()
+            # Check if current pinned chats exceed new limit
+            from ..db.models import PinnedChat as PinnedChatModel
+            current_pinned_count = s.query(PinnedChatModel).filter(
+                PinnedChatModel.user_id == current_user.id
+            ).count()
         
-        if current_pinned_count > settings_update.pinned_chats_limit:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Cannot reduce limit below current pinned chats count ({current_pinned_count})"
-            )
+            if current_pinned_count > settings_update.pinned_chats_limit:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Cannot reduce limit below current pinned chats count ({current_pinned_count})"
+                )
         
-        user_settings.pinned_chats_limit = settings_update.pinned_chats_limit
+            user_settings.pinned_chats_limit = settings_update.pinned_chats_limit
     
-    db.commit()
-    db.refresh(user_settings)
+        s.commit()
+        s.refresh(user_settings)
     
-    return user_settings
+        return UserSettings.model_validate(user_settings)
+
+    return await db.run_sync(_update)
+
+
+def _pin_frame(s: Session, chat_id: int, changes) -> str:
+    frames = envelopes.chats_changed_frames(chat_id, changes, chats_controller.changed_chat_outs(s, chat_id, changes))
+    return next(iter(frames.values()), "")
+
+
+async def _notify_pin_change(user_id: int, frame: str):
+    # A pin only moves the chat in this user's own list (on their other devices too)
+    if frame:
+        try:
+            await manager.unified_notify_user(user_id, frame)
+        except Exception:
+            pass
 
 
 @router.post("/pin-chat")
 async def pin_chat_endpoint(
     request: dict,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Pin a chat for the current user"""
-    chat_id = request.get("chat_id")
-    if not chat_id:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="chat_id is required"
-        )
+    def _pin(s: Session):
+        chat_id = request.get("chat_id")
+        if not chat_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="chat_id is required"
+            )
     
-    # Check if user already has this chat pinned
-    from ..db.models import PinnedChat as PinnedChatModel
-    existing = db.query(PinnedChatModel).filter(
-        PinnedChatModel.user_id == current_user.id,
-        PinnedChatModel.chat_id == chat_id
-    ).first()
-    
-    if existing:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Chat is already pinned"
-        )
+        # Check if user already has this chat pinned
+        from ..db.models import PinnedChat as PinnedChatModel
+        existing = s.query(PinnedChatModel).filter(
+            PinnedChatModel.user_id == current_user.id,
+            PinnedChatModel.chat_id == chat_id
+        ).first()
+    
+        if existing:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Chat is already pinned"
+            )
     
-    # Get user settings to check limit
-    user_settings = db.query(UserSettingsModel).filter(
-        UserSettingsModel.user_id == current_user.id
-    ).first()
+        # Get user settings to check limit
+        user_settings = s.query(UserSettingsModel).filter(
+            UserSettingsModel.user_id == current_user.id
+        ).first()
+    
+        if not user_settings:
+            # Create default settings
+            user_settings = UserSettingsModel(
+                user_id=current_user.id,
+                pinned_chats_limit=3
+            )
+            s.add(user_settings)
+            s.commit()
+            s.refresh(user_settings)
+    
+        # Check if user has reached the limit
+        current_pinned_count = s.query(PinnedChatModel).filter(
+            PinnedChatModel.user_id == current_user.id
+        ).count()
+    
+        if current_pinned_count >= user_settings.pinned_chats_limit:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Maximum pinned chats limit reached ({user_settings.pinned_chats_limit})"
+            )
     
-    if not user_settings:
-        # Create default settings
-        user_settings = UserSettingsModel(
+        # Create new pinned chat
+        new_pinned_chat = PinnedChatModel(
             user_id=current_user.id,
-            pinned_chats_limit=3
+            chat_id=chat_id
         )
-        db.add(user_settings)
-        db.commit()
-        db.refresh(user_settings)
-    
-    # Check if user has reached the limit
-    current_pinned_count = db.query(PinnedChatModel).filter(
-        PinnedChatModel.user_id == current_user.id
-    ).count()
-    
-    if current_pinned_count >= user_settings.pinned_chats_limit:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Maximum pinned chats limit reached ({user_settings.pinned_chats_limit})"
-        )
-    
-    # Create new pinned chat
-    new_pinned_chat = PinnedChatModel(
-        user_id=current_user.id,
-        chat_id=chat_id
-    )
     
-    db.add(new_pinned_chat)
-    db.commit()
+        s.add(new_pinned_chat)
+        s.flush()
+        changes = chats_controller.record_chat_change(s, chat_id, [current_user.id], "upsert")
+        s.commit()
     
-    return {"message": "Chat pinned successfully"}
+        return {"message": "Chat pinned successfully"}, _pin_frame(s, chat_id, changes)
+
+    out, frame = await db.run_sync(_pin)
+    await _notify_pin_change(current_user.id, frame)
+    return out
 
 
 @router.post("/unpin-chat")
 async def unpin_chat_endpoint(
     request: dict,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Unpin a chat for the current user"""
-    chat_id = request.get("chat_id")
-    if not chat_id:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="chat_id is required"
-        )
+    def _unpin(s: Session):
+        chat_id = request.get("chat_id")
+        if not chat_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="chat_id is required"
+            )
     
-    from ..db.models import PinnedChat as PinnedChatModel
-    pinned_chat = db.query(PinnedChatModel).filter(
-        PinnedChatModel.user_id == current_user.id,
-        PinnedChatModel.chat_id == chat_id
-    ).first()
+        from ..db.models import PinnedChat as PinnedChatModel
+        pinned_chat = s.query(PinnedChatModel).filter(
+            PinnedChatModel.user_id == current_user.id,
+            PinnedChatModel.chat_id == chat_id
+        ).first()
     
-    if not pinned_chat:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Pinned chat not found"
-        )
+        if not pinned_chat:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Pinned chat not found"
+            )
     
-    db.delete(pinned_chat)
-    db.commit()
+        s.delete(pinned_chat)
+        s.flush()
+        changes = chats_controller.record_chat_change(s, chat_id, [current_user.id], "upsert")
+        s.commit()
     
-    return {"message": "Chat unpinned successfully"}
+        return {"message": "Chat unpinned successfully"}, _pin_frame(s, chat_id, changes)
+
+    out, frame = await db.run_sync(_unpin)
+    await _notify_pin_change(current_user.id, frame)
+    return out
@@ -0,0 +1,600 @@
+import os
+import sys
+import base64
+import json
+import datetime
+import importlib
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(tmp_path):
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp_path / 'test.db'}"
+    os.environ["FILES_DIR"] = str(tmp_path / "files")
+    os.environ["SECRET_KEY"] = "test-secret"
+    importlib.import_module("app.core.config").get_settings.cache_clear()
+    dbmod = importlib.import_module("app.db.database")
+    importlib.reload(dbmod)
+    app_main = importlib.import_module("app.main")
+    importlib.reload(app_main)
+    dbmod.Base.metadata.create_all(bind=dbmod.engine)
+    # Process-local caches outlive the per-test database
+    from app.core.membership import membership
+    from app.ws.envelopes import envelope_cache
+    from app.ws.ws_manager import manager
+    membership.clear()
+    envelope_cache.clear()
+    manager.replay.drop()
+    manager.unread.clear()
+    return TestClient(app_main.app)
+
+
+def login(client: TestClient, username: str) -> dict:
+    dummy_jwk = json.dumps({"kty": "EC", "crv": "P-256", "x": username, "y": "B"})
+    res = client.post("/auth/register", json={
+        "username": username,
+        "first_name": "t",
+        "last_name": "t",
+        "password": "pass123",
+        "public_key_jwk": dummy_jwk,
+    })
+    assert res.status_code == 200
+    res = client.post("/token", data={"username": username, "password": "pass123"})
+    assert res.status_code == 200
+    return {"Authorization": f"Bearer {res.json()['access_token']}"}
+
+
+def b64(text: str) -> str:
+    return base64.b64encode(text.encode()).decode()
+
+
+def user_id(client: TestClient, headers: dict) -> int:
+    return client.get("/users/me/", headers=headers).json()["id"]
+
+
+def test_membership_index_follows_member_changes(client: TestClient):
+    from app.core.membership import membership
+
+    alice, bob, carol = (login(client, n) for n in ("alice", "bob", "carol"))
+    a, b, c = (user_id(client, h) for h in (alice, bob, carol))
+    chat = client.post("/chats/", json={"chat_type": "group", "name": "g", "participant_ids": [b]}, headers=alice).json()
+
+    assert membership.members(chat["id"]) == {a, b}
+    assert chat["id"] in membership.chats_for_user(b)
+
+    assert client.post(f"/chats/{chat['id']}/members", json={"member_ids": [c]}, headers=alice).status_code == 200
+    assert membership.is_member(chat["id"], c)
+
+    res = client.request("DELETE", f"/chats/{chat['id']}/members", json={"member_ids": [b]}, headers=alice)
+    assert res.status_code == 200
+    assert membership.members(chat["id"]) == {a, c}
+    assert chat["id"] not in membership.chats_for_user(b)
+
+
+def test_membership_load_racing_an_invalidation_is_not_cached(client: TestClient, monkeypatch):
+    import asyncio
+    from app.core.membership import membership
+    from app.db import database
+    from app.db.models import chat_users_table
+
+    alice, bob, carol = (login(client, n) for n in ("alice", "bob", "carol"))
+    a, b, c = (user_id(client, h) for h in (alice, bob, carol))
+    chat = client.post("/chats/", json={"chat_type": "group", "name": "g", "participant_ids": [b, c]}, headers=alice).json()
+    membership.clear()
+    query = membership._query
+
+    def remove_during_load(uid):
+        def racing_query(db, column, value):
+            ids = query(db, column, value)
+            # A member leaves after the read but before the result is stored
+            with database.SessionLocal() as s:
+                s.execute(chat_users_table.delete().where(
+                    chat_users_table.c.chat_id == chat["id"], chat_users_table.c.user_id == uid))
+                s.commit()
+            membership.invalidate_chat(chat["id"], [uid])
+            monkeypatch.setattr(membership, "_query", query)
+            return ids
+        monkeypatch.setattr(membership, "_query", racing_query)
+
+    remove_during_load(b)
+    assert membership.members(chat["id"]) == {a, b, c}
+    assert membership.members(chat["id"]) == {a, c}
+
+    membership.invalidate_chat(chat["id"])
+    remove_during_load(c)
+    assert asyncio.run(membership.amembers(chat["id"])) == {a, c}
+    assert not asyncio.run(membership.ais_member(chat["id"], c))
+
+
+def test_async_routes_create_chat_and_message(client: TestClient):
+    alice, bob = login(client, "alice"), login(client, "bob")
+    b = user_id(client, bob)
+    chat = client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()
+    assert client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()["id"] == chat["id"]
+
+    res = client.post(f"/chats/{chat['id']}/messages", json={"content": "hi"}, headers=bob)
+    assert res.status_code == 200 and res.json()["sender"]["username"] == "bob"
+    assert client.post("/chats/999/messages", json={"content": "x"}, headers=bob).status_code == 404
+    history = client.get(f"/chats/{chat['id']}/messages", headers=alice).json()
+    assert [m["content"] for m in history["messages"]] == ["hi"] and history["next_cursor"] is None
+
+
+def test_group_commit_preserves_per_chat_order(client: TestClient):
+    import asyncio
+    from app.core.group_commit import MessageWriter
+    from app.db import schemas
+    from app.db.database import SessionLocal
+    from app.db import models
+
+    alice, bob = login(client, "alice"), login(client, "bob")
+    b = user_id(client, bob)
+    me = client.get("/users/me/", headers=alice).json()
+    chats = [client.post("/chats/", json={"chat_type": "group", "name": n, "participant_ids": [b]}, headers=alice).json()["id"] for n in "xy"]
+
+    class Sender:
+        id = me["id"]
+        username = me["username"]
+
+    writer = MessageWriter(enabled=True, window_ms=20, max_batch=16)
+
+    async def scenario():
+        sends = [writer.submit(schemas.MessageCreate(content=f"{i}"), chats[i % 2], Sender()) for i in range(40)]
+        return await asyncio.gather(*sends)
+
+    results = asyncio.run(scenario())
+    assert [json.loads(saved[0].body)["content"] for saved in results] == [str(i) for i in range(40)]
+    assert writer.batches < 40 and writer.messages == 40
+
+    db = SessionLocal()
+    try:
+        for n, chat_id in enumerate(chats):
+            rows = db.query(models.Message).filter(models.Message.chat_id == chat_id).order_by(models.Message.id).all()
+            assert [m.content for m in rows] == [str(i) for i in range(n, 40, 2)]
+    finally:
+        db.close()
+
+
+def test_ws_v2_msgpack_round_trip(client: TestClient):
+    import msgpack
+
+    alice, bob = login(client, "alice"), login(client, "bob")
+    b = user_id(client, bob)
+    chat = client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()
+    token = alice["Authorization"].split(" ", 1)[1]
+    ciphertext, nonce = b"\x00\xffsecret", bytes(range(12))
+
+    with client.websocket_connect(f"/ws?token={token}", subprotocols=["chat.v2.msgpack"]) as ws:
+        assert ws.accepted_subprotocol == "chat.v2.msgpack"
+        ws.send_bytes(msgpack.packb({"v": 2, "type": "subscribe", "chat_id": chat["id"]}))
+        ws.send_bytes(msgpack.packb({"v": 2, "type": "send_message", "chat_id": chat["id"], "content_type": "text", "ciphertext": ciphertext, "nonce": nonce, "algo": "AES-GCM"}))
+        frames = []
+        while not any(f["type"] == "message" for f in frames):
+            frames.append(msgpack.unpackb(ws.receive_bytes(), raw=False))
+
+    msg = next(f for f in frames if f["type"] == "message")
+    assert msg["v"] == 2 and msg["message"]["ciphertext"] == ciphertext and msg["message"]["nonce"] == nonce
+    # Stored and served to v1 clients as base64, as before
+    history = client.get(f"/chats/{chat['id']}/messages", headers=bob).json()["messages"]
+    assert base64.b64decode(history[0]["ciphertext"]) == ciphertext
+
+
+def test_message_history_is_keyset_paginated(client: TestClient):
+    alice, bob = login(client, "alice"), login(client, "bob")
+    b = user_id(client, bob)
+    chat = client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()
+    url = f"/chats/{chat['id']}/messages"
+    ids = [client.post(url, json={"content": str(i)}, headers=alice).json()["id"] for i in range(7)]
+
+    # Backwards from the newest message, each page in id order
+    pages, cursor = [], None
+    while True:
+        page = client.get(url, params={"limit": 3, **({"before_id": cursor} if cursor else {})}, headers=bob).json()
+        pages.append([m["id"] for m in page["messages"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert pages == [ids[4:], ids[1:4], ids[:1]]
+
+    # Forwards from a known id
+    page = client.get(url, params={"after_id": ids[1], "limit": 4}, headers=bob).json()
+    assert [m["id"] for m in page["messages"]] == ids[2:6] and page["next_cursor"] == ids[5]
+    page = client.get(url, params={"after_id": ids[5], "limit": 4}, headers=bob).json()
+    assert [m["content"] for m in page["messages"]] == ["6"] and page["next_cursor"] is None
+
+    assert client.get(url, params={"before_id": ids[3], "after_id": ids[1]}, headers=bob).status_code == 400
+    assert client.get(url, params={"limit": 0}, headers=bob).status_code == 422
+
+
+def test_envelope_cache_serves_repeats_and_drops_a_deleted_senders(client: TestClient):
+    from app.controllers import users_controller
+    from app.db import database
+    from app.ws.envelopes import envelope_cache
+
+    alice, bob = login(client, "alice"), login(client, "bob")
+    a, b = user_id(client, alice), user_id(client, bob)
+    chat = client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()
+    url = f"/chats/{chat['id']}/messages"
+    ids = [client.post(url, json={"content": str(i)}, headers=alice).json()["id"] for i in range(3)]
+
+    # Sending encoded and cached them; history reuses the bytes
+    before = envelope_cache.stats()
+    first = client.get(url, headers=bob).json()
+    after = envelope_cache.stats()
+    assert after["hits"] == before["hits"] + 3 and after["misses"] == before["misses"]
+    assert client.get(url, headers=bob).json() == first
+    assert envelope_cache.stats()["hits"] == after["hits"] + 3
+    assert [m["sender"] for m in first["messages"]] == [{"id": a, "username": "alice"}] * 3
+
+    # Evicted entries miss once and are cached again
+    envelope_cache.clear()
+    client.get(url, headers=bob)
+    assert envelope_cache.stats()["misses"] == 3 and envelope_cache.stats()["size"] == 3
+    client.get(url, headers=bob)
+    assert envelope_cache.stats()["hits"] == 3 and envelope_cache.stats()["hit_rate"] == 0.5
+
+    # Deleting the sender rewrites their messages; the stale envelopes go
+    db = database.SessionLocal()
+    try:
+        assert users_controller.delete_user(db, a)
+    finally:
+        db.close()
+    assert envelope_cache.stats()["size"] == 0
+    page = client.get(url, headers=bob).json()
+    assert [m["id"] for m in page["messages"]] == ids
+    assert all(m["sender"] == {"id": None, "username": None} for m in page["messages"])
+
+
+def test_history_window_around_message_and_time(client: TestClient):
+    from app.db import database, models
+
+    alice, bob = login(client, "alice"), login(client, "bob")
+    b = user_id(client, bob)
+    chat = client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()
+    url = f"/chats/{chat['id']}/messages"
+    ids = [client.post(url, json={"content": str(i)}, headers=alice).json()["id"] for i in range(9)]
+    # One message per day, so a date lands between known messages
+    base = datetime.datetime(2026, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    db = database.SessionLocal()
+    for i, mid in enumerate(ids):
+        db.query(models.Message).filter(models.Message.id == mid).update({"timestamp": base + datetime.timedelta(days=i)})
+    db.commit()
+    db.close()
+
+    window = client.get(f"{url}/around", params={"message_id": ids[4], "limit": 4}, headers=bob).json()
+    assert [m["id"] for m in window["messages"]] == ids[2:6]
+    assert window["anchor_id"] == ids[4] and window["before_cursor"] == ids[2] and window["after_cursor"] == ids[5]
+    # The cursors continue through the regular pages
+    older = client.get(url, params={"before_id": window["before_cursor"]}, headers=bob).json()
+    assert [m["id"] for m in older["messages"]] == ids[:2]
+
+    window = client.get(f"{url}/around", params={"at": "2026-01-03T00:00:00Z", "limit": 10}, headers=bob).json()
+    assert window["anchor_id"] == ids[2] and [m["id"] for m in window["messages"]] == ids
+    assert window["before_cursor"] is None and window["after_cursor"] is None
+    window = client.get(f"{url}/around", params={"at": "2027-01-01T00:00:00Z", "limit": 2}, headers=bob).json()
+    assert window["anchor_id"] == ids[-1] and window["before_cursor"] == ids[-2]
+
+    assert client.get(f"{url}/around", headers=bob).status_code == 400
+    assert client.get(f"{url}/around", params={"message_id": 10_000}, headers=bob).status_code == 404
+
+
+def test_unread_counts_follow_chat_seqs(client: TestClient, monkeypatch):
+    alice, bob, carol = (login(client, n) for n in ("alice", "bob", "carol"))
+    a, b, c = (user_id(client, h) for h in (alice, bob, carol))
+    group = client.post("/chats/", json={"chat_type": "group", "name": "g", "participant_ids": [b, c]}, headers=alice).json()
+    private = client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()
+    for i in range(3):
+        client.post(f"/chats/{group['id']}/messages", json={"content": str(i)}, headers=alice)
+    client.post(f"/chats/{group['id']}/messages", json={"content": "x"}, headers=bob)
+    # Group E2EE fan-out: one row per recipient, one seq for the send
+    items = [{"recipient_id": r, "ciphertext": "Yw==", "nonce": "bg=="} for r in (b, c)]
+    client.post(f"/chats/{group['id']}/messages", json={"items": items}, headers=alice)
+    last = client.post(f"/chats/{private['id']}/messages", json={"content": "p"}, headers=alice).json()["id"]
+    state = client.post(f"/chats/{private['id']}/read-state", params={"last_read_message_id": last}, headers=bob).json()
+    assert state["read_seq"] == 1
+
+    # Each recipient sees their own copy of the send, under the same seq
+    for headers in (bob, carol):
+        history = client.get(f"/chats/{group['id']}/messages", headers=headers).json()["messages"]
+        assert [m["seq"] for m in history] == [1, 2, 3, 4, 5]
+
+    def counts(headers) -> dict:
+        # Registration also creates each user's own chat; only look at these two
+        rows = client.get("/chats/unread-counts", headers=headers).json()
+        return {r["chat_id"]: r["unread_count"] for r in rows if r["chat_id"] in (group["id"], private["id"])}
+
+    # Sending reads the chat for the sender: bob's reply leaves only the fan-out unread
+    expected = {
+        a: {group["id"]: 0, private["id"]: 0},
+        b: {group["id"]: 1, private["id"]: 0},
+        c: {group["id"]: 5},
+    }
+    for uid, headers in ((a, alice), (b, bob), (c, carol)):
+        assert counts(headers) == expected[uid]
+    monkeypatch.setenv("UNREAD_COUNTS", "query")
+    for uid, headers in ((a, alice), (b, bob), (c, carol)):
+        assert counts(headers) == expected[uid]
+
+
+def test_ws_subscribe_since_id_replays_missed_messages(client: TestClient):
+    from app.ws.ws_manager import manager
+
+    alice, bob = login(client, "alice"), login(client, "bob")
+    b = user_id(client, bob)
+    chat = client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()
+    ids = [client.post(f"/chats/{chat['id']}/messages", json={"content": str(i)}, headers=alice).json()["id"] for i in range(5)]
+    token = bob["Authorization"].split(" ", 1)[1]
+
+    def resume(since_id: int) -> dict:
+        with client.websocket_connect(f"/ws?token={token}") as ws:
+            ws.send_json({"v": 1, "type": "subscribe", "chat_id": chat["id"], "since_id": since_id})
+            while True:
+                frame = ws.receive_json()
+                if frame["type"] == "replay":
+                    return frame
+
+    # Everything since the first message is still in the ring
+    frame = resume(ids[0])
+    assert frame["source"] == "buffer" and frame["complete"] is True
+    assert [m["id"] for m in frame["messages"]] == ids[1:]
+
+    # A cold ring (e.g. after a restart) falls back to the indexed range query
+    manager.replay.drop()
+    frame = resume(ids[1])
+    assert frame["source"] == "db" and frame["complete"] is True
+    assert [m["content"] for m in frame["messages"]] == ["2", "3", "4"]
+
+
+def test_ws_pushes_unread_counts(client: TestClient):
+    import time
+    from app.ws.ws_manager import manager
+
+    alice, bob = login(client, "alice"), login(client, "bob")
+    b = user_id(client, bob)
+    chat = client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()
+    token = bob["Authorization"].split(" ", 1)[1]
+
+    def next_unread(ws) -> dict:
+        while True:
+            frame = ws.receive_json()
+            if frame["type"] == "unread":
+                return frame
+
+    # One event loop for the socket and the requests, as in a real worker
+    with client, client.websocket_connect(f"/ws?token={token}") as ws:
+        deadline = time.monotonic() + 2
+        while b not in manager.unread.counts and time.monotonic() < deadline:
+            time.sleep(0.01)
+        first = client.post(f"/chats/{chat['id']}/messages", json={"content": "1"}, headers=alice).json()["id"]
+        assert next_unread(ws) == {"v": 1, "type": "unread", "chat_id": chat["id"], "count": 1}
+        client.post(f"/chats/{chat['id']}/messages", json={"content": "2"}, headers=alice)
+        assert next_unread(ws)["count"] == 2
+        client.post(f"/chats/{chat['id']}/read-state", params={"last_read_message_id": first}, headers=bob)
+        assert next_unread(ws)["count"] == 1
+
+
+def test_chat_list_is_pinned_first_then_by_activity(client: TestClient):
+    alice, bob, carol = (login(client, n) for n in ("alice", "bob", "carol"))
+    b, c = user_id(client, bob), user_id(client, carol)
+    quiet = client.post("/chats/", json={"chat_type": "group", "name": "quiet", "participant_ids": [b]}, headers=alice).json()
+    with_bob = client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()
+    with_carol = client.post("/chats/private", json={"target_user_id": c}, headers=alice).json()
+    client.post(f"/chats/{with_carol['id']}/messages", json={"content": "1"}, headers=alice)
+    last = client.post(f"/chats/{with_bob['id']}/messages", json={"content": "2"}, headers=bob).json()
+    client.post("/user-settings/pin-chat", json={"chat_id": quiet["id"]}, headers=alice)
+
+    chats = client.get("/chats/", headers=alice).json()
+    order = [ch["id"] for ch in chats if ch["id"] in (quiet["id"], with_bob["id"], with_carol["id"])]
+    assert order == [quiet["id"], with_bob["id"], with_carol["id"]]
+    assert chats[0]["is_pinned"] is True and chats[0]["last_message_id"] is None
+    summary = next(ch for ch in chats if ch["id"] == with_bob["id"])
+    assert summary["last_message_id"] == last["id"] and summary["last_sender_id"] == b
+    assert summary["message_count"] == 1 and summary["last_message_at"] is not None
+
+
+def test_chat_list_query_count_does_not_grow_with_chats(client: TestClient):
+    from sqlalchemy import event
+    dbmod = importlib.import_module("app.db.database")
+
+    alice = login(client, "alice")
+    others = [user_id(client, login(client, f"u{i}")) for i in range(12)]
+
+    def list_queries() -> tuple:
+        seen = []
+        listener = lambda *args: seen.append(args[2])  # noqa: E731
+        event.listen(dbmod.engine, "before_cursor_execute", listener)
+        try:
+            chats = client.get("/chats/", headers=alice).json()
+        finally:
+            event.remove(dbmod.engine, "before_cursor_execute", listener)
+        return len(chats), len(seen)
+
+    client.post("/chats/private", json={"target_user_id": others[0]}, headers=alice)
+    few_chats, few_queries = list_queries()
+    for uid in others[1:]:
+        client.post("/chats/private", json={"target_user_id": uid}, headers=alice)
+    client.post("/chats/", json={"chat_type": "group", "name": "g", "participant_ids": others}, headers=alice)
+    many_chats, many_queries = list_queries()
+
+    assert many_chats == few_chats + 12
+    # The list version, chats with summaries and pins, then all participants
+    assert few_queries == many_queries == 3
+
+
+def test_chat_list_delta_since_version(client: TestClient):
+    alice, bob, carol = (login(client, n) for n in ("alice", "bob", "carol"))
+    b, c = user_id(client, bob), user_id(client, carol)
+    res = client.get("/chats/", headers=bob)
+    start = int(res.headers["X-Chat-List-Version"])
+
+    group = client.post("/chats/", json={"chat_type": "group", "name": "g", "participant_ids": [b, c]}, headers=alice).json()
+    client.put(f"/chats/{group['id']}/name", json={"name": "renamed"}, headers=alice)
+    delta = client.get("/chats/", params={"since_version": start}, headers=bob).json()
+    assert delta["version"] == start + 2 and not delta["full"]
+    assert [(ch["id"], ch["title"]) for ch in delta["upserts"]] == [(group["id"], "renamed")]
+    assert delta["removed"] == []
+
+    client.request("DELETE", f"/chats/{group['id']}/members", json={"member_ids": [b]}, headers=alice)
+    delta = client.get("/chats/", params={"since_version": start}, headers=bob).json()
+    assert delta["upserts"] == [] and delta["removed"] == [group["id"]]
+    # Nothing since the latest version; an unknown future version gets the full list
+    latest = client.get("/chats/", params={"since_version": delta["version"]}, headers=bob).json()
+    assert latest == {"version": delta["version"], "full": False, "upserts": [], "removed": []}
+    full = client.get("/chats/", params={"since_version": delta["version"] + 5}, headers=bob).json()
+    assert full["full"] and group["id"] not in [ch["id"] for ch in full["upserts"]]
+    # Carol's list saw the create, the rename and bob leaving
+    carol_delta = client.get("/chats/", params={"since_version": 0}, headers=carol).json()
+    assert [ch["id"] for ch in carol_delta["upserts"]] == [group["id"]]
+    assert [p["id"] for p in carol_delta["upserts"][0]["participants"]] == sorted([user_id(client, alice), c])
+
+
+def test_chats_changed_goes_only_to_affected_users(client: TestClient):
+    from app.ws.ws_manager import manager
+
+    alice, bob, carol = (login(client, n) for n in ("alice", "bob", "carol"))
+    b = user_id(client, bob)
+    version = int(client.get("/chats/", headers=bob).headers["X-Chat-List-Version"])
+    sent = []
+    original = manager.unified_notify_user
+
+    async def record(uid, message):
+        sent.append((uid, json.loads(message)))
+        await original(uid, message)
+
+    manager.unified_notify_user = record
+    try:
+        chat = client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()
+    finally:
+        manager.unified_notify_user = original
+    changed = [(uid, f) for uid, f in sent if f["type"] == "chats_changed"]
+    assert sorted(uid for uid, _ in changed) == sorted([user_id(client, alice), b])
+    frame = dict(changed)[b]
+    assert frame["version"] == version + 1 and frame["removed"] == []
+    assert [ch["id"] for ch in frame["upserts"]] == [chat["id"]]
+    assert "alice" in frame["upserts"][0]["title"]
+
+
+def test_chat_entries_carry_member_count_and_members_are_paged(client: TestClient):
+    alice = login(client, "alice")
+    others = [login(client, f"m{i}") for i in range(5)]
+    ids = [user_id(client, h) for h in others]
+    a = user_id(client, alice)
+    created = client.post("/chats/", json={"chat_type": "group", "name": "big", "participant_ids": ids}, headers=alice).json()
+    everyone = sorted([a, *ids])
+
+    assert created["member_count"] == 6
+    assert [p["id"] for p in created["participants"]] == everyone[:3]
+    listed = next(ch for ch in client.get("/chats/", headers=alice).json() if ch["id"] == created["id"])
+    assert listed["member_count"] == 6 and listed["participants"] == created["participants"]
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 4, **({"after_id": cursor} if cursor is not None else {})}
+        page = client.get(f"/chats/{created['id']}/members", params=params, headers=alice).json()
+        seen += [m["id"] for m in page["members"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == everyone
+    outsider = login(client, "outsider")
+    assert client.get(f"/chats/{created['id']}/members", headers=outsider).status_code == 403
+
+
+def test_private_chat_is_one_per_pair(client: TestClient):
+    alice, bob = login(client, "alice"), login(client, "bob")
+    a, b = user_id(client, alice), user_id(client, bob)
+
+    first = client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()
+    again = client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()
+    reverse = client.post("/chats/private", json={"target_user_id": a}, headers=bob).json()
+    assert first["id"] == again["id"] == reverse["id"]
+    assert client.post("/chats/private", json={"target_user_id": 9999}, headers=alice).status_code == 404
+
+    peers = {p["user_id"]: p for p in client.get("/users/approved-peers", headers=alice).json()}
+    assert peers[b]["chat_id"] == first["id"] and not peers[b]["is_self"]
+    own = client.post("/chats/private", json={"target_user_id": a}, headers=alice).json()
+    assert peers[a]["is_self"] and peers[a]["chat_id"] == own["id"] != first["id"]
+    assert list(peers)[0] == a
+
+
+def test_private_chat_via_generic_create_uses_the_pair_key(client: TestClient):
+    alice, bob, carol = login(client, "alice"), login(client, "bob"), login(client, "carol")
+    b, c = user_id(client, bob), user_id(client, carol)
+
+    # POST /chats/ with chat_type=private is the same DM as /chats/private
+    first = client.post("/chats/", json={"chat_type": "private", "participant_ids": [b]}, headers=alice).json()
+    again = client.post("/chats/", json={"chat_type": "private", "participant_ids": [user_id(client, alice)]}, headers=bob).json()
+    direct = client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()
+    assert first["id"] == again["id"] == direct["id"]
+    assert first["chat_type"] == "private" and first["member_count"] == 2
+
+    res = client.post("/chats/", json={"chat_type": "private", "participant_ids": [b, c]}, headers=alice)
+    assert res.status_code == 400
+    res = client.post("/chats/", json={"chat_type": "private", "participant_ids": [9999]}, headers=alice)
+    assert res.status_code == 404
+    dms = [ch for ch in client.get("/chats/", headers=alice).json() if ch["chat_type"] == "private" and ch["member_count"] == 2]
+    assert [ch["id"] for ch in dms] == [first["id"]]
+
+
+def test_history_holds_only_the_viewers_fan_out_copies(client: TestClient):
+    alice, bob, carol = (login(client, n) for n in ("alice", "bob", "carol"))
+    a, b, c = (user_id(client, h) for h in (alice, bob, carol))
+    chat = client.post("/chats/", json={"chat_type": "group", "name": "g", "participant_ids": [b, c]}, headers=alice).json()
+    client.post(f"/chats/{chat['id']}/messages", json={"content": "shared"}, headers=alice)
+    client.post(f"/chats/{chat['id']}/messages", json={"items": [
+        {"recipient_id": uid, "ciphertext": b64(f"for-{uid}"), "nonce": "bg=="} for uid in (a, b, c)
+    ]}, headers=alice)
+
+    def history(headers) -> list:
+        msgs = client.get(f"/chats/{chat['id']}/messages", headers=headers).json()["messages"]
+        return [(m["recipient_id"], m["ciphertext"]) for m in msgs]
+
+    assert history(bob) == [(None, None), (b, b64(f"for-{b}"))]
+    assert history(carol) == [(None, None), (c, b64(f"for-{c}"))]
+    first = client.get(f"/chats/{chat['id']}/messages", headers=bob).json()["messages"][0]["id"]
+    window = client.get(f"/chats/{chat['id']}/messages/around", params={"message_id": first}, headers=bob).json()
+    assert [m["recipient_id"] for m in window["messages"]] == [None, b]
+
+
+def test_fan_out_send_is_one_row_with_per_recipient_copies(client: TestClient):
+    from app.db import database, models
+
+    alice, bob, carol = (login(client, n) for n in ("alice", "bob", "carol"))
+    a, b, c = (user_id(client, h) for h in (alice, bob, carol))
+    chat = client.post("/chats/", json={"chat_type": "group", "name": "g", "participant_ids": [b, c]}, headers=alice).json()
+    sent = client.post(f"/chats/{chat['id']}/messages", json={"items": [
+        {"recipient_id": uid, "ciphertext": b64(f"for-{uid}"), "nonce": "bg=="} for uid in (a, b)
+    ]}, headers=alice).json()
+    assert (sent["recipient_id"], sent["ciphertext"]) == (a, b64(f"for-{a}"))
+
+    db = database.SessionLocal()
+    rows = db.query(models.Message).filter(models.Message.chat_id == chat["id"]).all()
+    copies = db.query(models.MessageRecipient).order_by(models.MessageRecipient.recipient_id).all()
+    db.close()
+    assert [(m.id, m.fanout, m.recipient_id, m.ciphertext) for m in rows] == [(sent["id"], True, None, None)]
+    # Stored as raw bytes, base64 only on the way out
+    assert [(r.message_id, r.recipient_id, r.ciphertext) for r in copies] == [(sent["id"], a, f"for-{a}".encode()), (sent["id"], b, f"for-{b}".encode())]
+
+    # Same id for every recipient; a member left out of the send doesn't see it
+    bob_view = client.get(f"/chats/{chat['id']}/messages", headers=bob).json()["messages"]
+    assert [(m["id"], m["ciphertext"]) for m in bob_view] == [(sent["id"], b64(f"for-{b}"))]
+    assert client.get(f"/chats/{chat['id']}/messages", headers=carol).json()["messages"] == []
+
+
+def test_binary_fields_round_trip_as_base64(client: TestClient):
+    alice, bob = login(client, "alice"), login(client, "bob")
+    b = user_id(client, bob)
+    chat = client.post("/chats/private", json={"target_user_id": b}, headers=alice).json()
+    url = f"/chats/{chat['id']}/messages"
+    ciphertext, nonce = base64.b64encode(bytes(range(200))).decode(), base64.b64encode(bytes(12)).decode()
+    sent = client.post(url, json={"ciphertext": ciphertext, "nonce": nonce, "algo": "AES-GCM"}, headers=alice).json()
+    assert (sent["ciphertext"], sent["nonce"]) == (ciphertext, nonce)
+    assert client.post(url, json={"ciphertext": "not base64!", "nonce": nonce}, headers=alice).status_code == 422
+
+    wrap = {"chat_id": chat["id"], "recipient_user_id": b, "wrapped_key_ciphertext": ciphertext, "wrapped_key_nonce": nonce}
+    assert client.post("/crypto/group-key/wrap", json=wrap, headers=alice).status_code == 200
+    got = client.get(f"/crypto/group-key/wrap/{chat['id']}", headers=bob).json()
+    assert (got["wrapped_key_ciphertext"], got["wrapped_key_nonce"]) == (ciphertext, nonce)
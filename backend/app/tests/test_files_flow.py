@@ -2,6 +2,7 @@ import io
 import os
 import sys
 import json
+import time
 import base64
 import importlib
 import pytest
@@ -21,6 +22,7 @@ def client(tmp_path):
     os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
     os.environ["FILES_DIR"] = str(files_dir)
     os.environ["SECRET_KEY"] = "test-secret"
+    importlib.import_module("app.core.config").get_settings.cache_clear()
     # Reload database and app to pick up env
     dbmod = importlib.import_module("app.db.database")
     importlib.reload(dbmod)
@@ -28,6 +30,14 @@ def client(tmp_path):
     importlib.reload(app_main)
     # Create tables (main may have done it already; safe to call again)
     dbmod.Base.metadata.create_all(bind=dbmod.engine)
+    # Process-local caches outlive the per-test database
+    from app.core.membership import membership
+    from app.ws.envelopes import envelope_cache
+    from app.ws.ws_manager import manager
+    membership.clear()
+    envelope_cache.clear()
+    manager.replay.drop()
+    manager.unread.clear()
     return TestClient(app_main.app)
 
 
@@ -45,8 +55,10 @@ def create_and_login_user(username: str, client: TestClient) -> str:
         },
     )
     assert res.status_code == 200
-    tok = res.json()["access_token"]
-    return tok
+    # Registration doesn't log in; the token comes from the password flow
+    res = client.post("/token", data={"username": username, "password": "pass123"})
+    assert res.status_code == 200
+    return res.json()["access_token"]
 
 
 def auth_headers(token: str):
@@ -108,3 +120,128 @@ def test_upload_and_send_attachment_file_flow(client: TestClient, tmp_path):
     assert res.content  # some bytes
 
 
+
+
+def test_upload_is_streamed_to_disk_and_limited(client: TestClient, tmp_path, monkeypatch):
+    tok = create_and_login_user("alice", client)
+    headers = {**auth_headers(tok), "x-nonce": base64.b64encode(os.urandom(12)).decode()}
+    files_dir = tmp_path / "files"
+    monkeypatch.setenv("FILES_MAX_MB", "1")
+    monkeypatch.setenv("FILES_CHUNK_KB", "64")
+
+    # Several chunks' worth arrives intact, under its final name only
+    payload = os.urandom(300 * 1024)
+    res = client.post("/files/upload", files={"file": ("a.bin", io.BytesIO(payload), "application/zip")}, headers=headers)
+    assert res.status_code == 200, res.text
+    assert res.json()["size_bytes"] == len(payload)
+    stored = list(files_dir.iterdir())
+    assert len(stored) == 1 and stored[0].read_bytes() == payload and not stored[0].name.startswith(".")
+
+    # Over the limit, the wrong type, or no nonce: rejected and nothing left behind
+    big = io.BytesIO(os.urandom(1024 * 1024 + 1))
+    res = client.post("/files/upload", files={"file": ("b.bin", big, "application/zip")}, headers=headers)
+    assert res.status_code == 400 and res.json()["detail"] == "File too large or empty"
+    res = client.post("/files/upload", files={"file": ("c.exe", io.BytesIO(b"MZ"), "application/x-msdownload")}, headers=headers)
+    assert res.status_code == 400 and res.json()["detail"] == "Unsupported file type"
+    res = client.post("/files/upload", files={"file": ("d.zip", io.BytesIO(b"PK"), "application/zip")}, headers=auth_headers(tok))
+    assert res.status_code == 400
+    assert list(files_dir.iterdir()) == stored
+
+
+def test_resumable_upload_in_chunks(client: TestClient, tmp_path, monkeypatch):
+    tok = create_and_login_user("alice", client)
+    other = create_and_login_user("bob", client)
+    files_dir = tmp_path / "files"
+    monkeypatch.setenv("FILES_MAX_MB", "1")
+    monkeypatch.setenv("FILES_UPLOAD_CHUNK_KB", "64")
+    nonce = base64.b64encode(os.urandom(12)).decode()
+    payload = os.urandom(200 * 1024)
+    chunk = 64 * 1024
+
+    # Type and size are refused before any data is sent
+    meta = {"filename": "clip.mp4", "mime_type": "video/mp4", "size_bytes": len(payload), "nonce": nonce}
+    res = client.post("/files/uploads", json={**meta, "mime_type": "application/x-msdownload"}, headers=auth_headers(tok))
+    assert res.status_code == 400
+    res = client.post("/files/uploads", json={**meta, "size_bytes": 2 * 1024 * 1024}, headers=auth_headers(tok))
+    assert res.status_code == 400
+    res = client.post("/files/uploads", json=meta, headers=auth_headers(tok))
+    assert res.status_code == 200, res.text
+    up = res.json()
+    assert up["chunk_size"] == chunk and up["received_bytes"] == 0
+    assert up["missing_offsets"] == [0, chunk, 2 * chunk, 3 * chunk]
+    url = f"/files/uploads/{up['id']}"
+
+    def put(offset, data=None, token=tok):
+        data = payload[offset:offset + chunk] if data is None else data
+        return client.put(f"{url}?offset={offset}", content=data, headers=auth_headers(token))
+
+    # Out of order; the received offset only counts the gap-free prefix
+    assert put(2 * chunk).status_code == 200
+    res = put(0)
+    assert res.status_code == 200
+    assert res.json()["received_bytes"] == chunk
+    assert res.json()["missing_offsets"] == [chunk, 3 * chunk]
+    # Misaligned, short, or someone else's session
+    assert put(100).status_code == 400
+    assert put(chunk, payload[chunk:chunk + 10]).status_code == 400
+    assert put(chunk, token=other).status_code == 404
+    assert client.get(url, headers=auth_headers(other)).status_code == 404
+    assert client.post(f"{url}/complete", headers=auth_headers(tok)).status_code == 409
+
+    # "Reconnect": ask where we are and send the rest, one chunk twice
+    res = client.get(url, headers=auth_headers(tok))
+    for offset in res.json()["missing_offsets"]:
+        assert put(offset).status_code == 200
+    assert put(0).status_code == 200
+    assert client.get(url, headers=auth_headers(tok)).json()["received_bytes"] == len(payload)
+    res = client.post(f"{url}/complete", headers=auth_headers(tok))
+    assert res.status_code == 200, res.text
+    att = res.json()
+    assert att["filename"] == "clip.mp4" and att["size_bytes"] == len(payload) and att["nonce"] == nonce
+    stored = list(files_dir.iterdir())
+    assert len(stored) == 1 and stored[0].read_bytes() == payload
+    assert client.get(url, headers=auth_headers(tok)).status_code == 404
+
+    # Abandoned sessions are dropped once they expire
+    res = client.post("/files/uploads", json=meta, headers=auth_headers(tok))
+    stale = res.json()["id"]
+    assert (files_dir / f".{stale}.upload").exists()
+    monkeypatch.setenv("FILES_UPLOAD_TTL_HOURS", "0")
+    res = client.post("/files/uploads", json=meta, headers=auth_headers(tok))
+    assert client.get(f"/files/uploads/{stale}", headers=auth_headers(tok)).status_code == 404
+    assert not (files_dir / f".{stale}.upload").exists()
+    assert client.delete(f"/files/uploads/{res.json()['id']}", headers=auth_headers(tok)).status_code == 200
+    assert list(files_dir.iterdir()) == stored
+
+
+def test_upload_sessions_are_capped_per_user_and_swept(client: TestClient, tmp_path, monkeypatch):
+    tok, other = create_and_login_user("alice", client), create_and_login_user("bob", client)
+    files_dir = tmp_path / "files"
+    monkeypatch.setenv("FILES_MAX_MB", "1")
+    monkeypatch.setenv("FILES_UPLOAD_QUOTA_MB", "1")
+    monkeypatch.setenv("FILES_UPLOAD_MAX_OPEN", "2")
+    monkeypatch.setenv("FILES_UPLOAD_CHUNK_KB", "64")
+    meta = {"filename": "a.zip", "mime_type": "application/zip", "nonce": base64.b64encode(os.urandom(12)).decode()}
+
+    def create(size, token=tok):
+        return client.post("/files/uploads", json={**meta, "size_bytes": size}, headers=auth_headers(token))
+
+    first = create(600 * 1024)
+    assert first.status_code == 200
+    # Nothing is reserved on disk until chunks arrive
+    assert (files_dir / f".{first.json()['id']}.upload").stat().st_size == 0
+    assert create(600 * 1024).status_code == 413
+    assert create(100 * 1024).status_code == 200
+    assert create(10 * 1024).status_code == 429
+    # Per user: someone else still has their full allowance
+    assert create(600 * 1024, token=other).status_code == 200
+
+    # Expired sessions go on the sweeper's timer, with no request touching uploads
+    monkeypatch.setenv("FILES_UPLOAD_TTL_HOURS", "0")
+    with client:
+        for _ in range(200):
+            if not any(p.name.endswith(".upload") for p in files_dir.iterdir()):
+                break
+            time.sleep(0.01)
+    assert list(files_dir.iterdir()) == []
+    assert client.get(f"/files/uploads/{first.json()['id']}", headers=auth_headers(tok)).status_code == 404
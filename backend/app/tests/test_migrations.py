@@ -0,0 +1,243 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+
+@pytest.fixture
+def run_migrations():
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    os.environ.setdefault("SECRET_KEY", "test-secret")
+    from app.db.migrations import run_migrations
+    return run_migrations
+
+
+def _old_schema(engine):
+    # The tables as they were before any migration step existed
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE chats (id INTEGER PRIMARY KEY, chat_type VARCHAR, name VARCHAR)"))
+        conn.execute(text("CREATE TABLE chat_users (chat_id INTEGER, user_id INTEGER, PRIMARY KEY (chat_id, user_id))"))
+        conn.execute(text(
+            "CREATE TABLE messages (id INTEGER PRIMARY KEY, chat_id INTEGER, sender_id INTEGER, "
+            "recipient_id INTEGER, timestamp DATETIME)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE user_chat_states (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+            "chat_id INTEGER NOT NULL, last_read_message_id INTEGER)"
+        ))
+
+
+def test_migrations_add_missing_indexes_once(tmp_path, run_migrations):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    _old_schema(engine)
+
+    run_migrations(engine)
+    run_migrations(engine)
+
+    names = [ix["name"] for ix in inspect(engine).get_indexes("messages")]
+    assert sorted(names) == ["ix_messages_chat_id_id", "ix_messages_chat_id_timestamp", "ix_messages_chat_recipient_id"]
+
+
+def test_message_seqs_are_backfilled(tmp_path, run_migrations):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    _old_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO chats (id, chat_type) VALUES (1, 'group'), (2, 'group')"))
+        conn.execute(text("INSERT INTO chat_users VALUES (1, 10), (1, 20), (1, 30), (2, 10)"))
+        # 10 sends 1-3; 20 sends 4; 5 and 6 are per-recipient copies for 20 and 30; 7 is in chat 2
+        conn.execute(text(
+            "INSERT INTO messages (id, chat_id, sender_id, recipient_id) VALUES "
+            "(1, 1, 10, NULL), (2, 1, 10, NULL), (3, 1, 10, NULL), (4, 1, 20, NULL), (5, 1, 10, 20), (6, 1, 10, 30), "
+            "(7, 2, 20, NULL)"
+        ))
+        conn.execute(text("INSERT INTO user_chat_states (user_id, chat_id, last_read_message_id) VALUES (20, 1, 2)"))
+
+    run_migrations(engine)
+    run_migrations(engine)
+
+    with engine.connect() as conn:
+        seqs = conn.execute(text("SELECT id, seq FROM messages ORDER BY id")).all()
+        last = dict(conn.execute(text("SELECT id, last_seq FROM chats")).all())
+        read = dict(conn.execute(text("SELECT user_id, read_seq FROM user_chat_states WHERE chat_id = 1")).all())
+    assert [seq for _, seq in seqs] == [1, 2, 3, 4, 5, 6, 1]
+    assert last == {1: 6, 2: 1}
+    # 10 sent last; 20 read 2 but then sent 4; 30 never read
+    assert read == {10: 6, 20: 4, 30: 0}
+
+
+def test_legacy_group_copies_share_one_seq(tmp_path, run_migrations):
+    from app.db.models import ChatSummary, MessageRecipient
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    _old_schema(engine)
+    with engine.begin() as conn:
+        for column in ("ciphertext TEXT", "nonce VARCHAR", "algo VARCHAR"):
+            conn.execute(text(f"ALTER TABLE messages ADD COLUMN {column}"))
+        conn.execute(text("INSERT INTO chats (id, chat_type) VALUES (1, 'group')"))
+        conn.execute(text("INSERT INTO chat_users VALUES (1, 10), (1, 20), (1, 30)"))
+        # 10 sends to all three (copies a few ms apart), again a minute later,
+        # then one plain message; 20 read the first send, 30 nothing
+        conn.execute(text(
+            "INSERT INTO messages (id, chat_id, sender_id, recipient_id, timestamp, ciphertext, nonce) VALUES "
+            "(1, 1, 10, 10, '2024-01-01 10:00:00.001', 'a10', 'n'), (2, 1, 10, 20, '2024-01-01 10:00:00.002', 'a20', 'n'), "
+            "(3, 1, 10, 30, '2024-01-01 10:00:00.004', 'a30', 'n'), "
+            "(4, 1, 10, 10, '2024-01-01 10:01:00.000', 'b10', 'n'), (5, 1, 10, 20, '2024-01-01 10:01:00.001', 'b20', 'n'), "
+            "(6, 1, 10, 30, '2024-01-01 10:01:00.002', 'b30', 'n'), (7, 1, 10, NULL, '2024-01-01 10:02:00', NULL, NULL)"
+        ))
+        conn.execute(text("INSERT INTO user_chat_states (user_id, chat_id, last_read_message_id) VALUES (20, 1, 3)"))
+    ChatSummary.__table__.create(engine)
+    MessageRecipient.__table__.create(engine)
+
+    run_migrations(engine)
+    run_migrations(engine)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, seq FROM messages ORDER BY id")).all()
+        copies = conn.execute(text("SELECT message_id, COUNT(*) FROM message_recipients GROUP BY message_id")).all()
+        last_seq = conn.execute(text("SELECT last_seq FROM chats")).scalar_one()
+        count = conn.execute(text("SELECT message_count FROM chat_summaries")).scalar_one()
+        read = dict(conn.execute(text("SELECT user_id, read_seq FROM user_chat_states")).all())
+        assert not inspect(conn).has_table("_legacy_send_ids")
+    # Three sends: two folded fan-outs and the plain message
+    assert [tuple(r) for r in rows] == [(1, 1), (4, 2), (7, 3)]
+    assert [tuple(c) for c in copies] == [(1, 3), (4, 3)]
+    assert (last_seq, count) == (3, 3)
+    # Unread is last_seq - read_seq: one per send the user can see
+    assert {uid: last_seq - seq for uid, seq in read.items()} == {10: 0, 20: 2, 30: 3}
+
+
+def test_chat_summaries_are_backfilled_once(tmp_path, run_migrations):
+    from app.db.models import ChatSummary
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    _old_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO chats (id, chat_type) VALUES (1, 'group'), (2, 'group'), (3, 'group')"))
+        conn.execute(text(
+            "INSERT INTO messages (id, chat_id, sender_id, recipient_id, timestamp) VALUES "
+            "(1, 1, 10, NULL, '2024-01-01 10:00:00'), (2, 2, 20, NULL, '2024-01-01 11:00:00'), "
+            "(3, 1, 30, NULL, '2024-01-01 12:00:00')"
+        ))
+    # As at startup: create_all adds the (empty) table before the steps run
+    ChatSummary.__table__.create(engine)
+
+    run_migrations(engine)
+    run_migrations(engine)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT chat_id, last_message_id, message_count, last_sender_id FROM chat_summaries ORDER BY chat_id"
+        )).all()
+    assert [tuple(r) for r in rows] == [(1, 3, 2, 30), (2, 2, 1, 20)]
+
+
+def test_private_pairs_are_backfilled_keeping_the_oldest_dm(tmp_path, run_migrations):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    _old_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO chats (id, chat_type) VALUES (1, 'private'), (2, 'private'), (3, 'private'), (4, 'group')"
+        ))
+        # 1 and 3 are duplicate DMs between 10 and 20; 2 is 10's self chat; 4 is a group
+        conn.execute(text("INSERT INTO chat_users VALUES (1, 20), (1, 10), (2, 10), (3, 10), (3, 20), (4, 10), (4, 20)"))
+
+    run_migrations(engine)
+    run_migrations(engine)
+
+    with engine.connect() as conn:
+        pairs = conn.execute(text("SELECT id, pair_low, pair_high FROM chats ORDER BY id")).all()
+    assert [tuple(p) for p in pairs] == [(1, 10, 20), (2, 10, 10), (3, None, None), (4, None, None)]
+    assert any(ix["name"] == "ux_chats_private_pair" and ix["unique"] for ix in inspect(engine).get_indexes("chats"))
+
+
+def test_per_recipient_rows_fold_into_message_recipients(tmp_path, run_migrations):
+    from app.db.models import ChatSummary, MessageRecipient
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    _old_schema(engine)
+    with engine.begin() as conn:
+        for column in ("ciphertext TEXT", "nonce VARCHAR", "algo VARCHAR"):
+            conn.execute(text(f"ALTER TABLE messages ADD COLUMN {column}"))
+        conn.execute(text("INSERT INTO chats (id, chat_type) VALUES (1, 'group')"))
+        conn.execute(text("INSERT INTO chat_users VALUES (1, 10), (1, 20), (1, 30)"))
+        # 1 is shared; 2 and 3 predate seqs, so they get one seq each
+        conn.execute(text(
+            "INSERT INTO messages (id, chat_id, sender_id, recipient_id, ciphertext, nonce) VALUES "
+            "(1, 1, 10, NULL, NULL, NULL), (2, 1, 10, 20, 'c20', 'n20'), (3, 1, 10, 30, 'c30', 'n30')"
+        ))
+    ChatSummary.__table__.create(engine)
+    # Up to date but for message_recipients, as before this step existed
+    run_migrations(engine)
+    with engine.begin() as conn:
+        # 4 and 5 are the two copies of one later send
+        conn.execute(text(
+            "INSERT INTO messages (id, chat_id, seq, sender_id, recipient_id, ciphertext, nonce) VALUES "
+            "(4, 1, 4, 20, 10, 'd10', 'm10'), (5, 1, 4, 20, 30, 'd30', 'm30')"
+        ))
+        conn.execute(text("UPDATE chat_summaries SET last_message_id = 5"))
+        conn.execute(text("UPDATE user_chat_states SET last_read_message_id = 5 WHERE user_id = 30"))
+    MessageRecipient.__table__.create(engine)
+
+    run_migrations(engine)
+    run_migrations(engine)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, seq, fanout, recipient_id, ciphertext FROM messages ORDER BY id")).all()
+        copies = conn.execute(text(
+            "SELECT message_id, recipient_id, ciphertext, nonce FROM message_recipients ORDER BY message_id, recipient_id"
+        )).all()
+        last = conn.execute(text("SELECT last_message_id FROM chat_summaries")).scalar_one()
+        read = conn.execute(text("SELECT last_read_message_id FROM user_chat_states WHERE user_id = 30")).scalar_one()
+    assert [tuple(r) for r in rows] == [(1, 1, 0, None, None), (2, 2, 1, None, None), (3, 3, 1, None, None), (4, 4, 1, None, None)]
+    assert [tuple(c) for c in copies] == [
+        (2, 20, "c20", "n20"), (3, 30, "c30", "n30"), (4, 10, "d10", "m10"), (4, 30, "d30", "m30"),
+    ]
+    assert (last, read) == (4, 4)
+
+
+def test_binary_columns_are_added_and_converted_in_batches(tmp_path, run_migrations):
+    import base64
+
+    from app.db.convert_binary import convert_all
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    _old_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE messages ADD COLUMN ciphertext TEXT"))
+        conn.execute(text("ALTER TABLE messages ADD COLUMN nonce VARCHAR"))
+        conn.execute(text(
+            "CREATE TABLE attachments (id INTEGER PRIMARY KEY, filename VARCHAR NOT NULL, nonce VARCHAR NOT NULL)"
+        ))
+        conn.execute(text("CREATE INDEX ix_attachments_filename ON attachments (filename)"))
+        conn.execute(text(
+            "INSERT INTO messages (id, chat_id, sender_id, ciphertext, nonce) VALUES "
+            f"(1, 1, 10, '{base64.b64encode(b'one').decode()}', 'AAAA'), (2, 1, 10, NULL, NULL), "
+            f"(3, 1, 10, 'not base64!', 'AAAA'), (4, 1, 10, '{base64.b64encode(bytes(range(256))).decode()}', 'AAAA')"
+        ))
+        conn.execute(text("INSERT INTO attachments (id, filename, nonce) VALUES (1, 'a.txt', 'AAECAwQFBgcICQoL')"))
+
+    run_migrations(engine)
+    run_migrations(engine)
+
+    columns = {c["name"]: c for c in inspect(engine).get_columns("attachments")}
+    assert columns["nonce"]["nullable"] and "nonce_bin" in columns
+    assert [ix["name"] for ix in inspect(engine).get_indexes("attachments")] == ["ix_attachments_filename"]
+
+    results = convert_all(engine, ["messages", "attachments"], batch=2)
+    assert results["messages"] == {"converted": 5, "skipped": 1, "batches": 2}
+    assert convert_all(engine, ["messages", "attachments"], batch=2)["messages"]["converted"] == 0
+
+    with engine.connect() as conn:
+        messages = conn.execute(text("SELECT id, ciphertext, ciphertext_bin, nonce, nonce_bin FROM messages ORDER BY id")).all()
+        attachment = conn.execute(text("SELECT nonce, nonce_bin FROM attachments")).one()
+    assert [tuple(m) for m in messages] == [
+        (1, None, b"one", None, b"\x00\x00\x00"),
+        (2, None, None, None, None),
+        (3, "not base64!", None, None, b"\x00\x00\x00"),
+        (4, None, bytes(range(256)), None, b"\x00\x00\x00"),
+    ]
+    assert tuple(attachment) == (None, bytes(range(12)))
@@ -0,0 +1,600 @@
+import asyncio
+import importlib
+import os
+import sys
+
+import pytest
+
+
+def _import(module: str, name: str):
+    # Imported lazily so collecting this file doesn't bind the app to a database
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    os.environ.setdefault("SECRET_KEY", "test-secret")
+    return getattr(importlib.import_module(module), name)
+
+
+def ConnectionManager():
+    return _import("app.ws.ws_manager", "ConnectionManager")()
+
+
+def Outbox(*args, **kwargs):
+    return _import("app.ws.outbox", "Outbox")(*args, **kwargs)
+
+
+class FakeSocket:
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.sent: list[str] = []
+        self.closed_code = None
+
+    async def send_text(self, data: str):
+        if self.fail:
+            raise RuntimeError("broken pipe")
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(data)
+
+    async def send_bytes(self, data: bytes):
+        await self.send_text(data)  # type: ignore[arg-type]
+
+    async def close(self, code: int = 1000):
+        self.closed_code = code
+
+
+async def _drain(*sockets, count: int, timeout: float = 2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while any(len(ws.sent) < count for ws in sockets) and loop.time() < deadline:
+        await asyncio.sleep(0.001)
+
+
+def test_broadcast_room_not_blocked_by_slow_member():
+    async def scenario():
+        manager = ConnectionManager()
+        fast = FakeSocket()
+        slow = FakeSocket(delay=0.5)
+        for uid, ws in ((1, slow), (2, fast)):
+            manager.register_user_socket(uid, ws)
+            manager.subscribe_room(ws, uid, "7")
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await manager.broadcast_room("7", "hello")
+        await _drain(fast, count=1)
+        assert fast.sent == ["hello"]
+        assert loop.time() - started < 0.25
+        manager.unregister_user_socket(1, slow)
+        manager.unregister_user_socket(2, fast)
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("policy,expected,closed", [
+    ("drop", ["a", "b"], False),
+    ("coalesce", [], True),
+])
+def test_outbox_overflow_policies(policy, expected, closed):
+    async def scenario():
+        ws = FakeSocket()
+        box = Outbox(ws, maxsize=2, policy=policy)
+        box.push("a")
+        box.push("b")
+        box.push("c")
+        await _drain(ws, count=2, timeout=0.05)
+        assert box.closed is closed
+        box.close()
+        assert ws.sent == expected
+
+    asyncio.run(scenario())
+
+
+def test_outbox_coalesces_by_key():
+    async def scenario():
+        ws = FakeSocket()
+        box = Outbox(ws, maxsize=2, policy="coalesce")
+        box.push("p1-online", key="presence:1")
+        box.push("msg")
+        box.push("p1-offline", key="presence:1")
+        await _drain(ws, count=2)
+        box.close()
+        assert ws.sent == ["p1-offline", "msg"]
+        assert box.coalesced == 1
+
+    asyncio.run(scenario())
+
+
+def test_slow_consumer_cannot_lose_a_message_frame_unnoticed(monkeypatch):
+    monkeypatch.setenv("WS_OVERFLOW_POLICY", "coalesce")
+    monkeypatch.setenv("WS_SEND_QUEUE_MAX", "2")
+
+    async def scenario():
+        manager = ConnectionManager()
+        slow = FakeSocket(delay=1.0)
+        manager.register_user_socket(1, slow)
+        manager.subscribe_room(slow, 1, "4")
+        await manager.broadcast_room("4", "typing-1", key="typing:4:2")
+        for i in range(3):
+            await manager.broadcast_room("4", f"message-{i}")
+            await manager.broadcast_room("4", f"typing-{i + 2}", key="typing:4:2")
+        await asyncio.sleep(0.01)
+        # Coalescing the typing frames is fine; overflowing past a message is not
+        assert slow not in manager.connections
+        assert slow.closed_code == 1013
+        assert manager.fanout_stats()["dropped"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_disconnect_policy_unregisters_slow_consumer(monkeypatch):
+    monkeypatch.setenv("WS_OVERFLOW_POLICY", "disconnect")
+    monkeypatch.setenv("WS_SEND_QUEUE_MAX", "1")
+
+    async def scenario():
+        manager = ConnectionManager()
+        slow = FakeSocket(delay=1.0)
+        manager.register_user_socket(1, slow)
+        manager.subscribe_room(slow, 1, "3")
+        for i in range(4):
+            await manager.broadcast_room("3", f"m{i}")
+        await asyncio.sleep(0.01)
+        assert slow not in manager.connections
+        assert "3" not in manager.room_conns
+        assert slow.closed_code == 1013
+        assert manager.fanout_stats()["slow_disconnects"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_broken_socket_is_dropped():
+    async def scenario():
+        manager = ConnectionManager()
+        broken = FakeSocket(fail=True)
+        manager.register_user_socket(1, broken)
+        manager.subscribe_room(broken, 1, "5")
+        await manager.broadcast_room("5", "x")
+        await asyncio.sleep(0.01)
+        assert 1 not in manager.user_conns
+        assert "5" not in manager.room_conns
+
+    asyncio.run(scenario())
+
+
+def test_registry_indexes_stay_consistent():
+    manager = ConnectionManager()
+    a1, a2, b = FakeSocket(), FakeSocket(), FakeSocket()
+    manager.register_user_socket(1, a1)
+    manager.register_user_socket(1, a2)
+    manager.register_user_socket(2, b)
+    for ws, uid in ((a1, 1), (a2, 1), (b, 2)):
+        manager.subscribe_room(ws, uid, "10")
+    manager.subscribe_room(a1, 1, "10")
+    manager.subscribe_room(a1, 1, "11")
+    assert len(manager.room_conns["10"]) == 3
+    assert manager.connections[a1].rooms == {"10", "11"}
+
+    manager.unsubscribe_room(a2, "10")
+    assert len(manager.room_conns["10"]) == 2
+    manager.disconnect_user_from_room("10", 1)
+    assert {c.websocket for c in manager.room_conns["10"]} == {b}
+    assert manager.connections[a1].rooms == {"11"}
+
+    manager.unregister_user_socket(1, a1)
+    assert "11" not in manager.room_conns
+    assert {c.websocket for c in manager.user_conns[1]} == {a2}
+    manager.unregister_user_socket(1, a2)
+    manager.unregister_user_socket(2, b)
+    assert not manager.connections and not manager.user_conns and not manager.room_conns
+
+
+def test_in_process_backplane_delivers_across_workers():
+    InProcessBackplane = _import("app.ws.backplane", "InProcessBackplane")
+    InProcessHub = _import("app.ws.backplane", "InProcessHub")
+
+    async def scenario():
+        hub = InProcessHub()
+        worker_a, worker_b = ConnectionManager(), ConnectionManager()
+        await worker_a.start_backplane(InProcessBackplane(hub))
+        await worker_b.start_backplane(InProcessBackplane(hub))
+        local, remote = FakeSocket(), FakeSocket()
+        worker_a.register_user_socket(1, local)
+        worker_a.subscribe_room(local, 1, "9")
+        worker_b.register_user_socket(2, remote)
+        worker_b.subscribe_room(remote, 2, "9")
+
+        await worker_a.broadcast_room("9", "room-frame")
+        await worker_a.unified_notify_user(2, "user-frame")
+        await worker_b.unified_broadcast_all("all-frame")
+        await _drain(local, count=2)
+        await _drain(remote, count=3)
+        assert local.sent == ["room-frame", "all-frame"]
+        assert remote.sent == ["room-frame", "user-frame", "all-frame"]
+
+        await worker_a.stop_backplane()
+        await worker_b.stop_backplane()
+        assert not hub.members
+
+    asyncio.run(scenario())
+
+
+def test_postgres_backplane_chunks_large_payloads():
+    PostgresBackplane = _import("app.ws.backplane", "PostgresBackplane")
+
+    class FakeConn:
+        def __init__(self):
+            self.notified = []
+            self.calls = 0
+
+        async def execute(self, _sql, _channel, payloads):
+            # Every chunk in one statement: one round trip per publish
+            self.calls += 1
+            for payload in payloads:
+                assert len(payload.encode("utf-8")) < 8000
+                self.notified.append(payload)
+
+    async def scenario():
+        received = []
+
+        async def handler(event):
+            received.append(event)
+
+        sender, listener = PostgresBackplane("postgresql://x"), PostgresBackplane("postgresql://x")
+        listener._handler = handler
+        listener._loop = asyncio.get_running_loop()
+        sender._publish_conn = FakeConn()
+        big = "ציון" * 5000
+        await sender.publish({"op": "room", "room": "1", "data": big})
+        assert len(sender._publish_conn.notified) > 1 and sender._publish_conn.calls == 1
+        for payload in reversed(sender._publish_conn.notified):
+            listener._on_notify(None, 0, "chat_ws", payload)
+        await asyncio.sleep(0)
+        assert [e["data"] for e in received] == [big]
+        assert not listener._partials
+
+    asyncio.run(scenario())
+
+
+def test_presence_is_batched_per_tick():
+    import json
+
+    async def scenario():
+        manager = ConnectionManager()
+        manager.presence.tick = 0.02
+        watcher, tab1, tab2, flapper = FakeSocket(), FakeSocket(), FakeSocket(), FakeSocket()
+        manager.register_user_socket(1, watcher)
+        manager.presence.connected(1, watcher)
+        await asyncio.sleep(0.05)
+        watcher.sent.clear()
+
+        # Two tabs of one user and a user who drops within the same tick
+        for uid, ws in ((2, tab1), (2, tab2), (3, flapper)):
+            manager.register_user_socket(uid, ws)
+            manager.presence.connected(uid, ws)
+        manager.unregister_user_socket(3, flapper)
+        manager.presence.disconnected(3)
+        await asyncio.sleep(0.05)
+        await _drain(watcher, tab1, count=1)
+
+        frames = [json.loads(f) for f in watcher.sent]
+        assert frames == [{"v": 1, "type": "presence_batch", "online": [2], "offline": []}]
+        snapshot = json.loads(tab1.sent[-1])
+        assert snapshot["type"] == "presence_snapshot" and snapshot["online_user_ids"] == [1, 2]
+        assert flapper.sent == []
+
+        # Closing one tab keeps the user online
+        manager.unregister_user_socket(2, tab1)
+        manager.presence.disconnected(2)
+        await asyncio.sleep(0.05)
+        assert len(watcher.sent) == 1
+        manager.presence.stop()
+
+    asyncio.run(scenario())
+
+
+def test_queued_presence_batches_are_not_coalesced_away(monkeypatch):
+    import json
+    monkeypatch.setenv("WS_SEND_QUEUE_MAX", "2")
+
+    async def scenario():
+        manager = ConnectionManager()
+        watcher = FakeSocket(delay=0.1)
+        manager.register_user_socket(1, watcher)
+        manager.connections[watcher].outbox.push("busy")
+        await asyncio.sleep(0)
+
+        # Backed up: each batch is still queued when the next one lands
+        others, flips = {}, []
+        for uid in (2, 3):
+            others[uid] = FakeSocket()
+            manager.register_user_socket(uid, others[uid])
+            manager.presence.connected(uid, others[uid])
+            await manager.presence.flush()
+            await asyncio.sleep(0.01)
+            flips.append(([uid], []))
+        manager.unregister_user_socket(2, others[2])
+        manager.presence.disconnected(2)
+        await manager.presence.flush()
+        await asyncio.sleep(0.15)
+
+        # Either every transition arrives in order or the socket is closed
+        # (and resyncs from a snapshot); never a silently merged-away batch
+        batches = [json.loads(f) for f in watcher.sent[1:]]
+        assert watcher.closed_code == 1013
+        assert [(b["online"], b["offline"]) for b in batches] == flips[:len(batches)]
+        manager.presence.stop()
+
+    asyncio.run(scenario())
+
+
+def test_presence_is_global_across_workers():
+    import json
+    InProcessBackplane = _import("app.ws.backplane", "InProcessBackplane")
+    InProcessHub = _import("app.ws.backplane", "InProcessHub")
+
+    async def scenario():
+        hub = InProcessHub()
+        worker_a, worker_b = ConnectionManager(), ConnectionManager()
+        for w in (worker_a, worker_b):
+            w.presence.tick = 0.02
+            await w.start_backplane(InProcessBackplane(hub))
+        on_a, on_b, other_b = FakeSocket(), FakeSocket(), FakeSocket()
+        worker_a.register_user_socket(1, on_a)
+        worker_a.presence.connected(1, on_a)
+        worker_b.register_user_socket(1, on_b)
+        worker_b.presence.connected(1, on_b)
+        worker_b.register_user_socket(2, other_b)
+        worker_b.presence.connected(2, other_b)
+        await asyncio.sleep(0.1)
+        assert worker_a.presence.published == worker_b.presence.published == {1, 2}
+
+        # User 1 leaves worker B but is still connected to worker A
+        other_b.sent.clear()
+        worker_b.unregister_user_socket(1, on_b)
+        worker_b.presence.disconnected(1)
+        await asyncio.sleep(0.1)
+        assert worker_b.presence.published == {1, 2}
+        assert not any(json.loads(f)["type"] == "presence_batch" for f in other_b.sent)
+
+        worker_a.unregister_user_socket(1, on_a)
+        worker_a.presence.disconnected(1)
+        await asyncio.sleep(0.1)
+        await _drain(other_b, count=1)
+        assert [json.loads(f) for f in other_b.sent] == [{"v": 1, "type": "presence_batch", "online": [], "offline": [1]}]
+
+        await worker_a.stop_backplane()
+        await worker_b.stop_backplane()
+
+    asyncio.run(scenario())
+
+
+def test_room_fanout_encodes_once_per_protocol():
+    import base64
+    import msgpack
+    PROTOCOL_V2 = _import("app.ws.protocol", "PROTOCOL_V2")
+
+    async def scenario():
+        manager = ConnectionManager()
+        v1a, v1b, v2a, v2b = FakeSocket(), FakeSocket(), FakeSocket(), FakeSocket()
+        for uid, ws, proto in ((1, v1a, 1), (2, v1b, 1), (3, v2a, PROTOCOL_V2), (4, v2b, PROTOCOL_V2)):
+            manager.register_user_socket(uid, ws, proto)
+            manager.subscribe_room(ws, uid, "5")
+        raw = bytes(range(40))
+        frame = '{"v": 1, "type": "message", "chat_id": 5, "message": {"id": 1, "ciphertext": "%s", "nonce": "AAAAAAAAAAAAAAAA", "attachment": null}}' % base64.b64encode(raw).decode()
+        await manager.broadcast_room("5", frame)
+        await _drain(v1a, v1b, v2a, v2b, count=1)
+
+        assert v1a.sent == [frame] and v1b.sent[0] is v1a.sent[0]
+        assert isinstance(v2a.sent[0], bytes) and v2b.sent[0] is v2a.sent[0]
+        decoded = msgpack.unpackb(v2a.sent[0], raw=False)
+        assert decoded["v"] == 2 and decoded["type"] == "message"
+        assert decoded["message"]["ciphertext"] == raw
+        assert decoded["message"]["nonce"] == bytes(12)
+
+    asyncio.run(scenario())
+
+
+def test_replay_buffer_only_answers_when_it_reaches_back():
+    ReplayBuffer = _import("app.ws.replay", "ReplayBuffer")
+    buf = ReplayBuffer(per_room=3, max_rooms=2)
+    for mid in (1, 2, 3, 4):
+        buf.record("7", mid, 9 if mid == 3 else None, b"m%d" % mid)
+
+    assert buf.since("7", 2, user_id=1) == [b"m4"]  # m3 is someone else's copy
+    assert buf.since("7", 2, user_id=9) == [b"m3", b"m4"]
+    assert buf.since("7", 4, user_id=1) == []
+    assert buf.since("7", 1, user_id=1) is None  # m1 fell out: can't prove completeness
+    assert buf.since("8", 0, user_id=1) is None
+
+    buf.record("8", 1, None, b"x")
+    buf.record("9", 1, None, b"y")  # evicts the least recently written room
+    assert buf.since("7", 3, user_id=1) is None
+
+
+def test_broadcast_message_feeds_replay_on_every_worker():
+    async def scenario():
+        InProcessBackplane = _import("app.ws.backplane", "InProcessBackplane")
+        hub = _import("app.ws.backplane", "InProcessHub")()
+        a, b = ConnectionManager(), ConnectionManager()
+        await a.start_backplane(InProcessBackplane(hub))
+        await b.start_backplane(InProcessBackplane(hub))
+        ws = FakeSocket()
+        b.register_user_socket(2, ws)
+        b.subscribe_room(ws, 2, "5")
+
+        await a.broadcast_message(5, 10, None, b'{"id": 10}')
+        await a.broadcast_message(5, 11, None, b'{"id": 11}')
+        await _drain(ws, count=2)
+
+        assert ws.sent[0] == '{"v": 1, "type": "message", "chat_id": 5, "message": {"id": 10}}'
+        assert a.replay.since("5", 10, 2) == b.replay.since("5", 10, 2) == [b'{"id": 11}']
+        await a.stop_backplane()
+        await b.stop_backplane()
+
+    asyncio.run(scenario())
+
+
+def test_per_recipient_rows_reach_only_their_recipient():
+    async def scenario():
+        m = ConnectionManager()
+        sockets = {uid: FakeSocket() for uid in (1, 2, 3)}
+        for uid, ws in sockets.items():
+            m.register_user_socket(uid, ws)
+            m.subscribe_room(ws, uid, "5")
+        other_room = FakeSocket()
+        m.register_user_socket(2, other_room)
+        m.subscribe_room(other_room, 2, "6")
+
+        # One fan-out send: a ciphertext row for each of 2 and 3, then a plain message
+        await m.broadcast_message(5, 10, 2, b'{"id": 10}')
+        await m.broadcast_message(5, 11, 3, b'{"id": 11}')
+        await m.broadcast_message(5, 12, None, b'{"id": 12}')
+        await _drain(*sockets.values(), count=1)
+        await asyncio.sleep(0.01)
+
+        ids = {uid: [s.split('"id": ')[1].split("}")[0] for s in ws.sent] for uid, ws in sockets.items()}
+        assert ids == {1: ["12"], 2: ["10", "12"], 3: ["11", "12"]}
+        assert other_room.sent == []
+
+    asyncio.run(scenario())
+
+
+def test_unread_counts_are_pushed_coalesced_across_workers():
+    import json
+
+    async def scenario():
+        InProcessBackplane = _import("app.ws.backplane", "InProcessBackplane")
+        hub = _import("app.ws.backplane", "InProcessHub")()
+        a, b = ConnectionManager(), ConnectionManager()
+        for w in (a, b):
+            w.unread.tick = 0.02
+            await w.start_backplane(InProcessBackplane(hub))
+        bob, carol = FakeSocket(), FakeSocket()
+        b.register_user_socket(2, bob)
+        b.unread.track(2, {5: 1})
+        b.register_user_socket(3, carol)
+        b.unread.track(3, {})
+
+        # Three sends on worker A within one tick: one frame per user with the total
+        for _ in range(3):
+            await a.unread.message_sent(5, 1, {2: 1, 3: 1})
+        await asyncio.sleep(0.1)
+        await _drain(bob, carol, count=1)
+        assert [json.loads(f) for f in bob.sent] == [{"v": 1, "type": "unread", "chat_id": 5, "count": 4}]
+        assert [json.loads(f) for f in carol.sent] == [{"v": 1, "type": "unread", "chat_id": 5, "count": 3}]
+        assert a.unread.counts == {}  # nobody connected to A
+
+        # Reading on another worker sets the absolute count
+        await a.unread.read_state(2, 5, 0)
+        await asyncio.sleep(0.1)
+        await _drain(bob, count=2)
+        assert json.loads(bob.sent[-1])["count"] == 0 and len(carol.sent) == 1
+
+        b.unregister_user_socket(2, bob)
+        b.unread.disconnected(2)
+        assert 2 not in b.unread.counts and 3 in b.unread.counts
+        await a.stop_backplane()
+        await b.stop_backplane()
+
+    asyncio.run(scenario())
+
+
+def test_unread_changes_during_the_initial_load_are_kept(monkeypatch):
+    import json
+
+    database = _import("app.ws.unread", "database")
+
+    async def scenario():
+        loading, release = asyncio.Event(), asyncio.Event()
+
+        class SlowSession:
+            # The count load, held open until the test has interleaved its changes
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            async def run_sync(self, fn):
+                loading.set()
+                await release.wait()
+                return {5: 2, 6: 7}
+
+        monkeypatch.setattr(database, "AsyncSessionLocal", SlowSession)
+        m = ConnectionManager()
+        m.unread.tick = 0.01
+        bob = FakeSocket()
+        m.register_user_socket(2, bob)
+        m.user_connected(2)
+        connecting = asyncio.ensure_future(m.unread.connected(2))
+        await loading.wait()
+        # Landed after the snapshot was taken: a send in 5, a read in 6
+        await m.unread.message_sent(5, 1, {2: 1})
+        await m.unread.read_state(2, 6, 0)
+        assert 2 not in m.unread.counts
+        release.set()
+        await connecting
+
+        assert m.unread.counts[2] == {5: 3, 6: 0}
+        await asyncio.sleep(0.05)
+        await _drain(bob, count=2)
+        assert sorted((f["chat_id"], f["count"]) for f in map(json.loads, bob.sent)) == [(5, 3), (6, 0)]
+        m.unread.stop()
+
+    asyncio.run(scenario())
+
+
+def test_a_send_is_one_bus_event_expanded_on_each_worker():
+    import json
+    from collections import namedtuple
+
+    Saved = namedtuple("Saved", "id recipient_id body")
+
+    async def scenario():
+        InProcessBackplane = _import("app.ws.backplane", "InProcessBackplane")
+        hub = _import("app.ws.backplane", "InProcessHub")()
+        a, b = ConnectionManager(), ConnectionManager()
+        published = []
+        for w in (a, b):
+            w.unread.tick = 0.01
+            await w.start_backplane(InProcessBackplane(hub))
+        original = a.backplane.publish
+
+        async def counting(event):
+            # Presence keeps its own periodic sync on the bus; only count sends
+            if not event["op"].startswith("presence"):
+                published.append(event["op"])
+            await original(event)
+
+        a.backplane.publish = counting
+        # Members 2..4 are connected to worker B and subscribed to the room
+        sockets = {uid: FakeSocket() for uid in (2, 3, 4)}
+        for uid, ws in sockets.items():
+            b.register_user_socket(uid, ws)
+            b.subscribe_room(ws, uid, "5")
+            b.unread.track(uid, {5: 0})
+
+        # A fan-out send from 1 with a copy per member
+        saved = [Saved(10, uid, json.dumps({"id": 10, "for": uid}).encode()) for uid in (1, 2, 3, 4)]
+        await a.deliver_send(5, 1, saved, [1, 2, 3, 4])
+        assert published == ["send"]
+
+        await asyncio.sleep(0.05)
+        await _drain(*sockets.values(), count=3)
+        for uid, ws in sockets.items():
+            frames = [json.loads(f) for f in ws.sent]
+            assert [f["message"]["for"] for f in frames if f["type"] == "message"] == [uid]
+            assert [f["chat_id"] for f in frames if f["type"] == "new_message"] == [5]
+            assert [f["count"] for f in frames if f["type"] == "unread"] == [1]
+        # Kept for resuming subscribers on the other worker too, per recipient
+        later = [Saved(11, uid, json.dumps({"id": 11, "for": uid}).encode()) for uid in (1, 2, 3, 4)]
+        await a.deliver_send(5, 3, later, [1, 2, 3, 4])
+        await asyncio.sleep(0.01)
+        assert published == ["send", "send"]
+        assert b.replay.since("5", 10, 2) == [later[1].body]
+        await a.stop_backplane()
+        await b.stop_backplane()
+
+    asyncio.run(scenario())
+
@@ -0,0 +1,234 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class Backplane:
+    """Pub/sub bus between WS workers.
+
+    The base class is the single-worker case: nothing to fan out, so
+    publish() is a no-op and every frame is delivered locally only.
+    Events are plain dicts; each carries the publishing worker's id so a
+    worker can skip its own events when the bus loops them back.
+    """
+
+    distributed = False
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self._handler: Optional[Handler] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self, handler: Handler):
+        self._handler = handler
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        self._handler = None
+
+    async def publish(self, event: dict):
+        return None
+
+    def publish_threadsafe(self, event: dict):
+        # For callers outside the event loop (sync routes run in the threadpool)
+        loop = self._loop
+        if not self.distributed or loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            loop.create_task(self.publish(event))
+        else:
+            asyncio.run_coroutine_threadsafe(self.publish(event), loop)
+
+    async def _dispatch(self, event: dict):
+        if event.get("origin") == self.worker_id or self._handler is None:
+            return
+        try:
+            await self._handler(event)
+        except Exception:
+            logger.exception("Backplane handler failed")
+
+
+class InProcessHub:
+    def __init__(self):
+        self.members: List["InProcessBackplane"] = []
+
+
+_default_hub = InProcessHub()
+
+
+class InProcessBackplane(Backplane):
+    """Bus shared by several ConnectionManagers in one process (tests)."""
+
+    distributed = True
+
+    def __init__(self, hub: Optional[InProcessHub] = None):
+        super().__init__()
+        self.hub = hub or _default_hub
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        if self not in self.hub.members:
+            self.hub.members.append(self)
+
+    async def stop(self):
+        if self in self.hub.members:
+            self.hub.members.remove(self)
+        await super().stop()
+
+    async def publish(self, event: dict):
+        event = dict(event, origin=self.worker_id)
+        # Round-trip through JSON like a real bus would
+        wire = json.dumps(event)
+        for member in list(self.hub.members):
+            if member is self:
+                continue
+            await member._dispatch(json.loads(wire))
+
+
+# Postgres caps NOTIFY payloads at 8000 bytes; stay well clear of it
+_PG_CHUNK_CHARS = 1800
+_PG_PARTIAL_TTL = 30.0
+
+
+class PostgresBackplane(Backplane):
+    """LISTEN/NOTIFY on the application database.
+
+    Payloads larger than one NOTIFY are split into numbered chunks, sent
+    by a single statement (one round trip, committed together) and
+    reassembled by the listeners.
+    """
+
+    distributed = True
+
+    def __init__(self, dsn: str, channel: str = "chat_ws"):
+        super().__init__()
+        self.dsn = dsn
+        self.channel = channel
+        self._listen_conn = None
+        self._publish_conn = None
+        self._publish_lock = asyncio.Lock()
+        self._partials: Dict[str, Tuple[float, List[Optional[str]]]] = {}
+        self._stopping = False
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        self._stopping = False
+        await self._connect()
+
+    async def _connect(self):
+        import asyncpg
+
+        self._listen_conn = await asyncpg.connect(self.dsn)
+        self._listen_conn.add_termination_listener(self._on_terminated)
+        await self._listen_conn.add_listener(self.channel, self._on_notify)
+        self._publish_conn = await asyncpg.connect(self.dsn)
+        try:
+            logger.info(f"Backplane postgres listening channel={self.channel} worker={self.worker_id}")
+        except Exception:
+            pass
+
+    def _on_terminated(self, _conn):
+        if self._stopping or self._loop is None:
+            return
+        logger.warning("Backplane postgres listener lost; reconnecting")
+        self._loop.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 0.5
+        while not self._stopping:
+            try:
+                await self._close_conns()
+                await self._connect()
+                # Anything published while we were away is gone; let the manager resync
+                if self._handler is not None:
+                    await self._handler({"op": "resync"})
+                return
+            except Exception:
+                logger.exception("Backplane reconnect failed")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10.0)
+
+    async def _close_conns(self):
+        for conn in (self._listen_conn, self._publish_conn):
+            if conn is not None:
+                try:
+                    await conn.close()
+                except Exception:
+                    pass
+        self._listen_conn = self._publish_conn = None
+
+    async def stop(self):
+        self._stopping = True
+        await self._close_conns()
+        await super().stop()
+
+    async def publish(self, event: dict):
+        wire = json.dumps(dict(event, origin=self.worker_id))
+        msg_id = uuid.uuid4().hex[:12]
+        parts = [wire[i:i + _PG_CHUNK_CHARS] for i in range(0, len(wire), _PG_CHUNK_CHARS)] or [""]
+        total = len(parts)
+        payloads = [f"{msg_id}:{idx}:{total}:{part}" for idx, part in enumerate(parts)]
+        async with self._publish_lock:
+            conn = self._publish_conn
+            if conn is None:
+                return
+            await conn.execute("SELECT pg_notify($1, p) FROM unnest($2::text[]) AS p", self.channel, payloads)
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str):
+        try:
+            msg_id, idx, total, data = payload.split(":", 3)
+            idx, total = int(idx), int(total)
+        except ValueError:
+            return
+        if total == 1:
+            wire = data
+        else:
+            now = time.monotonic()
+            _, parts = self._partials.setdefault(msg_id, (now, [None] * total))
+            parts[idx] = data
+            if any(p is None for p in parts):
+                self._expire_partials(now)
+                return
+            del self._partials[msg_id]
+            wire = "".join(parts)  # type: ignore[arg-type]
+        try:
+            event = json.loads(wire)
+        except ValueError:
+            return
+        if self._loop is not None:
+            self._loop.create_task(self._dispatch(event))
+
+    def _expire_partials(self, now: float):
+        for key, (started, _) in list(self._partials.items()):
+            if now - started > _PG_PARTIAL_TTL:
+                del self._partials[key]
+
+
+def _asyncpg_dsn(url: str) -> str:
+    # asyncpg wants a plain postgresql:// URL without a SQLAlchemy driver suffix
+    scheme, sep, rest = url.partition("://")
+    return f"{scheme.split('+', 1)[0]}{sep}{rest}"
+
+
+def create_backplane() -> Backplane:
+    kind = (os.environ.get("WS_BACKPLANE", "local") or "local").strip().lower()
+    if kind == "memory":
+        return InProcessBackplane()
+    if kind == "postgres":
+        from ..core.config import get_settings
+
+        dsn = os.environ.get("WS_BACKPLANE_DSN") or get_settings().DATABASE_URL
+        return PostgresBackplane(_asyncpg_dsn(dsn), channel=os.environ.get("WS_BACKPLANE_CHANNEL", "chat_ws"))
+    return Backplane()
@@ -0,0 +1,210 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+import json
+import os
+import threading
+
+from sqlalchemy import inspect as sa_inspect
+
+from ..db import binary, models
+
+
+def cache_capacity() -> int:
+    try:
+        return max(0, int(os.environ.get("MESSAGE_CACHE_SIZE", "10000")))
+    except Exception:
+        return 10000
+
+
+class EnvelopeCache:
+    """LRU of pre-encoded message envelopes keyed by message id, or by
+    (message id, recipient id) for one recipient's copy of a fan-out send.
+
+    Messages are immutable once stored; the one write that changes an
+    envelope is deleting its sender (sender_id goes to NULL), so entries
+    are indexed by sender and dropped with invalidate_sender. Otherwise
+    they only fall out when the cache is full.
+    """
+
+    def __init__(self, capacity: Optional[int] = None):
+        self.capacity = cache_capacity() if capacity is None else capacity
+        self._items: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._senders: Dict[Hashable, int] = {}
+        self._by_sender: Dict[int, Set[Hashable]] = {}
+        # History routes run in the threadpool, the WS loop on the event loop
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, message_id: Hashable) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get(message_id)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(message_id)
+            self.hits += 1
+            return data
+
+    def put(self, message_id: Hashable, data: bytes, sender_id: Optional[int] = None):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._items[message_id] = data
+            self._items.move_to_end(message_id)
+            if sender_id is not None:
+                self._senders[message_id] = sender_id
+                self._by_sender.setdefault(sender_id, set()).add(message_id)
+            while len(self._items) > self.capacity:
+                key, _ = self._items.popitem(last=False)
+                self._forget_sender(key)
+                self.evictions += 1
+
+    def invalidate_sender(self, sender_id: int) -> int:
+        """Drop every cached envelope of a sender's messages; returns how many."""
+        with self._lock:
+            keys = self._by_sender.pop(sender_id, set())
+            for key in keys:
+                self._items.pop(key, None)
+                self._senders.pop(key, None)
+            return len(keys)
+
+    def _forget_sender(self, key: Hashable):
+        sender_id = self._senders.pop(key, None)
+        if sender_id is not None:
+            keys = self._by_sender.get(sender_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_sender[sender_id]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._senders.clear()
+            self._by_sender.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+envelope_cache = EnvelopeCache()
+
+
+def message_dict(m: models.Message, sender: Optional[models.User] = None, copy: Any = None) -> dict:
+    # Single source of truth for the message shape (matches schemas.MessageOut);
+    # copy is one recipient's ciphertext of a fan-out send (anything with
+    # recipient_id, ciphertext, nonce and algo), shown as if it were the row's.
+    # Binary columns go out as base64 here, once per cached envelope
+    sender = sender if sender is not None else m.sender
+    att = m.attachment if m.attachment_id else None
+    src = copy if copy is not None else m
+    return {
+        "id": m.id,
+        "seq": m.seq,
+        "content": m.content,
+        "content_type": m.content_type,
+        "timestamp": (m.timestamp.isoformat() if m.timestamp else None),
+        "ciphertext": binary.encode(src.ciphertext, getattr(src, "ciphertext_b64", None)),
+        "nonce": binary.encode(src.nonce, getattr(src, "nonce_b64", None)),
+        "algo": src.algo,
+        "recipient_id": src.recipient_id,
+        "sender": {
+            "id": sender.id if sender else m.sender_id,
+            "username": sender.username if sender else None,
+        },
+        "attachment": ({
+            "id": att.id,
+            "filename": att.filename,
+            "mime_type": att.mime_type,
+            "size_bytes": att.size_bytes,
+            "nonce": binary.encode(att.nonce, att.nonce_b64),
+            "algo": att.algo,
+        } if att is not None else None),
+    }
+
+
+def own_copy(m: models.Message) -> Any:
+    # The reader's copy of a fan-out send, if the query loaded it (history
+    # reads with a viewer do); otherwise the logical row without ciphertext
+    if not m.fanout or "copies" in sa_inspect(m).unloaded:
+        return None
+    return m.copies[0] if m.copies else None
+
+
+def encode_message(m: models.Message, sender: Optional[models.User] = None, copy: Any = None) -> bytes:
+    key = m.id if copy is None else (m.id, copy.recipient_id)
+    data = envelope_cache.get(key)
+    if data is None:
+        data = json.dumps(message_dict(m, sender, copy)).encode("utf-8")
+        envelope_cache.put(key, data, m.sender_id)
+    return data
+
+
+def message_frame(chat_id: int, body: bytes) -> str:
+    # Splice the cached body into the v1 WS frame without re-serializing it
+    return '{"v": 1, "type": "message", "chat_id": %d, "message": %s}' % (chat_id, body.decode("utf-8"))
+
+
+def replay_frame(chat_id: int, since_id: int, bodies: Iterable[bytes], source: str, complete: bool) -> str:
+    # Missed messages after since_id, oldest first; complete=false means the
+    # client is further behind than one replay and should page history instead
+    return '{"v": 1, "type": "replay", "chat_id": %d, "since_id": %d, "source": "%s", "complete": %s, "messages": [%s]}' % (
+        chat_id, since_id, source, "true" if complete else "false", ",".join(b.decode("utf-8") for b in bodies),
+    )
+
+
+def new_message_frame(chat_id: int) -> str:
+    return json.dumps({"v": 1, "type": "new_message", "chat_id": chat_id})
+
+
+def chats_changed_frame(version: int, upserts: Iterable[dict] = (), removed: Iterable[int] = ()) -> str:
+    # The user's new chat list version and what changed to get there
+    return json.dumps({"v": 1, "type": "chats_changed", "version": version, "upserts": list(upserts), "removed": list(removed)})
+
+
+def chats_changed_frames(chat_id: int, changes: Dict[int, Tuple[int, str]], outs: Dict[int, dict]) -> Dict[int, str]:
+    """One frame per affected user from record_chat_change's (version, op) and the chat as each upserted user sees it."""
+    frames = {}
+    for uid, (version, op) in changes.items():
+        if op == "remove":
+            frames[uid] = chats_changed_frame(version, removed=[chat_id])
+        else:
+            frames[uid] = chats_changed_frame(version, upserts=[outs[uid]] if uid in outs else [])
+    return frames
+
+
+def history_page(messages: Iterable[models.Message]) -> bytes:
+    return b"[" + b",".join(encode_message(m, copy=own_copy(m)) for m in messages) + b"]"
+
+
+def _id_or_null(value: Optional[int]) -> bytes:
+    return b"null" if value is None else str(int(value)).encode("ascii")
+
+
+def message_page(messages: Iterable[models.Message], next_cursor: Optional[int]) -> bytes:
+    # schemas.MessagePage, spliced from cached envelopes
+    return b'{"messages": ' + history_page(messages) + b', "next_cursor": ' + _id_or_null(next_cursor) + b"}"
+
+
+def message_window(
+    messages: Iterable[models.Message], anchor_id: Optional[int], before_cursor: Optional[int], after_cursor: Optional[int]
+) -> bytes:
+    # schemas.MessageWindow
+    return (
+        b'{"messages": ' + history_page(messages)
+        + b', "anchor_id": ' + _id_or_null(anchor_id)
+        + b', "before_cursor": ' + _id_or_null(before_cursor)
+        + b', "after_cursor": ' + _id_or_null(after_cursor) + b"}"
+    )
@@ -0,0 +1,130 @@
+from collections import deque
+from typing import Callable, Deque, Optional, Tuple, Union
+from fastapi import WebSocket
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+# Overflow policies for a socket whose outbound queue is full
+POLICY_DROP = "drop"
+POLICY_COALESCE = "coalesce"
+POLICY_DISCONNECT = "disconnect"
+POLICIES = (POLICY_DROP, POLICY_COALESCE, POLICY_DISCONNECT)
+
+
+def queue_limit() -> int:
+    # Max frames buffered per socket before the overflow policy kicks in
+    try:
+        return max(1, int(os.environ.get("WS_SEND_QUEUE_MAX", "256")))
+    except Exception:
+        return 256
+
+
+def overflow_policy() -> str:
+    policy = (os.environ.get("WS_OVERFLOW_POLICY", POLICY_COALESCE) or "").strip().lower()
+    return policy if policy in POLICIES else POLICY_COALESCE
+
+
+class Outbox:
+    """Bounded outbound queue drained by a dedicated writer task.
+
+    Producers call push() which never awaits the socket, so one slow client
+    cannot stall a broadcast or the sender's receive loop.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        maxsize: Optional[int] = None,
+        policy: Optional[str] = None,
+        on_close: Optional[Callable[["Outbox", str], None]] = None,
+    ):
+        self.websocket = websocket
+        self.maxsize = maxsize or queue_limit()
+        self.policy = policy or overflow_policy()
+        self._on_close = on_close
+        # (coalesce key, frame) pairs in send order; bytes go out as binary frames
+        self._queue: Deque[Tuple[Optional[str], Union[str, bytes]]] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def push(self, message: Union[str, bytes], key: Optional[str] = None) -> bool:
+        """Enqueue a frame; returns False if it was dropped."""
+        if self.closed:
+            return False
+        if len(self._queue) >= self.maxsize:
+            if self.policy == POLICY_DISCONNECT:
+                self.close("overflow")
+                return False
+            if self.policy == POLICY_DROP:
+                self.dropped += 1
+                return False
+            # Coalesce: replace a pending frame with the same key. Anything else
+            # would silently lose a frame, so close instead; the client
+            # reconnects and replays from since_id.
+            if key is not None:
+                for i, (k, _) in enumerate(self._queue):
+                    if k == key:
+                        self._queue[i] = (key, message)
+                        self.coalesced += 1
+                        return True
+            self.close("overflow")
+            return False
+        self._queue.append((key, message))
+        self._ensure_writer()
+        return True
+
+    def _ensure_writer(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        assert self._wakeup is not None
+        while not self.closed:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            _, message = self._queue.popleft()
+            try:
+                if isinstance(message, bytes):
+                    await self.websocket.send_bytes(message)
+                else:
+                    await self.websocket.send_text(message)
+                self.sent += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.close("send_error")
+                return
+
+    def close(self, reason: str = "closed"):
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.clear()
+        task = self._task
+        self._task = None
+        try:
+            if task is not None and task is not asyncio.current_task():
+                task.cancel()
+        except Exception:
+            pass
+        if self._on_close is not None:
+            try:
+                self._on_close(self, reason)
+            except Exception:
+                logger.exception("Outbox close callback failed")
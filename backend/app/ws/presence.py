@@ -0,0 +1,206 @@
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+from fastapi import WebSocket
+import asyncio
+import json
+import logging
+import os
+import time
+
+if TYPE_CHECKING:
+    from .ws_manager import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+
+def tick_seconds() -> float:
+    try:
+        return max(0.01, int(os.environ.get("WS_PRESENCE_TICK_MS", "250")) / 1000.0)
+    except Exception:
+        return 0.25
+
+
+def sync_seconds() -> float:
+    try:
+        return max(1.0, float(os.environ.get("WS_PRESENCE_SYNC_S", "15")))
+    except Exception:
+        return 15.0
+
+
+class PresenceAggregator:
+    """Collects online/offline transitions and emits one presence_batch per tick.
+
+    Multi-tab users are deduped through manager.user_online_counts, and a
+    user who drops and comes back within the same tick produces no frame
+    at all. With a distributed backplane every worker shares its local
+    online set, so "online" means online on any worker.
+    """
+
+    def __init__(self, manager: "ConnectionManager", tick: Optional[float] = None):
+        self.manager = manager
+        self.tick = tick if tick is not None else tick_seconds()
+        # Users whose state may have changed since the last flush
+        self._dirty: Set[int] = set()
+        # Subset whose local (this worker's) state changed, for other workers
+        self._local_dirty: Set[int] = set()
+        # Online set as last announced to clients
+        self.published: Set[int] = set()
+        # Fresh sockets that still need a presence_snapshot
+        self._snapshot_waiters: List[WebSocket] = []
+        # Other workers: worker id -> (last heard, online user ids)
+        self._remote: Dict[str, Tuple[float, Set[int]]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sync_task: Optional[asyncio.Task] = None
+        self.batches_sent = 0
+        self.snapshots_sent = 0
+
+    # ---- local transitions ----
+    def connected(self, user_id: int, websocket: Optional[WebSocket] = None):
+        self.manager.user_connected(user_id)
+        if self.manager.user_online_counts.get(user_id) == 1:
+            self._dirty.add(user_id)
+            self._local_dirty.add(user_id)
+        if websocket is not None:
+            self._snapshot_waiters.append(websocket)
+        self._schedule()
+
+    def disconnected(self, user_id: int):
+        self.manager.user_disconnected(user_id)
+        if user_id not in self.manager.user_online_counts:
+            self._dirty.add(user_id)
+            self._local_dirty.add(user_id)
+            self._schedule()
+
+    def is_online(self, user_id: int) -> bool:
+        if user_id in self.manager.user_online_counts:
+            return True
+        return any(user_id in ids for _, ids in self._remote.values())
+
+    def online_ids(self) -> Set[int]:
+        ids = set(self.manager.user_online_counts)
+        for _, remote in self._remote.values():
+            ids |= remote
+        return ids
+
+    # ---- tick loop ----
+    def _schedule(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        assert self._wakeup is not None
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.tick)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Presence flush failed")
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, set()
+        local_dirty, self._local_dirty = self._local_dirty, set()
+        online: List[int] = []
+        offline: List[int] = []
+        for uid in dirty:
+            now = self.is_online(uid)
+            if now and uid not in self.published:
+                self.published.add(uid)
+                online.append(uid)
+            elif not now and uid in self.published:
+                self.published.discard(uid)
+                offline.append(uid)
+        if local_dirty and self.manager.backplane.distributed:
+            counts = self.manager.user_online_counts
+            await self.manager._publish({
+                "op": "presence",
+                "online": sorted(u for u in local_dirty if u in counts),
+                "offline": sorted(u for u in local_dirty if u not in counts),
+            })
+        if online or offline:
+            # Local sockets only: every worker computes the same batch itself.
+            # No coalesce key: a batch is a delta, so replacing a queued one
+            # would lose its transitions.
+            self.manager._deliver_all(json.dumps({
+                "v": 1,
+                "type": "presence_batch",
+                "online": sorted(online),
+                "offline": sorted(offline),
+            }))
+            self.batches_sent += 1
+        # Sockets that closed before the tick get nothing
+        waiters = [ws for ws in self._snapshot_waiters if ws in self.manager.connections]
+        self._snapshot_waiters = []
+        if waiters:
+            snapshot = json.dumps({
+                "v": 1,
+                "type": "presence_snapshot",
+                "online_user_ids": sorted(self.published),
+            })
+            for ws in waiters:
+                await self.manager.send_unified(ws, snapshot)
+            self.snapshots_sent += len(waiters)
+        try:
+            logger.info(f"Presence flush online={len(online)} offline={len(offline)} snapshots={len(waiters)}")
+        except Exception:
+            pass
+
+    # ---- other workers ----
+    def on_bus_event(self, event: dict):
+        worker = event.get("origin")
+        if not worker:
+            return
+        op = event.get("op")
+        now = time.monotonic()
+        if op == "presence_sync_request":
+            # A worker just started; answer with our full local set
+            asyncio.get_running_loop().create_task(self.publish_sync())
+            return
+        _, ids = self._remote.get(worker, (now, set()))
+        if op == "presence_sync":
+            new_ids = set(int(u) for u in event.get("online", []))
+            self._dirty |= ids ^ new_ids
+            ids = new_ids
+        else:
+            for uid in event.get("online", []):
+                ids.add(int(uid))
+                self._dirty.add(int(uid))
+            for uid in event.get("offline", []):
+                ids.discard(int(uid))
+                self._dirty.add(int(uid))
+        self._remote[worker] = (now, ids)
+        if self._dirty:
+            self._schedule()
+
+    async def publish_sync(self):
+        await self.manager._publish({"op": "presence_sync", "online": sorted(self.manager.user_online_counts)})
+
+    def start_sync(self):
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.get_running_loop().create_task(self._sync_loop())
+
+    async def _sync_loop(self):
+        interval = sync_seconds()
+        await self.manager._publish({"op": "presence_sync_request"})
+        while True:
+            await self.publish_sync()
+            await asyncio.sleep(interval)
+            # Forget workers that stopped heartbeating
+            cutoff = time.monotonic() - 3 * interval
+            for worker, (seen, ids) in list(self._remote.items()):
+                if seen < cutoff:
+                    del self._remote[worker]
+                    self._dirty |= ids
+            if self._dirty:
+                self._schedule()
+
+    def stop(self):
+        for task in (self._task, self._sync_task):
+            if task is not None:
+                task.cancel()
+        self._task = self._sync_task = None
+        self._remote.clear()
@@ -0,0 +1,135 @@
+from typing import Any, Optional, Tuple, Union
+from fastapi import WebSocket
+from starlette.websockets import WebSocketDisconnect
+import base64
+import binascii
+import json
+
+import msgpack
+
+# v1: JSON text frames. v2: MessagePack binary frames, with ciphertext and
+# nonces as raw bytes instead of base64 strings.
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+SUBPROTOCOL_V2 = "chat.v2.msgpack"
+
+# Base64 fields of a message envelope that v2 carries as bytes
+_MESSAGE_BINARY_FIELDS = ("ciphertext", "nonce")
+
+
+def negotiate(websocket: WebSocket) -> Tuple[int, Optional[str]]:
+    """Pick the protocol for a new socket: (protocol, subprotocol to accept with)."""
+    try:
+        offered = websocket.scope.get("subprotocols") or []
+    except Exception:
+        offered = []
+    if SUBPROTOCOL_V2 in offered:
+        return PROTOCOL_V2, SUBPROTOCOL_V2
+    try:
+        proto = websocket.query_params.get("proto")  # type: ignore[attr-defined]
+    except Exception:
+        proto = None
+    if proto == "2":
+        return PROTOCOL_V2, None
+    return PROTOCOL_V1, None
+
+
+def _b64_to_bytes(value: Any) -> Any:
+    if not isinstance(value, str):
+        return value
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        # Not base64 (e.g. a legacy plaintext value): send as is
+        return value
+
+
+def _message_to_v2(message: dict) -> dict:
+    out = dict(message)
+    for field in _MESSAGE_BINARY_FIELDS:
+        if out.get(field) is not None:
+            out[field] = _b64_to_bytes(out[field])
+    att = out.get("attachment")
+    if isinstance(att, dict) and att.get("nonce") is not None:
+        out["attachment"] = dict(att, nonce=_b64_to_bytes(att["nonce"]))
+    return out
+
+
+def to_v2(obj: Any) -> Any:
+    """A v1 frame object reshaped for v2 (version bump, binary fields as bytes)."""
+    if not isinstance(obj, dict):
+        return obj
+    out = dict(obj)
+    if "v" in out:
+        out["v"] = PROTOCOL_V2
+    if isinstance(out.get("message"), dict):
+        out["message"] = _message_to_v2(out["message"])
+    if isinstance(out.get("messages"), list):
+        out["messages"] = [_message_to_v2(m) if isinstance(m, dict) else m for m in out["messages"]]
+    return out
+
+
+def from_v2(obj: Any) -> Any:
+    """Incoming v2 payload to the v1 shape handlers expect: bytes become base64 text."""
+    if isinstance(obj, bytes):
+        return base64.b64encode(obj).decode("ascii")
+    if isinstance(obj, dict):
+        return {k: from_v2(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [from_v2(v) for v in obj]
+    return obj
+
+
+class Frame:
+    """One outgoing WS frame, encoded lazily and at most once per protocol.
+
+    Fan-out code builds a Frame once per broadcast; every v1 socket gets the
+    same str and every v2 socket the same bytes.
+    """
+
+    __slots__ = ("_obj", "_text", "_binary")
+
+    def __init__(self, obj: Any = None, text: Optional[str] = None):
+        self._obj = obj
+        self._text = text
+        self._binary: Optional[bytes] = None
+
+    @classmethod
+    def of(cls, message: Union["Frame", str, dict]) -> "Frame":
+        if isinstance(message, Frame):
+            return message
+        if isinstance(message, str):
+            return cls(text=message)
+        return cls(obj=message)
+
+    def obj(self) -> Any:
+        if self._obj is None and self._text is not None:
+            self._obj = json.loads(self._text)
+        return self._obj
+
+    def text(self) -> str:
+        if self._text is None:
+            self._text = json.dumps(self._obj)
+        return self._text
+
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = msgpack.packb(to_v2(self.obj()), use_bin_type=True)
+        return self._binary
+
+    def encode(self, protocol: int) -> Union[str, bytes]:
+        return self.binary() if protocol == PROTOCOL_V2 else self.text()
+
+
+async def receive_payload(websocket: WebSocket) -> dict:
+    """Next client payload as a dict, whichever protocol it was sent in."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        data = from_v2(msgpack.unpackb(message["bytes"], raw=False))
+    else:
+        data = json.loads(message.get("text") or "null")
+    if not isinstance(data, dict):
+        raise ValueError("WS payload must be an object")
+    return data
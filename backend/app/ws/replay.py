@@ -0,0 +1,74 @@
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.environ.get(name, str(default))))
+    except Exception:
+        return default
+
+
+# (message id, recipient id or None for everyone, encoded envelope)
+Entry = Tuple[int, Optional[int], bytes]
+
+
+class ReplayBuffer:
+    """Recent message envelopes per room, for resuming a subscription.
+
+    Fed from every message broadcast this worker sees (its own sends and
+    those relayed by the backplane), so a room's ring has no holes from its
+    oldest entry on. A client that already has that oldest message can be
+    caught up from memory; anyone further behind goes to the database.
+    """
+
+    def __init__(self, per_room: Optional[int] = None, max_rooms: Optional[int] = None):
+        self.per_room = _env_int("WS_REPLAY_BUFFER", 200) if per_room is None else per_room
+        self.max_rooms = _env_int("WS_REPLAY_ROOMS", 5000) if max_rooms is None else max_rooms
+        self._rooms: "OrderedDict[str, Deque[Entry]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, room_id: str, message_id: int, recipient_id: Optional[int], body: bytes):
+        if self.per_room <= 0 or self.max_rooms <= 0:
+            return
+        ring = self._rooms.get(room_id)
+        if ring is None:
+            ring = self._rooms[room_id] = deque(maxlen=self.per_room)
+            while len(self._rooms) > self.max_rooms:
+                self._rooms.popitem(last=False)
+        else:
+            self._rooms.move_to_end(room_id)
+        ring.append((message_id, recipient_id, body))
+
+    def since(self, room_id: str, since_id: int, user_id: int) -> Optional[List[bytes]]:
+        """Envelopes after since_id visible to user_id, or None if the ring can't tell."""
+        ring = self._rooms.get(room_id)
+        # The ring only proves completeness from its oldest entry on
+        if not ring or since_id < min(e[0] for e in ring):
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Relayed sends from other workers may land slightly out of id order
+        found = sorted(
+            (e for e in ring if e[0] > since_id and (e[1] is None or e[1] == user_id)),
+            key=lambda e: e[0],
+        )
+        return [e[2] for e in found]
+
+    def drop(self, room_id: Optional[str] = None):
+        if room_id is None:
+            self._rooms.clear()
+        else:
+            self._rooms.pop(room_id, None)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "rooms": len(self._rooms),
+            "per_room": self.per_room,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
@@ -1,14 +1,20 @@
+from typing import List, Optional, Tuple
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, status, Depends
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 import json
 import logging
+import os
 
 from .ws_manager import manager
-from ..db.database import SessionLocal
+from . import envelopes
+from .protocol import negotiate, receive_payload
+from ..db import database
 from ..deps.auth import get_current_user
 from ..db import schemas
 from ..controllers import messages_controller
-from ..db.models import Chat
+from ..core.membership import membership
+from ..core.group_commit import message_writer
 
 ws_router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -17,10 +23,33 @@ logger = logging.getLogger(__name__)
 # Deprecated endpoints removed after migration to unified WS
 
 
+def replay_limit() -> int:
+    # Max messages in one replay frame; a client further behind pages history
+    try:
+        return max(1, int(os.environ.get("WS_REPLAY_MAX", "500")))
+    except Exception:
+        return 500
+
+
+async def _missed_messages(chat_id: int, since_id: int, user_id: int) -> Tuple[List[bytes], str, bool]:
+    """Envelopes after since_id for user_id: (bodies, source, complete)."""
+    limit = replay_limit()
+    bodies: Optional[List[bytes]] = manager.replay.since(str(chat_id), since_id, user_id)
+    if bodies is not None:
+        return bodies[:limit], "buffer", len(bodies) <= limit
+
+    def _load(s: Session) -> Tuple[List[bytes], bool]:
+        # Range scan on (chat_id, id) after since_id, with this user's fan-out copies
+        rows, next_cursor = messages_controller.get_chat_messages_page(s, chat_id, limit, after_id=since_id, viewer_id=user_id)
+        return [envelopes.encode_message(m, copy=envelopes.own_copy(m)) for m in rows], next_cursor is None
+
+    async with database.AsyncSessionLocal() as db:
+        bodies, complete = await db.run_sync(_load)
+    return bodies, "db", complete
+
+
 @ws_router.websocket("/ws")
 async def websocket_unified(websocket: WebSocket):
-    # Authenticate using a short-lived DB session, then close it
-    db = SessionLocal()
     try:
         logger.info("WS /ws connection attempt")
     except Exception:
@@ -33,53 +62,39 @@ async def websocket_unified(websocket: WebSocket):
     if not token:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
+    # Authenticate using a short-lived async DB session, then close it
     try:
-        user = await get_current_user(db=db, token=token)
+        async with database.AsyncSessionLocal() as db:
+            user = await get_current_user(db=db, token=token)
     except HTTPException:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
-    finally:
-        try:
-            db.close()
-        except Exception:
-            pass
-    await websocket.accept()
+    # v1 JSON text by default; v2 MessagePack via ?proto=2 or the chat.v2.msgpack subprotocol
+    protocol, subprotocol = negotiate(websocket)
+    await websocket.accept(subprotocol=subprotocol)
     try:
-        logger.info(f"WS accepted user_id={user.id}")
+        logger.info(f"WS accepted user_id={user.id} protocol=v{protocol}")
     except Exception:
         pass
-    manager.register_user_socket(user.id, websocket)
+    manager.register_user_socket(user.id, websocket, protocol)
     try:
-        manager.user_connected(user.id)
+        # Snapshot and the online transition go out with the next presence tick
+        manager.presence.connected(user.id, websocket)
         logger.info(f"Presence: user_connected user_id={user.id} count={manager.user_online_counts.get(user.id)}")
     except Exception:
         pass
     try:
-        # Initial presence snapshot
-        try:
-            await websocket.send_text(json.dumps({
-                "v": 1,
-                "type": "presence_snapshot",
-                "online_user_ids": list(manager.user_online_counts.keys()),
-            }))
-            try:
-                logger.info(f"WS presence_snapshot sent user_id={user.id} online_count={len(manager.user_online_counts)}")
-            except Exception:
-                pass
-        except Exception:
-            pass
-        # Broadcast presence online to unified sockets
+        # Unread counters for this user follow every change from here on
+        await manager.unread.connected(user.id)
+    except Exception:
         try:
-            await manager.unified_broadcast_all(json.dumps({"v": 1, "type": "presence", "user_id": user.id, "online": True}))
-            try:
-                logger.info(f"WS presence online broadcast user_id={user.id}")
-            except Exception:
-                pass
+            logger.exception(f"WS unread counters load failed user_id={user.id}")
         except Exception:
             pass
+    try:
         # Main loop
         while True:
-            data = await websocket.receive_json()
+            data = await receive_payload(websocket)
             t = data.get("type")
             try:
                 logger.info(f"WS received type={t} user_id={user.id}")
@@ -87,49 +102,51 @@ async def websocket_unified(websocket: WebSocket):
                 pass
             if t == "subscribe":
                 chat_id = int(data.get("chat_id"))
-                # Auth check: membership (short-lived DB session)
-                _db = SessionLocal()
-                try:
-                    ok = _db.query(Chat).filter(Chat.id == chat_id, Chat.participants.any(id=user.id)).first() is not None
-                    if not ok:
-                        await websocket.send_text(json.dumps({"v": 1, "type": "error", "code": "FORBIDDEN", "message": "Not a member"}))
-                        try:
-                            logger.warning(f"WS subscribe forbidden user_id={user.id} chat_id={chat_id}")
-                        except Exception:
-                            pass
-                        continue
-                finally:
+                # Auth check: membership (in-memory index; DB only for a cold chat)
+                if not await membership.ais_member(chat_id, user.id):
+                    await manager.send_unified(websocket, json.dumps({"v": 1, "type": "error", "code": "FORBIDDEN", "message": "Not a member"}))
                     try:
-                        _db.close()
+                        logger.warning(f"WS subscribe forbidden user_id={user.id} chat_id={chat_id}")
                     except Exception:
                         pass
+                    continue
                 manager.subscribe_room(websocket, user.id, str(chat_id))
-                await websocket.send_text(json.dumps({"v": 1, "type": "subscribed", "chat_id": chat_id}))
+                await manager.send_unified(websocket, json.dumps({"v": 1, "type": "subscribed", "chat_id": chat_id}))
                 try:
                     logger.info(f"WS subscribed user_id={user.id} chat_id={chat_id}")
                 except Exception:
                     pass
+                # Resume: send what was missed after the client's last seen id.
+                # Subscribed first, so live messages can't fall in the gap
+                # (the client drops duplicates by id).
+                since_id = data.get("since_id")
+                if since_id is not None:
+                    since_id = int(since_id)
+                    bodies, source, complete = await _missed_messages(chat_id, since_id, user.id)
+                    await manager.send_unified(websocket, envelopes.replay_frame(chat_id, since_id, bodies, source, complete))
+                    try:
+                        logger.info(f"WS replay user_id={user.id} chat_id={chat_id} since_id={since_id} count={len(bodies)} source={source} complete={complete}")
+                    except Exception:
+                        pass
             elif t == "unsubscribe":
                 chat_id = int(data.get("chat_id"))
                 manager.unsubscribe_room(websocket, str(chat_id))
-                await websocket.send_text(json.dumps({"v": 1, "type": "unsubscribed", "chat_id": chat_id}))
+                await manager.send_unified(websocket, json.dumps({"v": 1, "type": "unsubscribed", "chat_id": chat_id}))
                 try:
                     logger.info(f"WS unsubscribed user_id={user.id} chat_id={chat_id}")
                 except Exception:
                     pass
             elif t == "send_message":
                 chat_id = int(data.get("chat_id"))
-                _db = SessionLocal()
+                # Auth check
+                if not await membership.ais_member(chat_id, user.id):
+                    await manager.send_unified(websocket, json.dumps({"v": 1, "type": "error", "code": "FORBIDDEN", "message": "Not a member"}))
+                    try:
+                        logger.warning(f"WS send_message forbidden user_id={user.id} chat_id={chat_id}")
+                    except Exception:
+                        pass
+                    continue
                 try:
-                    # Auth check
-                    ok = _db.query(Chat).filter(Chat.id == chat_id, Chat.participants.any(id=user.id)).first() is not None
-                    if not ok:
-                        await websocket.send_text(json.dumps({"v": 1, "type": "error", "code": "FORBIDDEN", "message": "Not a member"}))
-                        try:
-                            logger.warning(f"WS send_message forbidden user_id={user.id} chat_id={chat_id}")
-                        except Exception:
-                            pass
-                        continue
                     message = schemas.MessageCreate(
                         content=data.get("content"),
                         content_type=data.get("content_type", "text"),
@@ -138,89 +155,48 @@ async def websocket_unified(websocket: WebSocket):
                         algo=data.get("algo"),
                         attachment_id=data.get("attachment_id"),
                     )
-                    saved_messages = messages_controller.create_chat_message(db=_db, message=message, chat_id=chat_id, sender_id=user.id)
-                    try:
-                        logger.info(f"WS send_message saved user_id={user.id} chat_id={chat_id} count={len(saved_messages)}")
-                    except Exception:
-                        pass
-                    # Broadcast each saved message to room and send notify to each participant
-                    for saved in saved_messages:
-                        payload = {
-                            "v": 1,
-                            "type": "message",
-                            "chat_id": chat_id,
-                            "message": {
-                                "id": saved.id,
-                                "content": saved.content,
-                                "ciphertext": saved.ciphertext,
-                                "nonce": saved.nonce,
-                                "algo": saved.algo,
-                                "timestamp": (saved.timestamp.isoformat() if getattr(saved, "timestamp", None) else None),
-                                "sender": {"id": user.id, "username": user.username},
-                                "attachment": ({
-                                    "id": saved.attachment_id,
-                                    "filename": getattr(saved.attachment, 'filename', None),
-                                    "mime_type": getattr(saved.attachment, 'mime_type', None),
-                                    "size_bytes": getattr(saved.attachment, 'size_bytes', None),
-                                    "nonce": getattr(saved.attachment, 'nonce', None),
-                                    "algo": getattr(saved.attachment, 'algo', None),
-                                } if getattr(saved, 'attachment_id', None) else None),
-                            },
-                        }
-                        await manager.broadcast_room(str(chat_id), json.dumps(payload))
-                    try:
-                        logger.info(f"WS broadcast message user_id={user.id} chat_id={chat_id}")
-                    except Exception:
-                        pass
-                    # Lightweight notify to all participants (including not subscribed sockets)
-                    try:
-                        chat_rec = _db.query(Chat).get(chat_id)  # type: ignore
-                        pids = [p.id for p in chat_rec.participants] if chat_rec else []
-                    except Exception:
-                        pids = []
-                    for pid in pids:
-                        try:
-                            await manager.unified_notify_user(pid, json.dumps({"v": 1, "type": "new_message", "chat_id": chat_id}))
-                        except Exception:
-                            pass
-                    try:
-                        logger.info(f"WS notified participants chat_id={chat_id} recipients={len(pids)}")
-                    except Exception:
-                        pass
-                finally:
-                    try:
-                        _db.close()
-                    except Exception:
-                        pass
+                except ValidationError:
+                    # e.g. ciphertext or nonce that isn't base64
+                    await manager.send_unified(websocket, json.dumps({"v": 1, "type": "error", "code": "INVALID_PAYLOAD"}))
+                    continue
+                # Batched with concurrent sends when group commit is on
+                saved = await message_writer.submit(message, chat_id, user)
+                try:
+                    logger.info(f"WS send_message saved user_id={user.id} chat_id={chat_id} count={len(saved)}")
+                except Exception:
+                    pass
+                # Room broadcast, unread badges (pushed on the next tick) and a
+                # lightweight notify to all participants (including not
+                # subscribed sockets), with one bus event for the whole send
+                pids = await membership.amembers(chat_id)
+                await manager.deliver_send(chat_id, user.id, saved, pids)
+                try:
+                    logger.info(f"WS send delivered chat_id={chat_id} copies={len(saved)} recipients={len(pids)}")
+                except Exception:
+                    pass
             else:
-                await websocket.send_text(json.dumps({"v": 1, "type": "error", "code": "INVALID_PAYLOAD"}))
+                await manager.send_unified(websocket, json.dumps({"v": 1, "type": "error", "code": "INVALID_PAYLOAD"}))
                 try:
                     logger.warning(f"WS invalid payload user_id={user.id} data={data}")
                 except Exception:
                     pass
     except WebSocketDisconnect:
         manager.unregister_user_socket(user.id, websocket)
+        manager.unread.disconnected(user.id)
         try:
-            manager.user_disconnected(user.id)
+            manager.presence.disconnected(user.id)
             logger.info(f"Presence: user_disconnected user_id={user.id} count={manager.user_online_counts.get(user.id)}")
         except Exception:
             pass
-        try:
-            await manager.unified_broadcast_all(json.dumps({"v": 1, "type": "presence", "user_id": user.id, "online": False}))
-        except Exception:
-            pass
         try:
             logger.info(f"WS disconnect user_id={user.id}")
         except Exception:
             pass
     except Exception:
         manager.unregister_user_socket(user.id, websocket)
+        manager.unread.disconnected(user.id)
         try:
-            manager.user_disconnected(user.id)
-        except Exception:
-            pass
-        try:
-            await manager.broadcast_all(json.dumps({"v": 1, "type": "presence", "user_id": user.id, "online": False}))
+            manager.presence.disconnected(user.id)
         except Exception:
             pass
         try:
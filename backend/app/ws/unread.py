@@ -0,0 +1,182 @@
+from typing import TYPE_CHECKING, Dict, List, Mapping, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import os
+
+from ..db import database
+from ..controllers import chat_state_controller
+
+if TYPE_CHECKING:
+    from .ws_manager import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+
+def tick_seconds() -> float:
+    try:
+        return max(0.01, int(os.environ.get("WS_UNREAD_TICK_MS", "100")) / 1000.0)
+    except Exception:
+        return 0.1
+
+
+def unread_frame(chat_id: int, count: int) -> str:
+    return json.dumps({"v": 1, "type": "unread", "chat_id": chat_id, "count": count})
+
+
+class UnreadTracker:
+    """Unread counters of the users connected to this worker, pushed as absolute counts.
+
+    A user's counters (chats.last_seq - read_seq) are loaded once when their
+    first socket connects and then follow the deltas from sends and the
+    values from read-state changes, whichever worker they happened on.
+    Changes that arrive while the load is running are held back and
+    replayed on top of it. Changes are coalesced: at most one
+    {"type": "unread"} frame per user and chat per tick.
+    """
+
+    def __init__(self, manager: "ConnectionManager", tick: Optional[float] = None):
+        self.manager = manager
+        self.tick = tick if tick is not None else tick_seconds()
+        # user id -> chat id -> unread count, for users with a local socket
+        self.counts: Dict[int, Dict[int, int]] = {}
+        # user id -> (chat id, "inc" or "set", n) that arrived during their load
+        self._loading: Dict[int, List[Tuple[int, str, int]]] = {}
+        # user id -> chats whose count changed since the last flush
+        self._dirty: Dict[int, Set[int]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.frames_sent = 0
+
+    # ---- who is tracked ----
+    async def connected(self, user_id: int):
+        if user_id in self.counts or user_id in self._loading:
+            return
+        # From here on changes for this user are buffered, not dropped
+        self._loading[user_id] = []
+
+        def _load(s):
+            return chat_state_controller.get_unread_counts(s, user_id)
+
+        try:
+            async with database.AsyncSessionLocal() as db:
+                counts = await db.run_sync(_load)
+        finally:
+            pending = self._loading.pop(user_id, [])
+        if user_id not in self.manager.user_online_counts:
+            return
+        self.track(user_id, counts)
+        for chat_id, op, n in pending:
+            if op == "inc":
+                self.apply_increments(chat_id, {user_id: n})
+            else:
+                self.apply_set(user_id, chat_id, n)
+
+    def track(self, user_id: int, counts: Mapping[int, int]):
+        self.counts.setdefault(user_id, {}).update(counts)
+
+    def disconnected(self, user_id: int):
+        if user_id not in self.manager.user_online_counts:
+            self.counts.pop(user_id, None)
+            self._dirty.pop(user_id, None)
+
+    # ---- changes ----
+    def apply_increments(self, chat_id: int, increments: Mapping[int, int]):
+        for uid, n in increments.items():
+            chats = self.counts.get(uid)
+            if chats is None:
+                if uid in self._loading:
+                    self._loading[uid].append((chat_id, "inc", n))
+                continue
+            chats[chat_id] = chats.get(chat_id, 0) + n
+            self._mark(uid, chat_id)
+
+    def apply_set(self, user_id: int, chat_id: int, count: int):
+        chats = self.counts.get(user_id)
+        if chats is None:
+            if user_id in self._loading:
+                self._loading[user_id].append((chat_id, "set", count))
+            return
+        chats[chat_id] = count
+        self._mark(user_id, chat_id)
+
+    def apply_sent(self, chat_id: int, sender_id: int, increments: Mapping[int, int]):
+        # The send also advanced the sender's read position, so their count is 0
+        self.apply_increments(chat_id, increments)
+        self.apply_set(sender_id, chat_id, 0)
+
+    async def message_sent(self, chat_id: int, sender_id: int, increments: Mapping[int, int]):
+        """Counters bumped by a committed send; other workers apply the same deltas.
+
+        Sends normally come through manager.deliver_send, which carries
+        this in its one bus event; this is the standalone form.
+        """
+        self.apply_sent(chat_id, sender_id, increments)
+        await self.manager._publish({
+            "op": "unread",
+            "chat_id": chat_id,
+            "inc": {str(u): n for u, n in increments.items()},
+            "set": {str(sender_id): 0},
+        })
+
+    async def read_state(self, user_id: int, chat_id: int, count: int):
+        self.apply_set(user_id, chat_id, count)
+        await self.manager._publish({"op": "unread", "chat_id": chat_id, "set": {str(user_id): count}})
+
+    def on_bus_event(self, event: dict):
+        chat_id = int(event["chat_id"])
+        if event.get("inc"):
+            self.apply_increments(chat_id, {int(u): int(n) for u, n in event["inc"].items()})
+        for uid, count in (event.get("set") or {}).items():
+            self.apply_set(int(uid), chat_id, int(count))
+
+    # ---- delivery ----
+    def _mark(self, user_id: int, chat_id: int):
+        self._dirty.setdefault(user_id, set()).add(chat_id)
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._run())
+            except RuntimeError:
+                # No loop (sync caller): the next change on the loop flushes it
+                pass
+
+    async def _run(self):
+        assert self._wakeup is not None
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.tick)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Unread flush failed")
+
+    def flush(self) -> int:
+        dirty, self._dirty = self._dirty, {}
+        sent = 0
+        for uid, chat_ids in dirty.items():
+            chats = self.counts.get(uid)
+            if chats is None:
+                continue
+            for chat_id in chat_ids:
+                # Keyed so a backed-up socket keeps only the newest count per chat
+                sent += self.manager._deliver_user(uid, unread_frame(chat_id, chats.get(chat_id, 0)), key=f"unread:{chat_id}")
+        self.frames_sent += sent
+        return sent
+
+    def clear(self):
+        self.counts.clear()
+        self._loading.clear()
+        self._dirty.clear()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._wakeup = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"users": len(self.counts), "pending": sum(len(c) for c in self._dirty.values()), "frames_sent": self.frames_sent}
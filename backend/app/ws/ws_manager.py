@@ -1,306 +1,358 @@
-from typing import List, Dict, Set
-from fastapi import WebSocket
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+from fastapi import WebSocket, status
+import asyncio
 import logging
 
+from .outbox import Outbox
+from .backplane import Backplane
+from .presence import PresenceAggregator
+from .protocol import Frame, PROTOCOL_V1
+from .replay import ReplayBuffer
+from .unread import UnreadTracker
+from . import envelopes
+from ..controllers.chat_state_controller import unread_increments
+from ..core.membership import membership
+
 logger = logging.getLogger(__name__)
 
 
+class Connection:
+    """One unified WS connection and the rooms it is subscribed to."""
+
+    __slots__ = ("websocket", "user_id", "rooms", "outbox", "protocol")
+
+    def __init__(self, websocket: WebSocket, user_id: int, outbox: Outbox, protocol: int = PROTOCOL_V1):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.rooms: Set[str] = set()
+        self.outbox = outbox
+        self.protocol = protocol
+
+
+# Frames are passed around as a JSON str (v1) or a Frame; either way each
+# protocol's encoding is produced at most once per delivery
+Message = Union[str, Frame]
+
+
+def _push_all(conns, message: Message, key: Optional[str]) -> int:
+    frame = Frame.of(message)
+    text = frame.text()
+    total = 0
+    for conn in conns:
+        data = text if conn.protocol == PROTOCOL_V1 else frame.encode(conn.protocol)
+        if conn.outbox.push(data, key):
+            total += 1
+    return total
+
+
 class ConnectionManager:
     def __init__(self):
-        # We'll store connections per chat room
-        self.active_connections: Dict[str, List[WebSocket]] = {}
-        # Map websocket to user id for per-room permission enforcement
-        self._ws_to_user_id: Dict[WebSocket, int] = {}
-        # Presence subscribers (global)
-        self.presence_sockets: List[WebSocket] = []
+        # Indexes over unified connections; every add/remove is O(1)
+        self.connections: Dict[WebSocket, Connection] = {}
+        self.user_conns: Dict[int, Set[Connection]] = {}
+        self.room_conns: Dict[str, Set[Connection]] = {}
         # Online counts per user id
         self.user_online_counts: Dict[int, int] = {}
-        # Per-user notification sockets (global WS for notifications)
-        self.user_notify_sockets: Dict[int, List[WebSocket]] = {}
-        # Unified WS: per-user sockets (single socket per tab typically)
-        self.user_sockets: Dict[int, List[WebSocket]] = {}
-        # Unified WS: room membership maps
-        self.room_sockets: Dict[str, List[WebSocket]] = {}
-        self.socket_rooms: Dict[WebSocket, Set[str]] = {}
-
-    async def connect(self, websocket: WebSocket, chat_id: str, user_id: int):
-        await websocket.accept()
-        if chat_id not in self.active_connections:
-            self.active_connections[chat_id] = []
-        self.active_connections[chat_id].append(websocket)
-        self._ws_to_user_id[websocket] = user_id
+        # Totals carried over from outboxes that have been closed
+        self._retired_stats: Dict[str, int] = {"sent": 0, "dropped": 0, "coalesced": 0, "slow_disconnects": 0}
+        # Bus to the other workers; the default delivers locally only
+        self.backplane: Backplane = Backplane()
+        # Batches online/offline transitions into one frame per tick
+        self.presence = PresenceAggregator(self)
+        # Recent message envelopes per room for subscribe(since_id)
+        self.replay = ReplayBuffer()
+        # Unread counters of local users, pushed as they change
+        self.unread = UnreadTracker(self)
+
+    # ==== Backplane (multi-worker fan-out) ====
+    async def start_backplane(self, backplane: Backplane):
+        self.backplane = backplane
+        await backplane.start(self._on_bus_event)
+        if backplane.distributed:
+            membership.add_listener(self._on_membership_change)
+            self.presence.start_sync()
         try:
-            logger.info(f"WS connect room={chat_id} total_room_conns={len(self.active_connections[chat_id])}")
+            logger.info(f"Backplane started kind={type(backplane).__name__} worker={backplane.worker_id}")
         except Exception:
             pass
 
-    def disconnect(self, websocket: WebSocket, chat_id: str):
-        if chat_id in self.active_connections:
-            self.active_connections[chat_id].remove(websocket)
-            # If the room is empty, remove it from the dictionary
-            if not self.active_connections[chat_id]:
-                del self.active_connections[chat_id]
-        # remove mapping if present
+    async def stop_backplane(self):
+        membership.remove_listener(self._on_membership_change)
+        self.presence.stop()
+        self.unread.stop()
         try:
-            self._ws_to_user_id.pop(websocket, None)
-        except Exception:
-            pass
+            await self.backplane.stop()
+        finally:
+            self.backplane = Backplane()
+
+    async def _publish(self, event: dict):
+        if not self.backplane.distributed:
+            return
         try:
-            logger.info(f"WS disconnect room={chat_id}")
+            await self.backplane.publish(event)
         except Exception:
-            pass
+            logger.exception("Backplane publish failed")
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast(self, message: str, chat_id: str):
-        if chat_id in self.active_connections:
-            # iterate over a copy to allow safe removal
-            conns = list(self.active_connections[chat_id])
-            for connection in conns:
-                try:
-                    await connection.send_text(message)
-                except Exception:
-                    # drop broken socket and continue
-                    try:
-                        self.active_connections[chat_id].remove(connection)
-                    except ValueError:
-                        pass
-            try:
-                logger.info(f"Broadcast room={chat_id} sent_to={len(conns)}")
-            except Exception:
-                pass
+    async def _on_bus_event(self, event: dict):
+        op = event.get("op")
+        if op == "room":
+            self._deliver_room(str(event["room"]), event["data"], event.get("key"))
+        elif op == "user":
+            self._deliver_user(int(event["user_id"]), event["data"], event.get("key"))
+        elif op == "all":
+            self._deliver_all(event["data"], event.get("key"))
+        elif op == "message":
+            self._deliver_message(int(event["chat_id"]), int(event["message_id"]), event.get("recipient_id"), event["body"].encode("utf-8"))
+        elif op == "send":
+            self._deliver_send(
+                int(event["chat_id"]),
+                int(event["sender_id"]),
+                [(int(m["message_id"]), m.get("recipient_id"), m["body"].encode("utf-8")) for m in event["messages"]],
+                [int(u) for u in event["members"]],
+                bool(event.get("notify_sender", True)),
+            )
+        elif op == "resync":
+            # Bus events may have been lost: rings could have holes now
+            self.replay.drop()
+            await self._publish({"op": "presence_sync_request"})
+            await self.presence.publish_sync()
+        elif op == "membership":
+            if event.get("chat_id") is not None:
+                membership.invalidate_chat(int(event["chat_id"]), event.get("user_ids") or (), propagate=False)
+            elif event.get("user_id") is not None:
+                # A deleted user: their messages' envelopes still name them
+                envelopes.envelope_cache.invalidate_sender(int(event["user_id"]))
+                membership.invalidate_user(int(event["user_id"]), propagate=False)
+        elif op in ("presence", "presence_sync", "presence_sync_request"):
+            self.presence.on_bus_event(event)
+        elif op == "unread":
+            self.unread.on_bus_event(event)
 
-    async def broadcast_all(self, message: str):
-        # Send to all active chat connections across all rooms
-        for room_id, conns in list(self.active_connections.items()):
-            for connection in list(conns):
-                try:
-                    await connection.send_text(message)
-                except Exception:
-                    # Best-effort: ignore send errors here
-                    pass
-        try:
-            total = sum(len(v) for v in self.active_connections.values())
-            logger.info(f"BroadcastAll rooms={len(self.active_connections)} total_conns={total}")
-        except Exception:
-            pass
+    def _on_membership_change(self, change: dict):
+        self.backplane.publish_threadsafe(dict(change, op="membership"))
 
-    async def unified_broadcast_all(self, message: str):
-        # Send to all unified per-user sockets
-        total = 0
-        for uid, sockets in list(self.user_sockets.items()):
-            for ws in list(sockets):
-                try:
-                    await ws.send_text(message)
-                    total += 1
-                except Exception:
-                    try:
-                        sockets.remove(ws)
-                    except Exception:
-                        pass
+    def _deliver_all(self, message: Message, key: Optional[str] = None) -> int:
+        return _push_all(tuple(self.connections.values()), message, key)
+
+    def _deliver_room(self, room_id: str, message: Message, key: Optional[str] = None) -> int:
+        conns = self.room_conns.get(room_id)
+        if not conns:
+            return 0
+        # Snapshot: a push may close a connection and mutate the index
+        return _push_all(tuple(conns), message, key)
+
+    def _deliver_user(self, user_id: int, message: Message, key: Optional[str] = None) -> int:
+        return _push_all(tuple(self.user_conns.get(user_id, ())), message, key)
+
+    async def unified_broadcast_all(self, message: Message, key: Optional[str] = None):
+        # Enqueue to all unified per-user sockets; writer tasks do the sending
+        total = self._deliver_all(message, key)
+        await self._publish({"op": "all", "data": Frame.of(message).text(), "key": key})
         try:
-            logger.info(f"UnifiedBroadcastAll users={len(self.user_sockets)} total_conns={total}")
+            logger.info(f"UnifiedBroadcastAll users={len(self.user_conns)} total_conns={total}")
         except Exception:
             pass
 
     # ==== Unified WS helpers (rooms over a single socket) ====
-    def register_user_socket(self, user_id: int, websocket: WebSocket):
-        if user_id not in self.user_sockets:
-            self.user_sockets[user_id] = []
-        self.user_sockets[user_id].append(websocket)
-        self._ws_to_user_id[websocket] = user_id
-        if websocket not in self.socket_rooms:
-            self.socket_rooms[websocket] = set()
+    def register_user_socket(self, user_id: int, websocket: WebSocket, protocol: int = PROTOCOL_V1) -> Connection:
+        conn = self.connections.get(websocket)
+        if conn is None:
+            conn = Connection(websocket, user_id, Outbox(websocket, on_close=self._on_outbox_closed), protocol)
+            self.connections[websocket] = conn
+        self.user_conns.setdefault(user_id, set()).add(conn)
         try:
-            logger.info(f"UnifiedWS connect user_id={user_id} sockets={len(self.user_sockets[user_id])}")
+            logger.info(f"UnifiedWS connect user_id={user_id} sockets={len(self.user_conns[user_id])}")
         except Exception:
             pass
+        return conn
 
     def unregister_user_socket(self, user_id: int, websocket: WebSocket):
-        # Remove from user sockets
-        try:
-            if user_id in self.user_sockets and websocket in self.user_sockets[user_id]:
-                self.user_sockets[user_id].remove(websocket)
-                if not self.user_sockets[user_id]:
-                    del self.user_sockets[user_id]
-        except Exception:
-            pass
-        # Remove from any rooms
-        rooms = self.socket_rooms.get(websocket, set()).copy()
-        for room_id in rooms:
-            try:
-                if room_id in self.room_sockets and websocket in self.room_sockets[room_id]:
-                    self.room_sockets[room_id].remove(websocket)
-                    if not self.room_sockets[room_id]:
-                        del self.room_sockets[room_id]
-            except Exception:
-                pass
-        try:
-            self.socket_rooms.pop(websocket, None)
-            self._ws_to_user_id.pop(websocket, None)
-        except Exception:
-            pass
+        conn = self.connections.pop(websocket, None)
+        if conn is None:
+            return
+        conns = self.user_conns.get(conn.user_id)
+        if conns is not None:
+            conns.discard(conn)
+            if not conns:
+                del self.user_conns[conn.user_id]
+        for room_id in conn.rooms:
+            self._discard_from_room(conn, room_id)
+        conn.rooms = set()
+        conn.outbox.close("unregistered")
+        self._retire_outbox(conn.outbox)
         try:
             logger.info(f"UnifiedWS disconnect user_id={user_id}")
         except Exception:
             pass
 
     def subscribe_room(self, websocket: WebSocket, user_id: int, room_id: str):
-        if room_id not in self.room_sockets:
-            self.room_sockets[room_id] = []
-        if websocket not in self.room_sockets[room_id]:
-            self.room_sockets[room_id].append(websocket)
-        if websocket not in self.socket_rooms:
-            self.socket_rooms[websocket] = set()
-        self.socket_rooms[websocket].add(room_id)
-        self._ws_to_user_id[websocket] = user_id
+        conn = self.connections.get(websocket)
+        if conn is None:
+            conn = self.register_user_socket(user_id, websocket)
+        self.room_conns.setdefault(room_id, set()).add(conn)
+        conn.rooms.add(room_id)
         try:
-            logger.info(f"UnifiedWS subscribe user_id={user_id} room={room_id} subs={len(self.room_sockets[room_id])}")
+            logger.info(f"UnifiedWS subscribe user_id={user_id} room={room_id} subs={len(self.room_conns[room_id])}")
         except Exception:
             pass
 
     def unsubscribe_room(self, websocket: WebSocket, room_id: str):
+        conn = self.connections.get(websocket)
+        if conn is None:
+            return
+        conn.rooms.discard(room_id)
+        self._discard_from_room(conn, room_id)
+
+    def _discard_from_room(self, conn: Connection, room_id: str):
+        conns = self.room_conns.get(room_id)
+        if conns is None:
+            return
+        conns.discard(conn)
+        if not conns:
+            del self.room_conns[room_id]
+
+    def _deliver_message(self, chat_id: int, message_id: int, recipient_id: Optional[int], body: bytes) -> int:
+        room_id = str(chat_id)
+        self.replay.record(room_id, message_id, recipient_id, body)
+        if recipient_id is None:
+            return self._deliver_room(room_id, envelopes.message_frame(chat_id, body))
+        # A per-recipient row of an E2EE fan-out: only that user's subscribed
+        # sockets can decrypt it, so a group send costs O(members), not O(members^2)
+        conns = tuple(c for c in self.user_conns.get(int(recipient_id), ()) if room_id in c.rooms)
+        if not conns:
+            return 0
+        return _push_all(conns, envelopes.message_frame(chat_id, body), None)
+
+    async def broadcast_message(self, chat_id: int, message_id: int, recipient_id: Optional[int], body: bytes):
+        """Fan a stored message out to its room and keep it for replay."""
+        self._deliver_message(chat_id, message_id, recipient_id, body)
+        await self._publish({
+            "op": "message",
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "recipient_id": recipient_id,
+            "body": body.decode("utf-8"),
+        })
+
+    async def deliver_send(
+        self,
+        chat_id: int,
+        sender_id: int,
+        saved: Sequence,
+        member_ids: Iterable[int],
+        notify_sender: bool = True,
+    ):
+        """Everything one stored send fans out, with a single bus event for all of it.
+
+        saved are the send's envelopes (anything with id, recipient_id and
+        body; one per copy of a fan-out send). Locally and on every other
+        worker they go to the room and the replay buffer, the members'
+        unread counters move, and each member gets a new_message notify
+        (the sender only if notify_sender, e.g. for their other tabs).
+        """
+        messages = [(m.id, m.recipient_id, m.body) for m in saved]
+        members = sorted({int(u) for u in member_ids})
+        self._deliver_send(chat_id, sender_id, messages, members, notify_sender)
+        await self._publish({
+            "op": "send",
+            "chat_id": chat_id,
+            "sender_id": sender_id,
+            "messages": [{"message_id": i, "recipient_id": r, "body": b.decode("utf-8")} for i, r, b in messages],
+            "members": members,
+            "notify_sender": notify_sender,
+        })
+
+    def _deliver_send(
+        self,
+        chat_id: int,
+        sender_id: int,
+        messages: List[Tuple[int, Optional[int], bytes]],
+        members: List[int],
+        notify_sender: bool,
+    ):
+        for message_id, recipient_id, body in messages:
+            self._deliver_message(chat_id, message_id, recipient_id, body)
+        self.unread.apply_sent(chat_id, sender_id, unread_increments(members, sender_id))
+        notify = envelopes.new_message_frame(chat_id)
+        queued = 0
+        for uid in members:
+            if notify_sender or uid != sender_id:
+                queued += self._deliver_user(uid, notify, key=f"new_message:{chat_id}")
         try:
-            if room_id in self.room_sockets and websocket in self.room_sockets[room_id]:
-                self.room_sockets[room_id].remove(websocket)
-                if not self.room_sockets[room_id]:
-                    del self.room_sockets[room_id]
-        except Exception:
-            pass
-        try:
-            if websocket in self.socket_rooms:
-                self.socket_rooms[websocket].discard(room_id)
+            logger.info(f"Send delivered chat_id={chat_id} copies={len(messages)} members={len(members)} notified_local={queued}")
         except Exception:
             pass
 
-    async def broadcast_room(self, room_id: str, message: str):
-        if room_id not in self.room_sockets:
+    async def broadcast_room(self, room_id: str, message: Message, key: Optional[str] = None):
+        # Only enqueues; slow subscribers are isolated by their own outbox
+        self._deliver_room(room_id, message, key)
+        await self._publish({"op": "room", "room": room_id, "data": Frame.of(message).text(), "key": key})
+
+    async def send_unified(self, websocket: WebSocket, message: Message, key: Optional[str] = None):
+        # Direct replies go through the same queue to keep per-socket ordering
+        conn = self.connections.get(websocket)
+        if conn is None:
+            await websocket.send_text(Frame.of(message).text())
             return
-        for ws in list(self.room_sockets[room_id]):
-            try:
-                await ws.send_text(message)
-            except Exception:
-                # Drop broken
-                try:
-                    self.room_sockets[room_id].remove(ws)
-                except Exception:
-                    pass
+        conn.outbox.push(Frame.of(message).encode(conn.protocol), key)
 
+    def _retire_outbox(self, outbox: Outbox):
+        self._retired_stats["sent"] += outbox.sent
+        self._retired_stats["dropped"] += outbox.dropped
+        self._retired_stats["coalesced"] += outbox.coalesced
+        outbox.sent = outbox.dropped = outbox.coalesced = 0
 
-    def disconnect_user_from_room(self, chat_id: str, user_id: int):
-        if chat_id not in self.active_connections:
+    def _on_outbox_closed(self, outbox: Outbox, reason: str):
+        if reason == "unregistered":
             return
-        remaining: List[WebSocket] = []
-        for ws in list(self.active_connections[chat_id]):
-            uid = self._ws_to_user_id.get(ws)
-            if uid == user_id:
-                try:
-                    # best-effort close
-                    import anyio
-                    try:
-                        anyio.from_thread.run(ws.close)
-                    except Exception:
-                        pass
-                except Exception:
-                    pass
-                try:
-                    self._ws_to_user_id.pop(ws, None)
-                except Exception:
-                    pass
-            else:
-                remaining.append(ws)
-        self.active_connections[chat_id] = remaining
-
-    async def connect_presence(self, websocket: WebSocket):
-        await websocket.accept()
-        self.presence_sockets.append(websocket)
-
-    def disconnect_presence(self, websocket: WebSocket):
-        if websocket in self.presence_sockets:
-            self.presence_sockets.remove(websocket)
-
-    async def _broadcast_presence(self, user_id: int, online: bool):
-        # Prefer sending proper JSON from caller; this is a fallback
-        payload = f'{ {"type": "presence", "user_id": user_id, "online": online} }'
-        for ws in list(self.presence_sockets):
+        # Broken or too slow: drop the socket from every index
+        ws = outbox.websocket
+        conn = self.connections.get(ws)
+        uid = conn.user_id if conn is not None else None
+        if conn is not None:
+            self.unregister_user_socket(conn.user_id, ws)
+        if reason == "overflow":
+            self._retired_stats["slow_disconnects"] += 1
             try:
-                await ws.send_text(payload)
+                logger.warning(f"UnifiedWS slow consumer disconnected user_id={uid}")
             except Exception:
-                # Drop broken sockets
-                try:
-                    self.presence_sockets.remove(ws)
-                except ValueError:
-                    pass
-
-    async def connect_notify(self, user_id: int, websocket: WebSocket):
-        await websocket.accept()
-        if user_id not in self.user_notify_sockets:
-            self.user_notify_sockets[user_id] = []
-        self.user_notify_sockets[user_id].append(websocket)
-        try:
-            logger.info(f"Notify connect user_id={user_id} total_user_sockets={len(self.user_notify_sockets[user_id])}")
-        except Exception:
-            pass
-
-    def disconnect_notify(self, user_id: int, websocket: WebSocket):
-        if user_id in self.user_notify_sockets:
-            try:
-                self.user_notify_sockets[user_id].remove(websocket)
-                if not self.user_notify_sockets[user_id]:
-                    del self.user_notify_sockets[user_id]
-            except ValueError:
                 pass
-        try:
-            logger.info(f"Notify disconnect user_id={user_id}")
-        except Exception:
-            pass
-
-    async def notify_user(self, user_id: int, message: str):
-        if user_id in self.user_notify_sockets:
-            sockets = list(self.user_notify_sockets[user_id])
-            ok = 0
-            for ws in sockets:
-                try:
-                    await ws.send_text(message)
-                    ok += 1
-                except Exception:
-                    # drop broken
-                    self.disconnect_notify(user_id, ws)
             try:
-                logger.info(f"NotifyUser user_id={user_id} sent={ok} total={len(sockets)}")
+                asyncio.get_running_loop().create_task(self._close_socket(ws, status.WS_1013_TRY_AGAIN_LATER))
             except Exception:
                 pass
 
-    async def unified_notify_user(self, user_id: int, message: str):
-        sockets = list(self.user_sockets.get(user_id, []))
-        ok = 0
-        for ws in sockets:
-            try:
-                await ws.send_text(message)
-                ok += 1
-            except Exception:
-                try:
-                    self.user_sockets[user_id].remove(ws)
-                except Exception:
-                    pass
+    async def _close_socket(self, websocket: WebSocket, code: int):
         try:
-            logger.info(f"UnifiedNotifyUser user_id={user_id} sent={ok} total={(len(self.user_sockets.get(user_id, [])))}")
+            await websocket.close(code=code)
         except Exception:
             pass
 
-    async def notify_all(self, message: str):
-        # Broadcast to all connected notify sockets
-        total = 0
-        for user_id, sockets in list(self.user_notify_sockets.items()):
-            for ws in list(sockets):
-                try:
-                    await ws.send_text(message)
-                    total += 1
-                except Exception:
-                    self.disconnect_notify(user_id, ws)
+    def fanout_stats(self) -> Dict[str, int]:
+        stats = dict(self._retired_stats)
+        queued = 0
+        for conn in tuple(self.connections.values()):
+            stats["sent"] += conn.outbox.sent
+            stats["dropped"] += conn.outbox.dropped
+            stats["coalesced"] += conn.outbox.coalesced
+            queued += len(conn.outbox)
+        stats["queued"] = queued
+        stats["sockets"] = len(self.connections)
+        stats["rooms"] = len(self.room_conns)
+        return stats
+
+    def disconnect_user_from_room(self, chat_id: str, user_id: int):
+        # Drop every socket of this user from the room (e.g. removed from group)
+        for conn in tuple(self.user_conns.get(user_id, ())):
+            if chat_id in conn.rooms:
+                conn.rooms.discard(chat_id)
+                self._discard_from_room(conn, chat_id)
+
+    async def unified_notify_user(self, user_id: int, message: Message, key: Optional[str] = None):
+        ok = self._deliver_user(user_id, message, key)
+        await self._publish({"op": "user", "user_id": user_id, "data": Frame.of(message).text(), "key": key})
         try:
-            logger.info(f"NotifyAll total_sent={total} users={len(self.user_notify_sockets)}")
+            logger.info(f"UnifiedNotifyUser user_id={user_id} queued_local={ok}")
         except Exception:
             pass
 
@@ -315,5 +367,3 @@ class ConnectionManager:
 
 
 manager = ConnectionManager()
-
-
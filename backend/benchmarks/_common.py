@@ -0,0 +1,63 @@
+import asyncio
+import os
+import sys
+import time
+from typing import List, Optional
+
+
+def setup_env(tmp_dir: Optional[str] = None) -> str:
+    # Benchmarks import the app package directly; give settings something to load
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    if tmp_dir is not None:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+        os.environ["FILES_DIR"] = os.path.join(tmp_dir, "files")
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    os.environ.setdefault("SECRET_KEY", "bench-secret")
+    return root
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+class FakeSocket:
+    """Stand-in for starlette's WebSocket that records what it was sent."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.frames = 0
+        self.bytes_sent = 0
+        self.received_at: List[float] = []
+        self.closed_code: Optional[int] = None
+
+    async def send_text(self, data: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.frames += 1
+        self.bytes_sent += len(data.encode("utf-8"))
+        self.received_at.append(time.perf_counter())
+
+    async def send_bytes(self, data: bytes):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.frames += 1
+        self.bytes_sent += len(data)
+        self.received_at.append(time.perf_counter())
+
+    async def close(self, code: int = 1000):
+        self.closed_code = code
+
+
+def print_table(headers: List[str], rows: List[List[object]]):
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)]
+    line = "  ".join(str(h).ljust(w) for h, w in zip(headers, widths))
+    print(line)
+    print("-" * len(line))
+    for r in rows:
+        print("  ".join(str(c).ljust(w) for c, w in zip(r, widths)))
@@ -0,0 +1,145 @@
+"""Ciphertexts and nonces as base64 text vs raw bytes, before and after convert_binary.
+
+Seeds a DM chat of M E2EE messages and a G-member group of S fan-out sends,
+all in the legacy base64 text columns, then measures:
+  - storage: messages and message_recipients with their indexes
+             (sqlite dbstat after VACUUM, or pg_total_relation_size after VACUUM FULL)
+  - scan:    rows/s reading every ciphertext and nonce of the DM chat
+  - history: messages/s paging the whole DM chat (and the group as one member)
+             through get_chat_messages_page + message_page, envelope cache cleared
+then runs app.db.convert_binary and measures again.
+
+    python -m benchmarks.bench_binary_columns --messages 200000 --members 50 --sends 2000
+"""
+import argparse
+import base64
+import os
+import tempfile
+import time
+
+from ._common import print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_binary_columns_"))
+
+from sqlalchemy import insert, text  # noqa: E402
+
+from app.controllers import messages_controller  # noqa: E402
+from app.db import database, models  # noqa: E402
+from app.db.convert_binary import convert_all  # noqa: E402
+from app.db.migrations import run_migrations  # noqa: E402
+from app.ws import envelopes  # noqa: E402
+from app.ws.envelopes import envelope_cache  # noqa: E402
+
+
+def b64(n: int) -> str:
+    return base64.b64encode(os.urandom(n)).decode("ascii")
+
+
+def seed(messages: int, members: int, sends: int):
+    database.Base.metadata.create_all(bind=database.engine)
+    run_migrations(database.engine)
+    db = database.SessionLocal()
+    try:
+        users = [models.User(username=f"bench-{i}-{time.time_ns()}", password_hash="x") for i in range(members)]
+        dm = models.Chat(chat_type="private", last_seq=messages)
+        dm.participants.extend(users[:2])
+        group = models.Chat(chat_type="group", name="bench", last_seq=sends)
+        group.participants.extend(users)
+        db.add_all([*users, dm, group])
+        db.commit()
+        user_ids, dm_id, group_id = [u.id for u in users], dm.id, group.id
+    finally:
+        db.close()
+    # Straight into the text columns, as rows written before the binary ones
+    batch = 20000
+    with database.engine.begin() as conn:
+        for start in range(0, messages, batch):
+            conn.execute(insert(models.Message.__table__), [
+                {"chat_id": dm_id, "seq": n + 1, "sender_id": user_ids[n % 2], "content_type": "text",
+                 "fanout": False, "ciphertext": b64(216), "nonce": b64(12), "algo": "AES-GCM"}
+                for n in range(start, min(messages, start + batch))
+            ])
+        conn.execute(insert(models.Message.__table__), [
+            {"chat_id": group_id, "seq": n + 1, "sender_id": user_ids[n % members], "content_type": "text",
+             "fanout": True, "algo": None}
+            for n in range(sends)
+        ])
+        send_ids = [r[0] for r in conn.execute(text("SELECT id FROM messages WHERE chat_id = :c ORDER BY id"), {"c": group_id})]
+        for start in range(0, sends, 200):
+            conn.execute(insert(models.MessageRecipient.__table__), [
+                {"message_id": mid, "recipient_id": uid, "ciphertext": b64(216), "nonce": b64(12), "algo": "AES-GCM"}
+                for mid in send_ids[start:start + 200] for uid in user_ids
+            ])
+    return dm_id, group_id, user_ids[0]
+
+
+def storage_bytes() -> int:
+    with database.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("VACUUM FULL messages"))
+            conn.execute(text("VACUUM FULL message_recipients"))
+            return conn.execute(text(
+                "SELECT pg_total_relation_size('messages') + pg_total_relation_size('message_recipients')"
+            )).scalar_one()
+        conn.execute(text("VACUUM"))
+        return conn.execute(text(
+            "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN "
+            "(SELECT name FROM sqlite_master WHERE tbl_name IN ('messages', 'message_recipients'))"
+        )).scalar_one()
+
+
+def scan_rate(chat_id: int) -> float:
+    db = database.SessionLocal()
+    try:
+        t0 = time.perf_counter()
+        rows = db.query(models.Message).filter(models.Message.chat_id == chat_id).all()
+        n = sum(1 for m in rows if (m.ciphertext if m.ciphertext is not None else m.ciphertext_b64) is not None)
+        return n / (time.perf_counter() - t0)
+    finally:
+        db.close()
+
+
+def history_rate(chat_id: int, viewer: int, limit: int = 50) -> float:
+    envelope_cache.clear()
+    db = database.SessionLocal()
+    n, cursor = 0, None
+    t0 = time.perf_counter()
+    try:
+        while True:
+            rows, cursor = messages_controller.get_chat_messages_page(db, chat_id, limit, before_id=cursor, viewer_id=viewer)
+            envelopes.message_page(rows, cursor)
+            n += len(rows)
+            db.expunge_all()
+            if cursor is None:
+                return n / (time.perf_counter() - t0)
+    finally:
+        db.close()
+
+
+def measure(layout: str, dm_id: int, group_id: int, viewer: int):
+    return [
+        layout, f"{storage_bytes():,}", f"{scan_rate(dm_id):,.0f}",
+        f"{history_rate(dm_id, viewer):,.0f}", f"{history_rate(group_id, viewer):,.0f}",
+    ]
+
+
+def main(args):
+    dm_id, group_id, viewer = seed(args.messages, args.members, args.sends)
+    rows = [measure("base64 text", dm_id, group_id, viewer)]
+    t0 = time.perf_counter()
+    results = convert_all(database.engine, batch=args.batch)
+    took = time.perf_counter() - t0
+    converted = sum(r["converted"] for r in results.values())
+    rows.append(measure("raw bytes", dm_id, group_id, viewer))
+    print(f"DM chat of {args.messages:,} messages; {args.members}-member group with {args.sends:,} fan-out sends")
+    print(f"convert_binary: {converted:,} values in {took:.1f} s ({converted / took:,.0f}/s, batch={args.batch})")
+    print_table(["layout", "bytes", "scan rows/s", "DM history msg/s", "group history msg/s"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--sends", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=1000)
+    main(parser.parse_args())
@@ -0,0 +1,122 @@
+"""Chat list updates after chat creations: broadcast + refetch vs per-user deltas.
+
+Seeds U users, each in C chats, then creates E private chats between
+random pairs. Compares what keeping every online sidebar current costs:
+  - refetch: the old flow; a private chat creation told every online user
+             "chats_changed" and each refetched GET /chats/ in full
+  - delta:   record_chat_change bumps the two members' list versions and
+             each gets one chats_changed frame carrying the new chat
+
+    python -m benchmarks.bench_chat_delta --users 200 --chats 50 --events 20
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from ._common import print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_chat_delta_"))
+
+from sqlalchemy import event, insert, text  # noqa: E402
+
+from app.controllers import chats_controller  # noqa: E402
+from app.db import database, models  # noqa: E402
+from app.db.models import chat_users_table  # noqa: E402
+from app.ws import envelopes  # noqa: E402
+
+QUERIES = {"n": 0}
+
+
+@event.listens_for(database.engine, "before_cursor_execute")
+def _count(*_args):
+    QUERIES["n"] += 1
+
+
+def seed(users: int, chats: int, group_size: int):
+    database.Base.metadata.create_all(bind=database.engine)
+    stamp = time.time_ns()
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"username": f"bench-{stamp}-{i}", "password_hash": "x", "first_name": "f", "last_name": "l"}
+            for i in range(users)
+        ])
+        user_ids = [r[0] for r in conn.execute(text("SELECT id FROM users ORDER BY id"))][-users:]
+        # Groups of group_size consecutive users, enough for everyone to be in ~chats of them
+        groups = users * chats // group_size
+        conn.execute(insert(models.Chat), [{"chat_type": "group", "name": f"g{i}"} for i in range(groups)])
+        chat_ids = [r[0] for r in conn.execute(text("SELECT id FROM chats ORDER BY id"))][-groups:]
+        conn.execute(insert(chat_users_table), [
+            {"chat_id": chat_id, "user_id": user_ids[(i + k) % users]}
+            for i, chat_id in enumerate(chat_ids) for k in range(group_size)
+        ])
+    return user_ids
+
+
+def new_private_chat(db, a: int, b: int):
+    chat = models.Chat(chat_type="private")
+    db.add(chat)
+    db.flush()
+    db.execute(insert(chat_users_table), [{"chat_id": chat.id, "user_id": a}, {"chat_id": chat.id, "user_id": b}])
+    return chat.id
+
+
+def refetch(user_ids, pairs):
+    requests = payload = 0
+    QUERIES["n"] = 0
+    t0 = time.perf_counter()
+    for a, b in pairs:
+        db = database.SessionLocal()
+        try:
+            new_private_chat(db, a, b)
+            db.commit()
+            # Every online user refetches their whole list
+            for uid in user_ids:
+                chats = chats_controller.get_chat_list(db, uid)
+                payload += len(json.dumps([c.model_dump(mode="json") for c in chats]))
+                requests += 1
+        finally:
+            db.close()
+    ms = (time.perf_counter() - t0) * 1000.0
+    return ["refetch", len(pairs) * len(user_ids), requests, f"{payload:,}", QUERIES["n"], f"{ms:,.0f}"]
+
+
+def delta(pairs):
+    frames = payload = 0
+    QUERIES["n"] = 0
+    t0 = time.perf_counter()
+    for a, b in pairs:
+        db = database.SessionLocal()
+        try:
+            chat_id = new_private_chat(db, a, b)
+            changes = chats_controller.record_chat_change(db, chat_id, [a, b], "upsert")
+            db.commit()
+            out = envelopes.chats_changed_frames(chat_id, changes, chats_controller.changed_chat_outs(db, chat_id, changes))
+            frames += len(out)
+            payload += sum(len(f) for f in out.values())
+        finally:
+            db.close()
+    ms = (time.perf_counter() - t0) * 1000.0
+    return ["delta", frames, 0, f"{payload:,}", QUERIES["n"], f"{ms:,.0f}"]
+
+
+def main(args):
+    user_ids = seed(args.users, args.chats, args.group_size)
+    rng = random.Random(7)
+    print(f"users={args.users} chats/user~{args.chats} group size={args.group_size} private chats created={args.events}")
+    rows = [
+        refetch(user_ids, [tuple(rng.sample(user_ids, 2)) for _ in range(args.events)]),
+        delta([tuple(rng.sample(user_ids, 2)) for _ in range(args.events)]),
+    ]
+    print_table(["strategy", "notified", "REST calls", "bytes", "queries", "total ms"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--group-size", type=int, default=8)
+    parser.add_argument("--events", type=int, default=20)
+    main(parser.parse_args())
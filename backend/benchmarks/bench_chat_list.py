@@ -0,0 +1,111 @@
+"""GET /chats/ for a user in many chats: lazy ORM walk vs set-based projection.
+
+Seeds one user into C chats (a mix of private chats and groups of G
+members), then times building the sidebar list:
+  - lazy:       the old route body; user.chats, then participants loaded
+                per chat and walked for titles and UserBasic lists
+  - projection: chats_controller.get_chat_list; one query for the chats
+                (with summaries and pins), one for all participants
+
+    python -m benchmarks.bench_chat_list --chats 500 --group-size 8
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from ._common import percentile, print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_chat_list_"))
+
+from sqlalchemy import event, insert, text  # noqa: E402
+
+from app.controllers import chats_controller  # noqa: E402
+from app.db import database, models, schemas  # noqa: E402
+from app.db.models import chat_users_table  # noqa: E402
+
+QUERIES = {"n": 0}
+
+
+@event.listens_for(database.engine, "before_cursor_execute")
+def _count(*_args):
+    QUERIES["n"] += 1
+
+
+def seed(chats: int, group_size: int) -> int:
+    database.Base.metadata.create_all(bind=database.engine)
+    stamp = time.time_ns()
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"username": f"bench-{stamp}-{i}", "password_hash": "x", "first_name": "f", "last_name": "l"}
+            for i in range(chats + group_size)
+        ])
+        user_ids = [r[0] for r in conn.execute(text("SELECT id FROM users ORDER BY id"))][-(chats + group_size):]
+        me, peers = user_ids[0], user_ids[1:]
+        # Self chat, then half private chats and half groups
+        conn.execute(insert(models.Chat), [{"chat_type": "private"}] + [
+            {"chat_type": "private"} if i % 2 else {"chat_type": "group", "name": f"g{i}", "admin_user_id": me}
+            for i in range(chats - 1)
+        ])
+        chat_rows = conn.execute(text("SELECT id, chat_type FROM chats ORDER BY id")).all()[-chats:]
+        members = [{"chat_id": chat_rows[0][0], "user_id": me}]
+        for i, (chat_id, chat_type) in enumerate(chat_rows[1:]):
+            others = [peers[i % len(peers)]] if chat_type == "private" else [peers[(i + k) % len(peers)] for k in range(group_size - 1)]
+            members += [{"chat_id": chat_id, "user_id": uid} for uid in [me, *others]]
+        conn.execute(insert(chat_users_table), members)
+    return me
+
+
+def lazy(db, user_id: int):
+    # The route body before this change (minus the self-chat check)
+    pinned_chat_ids = {pc.chat_id for pc in db.query(models.PinnedChat.chat_id).filter(models.PinnedChat.user_id == user_id)}
+    result = []
+    for c, summary, pinned_at in (
+        db.query(models.Chat, models.ChatSummary, models.PinnedChat.pinned_at)
+        .join(chat_users_table, chat_users_table.c.chat_id == models.Chat.id)
+        .outerjoin(models.ChatSummary, models.ChatSummary.chat_id == models.Chat.id)
+        .outerjoin(models.PinnedChat, (models.PinnedChat.chat_id == models.Chat.id) & (models.PinnedChat.user_id == user_id))
+        .filter(chat_users_table.c.user_id == user_id)
+    ):
+        result.append(schemas.ChatOut(
+            id=c.id,
+            chat_type=c.chat_type,
+            name=c.name,
+            admin_user_id=c.admin_user_id,
+            participants=[schemas.UserBasic(id=u.id, username=u.username, first_name=u.first_name, last_name=u.last_name) for u in c.participants],
+            title=chats_controller.chat_title(c.chat_type, c.name, c.participants, user_id),
+            is_pinned=c.id in pinned_chat_ids,
+        ))
+    return result
+
+
+def measure(name: str, fn, user_id: int, reps: int):
+    times, result, queries = [], None, 0
+    for _ in range(reps):
+        db = database.SessionLocal()
+        QUERIES["n"] = 0
+        t0 = time.perf_counter()
+        try:
+            result = fn(db, user_id)
+        finally:
+            db.close()
+        times.append((time.perf_counter() - t0) * 1000.0)
+        queries = QUERIES["n"]
+    return [name, f"{percentile(times, 50):,.1f}", f"{percentile(times, 99):,.1f}", queries], result
+
+
+def main(args):
+    me = seed(args.chats, args.group_size)
+    print(f"user in {args.chats} chats (groups of {args.group_size}), reps={args.reps}")
+    row_a, old = measure("lazy", lazy, me, args.reps)
+    row_b, new = measure("projection", chats_controller.get_chat_list, me, args.reps)
+    assert sorted((c.id, c.title, len(c.participants)) for c in old) == sorted((c.id, c.title, c.member_count) for c in new)
+    print_table(["strategy", "p50 ms", "p99 ms", "queries"], [row_a, row_b])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--group-size", type=int, default=8)
+    parser.add_argument("--reps", type=int, default=10)
+    main(parser.parse_args())
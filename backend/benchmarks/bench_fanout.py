@@ -0,0 +1,88 @@
+"""Room fan-out latency: sequential sends vs per-socket outboxes.
+
+Measures delivery latency (broadcast call -> frame handed to the socket) seen
+by the fast members of a room while a share of members are slow readers.
+
+    python -m benchmarks.bench_fanout --members 200 --messages 50
+"""
+import argparse
+import asyncio
+import time
+
+from ._common import FakeSocket, percentile, print_table, setup_env
+
+setup_env()
+
+from app.ws.ws_manager import ConnectionManager  # noqa: E402
+
+
+async def _legacy_broadcast(sockets, message: str):
+    # The pre-outbox behaviour: await each socket in turn
+    for ws in sockets:
+        try:
+            await ws.send_text(message)
+        except Exception:
+            pass
+
+
+async def run_case(mode: str, members: int, slow_pct: float, messages: int, interval: float, slow_delay: float):
+    n_slow = int(members * slow_pct / 100.0)
+    sockets = [FakeSocket(delay=slow_delay if i < n_slow else 0.0) for i in range(members)]
+    fast = sockets[n_slow:]
+    manager = ConnectionManager()
+    for uid, ws in enumerate(sockets, start=1):
+        manager.register_user_socket(uid, ws)
+        manager.subscribe_room(ws, uid, "1")
+    sent_at = []
+    start = time.perf_counter()
+    for i in range(messages):
+        frame = f'{{"v": 1, "type": "message", "chat_id": 1, "message": {{"id": {i}}}}}'
+        sent_at.append(time.perf_counter())
+        if mode == "sequential":
+            await _legacy_broadcast(sockets, frame)
+        else:
+            await manager.broadcast_room("1", frame)
+        await asyncio.sleep(interval)
+    # Wait for the fast members to drain
+    deadline = time.perf_counter() + 30
+    while any(ws.frames < messages for ws in fast) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    latencies = []
+    for ws in fast:
+        for i, t in enumerate(ws.received_at[:messages]):
+            latencies.append((t - sent_at[i]) * 1000.0)
+    for uid, ws in enumerate(sockets, start=1):
+        manager.unregister_user_socket(uid, ws)
+    return {
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "elapsed": elapsed,
+        "stats": manager.fanout_stats(),
+    }
+
+
+async def main(args):
+    rows = []
+    for mode in ("sequential", "outbox"):
+        for slow_pct in (0.0, args.slow_pct):
+            r = await run_case(mode, args.members, slow_pct, args.messages, args.interval_ms / 1000.0, args.slow_ms / 1000.0)
+            rows.append([
+                mode,
+                f"{slow_pct:g}%",
+                f"{r['p50']:.2f}",
+                f"{r['p99']:.2f}",
+                f"{r['elapsed']:.2f}",
+            ])
+    print(f"members={args.members} messages={args.messages} interval={args.interval_ms}ms slow_delay={args.slow_ms}ms")
+    print_table(["mode", "slow", "p50 ms (fast)", "p99 ms (fast)", "wall s"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--slow-pct", type=float, default=5.0)
+    parser.add_argument("--slow-ms", type=float, default=20.0)
+    parser.add_argument("--interval-ms", type=float, default=5.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,77 @@
+"""Group E2EE fan-out: room broadcast of every per-recipient row vs routing each to its recipient.
+
+A send with `items` stores one ciphertext row per member. For groups of N
+members, each with one socket subscribed to the room, one such send:
+  - broadcast: every row goes to every subscriber (N x N envelopes)
+  - routed:    each row goes only to its recipient's sockets (N envelopes)
+
+    python -m benchmarks.bench_fanout_routing --sizes 50 200 1000
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import time
+
+from ._common import FakeSocket, print_table, setup_env
+
+setup_env()
+# Room for a whole broadcast fan-out per socket, so nothing is dropped and every byte is counted
+os.environ.setdefault("WS_SEND_QUEUE_MAX", "4096")
+
+from app.ws import envelopes  # noqa: E402
+from app.ws.ws_manager import ConnectionManager  # noqa: E402
+
+CHAT_ID = 1
+
+
+def fanout_rows(members: int, sender: int):
+    # What envelopes.encode_message gives for a 200-byte text encrypted per member
+    ciphertext = base64.b64encode(os.urandom(216)).decode("ascii")
+    return [
+        (10_000 + uid, uid, json.dumps({
+            "id": 10_000 + uid, "chat_id": CHAT_ID, "seq": 1, "sender_id": sender, "recipient_id": uid,
+            "content": None, "content_type": "text", "ciphertext": ciphertext, "nonce": "A" * 16, "algo": "AES-GCM",
+        }).encode("utf-8"))
+        for uid in range(1, members + 1)
+    ]
+
+
+async def run(members: int, routed: bool):
+    manager = ConnectionManager()
+    sockets = [FakeSocket() for _ in range(members)]
+    for uid, ws in enumerate(sockets, start=1):
+        manager.register_user_socket(uid, ws)
+        manager.subscribe_room(ws, uid, str(CHAT_ID))
+    rows = fanout_rows(members, sender=1)
+    t0 = time.perf_counter()
+    for message_id, recipient_id, body in rows:
+        if routed:
+            manager._deliver_message(CHAT_ID, message_id, recipient_id, body)
+        else:
+            # The old path: every row to the whole room
+            manager._deliver_room(str(CHAT_ID), envelopes.message_frame(CHAT_ID, body))
+    expected = 1 if routed else members
+    deadline = time.perf_counter() + 60
+    while any(ws.frames < expected for ws in sockets) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.001)
+    ms = (time.perf_counter() - t0) * 1000.0
+    return [
+        members, "routed" if routed else "broadcast",
+        f"{sum(ws.frames for ws in sockets):,}", f"{sum(ws.bytes_sent for ws in sockets):,}", f"{ms:,.0f}",
+    ]
+
+
+def main(args):
+    rows = []
+    for n in args.sizes:
+        rows.append(asyncio.run(run(n, routed=False)))
+        rows.append(asyncio.run(run(n, routed=True)))
+    print_table(["members", "strategy", "envelopes", "bytes sent", "ms"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 1000])
+    main(parser.parse_args())
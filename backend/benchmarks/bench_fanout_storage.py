@@ -0,0 +1,124 @@
+"""Group E2EE sends: one messages row per recipient vs one row + message_recipients.
+
+Writes S sends of a 200-byte message encrypted for every member of a
+G-member group and compares the two storage layouts:
+  - rows:    the old write path; G full messages rows per send (chat, sender,
+             time, type and seq repeated on each), added one ORM object at a time
+  - compact: create_chat_message; one logical messages row and a single
+             executemany of G (message_id, recipient_id, ciphertext, nonce, algo)
+
+Storage is the growth of the tables and their indexes (sqlite dbstat, or
+pg_total_relation_size on Postgres).
+
+    python -m benchmarks.bench_fanout_storage --members 100 --sends 500
+"""
+import argparse
+import base64
+import os
+import tempfile
+import time
+
+from ._common import percentile, print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_fanout_storage_"))
+
+from sqlalchemy import event, text  # noqa: E402
+
+from app.controllers import messages_controller  # noqa: E402
+from app.controllers.chats_controller import record_message  # noqa: E402
+from app.db import database, models, schemas  # noqa: E402
+
+QUERIES = {"n": 0}
+
+
+@event.listens_for(database.engine, "before_cursor_execute")
+def _count(*_args):
+    QUERIES["n"] += 1
+
+
+def seed(members: int):
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        users = [models.User(username=f"bench-{i}-{time.time_ns()}", password_hash="x") for i in range(members)]
+        chats = [models.Chat(chat_type="group", name=name) for name in ("rows", "compact")]
+        for chat in chats:
+            chat.participants.extend(users)
+        db.add_all([*users, *chats])
+        db.commit()
+        return [u.id for u in users], [c.id for c in chats]
+    finally:
+        db.close()
+
+
+def storage_bytes() -> int:
+    with database.engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            return conn.execute(text(
+                "SELECT pg_total_relation_size('messages') + pg_total_relation_size('message_recipients')"
+            )).scalar_one()
+        return conn.execute(text(
+            "SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN "
+            "(SELECT name FROM sqlite_master WHERE tbl_name IN ('messages', 'message_recipients'))"
+        )).scalar_one()
+
+
+def rows_send(db, body: schemas.MessageCreate, chat_id: int, sender_id: int):
+    # The write path before message_recipients: one full row per item
+    seq = messages_controller.next_seq(db, chat_id)
+    created = []
+    for it in body.items:
+        rec = models.Message(
+            chat_id=chat_id, sender_id=sender_id, recipient_id=it.recipient_id, content=None,
+            content_type=body.content_type, ciphertext=it.ciphertext, nonce=it.nonce, algo=it.algo, seq=seq,
+        )
+        db.add(rec)
+        created.append(rec)
+    db.flush()
+    record_message(db, chat_id, created[-1])
+    db.commit()
+
+
+def compact_send(db, body: schemas.MessageCreate, chat_id: int, sender_id: int):
+    messages_controller.create_chat_message(db=db, message=body, chat_id=chat_id, sender_id=sender_id)
+
+
+def measure(name: str, fn, chat_id: int, user_ids, sends: int):
+    items = [
+        {"recipient_id": uid, "ciphertext": base64.b64encode(os.urandom(216)).decode("ascii"), "nonce": "A" * 16, "algo": "AES-GCM"}
+        for uid in user_ids
+    ]
+    body = schemas.MessageCreate(items=items)
+    before = storage_bytes()
+    times = []
+    QUERIES["n"] = 0
+    for n in range(sends):
+        db = database.SessionLocal()
+        t0 = time.perf_counter()
+        try:
+            fn(db, body, chat_id, user_ids[n % len(user_ids)])
+        finally:
+            db.close()
+        times.append((time.perf_counter() - t0) * 1000.0)
+    grown = storage_bytes() - before
+    return [
+        len(user_ids), name, f"{grown:,}", f"{grown // sends:,}", f"{QUERIES['n'] / sends:.1f}",
+        f"{percentile(times, 50):.2f}", f"{percentile(times, 99):.2f}", f"{sum(times):,.0f}",
+    ]
+
+
+def main(args):
+    user_ids, (rows_chat, compact_chat) = seed(args.members)
+    rows = [
+        measure("rows", rows_send, rows_chat, user_ids, args.sends),
+        measure("compact", compact_send, compact_chat, user_ids, args.sends),
+    ]
+    print(f"{args.sends} sends, each encrypted for all {args.members} members")
+    print_table(["members", "layout", "bytes", "bytes/send", "queries/send", "p50 ms", "p99 ms", "total ms"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=100)
+    parser.add_argument("--sends", type=int, default=500)
+    main(parser.parse_args())
@@ -0,0 +1,134 @@
+"""Message history paging: keyset pages at increasing depth of one big chat.
+
+Seeds a chat with N messages from a pool of senders (some with
+attachments) and times GET /chats/{id}/messages pages via the same
+controller + encoder the route uses, at cursors from the newest message
+down to the very first. The envelope cache is cleared before every page
+so each one pays the full query + encode cost. With --full it also times
+the old unpaginated read (.all() + lazy sender/attachment loads) for scale.
+
+    python -m benchmarks.bench_history --messages 1000000 --limit 50
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from ._common import percentile, print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_history_"))
+
+from sqlalchemy import event, insert  # noqa: E402
+
+from app.controllers import messages_controller  # noqa: E402
+from app.db import database, models  # noqa: E402
+from app.ws import envelopes  # noqa: E402
+from app.ws.envelopes import envelope_cache  # noqa: E402
+
+QUERIES = {"n": 0}
+
+
+@event.listens_for(database.engine, "before_cursor_execute")
+def _count(*_args):
+    QUERIES["n"] += 1
+
+
+def seed(messages: int, senders: int):
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        users = [models.User(username=f"bench-{i}-{time.time_ns()}", password_hash="x") for i in range(senders)]
+        chat = models.Chat(chat_type="group", name="bench")
+        chat.participants.extend(users)
+        db.add_all([*users, chat])
+        db.flush()
+        atts = [models.Attachment(filename=f"f{i}.bin", mime_type="application/octet-stream", size_bytes=1024,
+                                  stored_path=f"bench/{i}", nonce=bytes(12), algo="AES-GCM", uploaded_by=users[0].id)
+                for i in range(100)]
+        db.add_all(atts)
+        db.flush()
+        user_ids, att_ids, chat_id = [u.id for u in users], [a.id for a in atts], chat.id
+        db.commit()
+    finally:
+        db.close()
+    rnd = random.Random(1)
+    batch = 20000
+    with database.engine.begin() as conn:
+        for start in range(0, messages, batch):
+            conn.execute(insert(models.Message), [
+                {
+                    "chat_id": chat_id,
+                    "sender_id": rnd.choice(user_ids),
+                    "content_type": "text",
+                    "ciphertext_bin": bytes(72),
+                    "nonce_bin": bytes(12),
+                    "algo": "AES-GCM",
+                    "attachment_id": (rnd.choice(att_ids) if rnd.random() < 0.01 else None),
+                }
+                for _ in range(min(batch, messages - start))
+            ])
+    db = database.SessionLocal()
+    try:
+        first = db.query(models.Message.id).filter(models.Message.chat_id == chat_id).order_by(models.Message.id.asc()).first()[0]
+        last = db.query(models.Message.id).filter(models.Message.chat_id == chat_id).order_by(models.Message.id.desc()).first()[0]
+    finally:
+        db.close()
+    return chat_id, first, last
+
+
+def time_page(chat_id: int, before_id, limit: int, reps: int):
+    times, size, queries = [], 0, 0
+    for _ in range(reps):
+        envelope_cache.clear()
+        db = database.SessionLocal()
+        QUERIES["n"] = 0
+        t0 = time.perf_counter()
+        try:
+            msgs, cursor = messages_controller.get_chat_messages_page(db, chat_id, limit, before_id=before_id)
+            size = len(envelopes.message_page(msgs, cursor))
+        finally:
+            db.close()
+        times.append((time.perf_counter() - t0) * 1000.0)
+        queries = QUERIES["n"]
+    return times, size, queries
+
+
+def time_full(chat_id: int):
+    envelope_cache.clear()
+    db = database.SessionLocal()
+    QUERIES["n"] = 0
+    t0 = time.perf_counter()
+    try:
+        msgs = db.query(models.Message).filter(models.Message.chat_id == chat_id).order_by(models.Message.id.asc()).all()
+        size = len(envelopes.history_page(msgs))
+    finally:
+        db.close()
+    return (time.perf_counter() - t0) * 1000.0, size, QUERIES["n"]
+
+
+def main(args):
+    t0 = time.perf_counter()
+    chat_id, first, last = seed(args.messages, args.senders)
+    print(f"seeded {args.messages:,} messages in {time.perf_counter() - t0:.1f}s; limit={args.limit} reps={args.reps}")
+    rows = []
+    for depth in (0.0, 0.1, 0.5, 0.9, 0.999):
+        offset = int((last - first) * depth)
+        before_id = None if depth == 0 else last + 1 - offset
+        times, size, queries = time_page(chat_id, before_id, args.limit, args.reps)
+        rows.append([f"{depth:.1%}", f"{offset:,}", f"{percentile(times, 50):.2f}", f"{percentile(times, 99):.2f}", f"{size:,}", queries])
+    print_table(["depth", "messages newer", "p50 ms", "p99 ms", "page bytes", "queries"], rows)
+    if args.full:
+        ms, size, queries = time_full(chat_id)
+        print()
+        print(f"old full read: {ms:,.0f} ms, {size / 1e6:,.1f} MB, {queries} queries")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--reps", type=int, default=20)
+    parser.add_argument("--full", action="store_true", help="also time the old unpaginated read")
+    main(parser.parse_args())
@@ -0,0 +1,99 @@
+"""History of a group E2EE chat: every fan-out row vs only the viewer's copies.
+
+Seeds a group of G members with S sends, each stored as G per-recipient
+ciphertext rows, then measures what one member pays to show the newest
+`limit` messages:
+  - unfiltered: pages of all rows (others' copies included), as many as
+                it takes to collect `limit` rows addressed to the viewer
+  - filtered:   one page with viewer_id, on (chat_id, recipient_id, id)
+
+    python -m benchmarks.bench_history_fanout --members 50 200 --sends 2000 --limit 50
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from ._common import percentile, print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_history_fanout_"))
+
+from sqlalchemy import insert  # noqa: E402
+
+from app.controllers import messages_controller  # noqa: E402
+from app.db import database, models  # noqa: E402
+from app.ws import envelopes  # noqa: E402
+from app.ws.envelopes import envelope_cache  # noqa: E402
+
+
+def seed(members: int, sends: int):
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        users = [models.User(username=f"bench-{members}-{i}-{time.time_ns()}", password_hash="x") for i in range(members)]
+        chat = models.Chat(chat_type="group", name="bench", last_seq=sends)
+        chat.participants.extend(users)
+        db.add_all([*users, chat])
+        db.commit()
+        user_ids, chat_id = [u.id for u in users], chat.id
+    finally:
+        db.close()
+    ciphertext = os.urandom(216)
+    with database.engine.begin() as conn:
+        for start in range(0, sends, 200):
+            conn.execute(insert(models.Message), [
+                {"chat_id": chat_id, "seq": n + 1, "sender_id": user_ids[n % members], "recipient_id": uid,
+                 "content_type": "text", "ciphertext_bin": ciphertext, "nonce_bin": bytes(12), "algo": "AES-GCM"}
+                for n in range(start, min(sends, start + 200)) for uid in user_ids
+            ])
+    return chat_id, user_ids[-1]
+
+
+def unfiltered(db, chat_id: int, viewer: int, limit: int):
+    mine, pages, size, cursor = 0, 0, 0, None
+    while mine < limit:
+        rows, cursor = messages_controller.get_chat_messages_page(db, chat_id, limit, before_id=cursor)
+        pages += 1
+        size += len(envelopes.message_page(rows, cursor))
+        mine += sum(1 for m in rows if m.recipient_id in (None, viewer))
+        if cursor is None:
+            break
+    return pages, size
+
+
+def filtered(db, chat_id: int, viewer: int, limit: int):
+    rows, cursor = messages_controller.get_chat_messages_page(db, chat_id, limit, viewer_id=viewer)
+    return 1, len(envelopes.message_page(rows, cursor))
+
+
+def measure(name: str, fn, members: int, chat_id: int, viewer: int, limit: int, reps: int):
+    times, pages, size = [], 0, 0
+    for _ in range(reps):
+        envelope_cache.clear()
+        db = database.SessionLocal()
+        t0 = time.perf_counter()
+        try:
+            pages, size = fn(db, chat_id, viewer, limit)
+        finally:
+            db.close()
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return [members, name, pages, f"{size:,}", f"{percentile(times, 50):,.1f}", f"{percentile(times, 99):,.1f}"]
+
+
+def main(args):
+    rows = []
+    for members in args.members:
+        chat_id, viewer = seed(members, args.sends)
+        rows.append(measure("unfiltered", unfiltered, members, chat_id, viewer, args.limit, args.reps))
+        rows.append(measure("filtered", filtered, members, chat_id, viewer, args.limit, args.reps))
+    print(f"{args.sends} sends per group, newest {args.limit} messages for one member, reps={args.reps}")
+    print_table(["members", "strategy", "pages", "bytes", "p50 ms", "p99 ms"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--sends", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--reps", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,99 @@
+"""Message ingest throughput: commit per message vs group commit.
+
+C concurrent senders spread over R chats each push M messages through
+MessageWriter.submit, the path used by the WS send_message handler and
+POST /chats/{id}/messages. Runs against a temp sqlite file by default;
+point DATABASE_URL at Postgres to measure the real thing.
+
+    python -m benchmarks.bench_ingest --senders 100 --messages 20 --window-ms 5
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from ._common import percentile, print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_ingest_"))
+
+from sqlalchemy import event  # noqa: E402
+
+from app.db import database, models, schemas  # noqa: E402
+from app.core.group_commit import MessageWriter  # noqa: E402
+
+if database.ASYNC_DATABASE_URL.startswith("sqlite"):
+    # Let many concurrent single-message writers queue on the file lock
+    # instead of failing after sqlite's default 5s
+    @event.listens_for(database.async_engine.sync_engine, "connect")
+    def _busy_timeout(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA busy_timeout = 120000")
+        cur.close()
+
+
+def seed(chats: int):
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        user = models.User(username=f"bench-{time.time_ns()}", password_hash="x")
+        rows = [models.Chat(chat_type="group", name=f"bench-{i}") for i in range(chats)]
+        for c in rows:
+            c.participants.append(user)
+        db.add_all([user, *rows])
+        db.commit()
+
+        class Sender:
+            id = user.id
+            username = user.username
+
+        return Sender(), [c.id for c in rows]
+    finally:
+        db.close()
+
+
+async def run(writer: MessageWriter, sender, chat_ids, senders: int, messages: int):
+    latencies: list = []
+
+    async def one(n: int):
+        chat_id = chat_ids[n % len(chat_ids)]
+        for k in range(messages):
+            t0 = time.perf_counter()
+            await writer.submit(schemas.MessageCreate(content=f"{n}:{k}"), chat_id, sender)
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(senders)))
+    return time.perf_counter() - t0, latencies
+
+
+async def main(args):
+    sender, chat_ids = seed(args.chats)
+    rows = []
+    modes = [("commit per message", MessageWriter(enabled=False))]
+    for window in args.window_ms:
+        modes.append((f"group commit {window:g}ms", MessageWriter(enabled=True, window_ms=window, max_batch=args.max_batch)))
+    for name, writer in modes:
+        elapsed, lat = await run(writer, sender, chat_ids, args.senders, args.messages)
+        total = args.senders * args.messages
+        stats = writer.stats()
+        rows.append([
+            name,
+            f"{total / elapsed:.0f}",
+            f"{percentile(lat, 50):.1f}",
+            f"{percentile(lat, 99):.1f}",
+            f"{stats['avg_batch']:.1f}" if writer.enabled else "1.0",
+        ])
+    await database.async_engine.dispose()
+    print(f"db={database.ASYNC_DATABASE_URL.split('://')[0]} senders={args.senders} messages/sender={args.messages} chats={args.chats}")
+    print_table(["mode", "msgs/s", "p50 ms", "p99 ms", "avg batch"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--senders", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--window-ms", type=float, nargs="+", default=[2.0, 5.0])
+    parser.add_argument("--max-batch", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
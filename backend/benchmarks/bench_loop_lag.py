@@ -0,0 +1,119 @@
+"""Event-loop lag under concurrent sends: blocking Session vs async engine.
+
+Runs the WS send_message DB step (messages_controller.create_chat_message +
+envelope encode) for C concurrent senders on one event loop, while a probe
+task measures how late its 5 ms ticks fire. Every send also runs a
+simulated slow query (pg_sleep UDF on sqlite) to stand in for DB latency.
+
+    python -m benchmarks.bench_loop_lag --senders 50 --sends 10 --query-ms 5
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+
+from ._common import percentile, print_table, setup_env
+
+_tmp = tempfile.mkdtemp(prefix="bench_lag_")
+setup_env(_tmp)
+
+from sqlalchemy import event, text  # noqa: E402
+
+from app.db import database, models, schemas  # noqa: E402
+from app.controllers import messages_controller  # noqa: E402
+from app.ws import envelopes  # noqa: E402
+
+
+def _install_sleep(dbapi_conn, _record):
+    dbapi_conn.create_function("pg_sleep", 1, lambda ms: time.sleep(ms / 1000.0) or 0)
+
+
+event.listen(database.engine, "connect", _install_sleep)
+event.listen(database.async_engine.sync_engine, "connect", _install_sleep)
+
+
+def seed() -> tuple:
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        user = models.User(username="bench", password_hash="x")
+        chat = models.Chat(chat_type="group", name="bench")
+        chat.participants.append(user)
+        db.add_all([user, chat])
+        db.commit()
+        return user.id, chat.id
+    finally:
+        db.close()
+
+
+def _send(s, user_id: int, chat_id: int, query_ms: float, i: int) -> bytes:
+    s.execute(text("SELECT pg_sleep(:ms)"), {"ms": query_ms})
+    msg = schemas.MessageCreate(content=f"m{i}", content_type="text")
+    saved = messages_controller.create_chat_message(db=s, message=msg, chat_id=chat_id, sender_id=user_id)
+    return envelopes.encode_message(saved[0])
+
+
+async def send_blocking(user_id, chat_id, query_ms, i):
+    db = database.SessionLocal()
+    try:
+        _send(db, user_id, chat_id, query_ms, i)
+    finally:
+        db.close()
+
+
+async def send_async(user_id, chat_id, query_ms, i):
+    async with database.AsyncSessionLocal() as db:
+        await db.run_sync(_send, user_id, chat_id, query_ms, i)
+
+
+async def probe(lags: list, stop: asyncio.Event, interval: float = 0.005):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        lags.append((loop.time() - t0 - interval) * 1000.0)
+
+
+async def run(send, user_id, chat_id, senders: int, sends: int, query_ms: float):
+    lags: list = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, stop))
+    await asyncio.sleep(0.02)
+
+    async def sender(n: int):
+        for k in range(sends):
+            await send(user_id, chat_id, query_ms, n * sends + k)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(sender(n) for n in range(senders)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await probe_task
+    return lags, elapsed
+
+
+async def main(args):
+    user_id, chat_id = seed()
+    rows = []
+    for name, send in (("blocking Session", send_blocking), ("async engine", send_async)):
+        lags, elapsed = await run(send, user_id, chat_id, args.senders, args.sends, args.query_ms)
+        total = args.senders * args.sends
+        rows.append([
+            name,
+            f"{percentile(lags, 50):.1f}",
+            f"{percentile(lags, 99):.1f}",
+            f"{max(lags) if lags else 0:.1f}",
+            len(lags),
+            f"{total / elapsed:.0f}",
+        ])
+    await database.async_engine.dispose()
+    print(f"senders={args.senders} sends/sender={args.sends} simulated query={args.query_ms}ms")
+    print_table(["db path", "lag p50 ms", "lag p99 ms", "lag max ms", "probe ticks", "sends/s"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--sends", type=int, default=10)
+    parser.add_argument("--query-ms", type=float, default=5.0)
+    asyncio.run(main(parser.parse_args()))
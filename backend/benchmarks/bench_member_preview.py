@@ -0,0 +1,119 @@
+"""Chat list payload with large groups: every participant embedded vs a member preview.
+
+Seeds G groups of M members (a company-wide group is the extreme case)
+plus C small chats for one user, then compares GET /chats/ for that user:
+  - embedded: the old ChatOut; every chat carries all its participants
+  - preview:  member_count plus the first CHAT_MEMBER_PREVIEW members;
+              the full list is paged from GET /chats/{id}/members
+Every member of a big group pays the embedded cost on each list load.
+
+    python -m benchmarks.bench_member_preview --members 2000 --groups 3 --chats 50
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from ._common import percentile, print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_member_preview_"))
+
+from sqlalchemy import insert, select, text  # noqa: E402
+
+from app.controllers import chats_controller  # noqa: E402
+from app.db import database, models, schemas  # noqa: E402
+from app.db.models import chat_users_table  # noqa: E402
+
+
+def seed(members: int, groups: int, chats: int) -> int:
+    database.Base.metadata.create_all(bind=database.engine)
+    stamp = time.time_ns()
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"username": f"bench-{stamp}-{i}", "password_hash": "x", "first_name": "First", "last_name": f"Last{i}"}
+            for i in range(members)
+        ])
+        user_ids = [r[0] for r in conn.execute(text("SELECT id FROM users ORDER BY id"))][-members:]
+        me = user_ids[0]
+        conn.execute(insert(models.Chat), [{"chat_type": "private"}] + [
+            {"chat_type": "group", "name": f"company-{i}", "admin_user_id": me} for i in range(groups)
+        ] + [{"chat_type": "private"} for _ in range(chats)])
+        chat_ids = [r[0] for r in conn.execute(text("SELECT id FROM chats ORDER BY id"))][-(1 + groups + chats):]
+        rows = [{"chat_id": chat_ids[0], "user_id": me}]
+        rows += [{"chat_id": c, "user_id": u} for c in chat_ids[1:1 + groups] for u in user_ids]
+        rows += [{"chat_id": c, "user_id": u} for i, c in enumerate(chat_ids[1 + groups:]) for u in (me, user_ids[1 + i])]
+        conn.execute(insert(chat_users_table), rows)
+    return me
+
+
+def embedded(db, user_id: int):
+    # The list as before: every participant of every chat
+    chats = chats_controller.get_chat_list(db, user_id)
+    u, cu, mine = models.User, chat_users_table, chat_users_table.alias("mine")
+    full = {}
+    for chat_id, uid, username, first_name, last_name in db.execute(
+        select(cu.c.chat_id, u.id, u.username, u.first_name, u.last_name)
+        .join(u, u.id == cu.c.user_id)
+        .join(mine, mine.c.chat_id == cu.c.chat_id)
+        .where(mine.c.user_id == user_id)
+        .order_by(cu.c.chat_id, u.id)
+    ):
+        full.setdefault(chat_id, []).append(
+            schemas.UserBasic(id=uid, username=username, first_name=first_name, last_name=last_name)
+        )
+    return [c.model_copy(update={"participants": full.get(c.id, [])}) for c in chats]
+
+
+def preview(db, user_id: int):
+    return chats_controller.get_chat_list(db, user_id)
+
+
+def measure(name: str, fn, user_id: int, reps: int):
+    times, size = [], 0
+    for _ in range(reps):
+        db = database.SessionLocal()
+        t0 = time.perf_counter()
+        try:
+            body = json.dumps([c.model_dump(mode="json") for c in fn(db, user_id)])
+        finally:
+            db.close()
+        times.append((time.perf_counter() - t0) * 1000.0)
+        size = len(body)
+    return [name, f"{size:,}", f"{percentile(times, 50):,.1f}", f"{percentile(times, 99):,.1f}"]
+
+
+def members_pages(chat_id: int, page: int):
+    db = database.SessionLocal()
+    try:
+        pages = total = 0
+        cursor = None
+        while True:
+            members, cursor = chats_controller.get_chat_members_page(db, chat_id, page, after_id=cursor)
+            pages += 1
+            total += len(json.dumps({"members": [m.model_dump(mode="json") for m in members], "next_cursor": cursor}))
+            if cursor is None:
+                return pages, total
+    finally:
+        db.close()
+
+
+def main(args):
+    me = seed(args.members, args.groups, args.chats)
+    print(f"{args.groups} groups x {args.members} members + {args.chats} private chats, "
+          f"preview={chats_controller.member_preview_size()}, reps={args.reps}")
+    rows = [measure("embedded", embedded, me, args.reps), measure("preview", preview, me, args.reps)]
+    print_table(["strategy", "GET /chats/ bytes", "p50 ms", "p99 ms"], rows)
+    group_id = next(c.id for c in preview(database.SessionLocal(), me) if c.chat_type == "group")
+    pages, total = members_pages(group_id, args.page)
+    print(f"opening one group's member list: {pages} pages of {args.page}, {total:,} bytes, only when asked for")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=2000)
+    parser.add_argument("--groups", type=int, default=3)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--page", type=int, default=100)
+    parser.add_argument("--reps", type=int, default=10)
+    main(parser.parse_args())
@@ -0,0 +1,87 @@
+"""send_message DB path throughput with and without the membership index.
+
+Seeds a SQLite database with one group chat and replays the per-frame work
+websocket_unified does for send_message: authorize, insert, collect the
+recipient list for new_message notifies.
+
+    python -m benchmarks.bench_membership --members 50 --messages 2000
+"""
+import argparse
+import tempfile
+import time
+
+from ._common import print_table, setup_env
+
+_tmp = tempfile.mkdtemp(prefix="bench-membership-")
+setup_env(_tmp)
+
+from app.db import database, models, schemas  # noqa: E402
+from app.controllers import messages_controller  # noqa: E402
+from app.core.membership import MembershipIndex  # noqa: E402
+
+
+def seed(members: int) -> int:
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        users = [models.User(username=f"u{i}", password_hash="x") for i in range(members)]
+        db.add_all(users)
+        db.flush()
+        chat = models.Chat(chat_type="group", name="bench")
+        chat.participants.extend(users)
+        db.add(chat)
+        db.commit()
+        return chat.id
+    finally:
+        db.close()
+
+
+def send_uncached(chat_id: int, user_id: int, body: schemas.MessageCreate) -> int:
+    # The pre-index path: membership query, insert, then participants again
+    db = database.SessionLocal()
+    try:
+        ok = db.query(models.Chat).filter(models.Chat.id == chat_id, models.Chat.participants.any(id=user_id)).first() is not None
+        if not ok:
+            return 0
+        messages_controller.create_chat_message(db=db, message=body, chat_id=chat_id, sender_id=user_id)
+        chat = db.query(models.Chat).get(chat_id)
+        return len([p.id for p in chat.participants])
+    finally:
+        db.close()
+
+
+def send_cached(index: MembershipIndex, chat_id: int, user_id: int, body: schemas.MessageCreate) -> int:
+    if not index.is_member(chat_id, user_id):
+        return 0
+    db = database.SessionLocal()
+    try:
+        messages_controller.create_chat_message(db=db, message=body, chat_id=chat_id, sender_id=user_id)
+    finally:
+        db.close()
+    return len(index.members(chat_id))
+
+
+def main(args):
+    chat_id = seed(args.members)
+    body = schemas.MessageCreate(content="hello", content_type="text")
+    index = MembershipIndex(enabled=True)
+    rows = []
+    for name, fn in (
+        ("no cache", lambda uid: send_uncached(chat_id, uid, body)),
+        ("membership index", lambda uid: send_cached(index, chat_id, uid, body)),
+    ):
+        t0 = time.perf_counter()
+        for i in range(args.messages):
+            assert fn(1 + i % args.members) == args.members
+        elapsed = time.perf_counter() - t0
+        rows.append([name, f"{args.messages / elapsed:.0f}", f"{elapsed / args.messages * 1000:.3f}"])
+    print(f"members={args.members} messages={args.messages} db={database.DATABASE_URL}")
+    print_table(["mode", "msgs/s", "ms/msg"], rows)
+    print(f"index stats: {index.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=2000)
+    main(parser.parse_args())
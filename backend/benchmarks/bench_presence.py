@@ -0,0 +1,91 @@
+"""Presence reconnect-storm benchmark: per-connect broadcasts vs tick batches.
+
+N users reconnect at once (e.g. after a deploy). The legacy path sent every
+new socket a snapshot and broadcast one presence frame per connect to all
+sockets, i.e. O(N^2) frames; the aggregator sends one presence_batch per
+tick plus one snapshot per socket.
+
+    python -m benchmarks.bench_presence --users 2000 --tick-ms 250
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from ._common import FakeSocket, print_table, setup_env
+
+setup_env()
+
+from app.ws.ws_manager import ConnectionManager  # noqa: E402
+
+
+async def _settle(manager: ConnectionManager, timeout: float = 60.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if not any(len(c.outbox) for c in manager.connections.values()):
+            return
+        await asyncio.sleep(0.01)
+
+
+async def legacy_storm(users: int, spread: float):
+    manager = ConnectionManager()
+    sockets = [FakeSocket() for _ in range(users)]
+    t0 = time.perf_counter()
+    for uid, ws in enumerate(sockets):
+        manager.register_user_socket(uid, ws)
+        manager.user_connected(uid)
+        await manager.send_unified(ws, json.dumps({
+            "v": 1, "type": "presence_snapshot", "online_user_ids": list(manager.user_online_counts.keys()),
+        }))
+        await manager.unified_broadcast_all(json.dumps({"v": 1, "type": "presence", "user_id": uid, "online": True}), key=f"presence:{uid}")
+        if spread:
+            await asyncio.sleep(spread / users)
+    await _settle(manager)
+    return sockets, time.perf_counter() - t0, manager.fanout_stats()
+
+
+async def batched_storm(users: int, spread: float, tick: float):
+    manager = ConnectionManager()
+    manager.presence.tick = tick
+    sockets = [FakeSocket() for _ in range(users)]
+    t0 = time.perf_counter()
+    for uid, ws in enumerate(sockets):
+        manager.register_user_socket(uid, ws)
+        manager.presence.connected(uid, ws)
+        if spread:
+            await asyncio.sleep(spread / users)
+    await asyncio.sleep(tick * 2)
+    await _settle(manager)
+    elapsed = time.perf_counter() - t0
+    manager.presence.stop()
+    return sockets, elapsed, manager.fanout_stats()
+
+
+def _row(name, sockets, elapsed, stats):
+    frames = sum(ws.frames for ws in sockets)
+    sent_bytes = sum(ws.bytes_sent for ws in sockets)
+    return [
+        name,
+        frames,
+        f"{frames / len(sockets):.1f}",
+        f"{sent_bytes / 1e6:.2f}",
+        stats["coalesced"] + stats["dropped"],
+        f"{elapsed * 1000:.0f}",
+    ]
+
+
+async def main(args):
+    rows = [
+        _row("per-connect (legacy)", *(await legacy_storm(args.users, args.spread))),
+        _row(f"batched {args.tick_ms}ms tick", *(await batched_storm(args.users, args.spread, args.tick_ms / 1000.0))),
+    ]
+    print(f"users={args.users} spread={args.spread}s")
+    print_table(["presence", "frames", "frames/socket", "MB sent", "coalesced+dropped", "wall ms"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--spread", type=float, default=1.0, help="seconds over which the reconnects arrive")
+    parser.add_argument("--tick-ms", type=int, default=250)
+    asyncio.run(main(parser.parse_args()))
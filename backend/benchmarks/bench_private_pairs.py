@@ -0,0 +1,122 @@
+"""DM lookup and the peers list: scanning private chats vs the pair-key index.
+
+Seeds U users, each with a self chat and DMs with K others, then times:
+  - DM lookup (POST /chats/private for an existing pair)
+      scan:  load every private chat and compare participant sets
+      pair:  chats_controller.find_private_chat, one unique-index probe
+  - peers -> chat id (GET /users/approved-peers)
+      scan:  every user, every private chat with its participants
+      pair:  chats_controller.list_peers, one query joined on the pair key
+
+    python -m benchmarks.bench_private_pairs --users 5000 --dms 3
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from ._common import percentile, print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_private_pairs_"))
+
+from sqlalchemy import event, insert, text  # noqa: E402
+
+from app.controllers import chats_controller  # noqa: E402
+from app.db import database, models  # noqa: E402
+from app.db.models import chat_users_table  # noqa: E402
+
+QUERIES = {"n": 0}
+
+
+@event.listens_for(database.engine, "before_cursor_execute")
+def _count(*_args):
+    QUERIES["n"] += 1
+
+
+def seed(users: int, dms: int, rng: random.Random):
+    database.Base.metadata.create_all(bind=database.engine)
+    stamp = time.time_ns()
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.User), [{"username": f"bench-{stamp}-{i}", "password_hash": "x"} for i in range(users)])
+        user_ids = [r[0] for r in conn.execute(text("SELECT id FROM users ORDER BY id"))][-users:]
+        pairs = {(u, u) for u in user_ids}
+        for u in user_ids:
+            for v in rng.sample(user_ids, dms):
+                if v != u:
+                    pairs.add(chats_controller.private_pair(u, v))
+        pairs = sorted(pairs)
+        conn.execute(insert(models.Chat), [{"chat_type": "private", "pair_low": lo, "pair_high": hi} for lo, hi in pairs])
+        rows = conn.execute(text("SELECT id, pair_low, pair_high FROM chats WHERE pair_low IS NOT NULL")).all()
+        conn.execute(insert(chat_users_table), [
+            {"chat_id": cid, "user_id": uid} for cid, lo, hi in rows for uid in {lo, hi}
+        ])
+    return user_ids, [p for p in pairs if p[0] != p[1]]
+
+
+def scan_lookup(db, a: int, b: int):
+    needed = {a, b}
+    for c in db.query(models.Chat).filter(models.Chat.chat_type == "private").all():
+        if {u.id for u in c.participants} == needed:
+            return c.id
+    return None
+
+
+def scan_peers(db, me: int):
+    users = db.query(models.User).all()
+    mapping = {}
+    for c in db.query(models.Chat).filter(models.Chat.chat_type == "private").all():
+        ids = [u.id for u in c.participants]
+        if me in ids:
+            if ids == [me]:
+                mapping[me] = c.id
+            elif len(ids) == 2:
+                mapping[ids[0] if ids[1] == me else ids[1]] = c.id
+    return {u.id: mapping.get(u.id) for u in users}
+
+
+def pair_peers(db, me: int):
+    return {uid: chat_id for uid, _, chat_id in chats_controller.list_peers(db, me)}
+
+
+def measure(name: str, fn, args_list):
+    times, results, queries = [], [], 0
+    for args in args_list:
+        db = database.SessionLocal()
+        QUERIES["n"] = 0
+        t0 = time.perf_counter()
+        try:
+            results.append(fn(db, *args))
+        finally:
+            db.close()
+        times.append((time.perf_counter() - t0) * 1000.0)
+        queries = QUERIES["n"]
+    return [name, f"{percentile(times, 50):,.1f}", f"{percentile(times, 99):,.1f}", queries], results
+
+
+def main(args):
+    rng = random.Random(11)
+    user_ids, pairs = seed(args.users, args.dms, rng)
+    print(f"users={args.users:,} private chats={len(pairs) + len(user_ids):,} reps={args.reps}")
+    lookups = rng.sample(pairs, args.reps)
+    me = [(rng.choice(user_ids),) for _ in range(args.reps)]
+    rows = []
+    row, old = measure("lookup: scan", scan_lookup, lookups)
+    rows.append(row)
+    row, new = measure("lookup: pair", chats_controller.find_private_chat, lookups)
+    rows.append(row)
+    assert old == new
+    row, old = measure("peers: scan", scan_peers, me)
+    rows.append(row)
+    row, new = measure("peers: pair", pair_peers, me)
+    rows.append(row)
+    assert old == new
+    print_table(["operation", "p50 ms", "p99 ms", "queries"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--dms", type=int, default=3)
+    parser.add_argument("--reps", type=int, default=5)
+    main(parser.parse_args())
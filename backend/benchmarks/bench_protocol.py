@@ -0,0 +1,128 @@
+"""WS protocol benchmark: v1 JSON vs v2 MessagePack frames.
+
+Builds E2EE-style message frames (base64 ciphertext + nonce, like the group
+fan-out rows) and reports, per payload size:
+  - bytes on the wire for v1, v2, and v1 under permessage-deflate (zlib raw
+    deflate with context takeover, which is what the extension does)
+  - encode time per broadcast (what the server pays once per protocol;
+    broadcasts that start from a v1 JSON str also parse it once for v2)
+  - decode time per frame (what every client pays)
+  - time to fan one frame out to a mixed room through ConnectionManager
+
+    python -m benchmarks.bench_protocol --sizes 64 512 4096 --room 1000
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import time
+import zlib
+
+import msgpack
+
+from ._common import FakeSocket, print_table, setup_env
+
+setup_env()
+
+from app.ws.protocol import Frame, PROTOCOL_V1, PROTOCOL_V2  # noqa: E402
+from app.ws.ws_manager import ConnectionManager  # noqa: E402
+
+
+def make_frame(size: int, i: int) -> str:
+    body = {
+        "id": 100000 + i,
+        "content": None,
+        "content_type": "text",
+        "timestamp": "2026-01-01T12:00:00.000000",
+        "ciphertext": base64.b64encode(os.urandom(size)).decode(),
+        "nonce": base64.b64encode(os.urandom(12)).decode(),
+        "algo": "AES-GCM",
+        "recipient_id": 42,
+        "sender": {"id": 7, "username": "someone"},
+        "attachment": None,
+    }
+    return json.dumps({"v": 1, "type": "message", "chat_id": 3, "message": body})
+
+
+def _timeit(fn, reps: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(reps):
+        fn()
+    return (time.perf_counter() - t0) / reps * 1e6
+
+
+def sizes_row(size: int, frames: int):
+    texts = [make_frame(size, i) for i in range(frames)]
+    v1 = sum(len(t.encode()) for t in texts)
+    v2_frames = [Frame(text=t).binary() for t in texts]
+    v2 = sum(len(b) for b in v2_frames)
+    comp = zlib.compressobj(6, zlib.DEFLATED, -15)
+    deflated = 0
+    for t in texts:
+        deflated += len(comp.compress(t.encode()) + comp.flush(zlib.Z_SYNC_FLUSH)) - 4
+    obj = json.loads(texts[0])
+    enc_v1 = _timeit(lambda: Frame(obj=obj).text(), 2000)
+    enc_v2 = _timeit(lambda: Frame(obj=obj).binary(), 2000)
+    enc_v2_text = _timeit(lambda: Frame(text=texts[0]).binary(), 2000)
+    enc_deflate = _timeit(lambda: zlib.compressobj(6, zlib.DEFLATED, -15).compress(texts[0].encode()), 2000)
+    dec_v1 = _timeit(lambda: json.loads(texts[0]), 2000)
+    dec_v2 = _timeit(lambda: msgpack.unpackb(v2_frames[0], raw=False), 2000)
+    return [
+        size,
+        f"{v1 / frames:.0f}",
+        f"{v2 / frames:.0f} ({v2 / v1:.0%})",
+        f"{deflated / frames:.0f} ({deflated / v1:.0%})",
+        f"{enc_v1:.1f}",
+        f"{enc_v2:.1f}",
+        f"{enc_v2_text:.1f}",
+        f"{enc_deflate:.1f}",
+        f"{dec_v1:.1f}",
+        f"{dec_v2:.1f}",
+    ]
+
+
+async def fanout_row(size: int, room: int, v2_share: float):
+    manager = ConnectionManager()
+    sockets = []
+    for uid in range(room):
+        ws = FakeSocket()
+        proto = PROTOCOL_V2 if uid < int(room * v2_share) else PROTOCOL_V1
+        manager.register_user_socket(uid, ws, proto)
+        manager.subscribe_room(ws, uid, "3")
+        sockets.append(ws)
+    text = make_frame(size, 0)
+    # Warm up: the first push to each socket also starts its writer task
+    manager._deliver_room("3", text)
+    reps = 50
+    t0 = time.perf_counter()
+    for _ in range(reps):
+        manager._deliver_room("3", text)
+    per_broadcast = (time.perf_counter() - t0) / reps * 1000.0
+    await asyncio.sleep(0)
+    for conn in list(manager.connections.values()):
+        conn.outbox.close("unregistered")
+    return [size, room, f"{v2_share:.0%}", f"{per_broadcast:.2f}"]
+
+
+async def main(args):
+    print(f"frames per size={args.frames}")
+    print_table(
+        ["ciphertext B", "v1 B/frame", "v2 B/frame", "v1+deflate B/frame",
+         "v1 enc us", "v2 enc us", "v2 from v1 text us", "deflate us", "v1 dec us", "v2 dec us"],
+        [sizes_row(size, args.frames) for size in args.sizes],
+    )
+    print()
+    rows = []
+    for size in args.sizes:
+        for share in (0.0, 0.5, 1.0):
+            rows.append(await fanout_row(size, args.room, share))
+    print_table(["ciphertext B", "room", "v2 sockets", "ms per broadcast (enqueue)"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 512, 4096])
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--room", type=int, default=1000)
+    asyncio.run(main(parser.parse_args()))
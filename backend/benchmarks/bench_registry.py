@@ -0,0 +1,112 @@
+"""Connection registry microbenchmark: list-based vs indexed ConnectionManager.
+
+Registers N connections over R rooms (plus one big company-wide room holding
+a share of everyone), then measures subscribe/unsubscribe churn and a mass
+disconnect.
+
+    python -m benchmarks.bench_registry --connections 50000 --rooms 5000
+"""
+import argparse
+import random
+import time
+from typing import Dict, List, Set
+
+from ._common import print_table, setup_env
+
+setup_env()
+
+from app.ws.ws_manager import ConnectionManager  # noqa: E402
+
+
+class LegacyRegistry:
+    """The list-based membership maps ConnectionManager used before."""
+
+    def __init__(self):
+        self.user_sockets: Dict[int, List[object]] = {}
+        self.room_sockets: Dict[str, List[object]] = {}
+        self.socket_rooms: Dict[object, Set[str]] = {}
+
+    def register_user_socket(self, user_id, websocket):
+        self.user_sockets.setdefault(user_id, []).append(websocket)
+        self.socket_rooms.setdefault(websocket, set())
+
+    def unregister_user_socket(self, user_id, websocket):
+        if user_id in self.user_sockets and websocket in self.user_sockets[user_id]:
+            self.user_sockets[user_id].remove(websocket)
+            if not self.user_sockets[user_id]:
+                del self.user_sockets[user_id]
+        for room_id in self.socket_rooms.get(websocket, set()).copy():
+            if room_id in self.room_sockets and websocket in self.room_sockets[room_id]:
+                self.room_sockets[room_id].remove(websocket)
+                if not self.room_sockets[room_id]:
+                    del self.room_sockets[room_id]
+        self.socket_rooms.pop(websocket, None)
+
+    def subscribe_room(self, websocket, user_id, room_id):
+        room = self.room_sockets.setdefault(room_id, [])
+        if websocket not in room:
+            room.append(websocket)
+        self.socket_rooms.setdefault(websocket, set()).add(room_id)
+
+    def unsubscribe_room(self, websocket, room_id):
+        if room_id in self.room_sockets and websocket in self.room_sockets[room_id]:
+            self.room_sockets[room_id].remove(websocket)
+            if not self.room_sockets[room_id]:
+                del self.room_sockets[room_id]
+        if websocket in self.socket_rooms:
+            self.socket_rooms[websocket].discard(room_id)
+
+
+def run(registry, sockets, rooms: int, big_share: float, churn: int, seed: int):
+    rnd = random.Random(seed)
+    n = len(sockets)
+    big_members = sockets[: int(n * big_share)]
+    t0 = time.perf_counter()
+    for i, ws in enumerate(sockets):
+        registry.register_user_socket(i, ws)
+        registry.subscribe_room(ws, i, str(1 + i % rooms))
+    for i, ws in enumerate(big_members):
+        registry.subscribe_room(ws, i, "0")
+    t_setup = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for _ in range(churn):
+        i = rnd.randrange(len(big_members))
+        ws = big_members[i]
+        registry.unsubscribe_room(ws, "0")
+        registry.subscribe_room(ws, i, "0")
+    t_churn = time.perf_counter() - t0
+
+    order = list(range(n))
+    rnd.shuffle(order)
+    t0 = time.perf_counter()
+    for i in order:
+        registry.unregister_user_socket(i, sockets[i])
+    t_disconnect = time.perf_counter() - t0
+    return t_setup, t_churn, t_disconnect
+
+
+def main(args):
+    rows = []
+    for name, factory in (("list (legacy)", LegacyRegistry), ("indexed", ConnectionManager)):
+        sockets = [object() for _ in range(args.connections)]
+        t_setup, t_churn, t_disc = run(factory(), sockets, args.rooms, args.big_room_share, args.churn, args.seed)
+        rows.append([
+            name,
+            f"{t_setup * 1000:.0f}",
+            f"{t_churn * 1000:.0f}",
+            f"{t_churn / args.churn * 1e6:.2f}",
+            f"{t_disc * 1000:.0f}",
+        ])
+    print(f"connections={args.connections} rooms={args.rooms} big_room={int(args.connections * args.big_room_share)} churn_ops={args.churn}")
+    print_table(["registry", "setup ms", "churn ms", "us/churn op", "mass disconnect ms"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, default=50_000)
+    parser.add_argument("--rooms", type=int, default=5_000)
+    parser.add_argument("--big-room-share", type=float, default=0.2)
+    parser.add_argument("--churn", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
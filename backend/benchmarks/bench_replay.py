@@ -0,0 +1,94 @@
+"""Reconnect catch-up: full history refetch vs since_id replay.
+
+One chat with H stored messages; N clients drop, miss M messages and
+reconnect. Compares, per client, what it costs to catch up:
+  - full:   GET /chats/{id}/messages (the whole history, as before)
+  - db:     subscribe with since_id, ring buffer cold (indexed range query)
+  - buffer: subscribe with since_id, answered from the in-memory ring
+
+Envelope caching is cleared before each strategy so encode cost is included.
+
+    python -m benchmarks.bench_replay --history 5000 --clients 200 --missed 20
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from ._common import percentile, print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_replay_"))
+
+from app.db import database, models  # noqa: E402
+from app.ws import envelopes  # noqa: E402
+from app.ws.envelopes import envelope_cache  # noqa: E402
+from app.ws.sockets import _missed_messages  # noqa: E402
+from app.ws.ws_manager import manager  # noqa: E402
+
+
+def seed(history: int):
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        user = models.User(username=f"bench-{time.time_ns()}", password_hash="x")
+        chat = models.Chat(chat_type="group", name="bench")
+        chat.participants.append(user)
+        db.add_all([user, chat])
+        db.flush()
+        db.bulk_save_objects([
+            models.Message(chat_id=chat.id, sender_id=user.id, content_type="text",
+                           ciphertext=bytes(90), nonce=bytes(12), algo="AES-GCM")
+            for _ in range(history)
+        ])
+        db.commit()
+        rows = db.query(models.Message).filter(models.Message.chat_id == chat.id).order_by(models.Message.id).all()
+        return user.id, chat.id, [(m.id, envelopes.encode_message(m)) for m in rows]
+    finally:
+        db.close()
+
+
+def full_history(chat_id: int) -> int:
+    db = database.SessionLocal()
+    try:
+        msgs = db.query(models.Message).filter(models.Message.chat_id == chat_id).order_by(models.Message.id.asc()).all()
+        return len(envelopes.history_page(msgs))
+    finally:
+        db.close()
+
+
+async def replay(chat_id: int, since_id: int, user_id: int) -> int:
+    bodies, _, _ = await _missed_messages(chat_id, since_id, user_id)
+    return len(envelopes.replay_frame(chat_id, since_id, bodies, "x", True).encode("utf-8"))
+
+
+async def measure(name: str, clients: int, call):
+    envelope_cache.clear()
+    times, total = [], 0
+    for _ in range(clients):
+        t0 = time.perf_counter()
+        total += await call()
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return [name, f"{total / clients:,.0f}", f"{total / 1e6:.2f}",
+            f"{percentile(times, 50):.2f}", f"{percentile(times, 99):.2f}", f"{sum(times):.0f}"]
+
+
+async def main(args):
+    user_id, chat_id, stored = seed(args.history)
+    since_id = stored[-args.missed - 1][0]
+    print(f"history={args.history} clients={args.clients} missed={args.missed} ring={manager.replay.per_room}")
+    rows = [await measure("full", args.clients, lambda: asyncio.to_thread(full_history, chat_id))]
+    manager.replay.drop()
+    rows.append(await measure("db", args.clients, lambda: replay(chat_id, since_id, user_id)))
+    for mid, body in stored[-manager.replay.per_room:]:
+        manager.replay.record(str(chat_id), mid, None, body)
+    rows.append(await measure("buffer", args.clients, lambda: replay(chat_id, since_id, user_id)))
+    print_table(["strategy", "B/client", "MB total", "p50 ms", "p99 ms", "total ms"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--history", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--missed", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,157 @@
+"""A large attachment over a link that drops once: single POST vs resumable chunks.
+
+Uploads one file of N MB through a shared link of R Mbit/s that fails
+every request in flight once P% of the file has crossed it:
+  - single:    POST /files/upload; after the drop the client starts over
+               and sends the whole body again
+  - resumable: POST /files/uploads, then PUT chunk_size pieces, K at a
+               time; after the drop it GETs the session, resends only the
+               missing chunks, and POSTs .../complete
+Reports bytes put on the wire, how many of them were thrown away, and
+the wall time to a stored attachment.
+
+    python -m benchmarks.bench_resumable_upload --mb 100 --mbps 200 --drop-at 95 --parallel 3
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from ._common import print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_resumable_upload_"))
+
+from app.core.security import create_access_token  # noqa: E402
+from app.db import database, models  # noqa: E402
+from app.main import app  # noqa: E402
+
+BOUNDARY = "benchboundary7d1f"
+PIECE = 64 * 1024
+
+
+class Dropped(Exception):
+    # Not an OSError, so it reaches the client rather than the route's disk-error handling
+    pass
+
+
+class Link:
+    """One shared uplink: caps total throughput and drops once at a byte count."""
+
+    def __init__(self, mbps: float, drop_at: int):
+        self.rate = mbps * 1e6 / 8.0
+        self.drop_at = drop_at
+        self.sent = 0
+        self.epoch = 0
+        self._free = 0.0
+
+    async def body(self, data: bytes, head: bytes = b"", tail: bytes = b""):
+        epoch = self.epoch
+        for piece in (head, *(data[i:i + PIECE] for i in range(0, len(data), PIECE)), tail):
+            if self.epoch != epoch:
+                raise Dropped("link dropped")
+            now = time.perf_counter()
+            self._free = max(now, self._free) + len(piece) / self.rate
+            await asyncio.sleep(self._free - now)
+            self.sent += len(piece)
+            if self.drop_at and self.sent >= self.drop_at:
+                self.drop_at = 0
+                self.epoch += 1
+            yield piece
+
+
+async def single(client, link: Link, payload: bytes, headers: dict) -> int:
+    head = (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.zip\"\r\n"
+        "Content-Type: application/zip\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{BOUNDARY}--\r\n".encode()
+    headers = {**headers, "content-type": f"multipart/form-data; boundary={BOUNDARY}",
+               "content-length": str(len(head) + len(payload) + len(tail))}
+    while True:
+        try:
+            res = await client.post("/files/upload", content=link.body(payload, head, tail), headers=headers, timeout=None)
+        except Dropped:
+            continue
+        assert res.status_code == 200, res.text
+        return res.json()["id"]
+
+
+async def resumable(client, link: Link, payload: bytes, headers: dict, parallel: int) -> int:
+    res = await client.post("/files/uploads", headers=headers, json={
+        "filename": "big.zip", "mime_type": "application/zip", "size_bytes": len(payload), "nonce": headers["x-nonce"],
+    })
+    assert res.status_code == 200, res.text
+    session = res.json()
+    url, size = f"/files/uploads/{session['id']}", session["chunk_size"]
+    pending = session["missing_offsets"]
+    while pending:
+        queue, failed = list(pending), []
+
+        async def worker():
+            while queue:
+                offset = queue.pop(0)
+                try:
+                    put = await client.put(f"{url}?offset={offset}", content=link.body(payload[offset:offset + size]),
+                                           headers={**headers, "content-length": str(len(payload[offset:offset + size]))}, timeout=None)
+                    if put.status_code != 200:
+                        failed.append(offset)
+                except Dropped:
+                    failed.append(offset)
+
+        await asyncio.gather(*(worker() for _ in range(parallel)))
+        if failed:
+            pending = (await client.get(url, headers=headers)).json()["missing_offsets"]
+        else:
+            pending = []
+    res = await client.post(f"{url}/complete", headers=headers)
+    assert res.status_code == 200, res.text
+    return res.json()["id"]
+
+
+async def run(args, strategy: str) -> list:
+    import httpx
+
+    payload = os.urandom(args.mb * 1024 * 1024)
+    link = Link(args.mbps, int(len(payload) * args.drop_at / 100.0))
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'bench'})}", "x-nonce": "AAAAAAAAAAAAAAAA"}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        t0 = time.perf_counter()
+        if strategy == "single":
+            att_id = await single(client, link, payload, headers)
+        else:
+            att_id = await resumable(client, link, payload, headers, args.parallel)
+        took = time.perf_counter() - t0
+    db = database.SessionLocal()
+    try:
+        assert db.get(models.Attachment, att_id).size_bytes == len(payload)
+    finally:
+        db.close()
+    wasted = link.sent - len(payload)
+    return [strategy, f"{link.sent / 2**20:,.1f}", f"{wasted / 2**20:,.1f}", f"{took:.1f}"]
+
+
+def main(args):
+    os.environ["FILES_MAX_MB"] = str(args.mb + 1)
+    os.environ["FILES_UPLOAD_CHUNK_KB"] = str(args.chunk_kb)
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        db.add(models.User(username="bench", password_hash="x"))
+        db.commit()
+    finally:
+        db.close()
+    rows = [asyncio.run(run(args, s)) for s in ("single", "resumable")]
+    print(f"{args.mb} MB over {args.mbps:g} Mbit/s, dropped once at {args.drop_at:g}%; "
+          f"chunks of {args.chunk_kb} KB, {args.parallel} in flight")
+    print_table(["strategy", "MB sent", "MB resent", "seconds"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=int, default=100)
+    parser.add_argument("--mbps", type=float, default=200.0)
+    parser.add_argument("--drop-at", type=float, default=95.0)
+    parser.add_argument("--chunk-kb", type=int, default=8192)
+    parser.add_argument("--parallel", type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,101 @@
+"""Seek latency: history windows around a message id or a timestamp.
+
+Seeds one chat with N messages, one per second, and times
+GET /chats/{id}/messages/around (controller + encoder, envelope cache cold)
+anchored at increasing depths, by message_id and by `at`. The `at` seeks
+are repeated with ix_messages_chat_id_timestamp dropped to show what the
+index buys.
+
+    python -m benchmarks.bench_seek --messages 1000000 --limit 50
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+from ._common import percentile, print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_seek_"))
+
+from sqlalchemy import insert, text  # noqa: E402
+
+from app.controllers import messages_controller  # noqa: E402
+from app.db import database, models  # noqa: E402
+from app.db.migrations import run_migrations  # noqa: E402
+from app.ws import envelopes  # noqa: E402
+from app.ws.envelopes import envelope_cache  # noqa: E402
+
+BASE = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+DEPTHS = (0.0, 0.1, 0.5, 0.9, 0.999)
+
+
+def seed(messages: int):
+    database.Base.metadata.create_all(bind=database.engine)
+    run_migrations(database.engine)
+    db = database.SessionLocal()
+    try:
+        user = models.User(username=f"bench-{time.time_ns()}", password_hash="x")
+        chat = models.Chat(chat_type="group", name="bench")
+        chat.participants.append(user)
+        db.add_all([user, chat])
+        db.commit()
+        user_id, chat_id = user.id, chat.id
+    finally:
+        db.close()
+    batch = 20000
+    with database.engine.begin() as conn:
+        for start in range(0, messages, batch):
+            conn.execute(insert(models.Message), [
+                {"chat_id": chat_id, "sender_id": user_id, "content_type": "text", "ciphertext_bin": bytes(72),
+                 "nonce_bin": bytes(12), "algo": "AES-GCM", "timestamp": BASE + datetime.timedelta(seconds=i)}
+                for i in range(start, min(messages, start + batch))
+            ])
+    with database.engine.connect() as conn:
+        first, last = conn.execute(text("SELECT min(id), max(id) FROM messages WHERE chat_id = :c"), {"c": chat_id}).one()
+    return chat_id, first, last
+
+
+def seek(chat_id: int, limit: int, reps: int, message_id=None, at=None):
+    times = []
+    for _ in range(reps):
+        envelope_cache.clear()
+        db = database.SessionLocal()
+        t0 = time.perf_counter()
+        try:
+            anchor = message_id if message_id is not None else messages_controller.find_anchor_at(db, chat_id, at)
+            msgs, before, after = messages_controller.get_chat_messages_around(db, chat_id, anchor, limit)
+            envelopes.message_window(msgs, anchor, before, after)
+        finally:
+            db.close()
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return times
+
+
+def main(args):
+    t0 = time.perf_counter()
+    chat_id, first, last = seed(args.messages)
+    n = last - first + 1
+    print(f"seeded {n:,} messages in {time.perf_counter() - t0:.1f}s; limit={args.limit} reps={args.reps}")
+    rows = []
+    for depth in DEPTHS:
+        back = int((n - 1) * depth)
+        by_id = seek(chat_id, args.limit, args.reps, message_id=last - back)
+        by_at = seek(chat_id, args.limit, args.reps, at=BASE + datetime.timedelta(seconds=n - 1 - back, milliseconds=500))
+        rows.append([f"{depth:.1%}", f"{back:,}", f"{percentile(by_id, 50):.2f}", f"{percentile(by_id, 99):.2f}",
+                     f"{percentile(by_at, 50):.2f}", f"{percentile(by_at, 99):.2f}"])
+    with database.engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_messages_chat_id_timestamp"))
+    for row, depth in zip(rows, DEPTHS):
+        back = int((n - 1) * depth)
+        no_ix = seek(chat_id, args.limit, max(1, args.reps // 10), at=BASE + datetime.timedelta(seconds=n - 1 - back, milliseconds=500))
+        row.append(f"{percentile(no_ix, 50):.1f}")
+    print_table(["depth", "messages newer", "id p50 ms", "id p99 ms", "at p50 ms", "at p99 ms", "at, no ts index p50 ms"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--reps", type=int, default=20)
+    main(parser.parse_args())
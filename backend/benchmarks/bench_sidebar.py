@@ -0,0 +1,102 @@
+"""Sidebar ordering: latest message per chat vs the chat_summaries join.
+
+Seeds C chats for one user with H messages each, then times getting the
+chat list in activity order:
+  - per-chat: list the chats, then read each chat's newest message (what
+              the client had to do to sort and preview)
+  - summary:  chats_controller.list_user_chats, one joined query
+
+    python -m benchmarks.bench_sidebar --chats 500 --messages 200
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from ._common import percentile, print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_sidebar_"))
+
+from sqlalchemy import event, insert, text  # noqa: E402
+
+from app.controllers import chats_controller, messages_controller  # noqa: E402
+from app.db import database, models  # noqa: E402
+from app.db.migrations import run_migrations  # noqa: E402
+from app.db.models import chat_users_table  # noqa: E402
+
+QUERIES = {"n": 0}
+
+
+@event.listens_for(database.engine, "before_cursor_execute")
+def _count(*_args):
+    QUERIES["n"] += 1
+
+
+def seed(chats: int, messages: int) -> int:
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        me = models.User(username=f"me-{time.time_ns()}", password_hash="x")
+        other = models.User(username=f"other-{time.time_ns()}", password_hash="x")
+        db.add_all([me, other])
+        db.commit()
+        me_id, other_id = me.id, other.id
+    finally:
+        db.close()
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Chat), [{"chat_type": "group", "name": f"c{i}", "last_seq": messages} for i in range(chats)])
+        chat_ids = [r[0] for r in conn.execute(text("SELECT id FROM chats ORDER BY id"))][-chats:]
+        conn.execute(insert(chat_users_table), [{"chat_id": c, "user_id": u} for c in chat_ids for u in (me_id, other_id)])
+        conn.execute(insert(models.Message), [
+            {"chat_id": c, "sender_id": other_id, "content_type": "text", "ciphertext_bin": bytes(72), "seq": n + 1}
+            for n in range(messages) for c in chat_ids
+        ])
+    # The summaries come from the upgrade backfill, as on an existing database
+    run_migrations(database.engine)
+    return me_id
+
+
+def per_chat(db, user_id: int):
+    chats = chats_controller.get_chats_for_user(db, user_id)
+    latest = {}
+    for c in chats:
+        rows, _ = messages_controller.get_chat_messages_page(db, c.id, 1)
+        latest[c.id] = rows[-1].id if rows else 0
+    return sorted(latest, key=lambda cid: latest[cid], reverse=True)
+
+
+def summary(db, user_id: int):
+    return [r.id for r in chats_controller.list_user_chats(db, user_id)]
+
+
+def measure(name: str, fn, user_id: int, reps: int):
+    times, order, queries = [], None, 0
+    for _ in range(reps):
+        db = database.SessionLocal()
+        QUERIES["n"] = 0
+        t0 = time.perf_counter()
+        try:
+            order = fn(db, user_id)
+        finally:
+            db.close()
+        times.append((time.perf_counter() - t0) * 1000.0)
+        queries = QUERIES["n"]
+    return [name, f"{percentile(times, 50):,.1f}", f"{percentile(times, 99):,.1f}", queries], order
+
+
+def main(args):
+    t0 = time.perf_counter()
+    me = seed(args.chats, args.messages)
+    print(f"seeded {args.chats:,} chats x {args.messages} messages in {time.perf_counter() - t0:.1f}s")
+    row_a, want = measure("per-chat", per_chat, me, args.reps)
+    row_b, got = measure("summary", summary, me, args.reps)
+    assert got == want
+    print_table(["strategy", "p50 ms", "p99 ms", "queries"], [row_a, row_b])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--reps", type=int, default=10)
+    main(parser.parse_args())
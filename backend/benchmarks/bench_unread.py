@@ -0,0 +1,117 @@
+"""GET /chats/unread-counts: per-chat queries vs seq arithmetic vs one grouped query.
+
+Seeds C chats (the measured user in every one, plus another member), M
+messages per chat and a read position half-way through, then times:
+  - legacy:   the old loop (all chats, lazy participants, a state lookup
+              and a COUNT(*) per chat)
+  - query:    UNREAD_COUNTS=query, one grouped query over messages
+  - seq:      chats.last_seq - user_chat_states.read_seq, one join
+
+    python -m benchmarks.bench_unread --chats 10000 --messages 10
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from ._common import percentile, print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_unread_"))
+
+from sqlalchemy import event, insert, text  # noqa: E402
+
+from app.controllers import chat_state_controller  # noqa: E402
+from app.db import database, models  # noqa: E402
+from app.db.migrations import run_migrations  # noqa: E402
+from app.db.models import chat_users_table  # noqa: E402
+
+QUERIES = {"n": 0}
+
+
+@event.listens_for(database.engine, "before_cursor_execute")
+def _count(*_args):
+    QUERIES["n"] += 1
+
+
+def seed(chats: int, messages: int):
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        me = models.User(username=f"me-{time.time_ns()}", password_hash="x")
+        other = models.User(username=f"other-{time.time_ns()}", password_hash="x")
+        db.add_all([me, other])
+        db.commit()
+        me_id, other_id = me.id, other.id
+    finally:
+        db.close()
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Chat), [{"chat_type": "group", "name": f"c{i}", "last_seq": messages} for i in range(chats)])
+        chat_ids = [r[0] for r in conn.execute(text("SELECT id FROM chats ORDER BY id"))][-chats:]
+        conn.execute(insert(chat_users_table), [{"chat_id": c, "user_id": u} for c in chat_ids for u in (me_id, other_id)])
+        conn.execute(insert(models.Message), [
+            {"chat_id": c, "sender_id": other_id, "content_type": "text", "content": "x", "seq": n + 1}
+            for c in chat_ids for n in range(messages)
+        ])
+        # Read up to the middle message of every chat
+        mids = conn.execute(text(
+            "SELECT chat_id, MIN(id) + :half FROM messages GROUP BY chat_id"), {"half": messages // 2}
+        ).all()
+        conn.execute(insert(models.UserChatState), [
+            {"user_id": me_id, "chat_id": c, "last_read_message_id": mid, "read_seq": messages // 2 + 1} for c, mid in mids
+        ])
+    run_migrations(database.engine)
+    return me_id
+
+
+def legacy(db, user_id: int):
+    result = []
+    for c in db.query(models.Chat).all():
+        if user_id not in [u.id for u in c.participants]:
+            continue
+        st = chat_state_controller.get_user_chat_state(db, user_id, c.id)
+        if st and st.last_read_message_id is not None:
+            cnt = db.query(models.Message).filter(models.Message.chat_id == c.id, models.Message.id > st.last_read_message_id).count()
+        else:
+            cnt = db.query(models.Message).filter(models.Message.chat_id == c.id).count()
+        result.append({"chat_id": c.id, "unread_count": int(cnt)})
+    return {r["chat_id"]: r["unread_count"] for r in result}
+
+
+def measure(name: str, fn, user_id: int, reps: int):
+    times, result, queries = [], None, 0
+    for _ in range(reps):
+        db = database.SessionLocal()
+        QUERIES["n"] = 0
+        t0 = time.perf_counter()
+        try:
+            result = fn(db, user_id)
+        finally:
+            db.close()
+        times.append((time.perf_counter() - t0) * 1000.0)
+        queries = QUERIES["n"]
+    return [name, f"{percentile(times, 50):,.1f}", f"{percentile(times, 99):,.1f}", queries, sum(result.values())], result
+
+
+def main(args):
+    t0 = time.perf_counter()
+    me = seed(args.chats, args.messages)
+    print(f"seeded {args.chats:,} chats x {args.messages} messages in {time.perf_counter() - t0:.1f}s")
+    rows = []
+    row, want = measure("legacy", legacy, me, max(1, args.reps // 10))
+    rows.append(row)
+    row, got = measure("query", chat_state_controller.get_unread_counts_query, me, args.reps)
+    assert got == want
+    rows.append(row)
+    os.environ["UNREAD_COUNTS"] = "seq"
+    row, got = measure("seq", chat_state_controller.get_unread_counts, me, args.reps)
+    assert got == want
+    rows.append(row)
+    print_table(["strategy", "p50 ms", "p99 ms", "queries", "total unread"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=10_000)
+    parser.add_argument("--messages", type=int, default=10)
+    parser.add_argument("--reps", type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,116 @@
+"""Badge updates after a burst of messages: refetch triggers vs pushed counts.
+
+One group of G online members, each also in C other chats; a member sends
+M messages in a burst. Compares what keeping every badge current costs:
+  - refetch: the old flow; each send notifies every other member, who calls
+             GET /chats/unread-counts (timed here via the controller)
+  - push:    the UnreadTracker; counts are kept in memory and pushed as
+             {"type": "unread"} frames, coalesced per user and chat per tick
+
+    python -m benchmarks.bench_unread_push --members 50 --chats 100 --messages 100
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from ._common import FakeSocket, print_table, setup_env
+
+setup_env(None if os.environ.get("DATABASE_URL") else tempfile.mkdtemp(prefix="bench_unread_push_"))
+
+from sqlalchemy import event, insert  # noqa: E402
+
+from app.controllers import chat_state_controller  # noqa: E402
+from app.db import database, models  # noqa: E402
+from app.db.models import chat_users_table  # noqa: E402
+from app.ws.ws_manager import ConnectionManager  # noqa: E402
+
+QUERIES = {"n": 0}
+
+
+@event.listens_for(database.engine, "before_cursor_execute")
+@event.listens_for(database.async_engine.sync_engine, "before_cursor_execute")
+def _count(*_args):
+    QUERIES["n"] += 1
+
+
+def seed(members: int, chats: int):
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        users = [models.User(username=f"bench-{i}-{time.time_ns()}", password_hash="x") for i in range(members)]
+        group = models.Chat(chat_type="group", name="bench")
+        group.participants.extend(users)
+        others = [models.Chat(chat_type="group", name=f"other-{i}") for i in range(chats)]
+        db.add_all([*users, group, *others])
+        db.flush()
+        user_ids, group_id = [u.id for u in users], group.id
+        db.execute(insert(chat_users_table), [{"user_id": u, "chat_id": c.id} for u in user_ids for c in others])
+        db.execute(insert(models.UserChatState), [
+            {"user_id": u, "chat_id": c, "read_seq": 0} for u in user_ids for c in [group_id, *(o.id for o in others)]
+        ])
+        db.commit()
+        return user_ids, group_id
+    finally:
+        db.close()
+
+
+def refetch(user_ids, messages: int):
+    # Every send: each other member re-reads all of their counts
+    QUERIES["n"] = 0
+    calls = 0
+    t0 = time.perf_counter()
+    for _ in range(messages):
+        for uid in user_ids[1:]:
+            db = database.SessionLocal()
+            try:
+                chat_state_controller.get_unread_counts(db, uid)
+            finally:
+                db.close()
+            calls += 1
+    ms = (time.perf_counter() - t0) * 1000.0
+    return ["refetch", messages * (len(user_ids) - 1), calls, QUERIES["n"], f"{ms:,.0f}"]
+
+
+async def push(user_ids, group_id: int, messages: int, gap: float):
+    manager = ConnectionManager()
+    sockets = {}
+    QUERIES["n"] = 0
+    t0 = time.perf_counter()
+    for uid in user_ids:
+        sockets[uid] = FakeSocket()
+        manager.register_user_socket(uid, sockets[uid])
+        manager.user_connected(uid)
+        await manager.unread.connected(uid)
+    sender = user_ids[0]
+    for _ in range(messages):
+        await manager.unread.message_sent(group_id, sender, chat_state_controller.unread_increments(user_ids, sender))
+        if gap:
+            await asyncio.sleep(gap)
+    await asyncio.sleep(manager.unread.tick * 2)
+    deadline = time.perf_counter() + 5
+    while any(ws.frames == 0 for uid, ws in sockets.items() if uid != sender) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.001)
+    ms = (time.perf_counter() - t0) * 1000.0
+    frames = sum(ws.frames for ws in sockets.values())
+    manager.unread.stop()
+    return ["push", frames, 0, QUERIES["n"], f"{ms:,.0f}"]
+
+
+def main(args):
+    user_ids, group_id = seed(args.members, args.chats)
+    print(f"members={args.members} chats/member={args.chats + 1} messages={args.messages} gap={args.gap_ms}ms")
+    rows = [refetch(user_ids, args.messages)]
+    rows.append(asyncio.run(push(user_ids, group_id, args.messages, args.gap_ms / 1000.0)))
+    print_table(["strategy", "frames", "REST calls", "queries", "total ms"], rows)
+    print("(push queries are the one-off loads when each member connects)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--gap-ms", type=float, default=1.0, help="pause between sends")
+    main(parser.parse_args())
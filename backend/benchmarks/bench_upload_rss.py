@@ -0,0 +1,142 @@
+"""Peak memory and event-loop stalls of one upload: read-it-all vs streamed to disk.
+
+Each (strategy, size) runs in a fresh process so ru_maxrss is its own:
+  - buffered:  the old handler; `await file.read()` on the parsed form, then
+               one blocking open().write() on the event loop
+  - streaming: POST /files/upload as it is now; parsed as it arrives and
+               written a chunk at a time off the loop, then renamed
+The body is generated in 64 KB pieces and sent through httpx's ASGI
+transport, so the client side holds no copy of the file. A probe task
+ticks every 5 ms to show how long the loop was blocked.
+
+    python -m benchmarks.bench_upload_rss --sizes 10 50 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from ._common import print_table, setup_env
+
+BOUNDARY = "benchboundary7d1f"
+# About what the server reads off the socket per receive
+PIECE = 64 * 1024
+
+
+def body_parts(mb: int):
+    head = (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.zip\"\r\n"
+        "Content-Type: application/zip\r\n\r\n"
+    ).encode()
+    piece = os.urandom(PIECE)
+
+    async def gen():
+        yield head
+        for _ in range(mb * 16):
+            yield piece
+        yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+    return gen, len(head) + mb * 16 * PIECE + len(f"\r\n--{BOUNDARY}--\r\n")
+
+
+def buffered_app():
+    from fastapi import FastAPI, File, HTTPException, UploadFile
+
+    from app.routes.files import _validate_mime, files_dir
+
+    app = FastAPI()
+
+    @app.post("/files/upload")
+    async def upload(file: UploadFile = File(...)):
+        data = await file.read()
+        _validate_mime(file.filename or "file", file.content_type or "application/octet-stream", len(data))
+        path = os.path.join(files_dir(), "buffered")
+        try:
+            with open(path, "wb") as f:
+                f.write(data)
+        except Exception:
+            raise HTTPException(status_code=500, detail="Failed to store file")
+        return {"size_bytes": len(data)}
+
+    return app, {}
+
+
+def streaming_app():
+    from app.core.security import create_access_token
+    from app.db import database, models
+    from app.main import app
+
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        db.add(models.User(username="bench", password_hash="x"))
+        db.commit()
+    finally:
+        db.close()
+    return app, {"Authorization": f"Bearer {create_access_token({'sub': 'bench'})}", "x-nonce": "AAAAAAAAAAAAAAAA"}
+
+
+async def probe(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(0.005)
+        lags.append((time.perf_counter() - t0) * 1000.0 - 5.0)
+
+
+async def child(strategy: str, mb: int) -> dict:
+    import httpx
+
+    app, headers = buffered_app() if strategy == "buffered" else streaming_app()
+    gen, length = body_parts(mb)
+    headers = {**headers, "content-type": f"multipart/form-data; boundary={BOUNDARY}", "content-length": str(length)}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        # Warm up imports and the first request path before taking the baseline
+        await client.get("/docs")
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        stop, lags = asyncio.Event(), []
+        task = asyncio.create_task(probe(stop, lags))
+        t0 = time.perf_counter()
+        res = await client.post("/files/upload", content=gen(), headers=headers, timeout=None)
+        took = time.perf_counter() - t0
+        stop.set()
+        await task
+    assert res.status_code == 200, res.text
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"rss_mb": (peak - base) / 1024.0, "seconds": took, "max_lag_ms": max(lags) if lags else 0.0}
+
+
+def main(args):
+    rows = []
+    for mb in args.sizes:
+        for strategy in ("buffered", "streaming"):
+            tmp = tempfile.mkdtemp(prefix="bench_upload_rss_")
+            env = dict(os.environ, FILES_MAX_MB=str(max(args.sizes) + 1),
+                       DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}", FILES_DIR=os.path.join(tmp, "files"))
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_upload_rss", "--child", strategy, "--mb", str(mb)],
+                env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            )
+            if out.returncode != 0:
+                raise SystemExit(out.stderr)
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            rows.append([mb, strategy, f"{r['rss_mb']:.1f}", f"{r['max_lag_ms']:.1f}", f"{mb / r['seconds']:.0f}"])
+    print("one upload per fresh process; peak RSS growth over the warmed-up baseline")
+    print_table(["file MB", "strategy", "peak RSS +MB", "max loop lag ms", "MB/s"], rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--child", choices=["buffered", "streaming"])
+    parser.add_argument("--mb", type=int, default=10)
+    args = parser.parse_args()
+    if args.child:
+        setup_env()
+        print(json.dumps(asyncio.run(child(args.child, args.mb))))
+    else:
+        main(args)
@@ -13,25 +13,50 @@ export async function machineAuth() {
   return res.json() as Promise<{ access_token: string; token_type: string }>;
 }
 
+export type ChatSummary = {
+  id: number;
+  chat_type: string;
+  participants: {
+    id: number;
+    username: string;
+    first_name?: string | null;
+    last_name?: string | null;
+  }[];
+  title?: string;
+  name?: string | null;
+  admin_user_id?: number | null;
+  // participants is a preview (first few members by id); all of them via getChatMembers
+  member_count?: number;
+  is_pinned: boolean;
+  last_message_id?: number | null;
+  last_message_at?: string | null;
+  last_sender_id?: number | null;
+  message_count?: number;
+};
+
+// What changed in the chat list after a version (GET /chats/?since_version=)
+export type ChatListDelta = {
+  version: number;
+  full: boolean;
+  upserts: ChatSummary[];
+  removed: number[];
+};
+
 export async function getChats(token: string) {
   const res = await fetch(`${API_BASE}/chats/`, { headers: authHeader(token) });
   if (!res.ok) throw new Error("Failed to load chats");
-  return res.json() as Promise<
-    Array<{
-      id: number;
-      chat_type: string;
-      participants: {
-        id: number;
-        username: string;
-        first_name?: string | null;
-        last_name?: string | null;
-      }[];
-      title?: string;
-      name?: string | null;
-      admin_user_id?: number | null;
-      is_pinned: boolean;
-    }>
-  >;
+  const chats = (await res.json()) as ChatSummary[];
+  const version = Number(res.headers.get("X-Chat-List-Version") ?? NaN);
+  return { chats, version: Number.isFinite(version) ? version : null };
+}
+
+export async function getChatsSince(token: string, sinceVersion: number) {
+  const res = await fetch(
+    `${API_BASE}/chats/?since_version=${encodeURIComponent(String(sinceVersion))}`,
+    { headers: authHeader(token) }
+  );
+  if (!res.ok) throw new Error("Failed to load chat changes");
+  return res.json() as Promise<ChatListDelta>;
 }
 
 // Legacy WS URL helpers removed after migrating to unified socket
@@ -302,14 +327,62 @@ export async function renameGroup(token: string, chatId: number, name: string) {
   }>;
 }
 
-export async function getChatMessages(token: string, chatId: number) {
-  const res = await fetch(`${API_BASE}/chats/${chatId}/messages`, {
-    headers: authHeader(token),
-  });
+// One page of history in id order; pass next_cursor back as beforeId for older
+export type ChatMember = {
+  id: number;
+  username: string;
+  first_name?: string | null;
+  last_name?: string | null;
+};
+
+export async function getChatMembers(
+  token: string,
+  chatId: number,
+  opts: { afterId?: number | null; limit?: number } = {}
+) {
+  const params = new URLSearchParams();
+  if (opts.afterId != null) params.set("after_id", String(opts.afterId));
+  if (opts.limit != null) params.set("limit", String(opts.limit));
+  const qs = params.toString();
+  const res = await fetch(
+    `${API_BASE}/chats/${chatId}/members${qs ? `?${qs}` : ""}`,
+    { headers: authHeader(token) }
+  );
+  if (!res.ok) throw new Error("Failed to load members");
+  return res.json() as Promise<{ members: ChatMember[]; next_cursor: number | null }>;
+}
+
+// Every member, page by page (group key distribution needs them all)
+export async function getAllChatMembers(token: string, chatId: number) {
+  const all: ChatMember[] = [];
+  let cursor: number | null = null;
+  do {
+    const page = await getChatMembers(token, chatId, { afterId: cursor, limit: 500 });
+    all.push(...page.members);
+    cursor = page.next_cursor;
+  } while (cursor != null);
+  return all;
+}
+
+export async function getChatMessages(
+  token: string,
+  chatId: number,
+  opts: { beforeId?: number; afterId?: number; limit?: number } = {}
+) {
+  const params = new URLSearchParams();
+  if (opts.beforeId != null) params.set("before_id", String(opts.beforeId));
+  if (opts.afterId != null) params.set("after_id", String(opts.afterId));
+  if (opts.limit != null) params.set("limit", String(opts.limit));
+  const qs = params.toString();
+  const res = await fetch(
+    `${API_BASE}/chats/${chatId}/messages${qs ? `?${qs}` : ""}`,
+    { headers: authHeader(token) }
+  );
   if (!res.ok) throw new Error("Failed to load messages");
-  return res.json() as Promise<
-    Array<{
+  return res.json() as Promise<{
+    messages: Array<{
       id: number;
+      seq?: number | null;
       content: string | null;
       content_type: string;
       timestamp: string;
@@ -326,8 +399,9 @@ export async function getChatMessages(token: string, chatId: number) {
         nonce: string;
         algo: string;
       } | null;
-    }>
-  >;
+    }>;
+    next_cursor: number | null;
+  }>;
 }
 
 export async function sendMessage(
@@ -367,6 +441,7 @@ export async function getReadState(token: string, chatId: number) {
   return res.json() as Promise<{
     chat_id: number;
     last_read_message_id: number | null;
+    read_seq: number;
   }>;
 }
 
@@ -386,6 +461,7 @@ export async function setReadState(
   return res.json() as Promise<{
     chat_id: number;
     last_read_message_id: number | null;
+    read_seq: number;
   }>;
 }
 
@@ -510,6 +586,89 @@ export async function getGroupKeyWrap(token: string, chatId: number) {
   }>;
 }
 
+export type UploadedAttachment = {
+  id: number;
+  filename: string;
+  mime_type: string;
+  size_bytes: number;
+  nonce: string;
+  algo: string;
+};
+
+type UploadSession = {
+  id: string;
+  chunk_size: number;
+  size_bytes: number;
+  received_bytes: number;
+  missing_offsets: number[];
+};
+
+// Above this, attachments go through a resumable upload session so a dropped
+// connection only costs the chunks in flight, not the whole file
+const RESUMABLE_UPLOAD_BYTES = 16 * 1024 * 1024;
+const UPLOAD_PARALLEL_CHUNKS = 3;
+const UPLOAD_CHUNK_RETRIES = 5;
+
+async function uploadResumable(
+  token: string,
+  ciphertext: Uint8Array,
+  filename: string,
+  mime: string,
+  nonceB64: string
+): Promise<UploadedAttachment> {
+  const res = await fetch(`${API_BASE}/files/uploads`, {
+    method: "POST",
+    headers: { ...authHeader(token), "Content-Type": "application/json" },
+    body: JSON.stringify({
+      filename,
+      mime_type: mime,
+      size_bytes: ciphertext.length,
+      nonce: nonceB64,
+    }),
+  });
+  if (!res.ok) throw new Error("Upload failed");
+  const session = (await res.json()) as UploadSession;
+  const url = `${API_BASE}/files/uploads/${session.id}`;
+  let pending = session.missing_offsets.slice();
+  for (let attempt = 0; pending.length; attempt++) {
+    if (attempt > UPLOAD_CHUNK_RETRIES) throw new Error("Upload failed");
+    if (attempt > 0) {
+      await new Promise((r) => setTimeout(r, 500 * 2 ** (attempt - 1)));
+      // Ask the server what actually arrived; a failed response may still have landed
+      try {
+        const status = await fetch(url, { headers: authHeader(token) });
+        if (status.ok) pending = ((await status.json()) as UploadSession).missing_offsets;
+      } catch {}
+      if (!pending.length) break;
+    }
+    const queue = pending.slice();
+    const failed: number[] = [];
+    const worker = async () => {
+      for (let offset = queue.shift(); offset !== undefined; offset = queue.shift()) {
+        const body = ciphertext.subarray(offset, offset + session.chunk_size);
+        try {
+          const put = await fetch(`${url}?offset=${offset}`, {
+            method: "PUT",
+            headers: { ...authHeader(token), "Content-Type": "application/octet-stream" },
+            body,
+          });
+          if (!put.ok) failed.push(offset);
+        } catch {
+          failed.push(offset);
+        }
+      }
+    };
+    await Promise.all(Array.from({ length: UPLOAD_PARALLEL_CHUNKS }, worker));
+    pending = failed;
+  }
+  const done = await fetch(`${url}/complete`, {
+    method: "POST",
+    headers: authHeader(token),
+  });
+  if (!done.ok) throw new Error("Upload failed");
+  return done.json() as Promise<UploadedAttachment>;
+}
+
 export async function uploadEncryptedFile(
   token: string,
   ciphertext: Uint8Array,
@@ -517,6 +676,9 @@ export async function uploadEncryptedFile(
   mime: string,
   nonceB64: string
 ) {
+  if (ciphertext.length > RESUMABLE_UPLOAD_BYTES) {
+    return uploadResumable(token, ciphertext, filename, mime, nonceB64);
+  }
   const form = new FormData();
   form.append("file", new Blob([ciphertext], { type: mime }), filename);
   const res = await fetch(`${API_BASE}/files/upload`, {
@@ -525,14 +687,7 @@ export async function uploadEncryptedFile(
     body: form,
   });
   if (!res.ok) throw new Error("Upload failed");
-  return res.json() as Promise<{
-    id: number;
-    filename: string;
-    mime_type: string;
-    size_bytes: number;
-    nonce: string;
-    algo: string;
-  }>;
+  return res.json() as Promise<UploadedAttachment>;
 }
 
 export async function downloadAttachment(token: string, id: number) {
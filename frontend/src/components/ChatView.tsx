@@ -43,6 +43,7 @@ export function ChatView({ token, onLogout }: Props) {
     refreshLists,
     loading,
     invalidateChatsCache,
+    applyChatsDelta,
     pinnedChatIds,
     maxPinnedChats,
     pinChat,
@@ -72,6 +73,9 @@ export function ChatView({ token, onLogout }: Props) {
     onSendAttachment,
     onDropFiles,
     firstUnreadIndex,
+    hasOlder,
+    loadingOlder,
+    loadOlder,
   } = useUnifiedSocket({
     token,
     activeChatId,
@@ -86,14 +90,9 @@ export function ChatView({ token, onLogout }: Props) {
       clearPublicKeyCache();
       refreshLists();
     },
-    onChatsChanged: () => {
-      invalidateChatsCache();
-      return refreshLists();
-    },
+    onChatsChanged: applyChatsDelta,
     onNewMessage: (chatId) =>
       setLastIncomingAt((prev) => ({ ...prev, [chatId]: Date.now() })),
-    onUnreadUpdate: (chatId) =>
-      setUnreadMap((prev) => ({ ...prev, [chatId]: 0 })),
     onRemovedFromChat: (chatId) => {
       try {
         const curr = activeChatIdRef.current;
@@ -263,7 +262,7 @@ export function ChatView({ token, onLogout }: Props) {
                           return `צ'אט עם ${name} | ${typeLabel}`;
                         })()
                       : `צ'אט עם ${
-                          chat.participants?.length ?? 0
+                          chat.member_count ?? chat.participants?.length ?? 0
                         } משתתפים | ${typeLabel}`;
                   return (
                     <span className="inline-flex items-center gap-2">
@@ -326,6 +325,9 @@ export function ChatView({ token, onLogout }: Props) {
               <ChatMessages
                 messages={messages}
                 firstUnreadIndex={firstUnreadIndex}
+                hasOlder={hasOlder}
+                loadingOlder={loadingOlder}
+                onLoadOlder={loadOlder}
                 myId={myId}
                 isGroup={(() => {
                   const chat = chats.find((c: any) => c.id === activeChatId);
@@ -369,6 +371,7 @@ export function ChatView({ token, onLogout }: Props) {
           }}
         />
         <GroupMembersDialog
+          token={token}
           open={showMembersDialog}
           onOpenChange={(open) => setShowMembersDialog(open)}
           chat={chats.find((c: any) => c.id === activeChatId) || null}
@@ -16,6 +16,9 @@ type Props = {
   token?: string;
   chatId?: number | null;
   otherUserId?: number | null;
+  hasOlder?: boolean;
+  loadingOlder?: boolean;
+  onLoadOlder?: () => void;
 };
 
 export const ChatMessages = memo(function ChatMessages({
@@ -26,6 +29,9 @@ export const ChatMessages = memo(function ChatMessages({
   token,
   chatId,
   otherUserId,
+  hasOlder,
+  loadingOlder,
+  onLoadOlder,
 }: Props) {
   const ChatMessageEx = ChatMessage as unknown as React.ComponentType<
     React.ComponentProps<typeof ChatMessage> & {
@@ -72,14 +78,28 @@ export const ChatMessages = memo(function ChatMessages({
     }
   }, []);
 
+  // Follow new messages at the bottom, but stay put when older pages are prepended
+  const lastMessageId = messages.length ? messages[messages.length - 1].id : null;
   useEffect(() => {
     anchorRef.current?.scrollIntoView({ behavior: "smooth", block: "end" });
-  }, [messages]);
+  }, [lastMessageId]);
 
   // code parsing/attachment decrypting delegated to components and hooks
 
   return (
     <div className="w-full max-w-full flex-1 overflow-y-auto space-y-2 pr-2 pl-2 box-border">
+      {hasOlder && onLoadOlder && (
+        <div className="flex justify-center py-2">
+          <button
+            type="button"
+            className="text-xs text-blue-600 dark:text-blue-400 hover:underline disabled:opacity-50"
+            disabled={loadingOlder}
+            onClick={onLoadOlder}
+          >
+            {loadingOlder ? "טוען…" : "טען הודעות קודמות"}
+          </button>
+        </div>
+      )}
       {(() => {
         // Helpers for day grouping
         const startOfDay = (d: Date) => {
@@ -1,9 +1,13 @@
 import { Dialog, DialogContent, DialogFooter, DialogHeader, DialogTitle } from "@/components/ui/dialog";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
-import { useState } from "react";
+import { useCallback, useEffect, useState } from "react";
+import { getChatMembers, type ChatMember } from "@/api";
+
+const MEMBERS_PAGE = 100;
 
 export function GroupMembersDialog({
+  token,
   open,
   onOpenChange,
   chat,
@@ -13,6 +17,7 @@ export function GroupMembersDialog({
   onAddMembers,
   onRemoveMember,
 }: {
+  token: string;
   open: boolean;
   onOpenChange: (open: boolean) => void;
   chat: any | null;
@@ -25,8 +30,36 @@ export function GroupMembersDialog({
   const [renameValue, setRenameValue] = useState("");
   const [renaming, setRenaming] = useState(false);
 
+  const [members, setMembers] = useState<ChatMember[]>([]);
+  const [nextCursor, setNextCursor] = useState<number | null>(null);
+  const [loadingMembers, setLoadingMembers] = useState(false);
+
   const isAdmin = Boolean(chat && chat.chat_type === "group" && chat.admin_user_id === myId);
-  const members = chat?.participants ?? [];
+  const chatId: number | null = chat?.id ?? null;
+
+  const loadMembers = useCallback(
+    async (after: number | null) => {
+      if (chatId == null) return;
+      setLoadingMembers(true);
+      try {
+        const page = await getChatMembers(token, chatId, { afterId: after, limit: MEMBERS_PAGE });
+        setMembers((prev) => (after == null ? page.members : [...prev, ...page.members]));
+        setNextCursor(page.next_cursor);
+      } catch {
+      } finally {
+        setLoadingMembers(false);
+      }
+    },
+    [token, chatId]
+  );
+
+  // First page on open, and again when membership changes (member_count moves)
+  useEffect(() => {
+    if (!open || chatId == null) return;
+    setMembers([]);
+    setNextCursor(null);
+    loadMembers(null);
+  }, [open, chatId, chat?.member_count, loadMembers]);
   const otherUsers = approvedUsers.filter((u) => !u.is_self && !members.some((m: any) => m.id === u.user_id));
 
   return (
@@ -68,7 +101,14 @@ export function GroupMembersDialog({
                   )}
                 </li>
               ))}
-              {members.length === 0 && <li className="text-sm text-muted-foreground">אין משתתפים</li>}
+              {members.length === 0 && !loadingMembers && <li className="text-sm text-muted-foreground">אין משתתפים</li>}
+              {nextCursor != null && (
+                <li>
+                  <Button size="sm" variant="ghost" className="w-full" disabled={loadingMembers} onClick={() => loadMembers(nextCursor)}>
+                    טען עוד ({members.length}/{chat?.member_count ?? members.length})
+                  </Button>
+                </li>
+              )}
             </ul>
           </div>
           {isAdmin && (
@@ -3,27 +3,29 @@ import { useQuery, useQueryClient } from "@tanstack/react-query";
 import {
   getApprovedPeers,
   getChats,
+  getChatsSince,
+  type ChatListDelta,
+  type ChatSummary,
   getUnreadCounts,
   pinChat as apiPinChat,
   unpinChat as apiUnpinChat,
   getUserSettings,
 } from "@/api";
 
-type ChatRec = {
-  id: number;
-  chat_type: string;
-  participants: {
-    id: number;
-    username: string;
-    first_name?: string | null;
-    last_name?: string | null;
-  }[];
-  title?: string;
-  name?: string | null;
-  admin_user_id?: number | null;
-  is_pinned: boolean;
+type ChatRec = ChatSummary;
+
+// A chats_changed frame: the new list version and the change that led to it
+export type ChatsChangedFrame = {
+  version?: number;
+  upserts?: ChatRec[];
+  removed?: number[];
 };
 
+// Newest activity first; chats without messages keep the server's order at the end
+function activityTime(chat: ChatRec): number {
+  return chat.last_message_at ? Date.parse(chat.last_message_at) || 0 : 0;
+}
+
 // Maximum number of chats that can be pinned
 const MAX_PINNED_CHATS = 3;
 
@@ -32,7 +34,11 @@ export function useChatList(token: string) {
 
   const chatsQuery = useQuery({
     queryKey: ["chats", token],
-    queryFn: () => getChats(token) as Promise<ChatRec[]>,
+    queryFn: async () => {
+      const { chats, version } = await getChats(token);
+      queryClient.setQueryData(["chatListVersion", token], version);
+      return chats;
+    },
     staleTime: 60_000,
     gcTime: 5 * 60_000,
   });
@@ -110,6 +116,53 @@ export function useChatList(token: string) {
     queryClient.invalidateQueries({ queryKey: ["chats", token] });
   }, [queryClient, token]);
 
+  const mergeChatsDelta = useCallback(
+    (delta: ChatListDelta) => {
+      queryClient.setQueryData(["chats", token], (prev: ChatRec[] | undefined) => {
+        if (delta.full || !prev) return delta.upserts;
+        const gone = new Set([...delta.removed, ...delta.upserts.map((c) => c.id)]);
+        // New and changed chats go first; the sort below places them
+        return [...delta.upserts, ...prev.filter((c) => !gone.has(c.id))];
+      });
+      queryClient.setQueryData(["chatListVersion", token], delta.version);
+    },
+    [queryClient, token]
+  );
+
+  // Apply a chats_changed frame: in order it is the whole change; after a
+  // gap (missed frames, reconnect) fetch everything since our version
+  const applyChatsDelta = useCallback(
+    async (frame: ChatsChangedFrame) => {
+      // Approved peers follow private chats
+      if (frame.removed?.length || frame.upserts?.some((c) => c.chat_type === "private")) {
+        queryClient.invalidateQueries({ queryKey: ["approvedPeers", token] });
+      }
+      const local = queryClient.getQueryData<number | null>(["chatListVersion", token]);
+      if (typeof frame.version !== "number" || local == null) {
+        invalidateChatsCache();
+        return;
+      }
+      if (frame.version <= local) return;
+      if (frame.version === local + 1) {
+        mergeChatsDelta({
+          version: frame.version,
+          full: false,
+          upserts: frame.upserts ?? [],
+          removed: frame.removed ?? [],
+        });
+        return;
+      }
+      try {
+        const delta = await getChatsSince(token, local);
+        const now = queryClient.getQueryData<number | null>(["chatListVersion", token]);
+        if (now == null || delta.full || delta.version > now) mergeChatsDelta(delta);
+      } catch {
+        invalidateChatsCache();
+      }
+    },
+    [queryClient, token, invalidateChatsCache, mergeChatsDelta]
+  );
+
   // Pin/unpin chat functions
   const pinChat = useCallback(
     async (chatId: number) => {
@@ -118,31 +171,29 @@ export function useChatList(token: string) {
 
       try {
         await apiPinChat(token, chatId);
-        // Invalidate chats cache to refresh data
-        queryClient.invalidateQueries({ queryKey: ["chats", token] });
+        // The chats_changed frame for the pin moves the chat
         return true;
       } catch (error) {
         console.error("Failed to pin chat:", error);
         return false;
       }
     },
-    [pinnedChatIdsFromAPI, maxPinnedChats, token, queryClient]
+    [pinnedChatIdsFromAPI, maxPinnedChats, token]
   );
 
   const unpinChat = useCallback(
     async (chatId: number) => {
       try {
         await apiUnpinChat(token, chatId);
-        // Invalidate chats cache to refresh data
-        queryClient.invalidateQueries({ queryKey: ["chats", token] });
       } catch (error) {
         console.error("Failed to unpin chat:", error);
       }
     },
-    [token, queryClient]
+    [token]
   );
 
-  // Sort chats: pinned first, then by last activity
+  // Sort chats: pinned first, then by last activity. The server already
+  // returns this order; re-sorting keeps it as live messages bump chats.
   const sortedChats = useMemo(() => {
     if (chats.length === 0) return [];
 
@@ -153,11 +204,9 @@ export function useChatList(token: string) {
       (chat) => !pinnedChatIdsFromAPI.includes(chat.id)
     );
 
-    // Sort unpinned by last activity (you can customize this sorting)
-    const sortedUnpinned = [...unpinned].sort((a, b) => {
-      // For now, just keep original order
-      return 0;
-    });
+    const sortedUnpinned = [...unpinned].sort(
+      (a, b) => activityTime(b) - activityTime(a)
+    );
 
     return [...pinned, ...sortedUnpinned];
   }, [chats, pinnedChatIdsFromAPI]);
@@ -171,6 +220,7 @@ export function useChatList(token: string) {
     refreshLists,
     loading,
     invalidateChatsCache,
+    applyChatsDelta,
     pinnedChatIds: pinnedChatIdsFromAPI,
     maxPinnedChats,
     pinChat,
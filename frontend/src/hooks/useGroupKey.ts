@@ -1,5 +1,10 @@
 import { useCallback, useRef } from "react";
-import { getGroupKeyWrap, getPublicKey, publishGroupKeyWrap } from "@/api";
+import {
+  getAllChatMembers,
+  getGroupKeyWrap,
+  getPublicKey,
+  publishGroupKeyWrap,
+} from "@/api";
 import {
   decryptBytesAesGcm,
   exportGroupKeyRaw,
@@ -75,7 +80,12 @@ export function useGroupKey(token: string | null) {
         await saveGroupKey(chat.id, key);
         groupKeyRef.current = key;
         const raw = await exportGroupKeyRaw(key);
-        for (const p of chat.participants) {
+        // chat.participants is only a preview; wrap the key for every member
+        let members: { id: number }[] = chat.participants;
+        try {
+          members = await getAllChatMembers(token, chat.id);
+        } catch {}
+        for (const p of members) {
           if (p.id === myUserId) continue;
           try {
             const pk = await getPublicKey(token, p.id);
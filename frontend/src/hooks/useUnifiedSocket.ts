@@ -14,6 +14,23 @@ import {
   getSharedKeyWithUser,
   loadGroupKey,
 } from "@/lib/e2ee";
+import type { ChatsChangedFrame } from "@/hooks/useChatList";
+
+type ChatMessage = { id: number; [k: string]: any };
+
+// Append messages not already present (replayed and live frames can overlap)
+function mergeById<T extends ChatMessage>(prev: T[] | undefined, incoming: T[]): T[] {
+  const base = prev ?? [];
+  const seen = new Set(base.map((m) => m.id));
+  const fresh = incoming.filter((m) => !seen.has(m.id));
+  if (!fresh.length) return base;
+  const merged = [...base, ...fresh];
+  // A gap replay can land after newer live messages: keep id order
+  const last = base.length ? base[base.length - 1].id : -Infinity;
+  return fresh.some((m) => m.id < last)
+    ? merged.sort((a, b) => a.id - b.id)
+    : merged;
+}
 
 type Chat = {
   id: number;
@@ -36,7 +53,6 @@ export function useUnifiedSocket({
   onUsersChanged,
   onChatsChanged,
   onNewMessage,
-  onUnreadUpdate,
   onRemovedFromChat,
 }: {
   token: string;
@@ -53,9 +69,8 @@ export function useUnifiedSocket({
   ) => void;
   setOnlineIds: React.Dispatch<React.SetStateAction<Set<number>>>;
   onUsersChanged: () => void;
-  onChatsChanged: () => void;
+  onChatsChanged: (frame: ChatsChangedFrame) => void;
   onNewMessage?: (chatId: number) => void;
-  onUnreadUpdate?: (chatId: number) => void;
   onRemovedFromChat?: (chatId: number) => void;
 }) {
   const queryClient = useQueryClient();
@@ -84,6 +99,16 @@ export function useUnifiedSocket({
   const sendQueueRef = useRef<string[]>([]);
   const prevSubRef = useRef<number | null>(null);
   const lastSubAckRef = useRef<number | null>(null);
+  // Newest message id seen per chat: the resume cursor sent with subscribe
+  const lastSeenRef = useRef<Record<number, number>>({});
+  const [historyReload, setHistoryReload] = useState<number>(0);
+  const reloadHandledRef = useRef<number>(0);
+  // Chats whose cached messages came from a full history load
+  const historyLoadedRef = useRef<Set<number>>(new Set());
+  // before_id for the next older page per chat (null once the start is reached)
+  const olderCursorRef = useRef<Record<number, number | null>>({});
+  const [hasOlder, setHasOlder] = useState<boolean>(false);
+  const [loadingOlder, setLoadingOlder] = useState<boolean>(false);
   const chatsRef = useRef<Chat[]>(chats);
   const activeChatIdRef = useRef<number | null>(activeChatId);
   const myIdRef = useRef<number | null>(myId);
@@ -91,7 +116,6 @@ export function useUnifiedSocket({
     onUsersChanged,
     onChatsChanged,
     onNewMessage,
-    onUnreadUpdate,
     onRemovedFromChat,
   });
   useEffect(() => {
@@ -108,17 +132,56 @@ export function useUnifiedSocket({
       onUsersChanged,
       onChatsChanged,
       onNewMessage,
-      onUnreadUpdate,
       onRemovedFromChat,
     };
   }, [
     onUsersChanged,
     onChatsChanged,
     onNewMessage,
-    onUnreadUpdate,
     onRemovedFromChat,
   ]);
 
+  const noteSeen = useCallback((chatId: number, ids: number[]) => {
+    const top = Math.max(lastSeenRef.current[chatId] ?? 0, ...ids);
+    if (top > 0) lastSeenRef.current[chatId] = top;
+  }, []);
+
+  // Per-chat seqs have no holes (the rows of one group send share one), so
+  // a jump past the last seq seen means frames for that chat were missed
+  const lastSeqRef = useRef<Record<number, number>>({});
+  const noteSeq = useCallback((chatId: number, seqs: unknown[]) => {
+    const known = seqs.filter((s): s is number => typeof s === "number");
+    if (!known.length) return false;
+    const prev = lastSeqRef.current[chatId];
+    lastSeqRef.current[chatId] = Math.max(prev ?? 0, ...known);
+    return prev != null && Math.min(...known) > prev + 1;
+  }, []);
+
+  // Move a chat up the sidebar without refetching the list
+  const touchChat = useCallback(
+    (chatId: number, at?: string | null) => {
+      try {
+        queryClient.setQueryData(["chats", token], (prev: any[] | undefined) =>
+          prev?.map((c) =>
+            c.id === chatId
+              ? { ...c, last_message_at: at ?? new Date().toISOString() }
+              : c
+          )
+        );
+      } catch {}
+    },
+    [queryClient, token]
+  );
+
+  const subscribeFrame = useCallback((chatId: number) => {
+    const sinceId = lastSeenRef.current[chatId];
+    return JSON.stringify(
+      sinceId != null
+        ? { v: 1, type: "subscribe", chat_id: chatId, since_id: sinceId }
+        : { v: 1, type: "subscribe", chat_id: chatId }
+    );
+  }, []);
+
   const wsUrl = useMemo(
     () =>
       `${API_BASE.replace(/^http/, "ws")}/ws?token=${encodeURIComponent(
@@ -151,7 +214,7 @@ export function useUnifiedSocket({
         try {
           const curr = activeChatIdRef.current;
           if (curr) {
-            ws.send(JSON.stringify({ v: 1, type: "subscribe", chat_id: curr }));
+            ws.send(subscribeFrame(curr));
             prevSubRef.current = curr;
             try {
               console.info("WS: subscribe (onopen)", { chatId: curr });
@@ -175,9 +238,7 @@ export function useUnifiedSocket({
                 lastSubAckRef.current !== want &&
                 ws.readyState === WebSocket.OPEN
               ) {
-                ws.send(
-                  JSON.stringify({ v: 1, type: "subscribe", chat_id: want })
-                );
+                ws.send(subscribeFrame(want));
                 prevSubRef.current = want;
                 try {
                   console.info("WS: subscribe (retry)", { chatId: want });
@@ -199,6 +260,62 @@ export function useUnifiedSocket({
           } catch {}
         } catch {}
       };
+      const decryptContent = async (
+        chatId: number,
+        message: any
+      ): Promise<string | null> => {
+        const chat = chatsRef.current.find((c) => c.id === chatId);
+        let content = message?.content as string | null;
+        if (!content && chat) {
+          if (
+            chat.chat_type === "private" &&
+            message?.ciphertext &&
+            message?.nonce
+          ) {
+            const other =
+              chat.participants.find((p) => p.id !== myIdRef.current) ||
+              (myIdRef.current != null
+                ? ({ id: myIdRef.current } as any)
+                : null);
+            if (other) {
+              try {
+                const keyRec = await getPublicKey(token, (other as any).id);
+                const shared = await getSharedKeyWithUser(
+                  (other as any).id,
+                  JSON.parse(keyRec.public_key_jwk)
+                );
+                content = await decryptTextAesGcm(
+                  message.ciphertext,
+                  message.nonce,
+                  shared
+                );
+              } catch {}
+            }
+          } else if (chat.chat_type === "group") {
+            const key =
+              groupKeyRef.current ||
+              (await ensureGroupKey(chat as any, myIdRef.current));
+            if (key && message?.ciphertext && message?.nonce) {
+              try {
+                content = await decryptTextAesGcm(
+                  message.ciphertext,
+                  message.nonce,
+                  key
+                );
+              } catch {}
+            }
+          }
+        }
+        return content ?? null;
+      };
+      const toChatMessage = (message: any, content: string | null) => ({
+        id: message?.id ?? Date.now(),
+        content,
+        content_type: message?.content_type,
+        sender: message?.sender,
+        timestamp: message?.timestamp as string | undefined,
+        attachment: message?.attachment ?? null,
+      });
       ws.onmessage = async (evt) => {
         try {
           const data = JSON.parse(evt.data);
@@ -215,6 +332,17 @@ export function useUnifiedSocket({
             setOnlineIds(new Set<number>(data.online_user_ids));
             return;
           }
+          if (data?.type === "presence_batch") {
+            const online: number[] = Array.isArray(data.online) ? data.online : [];
+            const offline: number[] = Array.isArray(data.offline) ? data.offline : [];
+            setOnlineIds((prev) => {
+              const next = new Set(prev);
+              for (const id of online) next.add(id);
+              for (const id of offline) next.delete(id);
+              return next;
+            });
+            return;
+          }
           if (data?.type === "presence" && typeof data.user_id === "number") {
             setOnlineIds((prev) => {
               const next = new Set(prev);
@@ -249,14 +377,27 @@ export function useUnifiedSocket({
             return;
           }
           if (data?.type === "chats_changed") {
-            handlersRef.current.onChatsChanged();
+            handlersRef.current.onChatsChanged(data);
             return;
           }
           if (
-            data?.type === "unread_update" &&
-            typeof data.chat_id === "number"
+            data?.type === "unread" &&
+            typeof data.chat_id === "number" &&
+            typeof data.count === "number"
           ) {
-            handlersRef.current.onUnreadUpdate?.(data.chat_id);
+            // Absolute count from the server; the open chat stays at 0
+            const chatId = data.chat_id as number;
+            const count =
+              activeChatIdRef.current === chatId ? 0 : (data.count as number);
+            try {
+              queryClient.setQueryData(
+                ["unreadCounts", token],
+                (prev: Record<number, number> | undefined) => ({
+                  ...(prev ?? {}),
+                  [chatId]: count,
+                })
+              );
+            } catch {}
             return;
           }
           if (
@@ -270,99 +411,82 @@ export function useUnifiedSocket({
             data?.type === "new_message" &&
             typeof data.chat_id === "number"
           ) {
+            // Badge counts arrive separately as "unread" frames
+            touchChat(data.chat_id);
             const curr = activeChatIdRef.current;
             if (!curr || curr !== data.chat_id) {
-              // Instead of incrementing by 1, let's get the actual count from the server
-              // This ensures accuracy and prevents drift
-              try {
-                // Get current unread counts from cache
-                const currentUnreadCounts = queryClient.getQueryData([
-                  "unreadCounts",
-                  token,
-                ]) as Record<number, number> | undefined;
-
-                // Increment by 1 for now, but we'll sync with server data later
-                const newCount = (currentUnreadCounts?.[data.chat_id] ?? 0) + 1;
-
-                setUnreadMap((prev) => ({
-                  ...prev,
-                  [data.chat_id]: newCount,
-                }));
-              } catch {
-                // Fallback to simple increment if cache access fails
-                setUnreadMap((prev) => ({
-                  ...prev,
-                  [data.chat_id]: (prev[data.chat_id] ?? 0) + 1,
-                }));
-              }
-
               handlersRef.current.onNewMessage?.(data.chat_id);
             }
             return;
           }
+          if (data?.type === "replay" && typeof data.chat_id === "number") {
+            const chatId = data.chat_id as number;
+            const replayed = Array.isArray(data.messages) ? data.messages : [];
+            try {
+              console.info("WS: replay", {
+                chatId,
+                count: replayed.length,
+                source: data.source,
+                complete: data.complete,
+              });
+            } catch {}
+            if (!data.complete) {
+              // Too far behind for one replay: page history from scratch
+              historyLoadedRef.current.delete(chatId);
+              if (activeChatIdRef.current === chatId)
+                setHistoryReload((n) => n + 1);
+              return;
+            }
+            if (!replayed.length) return;
+            const items = await Promise.all(
+              replayed.map(async (m: any) =>
+                toChatMessage(m, await decryptContent(chatId, m))
+              )
+            );
+            noteSeq(
+              chatId,
+              replayed.map((m: any) => m?.seq)
+            );
+            noteSeen(
+              chatId,
+              items.map((m) => m.id)
+            );
+            try {
+              queryClient.setQueryData(
+                ["messages", token, chatId],
+                (prev: any[] | undefined) => mergeById(prev, items)
+              );
+            } catch {}
+            if (activeChatIdRef.current === chatId) {
+              setMessages((prev) => mergeById(prev as any[], items) as any);
+              try {
+                await setReadState(token, chatId, items[items.length - 1].id);
+                setUnreadMap((prev) => ({ ...prev, [chatId]: 0 }));
+              } catch {}
+            }
+            return;
+          }
           if (data?.type === "message" && typeof data.chat_id === "number") {
             const chatId = data.chat_id as number;
-            const chat = chatsRef.current.find((c) => c.id === chatId);
-            let content = data.message?.content as string | null;
-            if (!content && chat) {
-              if (
-                chat.chat_type === "private" &&
-                data.message?.ciphertext &&
-                data.message?.nonce
-              ) {
-                const other =
-                  chat.participants.find((p) => p.id !== myIdRef.current) ||
-                  (myIdRef.current != null
-                    ? ({ id: myIdRef.current } as any)
-                    : null);
-                if (other) {
-                  try {
-                    const keyRec = await getPublicKey(token, (other as any).id);
-                    const shared = await getSharedKeyWithUser(
-                      (other as any).id,
-                      JSON.parse(keyRec.public_key_jwk)
-                    );
-                    content = await decryptTextAesGcm(
-                      data.message.ciphertext,
-                      data.message.nonce,
-                      shared
-                    );
-                  } catch {}
-                }
-              } else if (chat.chat_type === "group") {
-                const key =
-                  groupKeyRef.current ||
-                  (await ensureGroupKey(chat as any, myIdRef.current));
-                if (key && data.message?.ciphertext && data.message?.nonce) {
-                  try {
-                    content = await decryptTextAesGcm(
-                      data.message.ciphertext,
-                      data.message.nonce,
-                      key
-                    );
-                  } catch {}
-                }
-              }
+            const content = await decryptContent(chatId, data.message);
+            if (noteSeq(chatId, [data.message?.seq])) {
+              // Missed frames: resubscribing from the last id seen replays them
+              try {
+                console.info("WS: seq gap, resubscribing", { chatId });
+                wsRef.current?.send(subscribeFrame(chatId));
+              } catch {}
             }
+            if (typeof data.message?.id === "number")
+              noteSeen(chatId, [data.message.id]);
+            touchChat(chatId, data.message?.timestamp);
             if (activeChatIdRef.current === chatId) {
-              const newId = data.message?.id ?? Date.now();
-              const ts = data.message?.timestamp as string | undefined;
-              const newMsg = {
-                id: newId,
-                content: content ?? null,
-                content_type: data.message?.content_type,
-                sender: data.message?.sender,
-                timestamp: ts,
-                attachment: data.message?.attachment ?? null,
-              } as const;
-              setMessages((prev) => [...prev, newMsg as any]);
+              const newMsg = toChatMessage(data.message, content);
+              const newId = newMsg.id;
+              setMessages((prev) => mergeById(prev as any[], [newMsg]) as any);
               try {
                 queryClient.setQueryData(
                   ["messages", token, chatId],
-                  (prev: any[] | undefined) => [
-                    ...((prev as any[]) ?? []),
-                    newMsg,
-                  ]
+                  (prev: any[] | undefined) => mergeById(prev, [newMsg])
                 );
               } catch {}
               try {
@@ -377,20 +501,10 @@ export function useUnifiedSocket({
             } else {
               // Update cache for that chat so it shows immediately on switch
               try {
-                const newMsg = {
-                  id: data.message?.id ?? Date.now(),
-                  content: content ?? null,
-                  content_type: data.message?.content_type,
-                  sender: data.message?.sender,
-                  timestamp: data.message?.timestamp as string | undefined,
-                  attachment: data.message?.attachment ?? null,
-                } as const;
+                const newMsg = toChatMessage(data.message, content);
                 queryClient.setQueryData(
                   ["messages", token, chatId],
-                  (prev: any[] | undefined) => [
-                    ...((prev as any[]) ?? []),
-                    newMsg,
-                  ]
+                  (prev: any[] | undefined) => mergeById(prev, [newMsg])
                 );
               } catch {}
               handlersRef.current.onNewMessage?.(chatId);
@@ -442,9 +556,7 @@ export function useUnifiedSocket({
           } catch {}
         }
         if (activeChatId) {
-          sendQueueRef.current.push(
-            JSON.stringify({ v: 1, type: "subscribe", chat_id: activeChatId })
-          );
+          sendQueueRef.current.push(subscribeFrame(activeChatId));
           try {
             console.info("WS: queue subscribe (not open)", {
               chatId: activeChatId,
@@ -466,9 +578,7 @@ export function useUnifiedSocket({
     }
     if (activeChatId) {
       try {
-        ws.send(
-          JSON.stringify({ v: 1, type: "subscribe", chat_id: activeChatId })
-        );
+        ws.send(subscribeFrame(activeChatId));
         try {
           console.info("WS: subscribe", { chatId: activeChatId });
         } catch {}
@@ -476,95 +586,28 @@ export function useUnifiedSocket({
       setUnreadMap((prev) => ({ ...prev, [activeChatId]: 0 }));
     }
     prevSubRef.current = activeChatId;
-  }, [activeChatId, setUnreadMap, queryClient, token]);
+  }, [activeChatId, setUnreadMap, queryClient, token, subscribeFrame]);
 
-  // Sync unread counts with server periodically to prevent drift
-  useEffect(() => {
-    const syncInterval = setInterval(async () => {
-      try {
-        // Only sync if we have unread counts and they're not 0
-        const currentUnreadCounts = queryClient.getQueryData([
-          "unreadCounts",
-          token,
-        ]) as Record<number, number> | undefined;
-
-        if (currentUnreadCounts) {
-          const hasUnread = Object.values(currentUnreadCounts).some(
-            (count) => count > 0
-          );
-          if (hasUnread) {
-            // Invalidate unread counts to fetch fresh data from server
-            queryClient.invalidateQueries({
-              queryKey: ["unreadCounts", token],
-            });
-          }
-        }
-      } catch {
-        // Ignore errors in background sync
-      }
-    }, 30000); // Sync every 30 seconds
-
-    return () => clearInterval(syncInterval);
-  }, [queryClient, token]);
-
-  // Load history when activeChatId changes
-  useEffect(() => {
-    (async () => {
-      if (!activeChatId) return;
-      try {
-        const cached = queryClient.getQueryData([
-          "messages",
-          token,
-          activeChatId,
-        ]) as any[] | undefined;
-        if (cached && cached.length) setMessages(cached as any);
-        else setMessages([]);
-      } catch {
-        setMessages([]);
-      }
-      setMessagesLoading(true);
-      try {
-        const history = await getChatMessages(token, activeChatId);
-        let items = history as any[];
-        const chat = chatsRef.current.find((c) => c.id === activeChatId);
-        if (
-          chat &&
-          (chat.chat_type === "private" || chat.chat_type === "group")
-        ) {
-          const other =
-            chat.participants.find((p) => p.id !== myId) ||
-            (myId != null ? ({ id: myId } as any) : null);
-          if (chat.chat_type === "private") {
-            if (other) {
-              try {
-                const keyRec = await getPublicKey(token, (other as any).id);
-                const shared = await getSharedKeyWithUser(
-                  (other as any).id,
-                  JSON.parse(keyRec.public_key_jwk as string)
-                );
-                items = await Promise.all(
-                  history.map(async (m) =>
-                    m.ciphertext && m.nonce
-                      ? (async () => {
-                          try {
-                            const text = await decryptTextAesGcm(
-                              m.ciphertext as string,
-                              m.nonce as string,
-                              shared
-                            );
-                            return { ...m, content: text };
-                          } catch {
-                            return m as any;
-                          }
-                        })()
-                      : (m as any)
-                  )
-                );
-              } catch {}
-            }
-          } else if (chat.chat_type === "group") {
-            const key = await ensureGroupKey(chat as any, myId);
-            if (key) {
+  // Decrypt one page of history for display (messages from the REST API)
+  const decryptHistory = useCallback(
+    async (chatId: number, history: any[]) => {
+      let items = history as any[];
+      const chat = chatsRef.current.find((c) => c.id === chatId);
+      if (
+        chat &&
+        (chat.chat_type === "private" || chat.chat_type === "group")
+      ) {
+        const other =
+          chat.participants.find((p) => p.id !== myId) ||
+          (myId != null ? ({ id: myId } as any) : null);
+        if (chat.chat_type === "private") {
+          if (other) {
+            try {
+              const keyRec = await getPublicKey(token, (other as any).id);
+              const shared = await getSharedKeyWithUser(
+                (other as any).id,
+                JSON.parse(keyRec.public_key_jwk as string)
+              );
               items = await Promise.all(
                 history.map(async (m) =>
                   m.ciphertext && m.nonce
@@ -573,7 +616,7 @@ export function useUnifiedSocket({
                           const text = await decryptTextAesGcm(
                             m.ciphertext as string,
                             m.nonce as string,
-                            key
+                            shared
                           );
                           return { ...m, content: text };
                         } catch {
@@ -583,18 +626,85 @@ export function useUnifiedSocket({
                     : (m as any)
                 )
               );
-            }
+            } catch {}
+          }
+        } else if (chat.chat_type === "group") {
+          const key = await ensureGroupKey(chat as any, myId);
+          if (key) {
+            items = await Promise.all(
+              history.map(async (m) =>
+                m.ciphertext && m.nonce
+                  ? (async () => {
+                      try {
+                        const text = await decryptTextAesGcm(
+                          m.ciphertext as string,
+                          m.nonce as string,
+                          key
+                        );
+                        return { ...m, content: text };
+                      } catch {
+                        return m as any;
+                      }
+                    })()
+                  : (m as any)
+              )
+            );
           }
         }
-        const mapped = items.map((m: any) => ({
-          id: m.id,
-          content: m.content as any,
-          content_type: m.content_type as any,
-          sender: m.sender,
-          timestamp: m.timestamp as string,
-          attachment: m.attachment ?? null,
-        }));
+      }
+      return items.map((m: any) => ({
+        id: m.id,
+        content: m.content as any,
+        content_type: m.content_type as any,
+        sender: m.sender,
+        timestamp: m.timestamp as string,
+        attachment: m.attachment ?? null,
+      }));
+    },
+    [token, myId, ensureGroupKey]
+  );
+
+  // Load history when activeChatId changes
+  useEffect(() => {
+    (async () => {
+      if (!activeChatId) return;
+      try {
+        const cached = queryClient.getQueryData([
+          "messages",
+          token,
+          activeChatId,
+        ]) as any[] | undefined;
+        setHasOlder(olderCursorRef.current[activeChatId] != null);
+        if (cached && cached.length) {
+          setMessages(cached as any);
+          // The subscribe's since_id replay fills whatever happened meanwhile
+          if (
+            historyLoadedRef.current.has(activeChatId) &&
+            historyReload === reloadHandledRef.current
+          )
+            return;
+        } else setMessages([]);
+      } catch {
+        setMessages([]);
+      }
+      reloadHandledRef.current = historyReload;
+      setMessagesLoading(true);
+      try {
+        const page = await getChatMessages(token, activeChatId);
+        const history = page.messages;
+        const mapped = await decryptHistory(activeChatId, history);
+        olderCursorRef.current[activeChatId] = page.next_cursor;
+        setHasOlder(page.next_cursor != null);
         setMessages(mapped);
+        historyLoadedRef.current.add(activeChatId);
+        noteSeq(
+          activeChatId,
+          history.map((m: any) => m?.seq)
+        );
+        noteSeen(
+          activeChatId,
+          mapped.map((m: any) => m.id)
+        );
         try {
           queryClient.setQueryData(
             ["messages", token, activeChatId],
@@ -619,7 +729,35 @@ export function useUnifiedSocket({
         setMessagesLoading(false);
       }
     })();
-  }, [activeChatId, token, myId, ensureGroupKey, queryClient]);
+  }, [activeChatId, token, queryClient, historyReload, noteSeen, noteSeq, decryptHistory]);
+
+  // Older pages, on demand: keyset cursor from the last page loaded
+  const loadOlder = useCallback(async () => {
+    const chatId = activeChatId;
+    if (!chatId || loadingOlder) return;
+    const cursor = olderCursorRef.current[chatId];
+    if (cursor == null) return;
+    setLoadingOlder(true);
+    try {
+      const page = await getChatMessages(token, chatId, { beforeId: cursor });
+      const older = await decryptHistory(chatId, page.messages);
+      olderCursorRef.current[chatId] = page.next_cursor;
+      const prepend = (prev: any[] | undefined) => {
+        const have = new Set((prev ?? []).map((m: any) => m.id));
+        return [...older.filter((m: any) => !have.has(m.id)), ...(prev ?? [])];
+      };
+      try {
+        queryClient.setQueryData(["messages", token, chatId], prepend);
+      } catch {}
+      if (activeChatIdRef.current === chatId) {
+        setMessages((prev) => prepend(prev as any[]) as any);
+        setHasOlder(page.next_cursor != null);
+      }
+    } catch {
+    } finally {
+      setLoadingOlder(false);
+    }
+  }, [activeChatId, loadingOlder, token, decryptHistory, queryClient]);
 
   const sendText = useCallback(
     async (text: string) => {
@@ -811,5 +949,8 @@ export function useUnifiedSocket({
     onDropFiles,
     firstUnreadIndex,
     appendSystemNotice,
+    hasOlder,
+    loadingOlder,
+    loadOlder,
   };
 }